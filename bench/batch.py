@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""Benchmark of the batch query API.
+
+This module indexes synthetic catalog lines and runs the queries of each
+query mix of the synthetic catalog one by one with `search`, then at once with
+`search_many`, and checks that both return the same results. Queries of the
+any terms mode are also scored one at a time with the exhaustive product of
+`search_many`: dynamic pruning must not be slower than it, otherwise the exit
+status is 1.
+
+Example:
+    $ python bench/batch.py --lines 100000
+
+    batch Generating 100000 synthetic catalog lines...
+    batch Mix = any_terms, mode = any, search = 1.04 ms/query, search_many = 0.78 ms/query (1.34x)
+    batch Mix = any_terms, pruned = 1.04 ms/query, exhaustive = 3.77 ms/query
+    batch Mix = head, mode = all, search = 7.26 ms/query, search_many = 2.59 ms/query (2.81x)
+    ...
+
+"""
+import sys
+import time
+import optparse
+import logging
+sys.path.append('lib')
+from book import BookDataPreprocessor
+from search import SearchEngine
+from search import ANY_TERMS
+from synthetic import QUERY_MIXES
+from synthetic import SyntheticCatalog
+
+
+log_format = '%(asctime)s - %(levelname)s - %(module)s : %(lineno)d - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+logger = logging.getLogger(__name__)
+
+
+def run_benchmark(n_lines, n_queries):
+    """Index synthetic books and compare single and batch queries.
+
+    Args:
+      n_lines (int): Number of synthetic catalog lines.
+      n_queries (int): Number of queries of each query mix.
+
+    Returns:
+      list of str: Query mixes whose pruned any terms queries are slower
+        than the exhaustive product.
+
+    """
+    logger.info('Generating %d synthetic catalog lines...', n_lines)
+    catalog = SyntheticCatalog()
+    processor = BookDataPreprocessor()
+    books = processor.to_books(catalog.lines(n_lines))
+
+    logging.getLogger('search').setLevel(logging.WARNING)
+    engine = SearchEngine(cache_entries=0, merge_in_background=False)
+    engine.start(iter(books))
+    slower_mixes = []
+    for mix in sorted(QUERY_MIXES):
+        queries, mode = catalog.queries(n_queries, mix)
+        ts = time.time()
+        expected_results = [engine.search(query, 10, mode)
+                            for query in queries]
+        search_time = time.time() - ts
+
+        ts = time.time()
+        results = engine.search_many(queries, 10, mode)
+        batch_time = time.time() - ts
+
+        if results != expected_results:
+            logger.warning('Mix = %s, batch results differ', mix)
+        logger.info('Mix = %s, mode = %s, search = %.2f ms/query, '
+                    'search_many = %.2f ms/query (%.2fx)', mix, mode,
+                    1000 * search_time / n_queries,
+                    1000 * batch_time / n_queries,
+                    search_time / max(batch_time, 1e-9))
+
+        if mode == ANY_TERMS:
+            ts = time.time()
+            for query in queries:
+                engine.search_many([query], 10, mode)
+            exhaustive_time = time.time() - ts
+            logger.info('Mix = %s, pruned = %.2f ms/query, exhaustive = '
+                        '%.2f ms/query', mix, 1000 * search_time / n_queries,
+                        1000 * exhaustive_time / n_queries)
+            if search_time > exhaustive_time:
+                logger.warning('Mix = %s, pruned queries are slower than '
+                               'the exhaustive product', mix)
+                slower_mixes.append(mix)
+    return slower_mixes
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--lines',
+                      dest='lines',
+                      type='int',
+                      help='Number of synthetic catalog lines',
+                      default=100000)
+    parser.add_option('-q', '--queries',
+                      dest='queries',
+                      type='int',
+                      help='Number of queries of each query mix',
+                      default=200)
+
+    options, args = parser.parse_args()
+    if run_benchmark(options.lines, options.queries):
+        sys.exit(1)
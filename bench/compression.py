@@ -0,0 +1,240 @@
+#!/usr/bin/python
+"""Benchmark of the compressed posting lists.
+
+This module builds the posting lists of the titles of a synthetic catalog,
+whose words follow a Zipf distribution, and compares plain `int32` posting
+lists with `CompressedPostings`: memory, snapshot size, and time of
+intersections and MaxScore top-k evaluations. Posting lists are only part of
+an index, so whole search engines indexing synthetic catalog lines with and
+without compression are compared as well: the memory of all their segments
+(term frequencies, posting lists, positions and scores) and the size of
+their snapshots.
+
+Example:
+    $ python bench/compression.py --docs 1000000 --queries 1000
+
+    compression Generating postings of 1000000 synthetic catalog titles...
+    compression Postings = plain, Memory = 26.2 MB, Snapshot = 26.2 MB
+    compression Postings = compressed, Memory = 10.7 MB, Snapshot = 10.7 MB
+    compression Function = intersect (plain), Time = 0.01 sec
+    compression Function = intersect (compressed), Time = 0.14 sec
+    compression Function = top_k (plain), Time = 0.35 sec
+    compression Function = top_k (compressed), Time = 0.91 sec
+    compression Indexing 100000 synthetic catalog lines...
+    compression Engine = plain, Memory = 16.9 MB, Snapshot = 26.8 MB
+    compression Engine = compressed, Memory = 15.7 MB, Snapshot = 25.3 MB
+
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+import logging
+import numpy as np
+import scipy.sparse as sp
+sys.path.append('lib')
+from book import BookDataPreprocessor
+from postings import CompressedPostings
+from postings import POSTINGS_DTYPE
+from postings import intersect
+from pruning import MaxScoreEvaluator
+from search import SearchEngine
+from snapshot import SnapshotWriter
+from synthetic import DEFAULT_WORDS
+from synthetic import SyntheticCatalog
+
+
+log_format = '%(asctime)s - %(levelname)s - %(module)s : %(lineno)d - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+logger = logging.getLogger(__name__)
+
+
+def synthetic_postings(catalog, n_docs):
+    """Build the posting lists of the titles of a synthetic catalog.
+
+    Terms are identified by their frequency rank in the catalog.
+
+    Args:
+      catalog (SyntheticCatalog): Catalog of the titles.
+      n_docs (int): Number of titles.
+
+    Returns:
+      tuple: Start of the posting list of each term, and the sorted posting
+        lists of all terms, concatenated.
+
+    """
+    bounds, terms = catalog.title_ranks(n_docs)
+    docs = np.repeat(np.arange(n_docs), np.diff(bounds))
+    matrix = sp.csc_matrix((np.ones(len(docs)), (docs, terms)),
+                           shape=(n_docs, len(catalog.words)))
+    matrix.sum_duplicates()
+    return matrix.indptr.astype(np.int64), \
+        matrix.indices.astype(POSTINGS_DTYPE)
+
+
+def directory_size(path):
+    """Measure the size of the files of a directory and its subdirectories.
+
+    Args:
+      path (str): Directory.
+
+    Returns:
+      int: Total size in bytes of the files.
+
+    """
+    return sum(os.path.getsize(os.path.join(directory, filename))
+               for directory, subdirectories, filenames in os.walk(path)
+               for filename in filenames)
+
+
+def snapshot_size(save):
+    """Measure the size of the arrays written by a save function.
+
+    Args:
+      save (callable): Function writing entries to a SnapshotWriter.
+
+    Returns:
+      int: Total size in bytes of the written arrays.
+
+    """
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+        writer = SnapshotWriter(snapshot_dir)
+        save(writer)
+        writer.close()
+        return sum(os.path.getsize(os.path.join(directory, filename))
+                   for directory, subdirectories, filenames
+                   in os.walk(snapshot_dir)
+                   for filename in filenames if filename.endswith('.npy'))
+    finally:
+        shutil.rmtree(snapshot_dir)
+
+
+def engine_sizes(n_lines, compressed):
+    """Measure the memory and snapshot size of a whole search engine.
+
+    Args:
+      n_lines (int): Number of synthetic catalog lines indexed.
+      compressed (bool): Whether posting lists are compressed.
+
+    Returns:
+      tuple: Size in bytes of all the segments of the engine, and of its
+        snapshot.
+
+    """
+    books = BookDataPreprocessor().to_books(SyntheticCatalog().lines(n_lines))
+    engine = SearchEngine(cache_entries=0, merge_in_background=False,
+                          compressed=compressed)
+    engine.start(iter(books))
+    memory = sum(segment.nbytes() for segment in engine.segments)
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+        engine.save(snapshot_dir)
+        return memory, directory_size(snapshot_dir)
+    finally:
+        shutil.rmtree(snapshot_dir)
+
+
+def save_plain(writer, offsets, postings):
+    """Store plain posting lists as `Index.save` does.
+
+    """
+    writer.write_array('index_postings', postings)
+    writer.write_array('index_offsets', offsets)
+
+
+def run_benchmark(n_docs, n_words, n_queries, n_lines):
+    """Compare plain and compressed posting lists.
+
+    Args:
+      n_docs (int): Number of documents.
+      n_words (int): Number of title words of the synthetic catalog.
+      n_queries (int): Number of queries of each kind.
+      n_lines (int): Number of synthetic catalog lines indexed by the
+        compared search engines.
+
+    """
+    logger.info('Generating postings of %d synthetic catalog titles...',
+                n_docs)
+    offsets, postings = synthetic_postings(SyntheticCatalog(n_words), n_docs)
+    compressed = CompressedPostings()
+    compressed.build(offsets, postings)
+
+    megabyte = 1024.0 * 1024
+    logger.info('Postings = plain, Memory = %.1f MB, Snapshot = %.1f MB',
+                (offsets.nbytes + postings.nbytes) / megabyte,
+                snapshot_size(lambda writer: save_plain(writer, offsets,
+                                                        postings)) / megabyte)
+    logger.info('Postings = compressed, Memory = %.1f MB, Snapshot = %.1f MB',
+                compressed.nbytes() / megabyte,
+                snapshot_size(compressed.save) / megabyte)
+
+    # queries mix frequent and rare terms, as real queries do
+    random = np.random.RandomState(7)
+    lengths = np.diff(offsets)
+    used_terms = np.flatnonzero(lengths > 0)
+    queries = [random.choice(used_terms[:1000], 1).tolist() +
+               random.choice(used_terms, random.randint(1, 3)).tolist()
+               for query in range(n_queries)]
+
+    def plain_list(term):
+        return postings[offsets[term]:offsets[term + 1]]
+
+    for name, postings_list in [('plain', plain_list),
+                                ('compressed', compressed.postings_list)]:
+        ts = time.time()
+        for query in queries:
+            intersect([postings_list(term) for term in query])
+        logger.info('Function = intersect (%s), Time = %2.2f sec', name,
+                    time.time() - ts)
+
+    for name, postings_list in [('plain', plain_list),
+                                ('compressed', compressed.postings_list)]:
+        ts = time.time()
+        for query in queries:
+            postings_lists = [postings_list(term) for term in query]
+            impacts_lists = [np.ones(len(term_postings)) / (1 + term)
+                             for term, term_postings
+                             in zip(query, postings_lists)]
+            upper_bounds = [1.0 / (1 + term) for term in query]
+            MaxScoreEvaluator(postings_lists, impacts_lists,
+                              upper_bounds).top_k(10)
+        logger.info('Function = top_k (%s), Time = %2.2f sec', name,
+                    time.time() - ts)
+
+    logger.info('Indexing %d synthetic catalog lines...', n_lines)
+    logging.getLogger('search').setLevel(logging.WARNING)
+    for name, compressed in [('plain', False), ('compressed', True)]:
+        memory, snapshot = engine_sizes(n_lines, compressed)
+        logger.info('Engine = %s, Memory = %.1f MB, Snapshot = %.1f MB', name,
+                    memory / megabyte, snapshot / megabyte)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-d', '--docs',
+                      dest='docs',
+                      type='int',
+                      help='Number of documents',
+                      default=1000000)
+    parser.add_option('-w', '--words',
+                      dest='words',
+                      type='int',
+                      help='Number of title words of the synthetic catalog',
+                      default=DEFAULT_WORDS)
+    parser.add_option('-q', '--queries',
+                      dest='queries',
+                      type='int',
+                      help='Number of queries of each kind',
+                      default=200)
+    parser.add_option('-n', '--lines',
+                      dest='lines',
+                      type='int',
+                      help='Number of synthetic catalog lines indexed by '
+                           'the compared search engines',
+                      default=100000)
+
+    options, args = parser.parse_args()
+    run_benchmark(options.docs, options.words, options.queries, options.lines)
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+"""Benchmark of the memory used by the loaded books.
+
+This module loads a catalog in fresh processes and reports their resident
+memory: once with the books kept as a list of `Book` objects with their
+words counted, as they were kept before the columnar store, once with the
+books in a `DocumentStore`, once with the books in a `RecordStore`, once for
+a whole `BookInventory`, keeping its books in memory or in a record file, and
+once for a `ShardedSearchEngine`, whose parent process only streams the books
+to its workers. The peak resident memory of each process is reported as well,
+the workers of the sharded engine being excluded.
+
+When no catalog file is given, a synthetic catalog is generated.
+
+Example:
+    $ python bench/memory.py --lines 300000
+
+    memory Writing 300000 synthetic catalog lines to /tmp/tmpEpDMW3...
+    memory Books = objects, RSS = 612.7 MB (+530.8 MB), peak = 612.7 MB
+    memory Books = store, RSS = 82.5 MB (+0.6 MB), peak = 82.4 MB, store = 25.8 MB
+    memory Books = records, RSS = 83.5 MB (+1.7 MB), peak = 83.5 MB, store = 2.6 MB
+    memory Books = inventory, RSS = 217.0 MB (+135.1 MB), peak = 234.0 MB, store = 25.8 MB
+    memory Books = lazy_inventory, RSS = 214.2 MB (+132.3 MB), peak = 231.2 MB, store = 2.6 MB
+    memory Books = sharded, RSS = 92.3 MB (+10.5 MB), peak = 92.3 MB
+
+"""
+import os
+import sys
+import resource
+import tempfile
+import optparse
+import logging
+import multiprocessing
+from itertools import islice
+sys.path.append('lib')
+from book import BookDataPreprocessor
+from book import BookInventory
+from book import PREPROCESS_BLOCK_LINES
+from records import RecordStore
+from shards import HASH_PARTITION
+from shards import ShardedSearchEngine
+from store import DocumentStore
+from synthetic import SyntheticCatalog
+
+
+log_format = '%(asctime)s - %(levelname)s - %(module)s : %(lineno)d - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+logger = logging.getLogger(__name__)
+
+# worker processes of the sharded engine
+SHARDS_COUNT = 4
+
+MODES = ['objects', 'store', 'records', 'inventory', 'lazy_inventory',
+         'sharded']
+
+
+def resident_memory():
+    """Return the resident memory of the current process.
+
+    Returns:
+      int: Resident memory in bytes, or the peak resident memory where the
+        current one is not available.
+
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def peak_memory():
+    """Return the peak resident memory of the current process.
+
+    Returns:
+      int: Peak resident memory in bytes, child processes excluded.
+
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak
+
+
+def read_books(filename):
+    """Read the books of a catalog, preprocessing lines in blocks.
+
+    Args:
+      filename (str): File name of the catalog.
+
+    Yields:
+      Book: Book described by each line of the catalog.
+
+    """
+    processor = BookDataPreprocessor()
+    with open(filename) as catalog:
+        while True:
+            entries = list(islice(catalog, PREPROCESS_BLOCK_LINES))
+            if len(entries) == 0:
+                break
+            for book in processor.to_books(entries):
+                yield book
+
+
+def load_books(filename, mode, results):
+    """Load the books of a catalog and report the resident memory.
+
+    Args:
+      filename (str): File name of the catalog.
+      mode (str): How the books are kept, one of `MODES`.
+      results (multiprocessing.Queue): Queue receiving the resident memory
+        before and after loading, its peak, and the size of the store.
+
+    """
+    initial_memory = resident_memory()
+    store_size = None
+    if mode == 'objects':
+        books = []
+        for book in read_books(filename):
+            book.words_count
+            books.append(book)
+    elif mode in ['store', 'records']:
+        books = DocumentStore() if mode == 'store' else RecordStore()
+        for book in read_books(filename):
+            books.append(book)
+        store_size = books.nbytes()
+    elif mode == 'sharded':
+        books = ShardedSearchEngine(SHARDS_COUNT, HASH_PARTITION)
+        books.start(read_books(filename))
+    else:
+        books = BookInventory(filename,
+                              lazy_objects=mode == 'lazy_inventory')
+        books.load_books()
+        store_size = books.engine.objects.nbytes()
+    results.put((initial_memory, resident_memory(), peak_memory(),
+                 store_size))
+    if mode == 'sharded':
+        books.close()
+
+
+def run_benchmark(filename):
+    """Report the resident memory of each way of keeping the books.
+
+    Args:
+      filename (str): File name of the catalog.
+
+    """
+    megabyte = 1024.0 * 1024
+    for mode in MODES:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=load_books,
+                                          args=(filename, mode, results))
+        process.start()
+        initial_memory, memory, peak, store_size = results.get()
+        process.join()
+
+        message = 'Books = %s, RSS = %.1f MB (+%.1f MB), peak = %.1f MB' % (
+            mode, memory / megabyte, (memory - initial_memory) / megabyte,
+            peak / megabyte)
+        if store_size is not None:
+            message += ', store = %.1f MB' % (store_size / megabyte)
+        logger.info(message)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-c', '--catalog',
+                      dest='catalog',
+                      help='Catalog file, a synthetic one by default')
+    parser.add_option('-n', '--lines',
+                      dest='lines',
+                      type='int',
+                      help='Number of synthetic catalog lines',
+                      default=500000)
+
+    options, args = parser.parse_args()
+    if options.catalog is not None:
+        run_benchmark(options.catalog)
+    else:
+        catalog_file, filename = tempfile.mkstemp()
+        try:
+            logger.info('Writing %d synthetic catalog lines to %s...',
+                        options.lines, filename)
+            with os.fdopen(catalog_file, 'wb') as catalog:
+                catalog.writelines(SyntheticCatalog().lines(options.lines))
+            run_benchmark(filename)
+        finally:
+            os.remove(filename)
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+"""Benchmark of the precision of the tf-idf scores.
+
+This module indexes synthetic catalog lines with each score precision and
+reports the memory of the scores and of the whole segments, raw term
+frequencies and posting lists included, the time of the queries of every
+query mix of the synthetic catalog, and how many of the top 10 results of
+each query are the ones found with double precision scores.
+
+Example:
+    $ python bench/scores.py --lines 100000
+
+    scores Generating 100000 synthetic catalog lines...
+    scores Precision = float64, scores = 5.9 MB, segments = 16.9 MB, Time = 0.22 sec
+    scores Precision = float32, scores = 3.0 MB (1.95x), segments = 14.0 MB (1.20x), Time = 0.24 sec, top 10 agreement = 100.0%
+    scores Precision = uint8, scores = 0.9 MB (6.68x), segments = 11.9 MB (1.42x), Time = 0.18 sec, top 10 agreement = 99.2%
+
+"""
+import sys
+import time
+import optparse
+import logging
+sys.path.append('lib')
+from book import BookDataPreprocessor
+from search import SCORE_PRECISIONS
+from search import SearchEngine
+from synthetic import QUERY_MIXES
+from synthetic import SyntheticCatalog
+
+
+log_format = '%(asctime)s - %(levelname)s - %(module)s : %(lineno)d - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+logger = logging.getLogger(__name__)
+
+
+def run_benchmark(n_lines, n_queries):
+    """Index synthetic books with each score precision and compare them.
+
+    Args:
+      n_lines (int): Number of synthetic catalog lines.
+      n_queries (int): Number of queries of each query mix.
+
+    """
+    logger.info('Generating %d synthetic catalog lines...', n_lines)
+    catalog = SyntheticCatalog()
+    processor = BookDataPreprocessor()
+    books = processor.to_books(catalog.lines(n_lines))
+    mixes = [catalog.queries(n_queries, mix) for mix in sorted(QUERY_MIXES)]
+
+    megabyte = 1024.0 * 1024
+    logging.getLogger('search').setLevel(logging.WARNING)
+    expected_results = None
+    expected_size = None
+    expected_segments_size = None
+    for precision in SCORE_PRECISIONS:
+        engine = SearchEngine(cache_entries=0, merge_in_background=False,
+                              precision=precision)
+        engine.start(iter(books))
+        size = sum(segment.rank.nbytes() for segment in engine.segments)
+        segments_size = sum(segment.nbytes() for segment in engine.segments)
+
+        ts = time.time()
+        results = [[result.indexable.iid
+                    for result in engine.search(query, 10, mode)]
+                   for queries, mode in mixes for query in queries]
+        search_time = time.time() - ts
+
+        if expected_results is None:
+            expected_results = results
+            expected_size = size
+            expected_segments_size = segments_size
+            logger.info('Precision = %s, scores = %.1f MB, segments = %.1f MB, '
+                        'Time = %2.2f sec', precision, size / megabyte,
+                        segments_size / megabyte, search_time)
+            continue
+
+        matches = sum(len(set(iids) & set(expected_iids)) for iids,
+                      expected_iids in zip(results, expected_results))
+        expected_count = sum(len(iids) for iids in expected_results)
+        logger.info('Precision = %s, scores = %.1f MB (%.2fx), '
+                    'segments = %.1f MB (%.2fx), Time = %2.2f sec, '
+                    'top 10 agreement = %.1f%%', precision, size / megabyte,
+                    float(expected_size) / size, segments_size / megabyte,
+                    float(expected_segments_size) / segments_size,
+                    search_time, 100.0 * matches / max(expected_count, 1))
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--lines',
+                      dest='lines',
+                      type='int',
+                      help='Number of synthetic catalog lines',
+                      default=100000)
+    parser.add_option('-q', '--queries',
+                      dest='queries',
+                      type='int',
+                      help='Number of queries of each query mix',
+                      default=200)
+
+    options, args = parser.parse_args()
+    run_benchmark(options.lines, options.queries)
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+"""Load test of the query server.
+
+This module sends queries to a query server from several concurrent
+clients and reports the throughput and the latency percentiles. The queries
+are those of a query mix of the synthetic catalog. Without an address, a
+server is started in the process on synthetic catalog lines, so the load
+test needs neither a catalog nor a network.
+
+Example:
+    $ python bench/server_load.py --lines 100000 --clients 8
+
+    server_load Generating 100000 synthetic catalog lines...
+    server_load Serving on 127.0.0.1:36777
+    server_load Clients = 8, queries = 1600, QPS = 453.3, latency p50 = 17.5 ms, p95 = 20.2 ms, p99 = 22.2 ms
+    server_load Batches = 200, queries per batch = 8.0
+
+"""
+import sys
+import time
+import optparse
+import logging
+import threading
+import numpy as np
+sys.path.append('lib')
+from book import BookDataPreprocessor
+from search import SearchEngine
+from server import QueryClient
+from server import QueryServer
+from synthetic import QUERY_MIXES
+from synthetic import SyntheticCatalog
+
+
+log_format = '%(asctime)s - %(levelname)s - %(module)s : %(lineno)d - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+logger = logging.getLogger(__name__)
+
+
+def run_clients(address, queries, n_clients, mode=None):
+    """Send queries to a server from concurrent clients.
+
+    Args:
+      address (tuple): Host and port of the server.
+      queries (list of str): Queries sent by each client, each client
+        starting at a different query.
+      n_clients (int): Number of concurrent clients.
+      mode (str, optional): Query mode, the one of the server if None.
+
+    Returns:
+      tuple: Latency of each query, in seconds, and total time.
+
+    """
+    latencies = [[] for _ in range(n_clients)]
+
+    def send(client_id):
+        client = QueryClient(address)
+        shift = client_id * len(queries) // n_clients
+        try:
+            for query in queries[shift:] + queries[:shift]:
+                ts = time.time()
+                try:
+                    client.search(query, 10, mode)
+                except ValueError:
+                    pass
+                latencies[client_id].append(time.time() - ts)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=send, args=(client_id,))
+               for client_id in range(n_clients)]
+    ts = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.concatenate(latencies), time.time() - ts
+
+
+def run_benchmark(address, n_lines, n_queries, n_clients, mix):
+    """Load a server and report throughput and latencies.
+
+    Args:
+      address (tuple): Host and port of the server, None to start one on
+        synthetic catalog lines.
+      n_lines (int): Number of synthetic catalog lines.
+      n_queries (int): Number of queries sent by each client.
+      n_clients (int): Number of concurrent clients.
+      mix (str): Query mix of the queries, a key of `QUERY_MIXES`.
+
+    """
+    catalog = SyntheticCatalog()
+    query_server = None
+    if address is None:
+        logger.info('Generating %d synthetic catalog lines...', n_lines)
+        books = BookDataPreprocessor().to_books(catalog.lines(n_lines))
+        logging.getLogger('search').setLevel(logging.WARNING)
+        engine = SearchEngine(cache_entries=0, merge_in_background=False)
+        engine.start(iter(books))
+        query_server = QueryServer(('127.0.0.1', 0), engine)
+        thread = threading.Thread(target=query_server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        address = query_server.server_address[:2]
+        logger.info('Serving on %s:%d', *address)
+
+    try:
+        queries, mode = catalog.queries(n_queries, mix)
+        latencies, total_time = run_clients(address, queries, n_clients,
+                                            mode)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        logger.info('Clients = %d, queries = %d, QPS = %.1f, latency p50 = '
+                    '%.1f ms, p95 = %.1f ms, p99 = %.1f ms', n_clients,
+                    len(latencies), len(latencies) / total_time, p50, p95,
+                    p99)
+    finally:
+        if query_server is not None:
+            batcher = query_server.batcher
+            logger.info('Batches = %d, queries per batch = %.1f',
+                        batcher.batches,
+                        float(batcher.queries) / max(batcher.batches, 1))
+            query_server.shutdown()
+            query_server.server_close()
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-a', '--address',
+                      dest='address',
+                      help='Host and port of a running server, as host:port',
+                      default=None)
+    parser.add_option('-n', '--lines',
+                      dest='lines',
+                      type='int',
+                      help='Number of synthetic catalog lines, without '
+                           'address',
+                      default=100000)
+    parser.add_option('-q', '--queries',
+                      dest='queries',
+                      type='int',
+                      help='Number of queries sent by each client',
+                      default=200)
+    parser.add_option('-c', '--clients',
+                      dest='clients',
+                      type='int',
+                      help='Number of concurrent clients',
+                      default=8)
+    parser.add_option('-x', '--mix',
+                      dest='mix',
+                      type='choice',
+                      choices=sorted(QUERY_MIXES),
+                      help='Query mix of the queries: %s' %
+                           ', '.join(sorted(QUERY_MIXES)),
+                      default='two_terms')
+
+    options, args = parser.parse_args()
+    address = None
+    if options.address is not None:
+        host, port = options.address.rsplit(':', 1)
+        address = (host, int(port))
+    run_benchmark(address, options.lines, options.queries, options.clients,
+                  options.mix)
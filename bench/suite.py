@@ -0,0 +1,355 @@
+#!/usr/bin/python
+"""Reproducible benchmark suite of indexing and searching.
+
+This module indexes synthetic catalogs of each given size, see
+`synthetic.SyntheticCatalog`, and measures the time of each indexing phase,
+the peak resident memory, and the latency percentiles of the queries of each
+query mix. Every catalog is indexed in a fresh process, so the peak memory is
+its own. The results are written as JSON, and compared with a baseline
+written by an earlier run: metrics higher than their baseline by more than
+the tolerance are reported as regressions, and the exit status is 1.
+
+The indexing phases are those of `SearchEngine.start`:
+  - parse: preprocessing of the catalog lines into books;
+  - vocabulary: tokenization and assignment of a term index to each word;
+  - tf: assembly of the term frequency matrix;
+  - idf: inverse document frequency of the terms;
+  - norm: tf-idf scores and their normalization by document;
+  - postings: posting lists, and positions with `--positional`.
+
+Example:
+    $ python bench/suite.py --lines 10000,100000 --output bench.json
+    $ python bench/suite.py --lines 10000,100000 --baseline bench.json
+
+    suite Lines = 100000, docs = 100000, terms = 43432, Time = 2.80 sec, peak RSS = 104.7 MB
+    suite Lines = 100000, phase = parse, Time = 1.15 sec
+    ...
+    suite Lines = 100000, mix = two_terms, p50 = 0.57 ms, p95 = 1.47 ms, p99 = 2.24 ms
+    ...
+    suite No regression against bench.json
+
+"""
+import sys
+import json
+import time
+import platform
+import resource
+import optparse
+import logging
+import multiprocessing
+import numpy as np
+import scipy
+sys.path.append('lib')
+from book import BookDataPreprocessor
+from book import PREPROCESS_BLOCK_LINES
+from positions import PositionalIndex
+from search import Index
+from search import SearchEngine
+from search import TermMatrixBuilder
+from search import TfidfRank
+from search import load_stop_words
+from store import DocumentStore
+from synthetic import DEFAULT_EXPONENT
+from synthetic import DEFAULT_WORDS
+from synthetic import QUERY_MIXES
+from synthetic import SyntheticCatalog
+
+
+log_format = '%(asctime)s - %(levelname)s - %(module)s : %(lineno)d - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+logger = logging.getLogger(__name__)
+
+# version of the format of the results
+RESULTS_VERSION = 1
+
+PHASES = ['parse', 'vocabulary', 'tf', 'idf', 'norm', 'postings']
+
+# differences below these are noise, by unit of the metric
+NOISE_FLOORS = {'sec': 0.01, 'ms': 0.5, 'mb': 2.0}
+
+
+def peak_memory():
+    """Return the peak resident memory of the current process.
+
+    Returns:
+      float: Peak resident memory in megabytes.
+
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        peak /= 1024.0
+    return peak / 1024.0
+
+
+def percentiles(latencies):
+    """Summarize query latencies.
+
+    Args:
+      latencies (list of float): Latency of each query, in seconds.
+
+    Returns:
+      dict: Number of queries, and mean and percentiles of the latencies,
+        in milliseconds.
+
+    """
+    latencies = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'count': len(latencies), 'mean_ms': float(latencies.mean()),
+            'p50_ms': float(p50), 'p95_ms': float(p95),
+            'p99_ms': float(p99)}
+
+
+def run_catalog(options):
+    """Index a synthetic catalog and search it, in a worker process.
+
+    Args:
+      options (dict): Number of lines, words, Zipfian exponent, seed,
+        number of queries per mix and whether positions are indexed.
+
+    Returns:
+      dict: Results of the catalog.
+
+    """
+    catalog = SyntheticCatalog(options['words'], exponent=options['exponent'],
+                               seed=options['seed'])
+    lines = catalog.lines(options['lines'])
+    stop_words = load_stop_words()
+    logging.getLogger('search').setLevel(logging.WARNING)
+    phases = {}
+
+    ts = time.time()
+    processor = BookDataPreprocessor()
+    store = DocumentStore()
+    for start in range(0, len(lines), PREPROCESS_BLOCK_LINES):
+        for book in processor.to_books(
+                lines[start:start + PREPROCESS_BLOCK_LINES],
+                options['positional']):
+            store.append(book)
+    phases['parse'] = time.time() - ts
+    del lines
+
+    ts = time.time()
+    builder = TermMatrixBuilder(stop_words, options['positional'])
+    for book in store:
+        builder.add(book)
+    phases['vocabulary'] = time.time() - ts
+
+    ts = time.time()
+    columns = builder.columns()
+    phases['tf'] = time.time() - ts
+
+    ts = time.time()
+    rank = TfidfRank(stop_words)
+    idf = rank.compute_idf(np.diff(columns.indptr), builder.n_docs)
+    phases['idf'] = time.time() - ts
+
+    ts = time.time()
+    index = Index(stop_words)
+    index.build_index_from(builder)
+    if options['positional']:
+        PositionalIndex().build_index_from(builder, index)
+    phases['postings'] = time.time() - ts
+
+    ts = time.time()
+    rank.build_rank_from(builder, idf, index=index)
+    phases['norm'] = time.time() - ts
+    peak_rss = peak_memory()
+    n_terms = len(builder.vocabulary)
+    del rank, index
+
+    engine = SearchEngine(cache_entries=0, merge_in_background=False,
+                          positional=options['positional'])
+    engine.start_from(builder, store)
+    queries = {}
+    for mix in sorted(QUERY_MIXES):
+        mix_queries, mode = catalog.queries(options['queries'], mix)
+        latencies = []
+        for query in mix_queries:
+            ts = time.time()
+            engine.search(query, 10, mode)
+            latencies.append(time.time() - ts)
+        queries[mix] = percentiles(latencies)
+
+    indexing = dict(('%s_sec' % phase, phases[phase]) for phase in PHASES)
+    indexing['total_sec'] = sum(phases.values())
+    return {'docs': builder.n_docs, 'terms': n_terms, 'indexing': indexing,
+            'peak_rss_mb': peak_rss, 'queries': queries}
+
+
+def run_suite(sizes, n_words, exponent, seed, n_queries, positional):
+    """Run the benchmark of each catalog size in a fresh process.
+
+    Args:
+      sizes (list of int): Number of lines of each catalog.
+      n_words (int): Number of title words.
+      exponent (float): Exponent of the Zipfian distribution of words.
+      seed (int): Seed of the random number generator.
+      n_queries (int): Number of queries of each query mix.
+      positional (bool): Whether term positions are indexed.
+
+    Returns:
+      dict: Environment, configuration and results of each catalog size.
+
+    """
+    config = {'words': n_words, 'exponent': exponent, 'seed': seed,
+              'queries': n_queries, 'positional': positional}
+    runs = {}
+    for n_lines in sizes:
+        options = dict(config, lines=n_lines)
+        pool = multiprocessing.Pool(1)
+        try:
+            run = pool.apply(run_catalog, (options,))
+        finally:
+            pool.close()
+            pool.join()
+        runs[str(n_lines)] = run
+
+        logger.info('Lines = %d, docs = %d, terms = %d, Time = %2.2f sec, '
+                    'peak RSS = %.1f MB', n_lines, run['docs'], run['terms'],
+                    run['indexing']['total_sec'], run['peak_rss_mb'])
+        for phase in PHASES:
+            logger.info('Lines = %d, phase = %s, Time = %2.2f sec', n_lines,
+                        phase, run['indexing']['%s_sec' % phase])
+        for mix in sorted(run['queries']):
+            latencies = run['queries'][mix]
+            logger.info('Lines = %d, mix = %s, p50 = %.2f ms, p95 = %.2f ms, '
+                        'p99 = %.2f ms', n_lines, mix, latencies['p50_ms'],
+                        latencies['p95_ms'], latencies['p99_ms'])
+
+    environment = {'python': platform.python_version(),
+                   'numpy': np.__version__, 'scipy': scipy.__version__,
+                   'platform': platform.platform(),
+                   'processor': platform.processor()}
+    return {'version': RESULTS_VERSION, 'environment': environment,
+            'config': config, 'runs': runs}
+
+
+def flatten_metrics(results):
+    """List the metrics of results, lower values being better.
+
+    Args:
+      results (dict): Results of `run_suite`.
+
+    Returns:
+      dict: Value of each metric, by dotted name such as
+        `100000.queries.head.p95_ms`.
+
+    """
+    metrics = {}
+
+    def visit(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.iteritems():
+                visit(prefix + [key], item)
+        elif prefix[-1].rsplit('_', 1)[-1] in NOISE_FLOORS:
+            metrics['.'.join(prefix)] = value
+
+    for n_lines, run in results['runs'].iteritems():
+        visit([n_lines], run)
+    return metrics
+
+
+def compare_results(results, baseline, tolerance):
+    """Find the metrics which regressed since a baseline.
+
+    Metrics are compared when both results have them and the configurations
+    match. A metric regressed when it is higher than its baseline by more
+    than `tolerance`, relatively, and by more than the noise floor of its
+    unit.
+
+    Args:
+      results (dict): Results of `run_suite`.
+      baseline (dict): Results of an earlier run.
+      tolerance (float): Relative increase tolerated, 0.2 for 20%.
+
+    Returns:
+      list of tuple: Name, baseline value and value of each regressed
+        metric, sorted by name.
+
+    Raises:
+      ValueError: If the results can not be compared with the baseline.
+
+    """
+    if baseline.get('version') != RESULTS_VERSION:
+        raise ValueError('Unknown baseline version: %s' %
+                         baseline.get('version'))
+    if baseline['config'] != results['config']:
+        raise ValueError('Baseline configuration differs: %s' %
+                         baseline['config'])
+    metrics = flatten_metrics(results)
+    baseline_metrics = flatten_metrics(baseline)
+    regressions = []
+    for name in sorted(set(metrics) & set(baseline_metrics)):
+        value, expected = metrics[name], baseline_metrics[name]
+        floor = NOISE_FLOORS[name.rsplit('_', 1)[-1]]
+        if value > expected * (1 + tolerance) and value - expected > floor:
+            regressions.append((name, expected, value))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--lines',
+                      dest='lines',
+                      help='Comma-separated numbers of lines of the catalogs',
+                      default='10000,100000')
+    parser.add_option('-w', '--words',
+                      dest='words',
+                      type='int',
+                      help='Number of title words',
+                      default=DEFAULT_WORDS)
+    parser.add_option('-z', '--exponent',
+                      dest='exponent',
+                      type='float',
+                      help='Exponent of the Zipfian distribution of words',
+                      default=DEFAULT_EXPONENT)
+    parser.add_option('-r', '--seed',
+                      dest='seed',
+                      type='int',
+                      help='Seed of the random number generator',
+                      default=42)
+    parser.add_option('-q', '--queries',
+                      dest='queries',
+                      type='int',
+                      help='Number of queries of each query mix',
+                      default=200)
+    parser.add_option('-p', '--positional',
+                      dest='positional',
+                      action='store_true',
+                      help='Index words positions',
+                      default=False)
+    parser.add_option('-o', '--output',
+                      dest='output',
+                      help='Location of the JSON results',
+                      default=None)
+    parser.add_option('-b', '--baseline',
+                      dest='baseline',
+                      help='Location of JSON results to compare with',
+                      default=None)
+    parser.add_option('-t', '--tolerance',
+                      dest='tolerance',
+                      type='float',
+                      help='Relative increase of a metric tolerated before '
+                           'it is reported as a regression',
+                      default=0.2)
+
+    options, args = parser.parse_args()
+    sizes = [int(size) for size in options.lines.split(',')]
+    results = run_suite(sizes, options.words, options.exponent,
+                        options.seed, options.queries, options.positional)
+    if options.output is not None:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if options.baseline is not None:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_results(results, baseline, options.tolerance)
+        for name, expected, value in regressions:
+            logger.warning('Regression of %s: %.3f, baseline %.3f (%+.0f%%)',
+                           name, value, expected,
+                           100.0 * (value - expected) / max(expected, 1e-9))
+        if len(regressions) > 0:
+            sys.exit(1)
+        logger.info('No regression against %s', options.baseline)
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+"""Generator of synthetic title/author catalogs.
+
+This module generates catalogs in the format of the books catalog, so that
+benchmarks need no download. Words are invented from syllables, and drawn
+from a Zipfian distribution: the word of rank `r` occurs with a probability
+proportional to `1 / r ** exponent`, so a few words are in most titles and
+most words are rare, as in natural language. The most frequent words are
+stop words. Catalogs and queries only depend on the seed, and every benchmark
+draws its documents and queries from a `SyntheticCatalog`, so that they all
+measure the same corpus.
+
+Example:
+    $ python bench/synthetic.py --lines 1000000 --output ./data/synthetic_title_author.tab.txt
+
+    synthetic Writing 1000000 synthetic catalog lines to ./data/synthetic_title_author.tab.txt...
+
+"""
+import sys
+import optparse
+import logging
+import numpy as np
+sys.path.append('lib')
+from search import ALL_TERMS
+from search import ANY_TERMS
+
+
+log_format = '%(asctime)s - %(levelname)s - %(module)s : %(lineno)d - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORDS = 50000
+DEFAULT_NAMES = 5000
+DEFAULT_EXPONENT = 1.1
+
+# most frequent words of the titles
+STOP_WORDS = ['the', 'of', 'and', 'in', 'a', 'to', 'on', 'for']
+SYLLABLES = [consonant + vowel for consonant in 'bcdfghjklmnprstvz'
+             for vowel in 'aeiou'] + ['an', 'el', 'is', 'or', 'us']
+# punctuation between the words of punctuated titles, and words appended to
+# the authors with non-ASCII characters
+SEPARATORS = [', ', ' : ', ' - ', '. ', ' (', ') ', ' [', '] ', "'s "]
+ACCENTED_WORDS = ['\xc3\x89cole', 'M\xc3\xbcller', 'fran\xc3\xa7aise',
+                  'Bront\xc3\xab', 'Espa\xc3\xb1a']
+
+# query mixes: number of terms, query mode, and the ranks the terms are drawn
+# from, None for the Zipfian distribution of the catalog
+QUERY_MIXES = {
+    'head': (1, ALL_TERMS, (len(STOP_WORDS), 200)),
+    'two_terms': (2, ALL_TERMS, None),
+    'long': (4, ALL_TERMS, None),
+    'rare': (2, ALL_TERMS, (2000, None)),
+    'any_terms': (3, ANY_TERMS, None),
+}
+
+
+def synthetic_words(n_words, random):
+    """Invent distinct words from syllables.
+
+    Args:
+      n_words (int): Number of words.
+      random (numpy.random.RandomState): Random number generator.
+
+    Returns:
+      list of str: Words, in random order.
+
+    """
+    words = set()
+    result = []
+    while len(result) < n_words:
+        word = ''.join(random.choice(SYLLABLES, random.randint(2, 5)))
+        if word not in words:
+            words.add(word)
+            result.append(word)
+    return result
+
+
+def zipf_probabilities(n_words, exponent=DEFAULT_EXPONENT):
+    """Compute the Zipfian probability of each word rank.
+
+    Args:
+      n_words (int): Number of words.
+      exponent (float): Exponent of the distribution.
+
+    Returns:
+      numpy.ndarray: Probability of each rank, decreasing.
+
+    """
+    weights = 1.0 / np.arange(1, n_words + 1) ** exponent
+    return weights / weights.sum()
+
+
+class SyntheticCatalog(object):
+    """Synthetic catalog with Zipfian titles and authors.
+
+    Args:
+      n_words (int, optional): Number of title words, stop words included.
+      n_names (int, optional): Number of author names.
+      exponent (float, optional): Exponent of the Zipfian distributions.
+      seed (int, optional): Seed of the random number generator.
+
+    Attributes:
+      words (list of str): Title words by decreasing frequency.
+      names (list of str): Author names by decreasing frequency.
+      exponent (float): Exponent of the Zipfian distributions.
+      seed (int): Seed of the random number generator.
+
+    """
+
+    def __init__(self, n_words=DEFAULT_WORDS, n_names=DEFAULT_NAMES,
+                 exponent=DEFAULT_EXPONENT, seed=42):
+        random = np.random.RandomState(seed)
+        invented = synthetic_words(n_words + n_names, random)
+        self.words = STOP_WORDS + invented[:n_words - len(STOP_WORDS)]
+        self.names = [name.capitalize() for name in invented[n_words:]]
+        self.exponent = exponent
+        self.seed = seed
+        self._words_cdf = np.cumsum(zipf_probabilities(len(self.words),
+                                                       exponent))
+        self._names_cdf = np.cumsum(zipf_probabilities(len(self.names),
+                                                       exponent))
+
+    def lines(self, n_lines, start=0, punctuated_ratio=0.0,
+              accented_ratio=0.0):
+        """Generate catalog lines.
+
+        The titles are those of `titles`, whatever the ratios of punctuated
+        and accented lines.
+
+        Args:
+          n_lines (int): Number of lines.
+          start (int, optional): Identifier of the first line.
+          punctuated_ratio (float, optional): Ratio of the spaces between
+            title words replaced by punctuation.
+          accented_ratio (float, optional): Ratio of the authors with
+            non-ASCII characters.
+
+        Returns:
+          list of str: Tab-delimited lines with an identifier, a title of 2
+            to 12 words and an author, ending with a line break.
+
+        """
+        random = np.random.RandomState([self.seed, start])
+        bounds, words = self.__draw_titles(n_lines, random)
+        names = self.__draw(self._names_cdf, 2 * n_lines, random)
+        years = random.randint(1800, 2000, n_lines)
+        separators = np.array([' '] * len(words), dtype=object)
+        if punctuated_ratio > 0:
+            punctuated = random.random_sample(len(words)) < punctuated_ratio
+            separators[punctuated] = random.choice(SEPARATORS,
+                                                   punctuated.sum())
+        accents = [''] * n_lines
+        if accented_ratio > 0:
+            for line in np.flatnonzero(
+                    random.random_sample(n_lines) < accented_ratio):
+                accents[line] = ' ' + random.choice(ACCENTED_WORDS)
+        lines = []
+        for line in range(n_lines):
+            begin, end = bounds[line], bounds[line + 1]
+            title = ''.join(self.words[rank] + separator for rank, separator
+                            in zip(words[begin:end - 1],
+                                   separators[begin:end - 1]))
+            title += self.words[words[end - 1]]
+            lines.append('%d\t%s %d\t%s, %s%s\n' % (
+                start + line, title.capitalize(), years[line],
+                self.names[names[2 * line]], self.names[names[2 * line + 1]],
+                accents[line]))
+        return lines
+
+    def titles(self, n_lines, start=0):
+        """Generate the titles of catalog lines, without their year.
+
+        Args:
+          n_lines (int): Number of lines.
+          start (int, optional): Identifier of the first line.
+
+        Returns:
+          list of str: Lower case words of the title of each line of
+            `lines`, separated by spaces.
+
+        """
+        bounds, words = self.title_ranks(n_lines, start)
+        return [' '.join(self.words[rank] for rank in
+                         words[bounds[line]:bounds[line + 1]])
+                for line in range(n_lines)]
+
+    def title_ranks(self, n_lines, start=0):
+        """Draw the words of the titles of catalog lines.
+
+        Args:
+          n_lines (int): Number of lines.
+          start (int, optional): Identifier of the first line.
+
+        Returns:
+          tuple: Start of the words of each title, followed by the total
+            number of words, and the rank in `words` of each word of the
+            titles of `lines`, concatenated.
+
+        """
+        return self.__draw_titles(n_lines,
+                                  np.random.RandomState([self.seed, start]))
+
+    def queries(self, n_queries, mix):
+        """Generate queries of a query mix.
+
+        Args:
+          n_queries (int): Number of queries.
+          mix (str): Name of the mix, a key of `QUERY_MIXES`.
+
+        Returns:
+          tuple: Query strings and their query mode.
+
+        """
+        n_terms, mode, ranks = QUERY_MIXES[mix]
+        random = np.random.RandomState([self.seed, sorted(QUERY_MIXES).index(
+            mix), n_queries])
+        if ranks is None:
+            terms = self.__draw(self._words_cdf, n_queries * n_terms, random)
+        else:
+            first, last = ranks
+            last = min(last or len(self.words), len(self.words))
+            terms = random.randint(first, last, n_queries * n_terms)
+        queries = [' '.join(self.words[rank] for rank in
+                            terms[query * n_terms:(query + 1) * n_terms])
+                   for query in range(n_queries)]
+        return queries, mode
+
+    def __draw_titles(self, n_lines, random):
+        """Draw the lengths and the words of titles.
+
+        """
+        lengths = random.randint(2, 13, n_lines)
+        words = self.__draw(self._words_cdf, lengths.sum(), random)
+        return np.concatenate([[0], np.cumsum(lengths)]), words
+
+    def __draw(self, cdf, size, random):
+        """Draw ranks from a cumulative distribution.
+
+        """
+        ranks = np.searchsorted(cdf, random.random_sample(size) * cdf[-1])
+        return np.minimum(ranks, len(cdf) - 1)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--lines',
+                      dest='lines',
+                      type='int',
+                      help='Number of catalog lines',
+                      default=100000)
+    parser.add_option('-o', '--output',
+                      dest='output',
+                      help='Location of the catalog file',
+                      default='./data/synthetic_title_author.tab.txt')
+    parser.add_option('-w', '--words',
+                      dest='words',
+                      type='int',
+                      help='Number of title words',
+                      default=DEFAULT_WORDS)
+    parser.add_option('-z', '--exponent',
+                      dest='exponent',
+                      type='float',
+                      help='Exponent of the Zipfian distribution of words',
+                      default=DEFAULT_EXPONENT)
+    parser.add_option('-r', '--seed',
+                      dest='seed',
+                      type='int',
+                      help='Seed of the random number generator',
+                      default=42)
+
+    options, args = parser.parse_args()
+    catalog = SyntheticCatalog(options.words, exponent=options.exponent,
+                               seed=options.seed)
+    logger.info('Writing %d synthetic catalog lines to %s...', options.lines,
+                options.output)
+    block_lines = 100000
+    with open(options.output, 'w') as output:
+        for start in range(0, options.lines, block_lines):
+            output.writelines(catalog.lines(
+                min(block_lines, options.lines - start), start))
@@ -7,7 +7,7 @@ containing books' information. The result is displayed on STDOUT and outputs
 the top 10 matches ordered by their tf*idf scores.
 
 Example:
-    $ python solution.py --data './data/title_author.tab.txt'
+    $ python solution.py --data './data/title_author.tab.txt' --index './index' --trace
 
     book_index Loading books...
     book Loading books from file...
@@ -17,21 +17,27 @@ Example:
     search Starting tf-idf computation...
     search Starting tf-idf norm computation...
     search Building index...
-    search Function = load_books, Time = 406.88 sec
+    tracing Span = load_books, Time = 406.88 sec
     book_index Done loading books, 1284904 docs in index
 
     Enter a query, or hit enter to quit: Alys Eyre Macklin Greuze
-    util Function = search_books, Time = 0.63 sec
     score: 32.6460707315, id: 1277695, title: Greuze, author: Alys Eyre Macklin
     score: 32.6460707315, id: 570698, title: Greuze, author: Alys Eyre Macklin
     ...
 
+The time spent loading the books and answering each query is only logged with
+`--trace`, which also displays the steps of each query after its results and
+the recorded metrics before quitting.
+
 """
 import sys
 import optparse
 import logging
 sys.path.append('lib')
 import book
+import search
+import server
+import tracing
 
 DEBUG = True
 
@@ -44,38 +50,197 @@ logger = logging.getLogger(__name__)
 CATALOG_FILENAME = 'data/min_title_author.tab.txt' if DEBUG else 'data/title_author.tab.txt'
 
 
-def execute_search(data_location):
+def execute_search(data_location, index_location=None,
+                   mode=search.ALL_TERMS, positional=False, new_data=None,
+                   processes=1, compressed=False, precision=search.FLOAT64,
+                   duplicates=None, lazy_objects=False, warm_up=False,
+                   explain=False, serve=None,
+                   max_requests=server.DEFAULT_MAX_REQUESTS, trace=False):
     """Capture query from STDIN and display the result on STDOUT.
 
     The query of terms is executed against an indexed data structure
     containing books' information. If not result is found, an warning message
-    will notify the user of such situation.
+    will notify the user of such situation. If `serve` is set, queries are
+    instead received from the network, see `server.QueryServer`, until the
+    process is interrupted.
 
     Args:
       data_location (str): Location of the data file that will be indexed.
+      index_location (str, optional): Location of the index snapshot, loaded
+        if it exists and written after indexing otherwise.
+      mode (str, optional): Whether results must contain all the query terms
+        or any of them.
+      positional (bool, optional): Whether words positions are indexed,
+        enabling phrase and proximity queries.
+      new_data (str, optional): Location of a data file with new books,
+        added to the loaded index.
+      processes (int, optional): Number of processes parsing the data file.
+      compressed (bool, optional): Whether posting lists are compressed.
+      precision (str, optional): Storage of the tf-idf scores.
+      duplicates (str, optional): Whether identical books are indexed once
+        and displayed one per line (`expand`) or on a single line
+        (`collapse`). All books are indexed by default.
+      lazy_objects (bool, optional): Whether titles and authors are read
+        from a record file for the displayed results instead of being kept
+        in memory.
+      warm_up (bool, optional): Whether queries are answered while the
+        books are indexed in the background, from the books indexed so far.
+      explain (bool, optional): Whether the plan of each query is displayed
+        before its results.
+      serve (str, optional): Host and port, as `host:port`, of the server
+        answering queries sent as lines of JSON.
+      max_requests (int, optional): Maximum number of queries evaluated at
+        once by the server.
+      trace (bool, optional): Whether the spans of each query are displayed
+        after its results, and all the recorded metrics before quitting.
 
     """
     query = None
-    repository = book.BookInventory(data_location)
+    if trace:
+        tracing.tracer.enable()
+    repository = book.BookInventory(data_location, index_location,
+                                    positional, processes, compressed,
+                                    precision, duplicates is not None,
+                                    lazy_objects, warm_up)
     logger.info('Loading books...')
 
     repository.load_books()
+    if new_data is not None:
+        repository.add_books(new_data)
     docs_number = repository.books_count()
-    logger.info('Done loading books, %d docs in index', docs_number)
+    if repository.engine.warming_up:
+        logger.info('Warming up, %d docs in index so far', docs_number)
+    else:
+        logger.info('Done loading books, %d docs in index', docs_number)
+
+    if serve is not None:
+        host, port = serve.rsplit(':', 1)
+        query_server = server.QueryServer(
+            (host, int(port)), repository.engine, mode,
+            duplicates == 'collapse', max_requests)
+        logger.info('Serving queries on %s:%d...',
+                    *query_server.server_address[:2])
+        try:
+            query_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            query_server.server_close()
+            if trace:
+                print tracing.tracer.dump()
+        return
 
     while query is not '':
         query = raw_input('Enter a query, or hit enter to quit: ')
-        search_results = repository.search_books(query)
+        try:
+            if explain and query:
+                print repository.explain_query(query, mode=mode)
+            search_results = repository.search_books(
+                query, mode=mode, collapse=duplicates == 'collapse')
+        except ValueError as error:
+            search_results = error
 
         print search_results
+        if trace and query:
+            print tracing.format_trace(tracing.tracer.last_trace())
+
+    if trace:
+        print tracing.tracer.dump()
 
 
 if __name__ == '__main__':
     parser = optparse.OptionParser()
     parser.add_option('-d', '--data',
                       dest='data',
-                      help='Location of the data file that will be indexed',
+                      help='Location of the data file that will be indexed, '
+                           'plain text, gzip or zip',
                       default=CATALOG_FILENAME)
+    parser.add_option('-i', '--index',
+                      dest='index',
+                      help='Location of the index snapshot that will be '
+                           'loaded if it exists, or written after indexing',
+                      default=None)
+    parser.add_option('-a', '--any',
+                      dest='mode',
+                      action='store_const',
+                      const=search.ANY_TERMS,
+                      help='Rank books containing any of the query terms',
+                      default=search.ALL_TERMS)
+    parser.add_option('-p', '--positional',
+                      dest='positional',
+                      action='store_true',
+                      help='Index words positions, enabling "phrase" and '
+                           'NEAR/k queries',
+                      default=False)
+    parser.add_option('-u', '--update',
+                      dest='update',
+                      help='Location of a data file with new books that will '
+                           'be added to the index',
+                      default=None)
+    parser.add_option('-j', '--jobs',
+                      dest='jobs',
+                      type='int',
+                      help='Number of processes parsing the data file',
+                      default=1)
+    parser.add_option('-c', '--compressed',
+                      dest='compressed',
+                      action='store_true',
+                      help='Compress posting lists, using less memory',
+                      default=False)
+    parser.add_option('-s', '--scores',
+                      dest='precision',
+                      type='choice',
+                      choices=search.SCORE_PRECISIONS,
+                      help='Storage of the tf-idf scores: float64, float32 '
+                           'or uint8 (quantized), using less memory',
+                      default=search.FLOAT64)
+    parser.add_option('-D', '--dedup',
+                      dest='duplicates',
+                      type='choice',
+                      choices=['expand', 'collapse'],
+                      help='Index books with the same title and author once, '
+                           'and display them one per line (expand) or on a '
+                           'single line (collapse)',
+                      default=None)
+    parser.add_option('-l', '--lazy',
+                      dest='lazy_objects',
+                      action='store_true',
+                      help='Keep titles and authors on disk and read them '
+                           'for the displayed results, using less memory',
+                      default=False)
+    parser.add_option('-w', '--warm-up',
+                      dest='warm_up',
+                      action='store_true',
+                      help='Answer queries while the books are indexed in '
+                           'the background, from the books indexed so far',
+                      default=False)
+    parser.add_option('-e', '--explain',
+                      dest='explain',
+                      action='store_true',
+                      help='Display the plan of each query: normalized '
+                           'terms, intersection order and strategies',
+                      default=False)
+    parser.add_option('-S', '--serve',
+                      dest='serve',
+                      help='Answer queries sent as lines of JSON to host:port '
+                           'instead of reading them from STDIN',
+                      default=None)
+    parser.add_option('-m', '--max-requests',
+                      dest='max_requests',
+                      type='int',
+                      help='Maximum number of queries evaluated at once by '
+                           'the server',
+                      default=server.DEFAULT_MAX_REQUESTS)
+    parser.add_option('-t', '--trace',
+                      dest='trace',
+                      action='store_true',
+                      help='Display the time spent in each step of each '
+                           'query, and the recorded metrics before quitting',
+                      default=False)
 
     options, args = parser.parse_args()
-    execute_search(options.data)
+    execute_search(options.data, options.index, options.mode,
+                   options.positional, options.update, options.jobs,
+                   options.compressed, options.precision, options.duplicates,
+                   options.lazy_objects, options.warm_up, options.explain,
+                   options.serve, options.max_requests, options.trace)
@@ -1,23 +1,113 @@
 # -*- coding: utf-8 -*-
+import os
 import re
+import string
 import unicodedata
 import logging
-from util import timed
+import threading
+import multiprocessing
+from catalog import CatalogReader
+from catalog import is_compressed
+from search import ALL_TERMS
+from search import FLOAT64
 from search import Indexable
 from search import SearchEngine
+from search import TermMatrixBuilder
+from store import DocumentStore
+from tracing import traced
+from tracing import tracer
 
 
 logger = logging.getLogger(__name__)
 
 
+# catalog chunks parsed by each process, smaller chunks balance the load
+CHUNKS_PER_PROCESS = 4
+
+# catalog lines preprocessed at once
+PREPROCESS_BLOCK_LINES = 1024
+
+
+def catalog_chunks(filename, chunks_count):
+    """Split a catalog file in byte ranges of whole lines.
+
+    Args:
+      filename (str): File name of the catalog.
+      chunks_count (int): Desired number of chunks.
+
+    Returns:
+      list of tuple: Start and end offsets of each chunk, in file order.
+        There may be fewer chunks than requested for small files.
+
+    """
+    size = os.path.getsize(filename)
+    boundaries = [0]
+    with open(filename, 'rb') as catalog:
+        for chunk in range(1, chunks_count):
+            offset = size * chunk // chunks_count
+            if offset <= boundaries[-1]:
+                continue
+            # the chunk ends with the line containing the previous byte
+            catalog.seek(offset - 1)
+            catalog.readline()
+            if catalog.tell() > boundaries[-1]:
+                boundaries.append(catalog.tell())
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def parse_catalog_chunk(chunk):
+    """Parse the books of a catalog chunk, usually in a worker process.
+
+    The books are sent back to the parent process in a compact form: their
+    term frequencies, accumulated in a builder, and their fields in a
+    columnar document store.
+
+    Args:
+      chunk (tuple): File name of the catalog, start and end offsets of the
+        chunk, stop words, and whether positions are kept.
+
+    Returns:
+      tuple: TermMatrixBuilder with the term frequencies of the books, and
+        DocumentStore with the books.
+
+    """
+    filename, start, end, stop_words, positional = chunk
+    with open(filename, 'rb') as catalog:
+        catalog.seek(start)
+        content = catalog.read(end - start)
+
+    entries = content.split('\n')
+    if content.endswith('\n'):
+        entries.pop()
+
+    processor = BookDataPreprocessor()
+    builder = TermMatrixBuilder(stop_words, positional)
+    store = DocumentStore()
+    for start in range(0, len(entries), PREPROCESS_BLOCK_LINES):
+        block = entries[start:start + PREPROCESS_BLOCK_LINES]
+        for book in processor.to_books(block, positional):
+            builder.add(book)
+            store.append(book)
+    return builder, store
+
+
 class Book(Indexable):
     """Class encapsulating a specific behavior of indexed books.
 
+    The indexed text of a book is its title followed by its author, so only
+    these two fields are stored, and `metadata` is derived from them when it
+    is not given.
+
     Args:
       iid (int): Identifier of indexable objects.
       title (str): Title of the book.
       author (str): Author of the book.
-      metadata (str): Plain text with data to be indexed.
+      metadata (str, optional): Plain text with data to be indexed, the
+        title and the author by default.
+      positional (bool, optional): Whether the positions of the words in
+        `metadata` are kept.
 
     Attributes:
       title (str): Title of the book.
@@ -25,10 +115,39 @@ class Book(Indexable):
 
     """
 
-    def __init__(self, iid, title, author, metadata):
-        Indexable.__init__(self, iid, metadata)
+    __slots__ = ('title', 'author', '_metadata')
+
+    STORED_FIELDS = ('title', 'author')
+    DUPLICATE_FIELDS = ('title', 'author')
+
+    def __init__(self, iid, title, author, metadata=None, positional=False):
         self.title = title
         self.author = author
+        Indexable.__init__(self, iid, metadata, positional)
+
+    @property
+    def metadata(self):
+        """str: Plain text with data to be indexed."""
+        if self._metadata is None:
+            return '%s %s' % (self.title, self.author)
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata
+
+    @staticmethod
+    def normalize_query(text):
+        """Split the text of a query in words preprocessed like the catalog.
+
+        Args:
+          text (str): Text of the query, or of one of its phrases.
+
+        Returns:
+          list of str: Preprocessed words.
+
+        """
+        return BookDataPreprocessor().normalize(text).split()
 
     def __repr__(self):
         return 'id: %s, title: %s, author: %s' % \
@@ -40,6 +159,10 @@ class BookDataPreprocessor(object):
 
     """
 
+    _BOOK_META_ID_INDEX = 0
+    _BOOK_META_TITLE_INDEX = 1
+    _BOOK_META_AUTHOR_INDEX = 2
+
     _EXTRA_SPACE_REGEX = re.compile(r'\s+', re.IGNORECASE)
     _SPECIAL_CHAR_REGEX = re.compile(
         # detect punctuation characters
@@ -49,6 +172,18 @@ class BookDataPreprocessor(object):
         # detect commas NOT between numbers
         r"(?<!\d)(,+)(?!=\d)|(\$+))")
 
+    # tables and expressions of the batch mode, see `preprocess_batch`
+    _LOWER_TABLE = string.maketrans(string.ascii_uppercase + '\t',
+                                    string.ascii_lowercase + '|')
+    _SPECIAL_CHARS = ".?!:;()}{'-[]$"
+    _SPECIAL_CHAR_TABLE = string.maketrans(_SPECIAL_CHARS,
+                                           ' ' * len(_SPECIAL_CHARS))
+    _COMMA_REGEX = re.compile(r"(?<!\d)(,+)(?!=\d)")
+    _LINE_EDGES_REGEX = re.compile(r'^[ \r\x0b\x0c]+|[ \r\x0b\x0c]+$',
+                                   re.MULTILINE)
+    _NON_ASCII_LINE_REGEX = re.compile(r'^.*[\x80-\xff].*$', re.MULTILINE)
+    _LINE_SPACE_REGEX = re.compile(r'[ \t\r\x0b\x0c]+')
+
     def preprocess(self, entry):
         """Preprocess an entry to a sanitized format.
 
@@ -75,6 +210,108 @@ class BookDataPreprocessor(object):
 
         return book_desc
 
+    def normalize(self, text):
+        """Normalize free text, such as a query, like the catalog fields.
+
+        The steps are those of `preprocess`, except that the text is not
+        split in fields. Invalid UTF-8 sequences are ignored.
+
+        Args:
+          text (str): Text to be normalized.
+
+        Returns:
+          str: Sanitized text.
+
+        """
+        f_text = self.strip_accents(unicode(text.lower(), 'utf-8', 'ignore'))
+        f_text = self._SPECIAL_CHAR_REGEX.sub(' ', f_text)
+        return self._EXTRA_SPACE_REGEX.sub(' ', f_text).strip()
+
+    def preprocess_batch(self, entries):
+        """Preprocess a block of entries at once.
+
+        The entries are joined in a single string, so that each step is a
+        single call over the block instead of one call per entry, and the
+        steps of `preprocess` are replaced by cheaper equivalents:
+          1) Lowercase and tab replacement are a translation table;
+          2) Only lines with non-ASCII characters are decoded and normalized,
+          pure-ASCII lines are left as they are;
+          3) Special characters other than commas are a translation table,
+          since runs of whitespaces are collapsed anyway. Only commas, which
+          depend on their neighbors, are still replaced by an expression.
+
+        The result is the same as calling `preprocess` on each entry.
+
+        Args:
+          entries (list of str): Book entries, each on a single line with an
+            optional trailing line break.
+
+        Returns:
+          list of list of str: Sanitized fields of each entry.
+
+        """
+        if len(entries) == 0:
+            return []
+
+        block = '\n'.join(entry[:-1] if entry.endswith('\n') else entry
+                          for entry in entries)
+        block = block.translate(self._LOWER_TABLE)
+        block = self._LINE_EDGES_REGEX.sub('', block)
+        block = self._NON_ASCII_LINE_REGEX.sub(self.__strip_line_accents,
+                                               block)
+        block = block.translate(self._SPECIAL_CHAR_TABLE)
+        if ',' in block:
+            block = self._COMMA_REGEX.sub(' ', block)
+        block = self._LINE_SPACE_REGEX.sub(' ', block)
+
+        return [line.split('|') for line in block.split('\n')]
+
+    def __strip_line_accents(self, match):
+        return self.strip_accents(unicode(match.group(0), 'utf-8'))
+
+    def to_book(self, entry, positional=False):
+        """Create a book from a catalog entry.
+
+        Args:
+          entry (str): Tab-delimited identifier, title and author.
+          positional (bool, optional): Whether the positions of the words
+            are kept.
+
+        Returns:
+          Book: Book described by the entry.
+
+        """
+        return self.__book_from(self.preprocess(entry), positional)
+
+    def to_books(self, entries, positional=False):
+        """Create books from a block of catalog entries.
+
+        Args:
+          entries (list of str): Tab-delimited identifier, title and author
+            of each book, as lines of the catalog.
+          positional (bool, optional): Whether the positions of the words
+            are kept.
+
+        Returns:
+          list of Book: Books described by the entries.
+
+        """
+        return [self.__book_from(book_desc, positional)
+                for book_desc in self.preprocess_batch(entries)]
+
+    def __book_from(self, book_desc, positional):
+        """Create a book from the sanitized fields of an entry.
+
+        Fields following the author are kept as part of the author, so that
+        every indexed word is stored.
+
+        """
+        iid = book_desc[self._BOOK_META_ID_INDEX].strip()
+        title = book_desc[self._BOOK_META_TITLE_INDEX].strip()
+        author = ' '.join(book_desc[self._BOOK_META_AUTHOR_INDEX:]).strip()
+
+        return Book(iid, title, author, positional=positional)
+
     def strip_accents(self, text):
         return unicodedata.normalize('NFD', text).encode('ascii', 'ignore')
 
@@ -84,49 +321,245 @@ class BookInventory(object):
 
     Args:
       filename (str): File name containing book inventory data.
+      index_location (str, optional): Directory of the index snapshot. When
+        a snapshot exists it is loaded instead of indexing `filename`,
+        otherwise one is written after the index is built.
+      positional (bool, optional): Whether words positions are indexed,
+        enabling phrase and proximity queries.
+      processes (int, optional): Number of processes parsing the catalog.
+      compressed (bool, optional): Whether posting lists are compressed.
+      precision (str, optional): Storage of the tf-idf scores, one of
+        `SCORE_PRECISIONS`.
+      deduplicate (bool, optional): Whether books with the same title and
+        author are indexed once.
+      lazy_objects (bool, optional): Whether titles and authors are kept in
+        a record file read for the displayed results instead of in memory.
+      warm_up (bool, optional): Whether the catalog is indexed in the
+        background, searches being answered from the books indexed so far.
 
     Attributes:
       filename (str): File name containing book inventory data.
+      index_location (str): Directory of the index snapshot.
+      processes (int): Number of processes parsing the catalog.
+      warm_up (bool): Whether the catalog is indexed in the background.
       indexer (Indexer): Object responsible for indexing book inventory data.
 
     """
 
-    _BOOK_META_ID_INDEX = 0
-    _BOOK_META_TITLE_INDEX = 1
-    _BOOK_META_AUTHOR_INDEX = 2
     _NO_RESULTS_MESSAGE = 'Sorry, no results.'
+    _PARTIAL_MESSAGE = 'Partial results, %d books indexed so far'
+    _COVERAGE_MESSAGE = ' (%.0f%% of the catalog)'
 
-    def __init__(self, filename):
+    def __init__(self, filename, index_location=None, positional=False,
+                 processes=1, compressed=False, precision=FLOAT64,
+                 deduplicate=False, lazy_objects=False, warm_up=False):
         self.filename = filename
-        self.engine = SearchEngine()
-
-    @timed
+        self.index_location = index_location
+        self.positional = positional
+        self.processes = processes
+        self.warm_up = warm_up
+        self._read_bytes = 0
+        self._save_thread = None
+        self.engine = SearchEngine(positional, compressed=compressed,
+                                   precision=precision,
+                                   deduplicate=deduplicate,
+                                   lazy_objects=lazy_objects)
+
+    @traced()
     def load_books(self):
         """Load books from a file name.
 
-        This method leverages the iterable behavior of File objects
-        that automatically uses buffered IO and memory management handling
-        effectively large files.
+        The catalog may be plain text, gzip or zip, and is read by a
+        background thread while the previous lines are preprocessed, see
+        `CatalogReader`. Books are streamed to the search engine as they are
+        read, and indexed in the same pass.
+
+        With several `processes`, the catalog is split in chunks of whole
+        lines which are parsed in parallel, see `__parse_in_parallel`.
+        Compressed catalogs can not be split by byte ranges and are always
+        parsed by a single process.
+
+        If an index snapshot is available in `index_location`, the books are
+        loaded from it and the catalog file is not read.
+
+        With `warm_up`, this method returns at once and the catalog is read
+        and indexed in the background by a single process, see `__warm_up`.
 
         """
+        if self.index_location is not None and \
+                self.engine.snapshot_exists(self.index_location):
+            self.engine.load(self.index_location)
+            return
+
         logger.info('Loading books from file...')
-        processor = BookDataPreprocessor()
-        with open(self.filename) as catalog:
-            for entry in catalog:
-                book_desc = processor.preprocess(entry)
-                metadata = ' '.join(book_desc[self._BOOK_META_TITLE_INDEX:])
+        compressed = is_compressed(self.filename)
+        if self.warm_up:
+            self.__warm_up(compressed)
+            return
+        if self.processes > 1 and compressed:
+            logger.warning('Compressed catalog %s is parsed by a single '
+                           'process', self.filename)
+        if self.processes > 1 and not compressed:
+            self.__parse_in_parallel()
+        else:
+            self.engine.start(self.__read_books(self.filename))
+
+        if self.index_location is not None:
+            self.engine.save(self.index_location)
+
+    def __warm_up(self, compressed):
+        """Index the catalog in the background, answering searches meanwhile.
+
+        The coverage of partial results is the fraction of the catalog bytes
+        read, unknown for compressed catalogs. The index snapshot is written
+        once all books are indexed.
+
+        """
+        progress = None
+        if not compressed:
+            catalog_bytes = max(os.path.getsize(self.filename), 1)
+            progress = lambda: min(self._read_bytes / float(catalog_bytes),
+                                   1.0)
+        self._read_bytes = 0
+        self.engine.warm_up(self.__read_books(self.filename),
+                            progress=progress)
+
+        if self.index_location is not None:
+            self._save_thread = threading.Thread(
+                target=self.__save_after_warm_up, name='book-index-save')
+            self._save_thread.daemon = True
+            self._save_thread.start()
+
+    def __save_after_warm_up(self):
+        """Write the index snapshot once the warm-up is done.
+
+        """
+        try:
+            self.engine.wait_for_warm_up()
+        except Exception:
+            # already reported by the engine, the partial index is not saved
+            return
+        self.engine.save(self.index_location)
+
+    def wait_for_books(self):
+        """Block until the books of a warm-up are indexed and saved.
+
+        Raises:
+          Exception: The error which stopped the warm-up, if any.
+
+        """
+        self.engine.wait_for_warm_up()
+        if self._save_thread is not None:
+            self._save_thread.join()
+
+    def __parse_in_parallel(self):
+        """Parse the catalog in a pool of processes and index the books.
+
+        Every process parses chunks of the catalog and accumulates the term
+        frequencies of their books. The chunks are merged in file order, so
+        terms and books are numbered as in a serial pass and the index is
+        the same.
+
+        """
+        chunks = catalog_chunks(self.filename,
+                                self.processes * CHUNKS_PER_PROCESS)
+        stop_words = self.engine.stop_words
+        tasks = [(self.filename, start, end, stop_words, self.positional)
+                 for start, end in chunks]
+
+        builder = TermMatrixBuilder(stop_words, self.positional)
+        books = self.engine.new_store()
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            for chunk_builder, chunk_books in pool.imap(parse_catalog_chunk,
+                                                        tasks):
+                builder.extend(chunk_builder)
+                books.extend(chunk_books)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.engine.start_from(builder, books)
+
+    @traced()
+    def add_books(self, filename):
+        """Add the books of another catalog file to the loaded books.
+
+        The new books are indexed in a new segment of the index, without
+        rebuilding it. The index snapshot is updated if `index_location` is
+        set.
+
+        Args:
+          filename (str): File name containing the new books.
+
+        """
+        logger.info('Adding books from %s...', filename)
+        self.engine.add_objects(self.__read_books(filename))
 
-                iid = book_desc[self._BOOK_META_ID_INDEX].strip()
-                title = book_desc[self._BOOK_META_TITLE_INDEX].strip()
-                author = book_desc[self._BOOK_META_AUTHOR_INDEX].strip()
+        if self.index_location is not None:
+            self.engine.save(self.index_location)
 
-                book = Book(iid, title, author, metadata)
-                self.engine.add_object(book)
+    def delete_book(self, iid):
+        """Delete a book from the loaded books.
 
-        self.engine.start()
+        The index snapshot is updated if `index_location` is set.
 
-    @timed
-    def search_books(self, query, n_results=10):
+        Args:
+          iid (str): Identifier of the book.
+
+        Returns:
+          bool: True if the book was found.
+
+        """
+        deleted = self.engine.delete(iid) > 0
+        if deleted and self.index_location is not None:
+            self.engine.save(self.index_location)
+        return deleted
+
+    def update_book(self, iid, title, author):
+        """Replace the title and author of a book.
+
+        The book is added if it was not loaded. The index snapshot is
+        updated if `index_location` is set.
+
+        Args:
+          iid (str): Identifier of the book.
+          title (str): New title of the book.
+          author (str): New author of the book.
+
+        Returns:
+          bool: True if the book was found.
+
+        """
+        entry = '\t'.join([iid, title, author])
+        book = BookDataPreprocessor().to_book(entry, self.positional)
+        updated = self.engine.update(iid, book) > 0
+        if self.index_location is not None:
+            self.engine.save(self.index_location)
+        return updated
+
+    def __read_books(self, filename):
+        """Read books from a catalog file, preprocessing lines in blocks.
+
+        Args:
+          filename (str): File name containing book inventory data, plain
+            text or compressed.
+
+        Yields:
+          Book: Book described by each line of the catalog.
+
+        """
+        processor = BookDataPreprocessor()
+        for entries in CatalogReader(filename, PREPROCESS_BLOCK_LINES):
+            # lines are counted with their line break
+            self._read_bytes += sum(len(entry) for entry in entries) + \
+                len(entries)
+            for book in processor.to_books(entries, self.positional):
+                yield book
+
+    @traced()
+    def search_books(self, query, n_results=10, mode=ALL_TERMS,
+                     collapse=False):
         """Search books according to provided query of terms.
 
         The query is executed against the indexed books, and a list of books
@@ -136,19 +569,52 @@ class BookInventory(object):
         Args:
           query (str): Query string with one or more terms.
           n_results (int): Desired number of results.
+          mode (str): Whether books must contain all the query terms
+            (`ALL_TERMS`) or any of them (`ANY_TERMS`).
+          collapse (bool): Whether books with the same title and author are
+            displayed once, followed by the identifiers of their duplicates.
+
+        Returns:
+          str: Books and their respective tf-idf scores, one per line,
+            followed by the part of the catalog searched while the books
+            are being indexed.
+
+        """
+        if len(query) == 0:
+            return self._NO_RESULTS_MESSAGE
+        result = self.engine.search(query, n_results, mode, collapse)
+
+        with tracer.span('format'):
+            lines = [str(indexable) for indexable in result]
+            if len(lines) == 0:
+                lines.append(self._NO_RESULTS_MESSAGE)
+            if not result.complete:
+                lines.append(self.__partial_message(result))
+            return '\n'.join(lines)
+
+    def explain_query(self, query, n_results=10, mode=ALL_TERMS):
+        """Describe how a query is evaluated against the indexed books.
+
+        Args:
+          query (str): Query string with one or more terms.
+          n_results (int): Desired number of results.
+          mode (str): Whether books must contain all the query terms
+            (`ALL_TERMS`) or any of them (`ANY_TERMS`).
 
         Returns:
-          list of IndexableResult: List containing books and their respective
-            tf-idf scores.
+          str: Plan of the query, see `SearchEngine.explain`.
 
         """
-        result = ''
-        if len(query) > 0:
-            result = self.engine.search(query, n_results)
+        return self.engine.explain(query, n_results, mode).explain()
 
-        if len(result) > 0:
-            return '\n'.join([str(indexable) for indexable in result])
-        return self._NO_RESULTS_MESSAGE
+    def __partial_message(self, result):
+        """Describe the part of the catalog searched by partial results.
+
+        """
+        if result.coverage is None:
+            return self._PARTIAL_MESSAGE % result.covered_count
+        return (self._PARTIAL_MESSAGE + self._COVERAGE_MESSAGE) % (
+            result.covered_count, 100 * result.coverage)
 
     def books_count(self):
         """Return number of books already in the index.
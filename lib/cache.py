@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Bounded cache evicting the least recently used entries.
+
+    The cache can be bounded by number of entries, by the estimated memory of
+    the entries, or both. Entries are tagged with the generation of the data
+    they were computed from: once the data changes, `invalidate` bumps the
+    generation, and older entries are discarded when they are looked up.
+
+    Args:
+      max_entries (int, optional): Maximum number of entries.
+      max_bytes (int, optional): Maximum estimated memory of the entries.
+      sizeof (callable, optional): Function estimating the memory of a
+        cached value, in bytes. Required if `max_bytes` is set.
+
+    Attributes:
+      max_entries (int): Maximum number of entries, None if unbounded.
+      max_bytes (int): Maximum estimated memory, None if unbounded.
+      generation (int): Generation of the data cached values are valid for.
+      hits (int): Number of successful lookups.
+      misses (int): Number of lookups without a valid entry.
+      evictions (int): Number of entries evicted to respect the bounds.
+      stale (int): Number of entries discarded after an invalidation.
+
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None):
+        if max_bytes is not None and sizeof is None:
+            raise ValueError('A sizeof function is required to bound the '
+                             'cache memory')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value of a key.
+
+        Args:
+          key (hashable): Key of the entry.
+
+        Returns:
+          object: Cached value, or None if there is no valid entry.
+
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            generation, value, size = entry
+            if generation != self.generation:
+                self._bytes -= size
+                self.stale += 1
+                self.misses += 1
+                return None
+
+            # reinsert the entry as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        """Cache the value of a key, evicting entries if needed.
+
+        Args:
+          key (hashable): Key of the entry.
+          value (object): Value to be cached.
+          generation (int, optional): Generation of the data the value was
+            computed from, read before computing it. Values computed from
+            data that has been invalidated since are not cached.
+
+        """
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            previous_entry = self._entries.pop(key, None)
+            if previous_entry is not None:
+                self._bytes -= previous_entry[2]
+
+            self._entries[key] = (self.generation, value, size)
+            self._bytes += size
+
+            while self.__over_budget():
+                evicted_key, evicted_entry = self._entries.popitem(last=False)
+                self._bytes -= evicted_entry[2]
+                self.evictions += 1
+
+    def invalidate(self):
+        """Mark all cached values as stale.
+
+        Stale entries are not removed at once, but discarded when looked up
+        or evicted as the least recently used.
+
+        """
+        with self._lock:
+            self.generation += 1
+
+    def clear(self):
+        """Remove all entries from the cache.
+
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the cache counters.
+
+        Returns:
+          dict: Hits, misses, evictions, stale entries, current number of
+            entries and estimated memory.
+
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'stale': self.stale,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __over_budget(self):
+        if self.max_entries is not None and \
+                len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self._bytes > self.max_bytes
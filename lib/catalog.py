@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import gzip
+import zipfile
+import logging
+import threading
+from Queue import Queue
+from Queue import Full
+
+
+logger = logging.getLogger(__name__)
+
+
+# bytes of decompressed catalog read at once by the reading thread
+READ_CHUNK_BYTES = 1 << 20
+
+# line batches waiting to be preprocessed, bounding the memory of the reader
+QUEUE_BATCHES = 8
+
+# seconds between checks that the consumer still wants batches
+PUT_TIMEOUT = 0.1
+
+_GZIP_MAGIC = '\x1f\x8b'
+_ZIP_MAGIC = 'PK\x03\x04'
+
+
+def is_compressed(filename):
+    """Tell whether a catalog file is compressed.
+
+    The format is detected from the first bytes of the file, not from its
+    extension.
+
+    Args:
+      filename (str): File name of the catalog.
+
+    Returns:
+      bool: True if the catalog is a gzip or zip file.
+
+    """
+    with open(filename, 'rb') as catalog:
+        magic = catalog.read(len(_ZIP_MAGIC))
+    return magic.startswith(_GZIP_MAGIC) or magic == _ZIP_MAGIC
+
+
+def open_catalog(filename):
+    """Open a catalog file, decompressing it on the fly if needed.
+
+    Plain text, gzip and zip catalogs are supported. A zip archive must
+    contain the catalog as its first file.
+
+    Args:
+      filename (str): File name of the catalog.
+
+    Returns:
+      file: Binary file object with the lines of the catalog.
+
+    Raises:
+      ValueError: If a zip archive contains no file.
+
+    """
+    with open(filename, 'rb') as catalog:
+        magic = catalog.read(len(_ZIP_MAGIC))
+
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.GzipFile(filename, 'rb')
+    if magic == _ZIP_MAGIC:
+        with zipfile.ZipFile(filename) as archive:
+            members = [info for info in archive.infolist()
+                       if not info.filename.endswith('/')]
+            if len(members) == 0:
+                raise ValueError('No catalog in zip archive: %s' % filename)
+            # the member keeps its own handle on the archive file
+            return archive.open(members[0])
+    return open(filename, 'rb')
+
+
+class CatalogReader(object):
+    """Stream the lines of a catalog in batches read by a background thread.
+
+    A producer thread reads the catalog by chunks, decompressing it if
+    needed, splits the chunks in lines and puts batches of lines in a bounded
+    queue. Reading and decompressing a chunk release the GIL, so they overlap
+    with the preprocessing of the previous batches by the consumer, and the
+    memory of the reader only depends on the size of the chunks and of the
+    queue, not on the size of the catalog.
+
+    Lines are returned without their trailing line break.
+
+    Args:
+      filename (str): File name of the catalog, see `open_catalog`.
+      batch_lines (int): Number of lines of each batch, the last batch may
+        be shorter.
+      queue_batches (int, optional): Number of batches waiting in the queue.
+      chunk_bytes (int, optional): Number of bytes read at once.
+
+    Attributes:
+      filename (str): File name of the catalog.
+      batch_lines (int): Number of lines of each batch.
+      queue_batches (int): Number of batches waiting in the queue.
+      chunk_bytes (int): Number of bytes read at once.
+
+    """
+
+    def __init__(self, filename, batch_lines, queue_batches=QUEUE_BATCHES,
+                 chunk_bytes=READ_CHUNK_BYTES):
+        self.filename = filename
+        self.batch_lines = batch_lines
+        self.queue_batches = queue_batches
+        self.chunk_bytes = chunk_bytes
+
+    def __iter__(self):
+        """Iterate over the batches of lines of the catalog.
+
+        The reading thread is stopped if the iteration is interrupted, and
+        errors of the reading thread are raised by the iteration.
+
+        Yields:
+          list of str: Consecutive lines of the catalog.
+
+        """
+        batches = Queue(self.queue_batches)
+        stopped = threading.Event()
+        thread = threading.Thread(target=self.__produce,
+                                  args=(batches, stopped),
+                                  name='catalog-reader')
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stopped.set()
+            thread.join()
+
+    def __produce(self, batches, stopped):
+        """Read the catalog and put its batches of lines in the queue.
+
+        The end of the catalog is marked by None, and an error by the raised
+        exception.
+
+        """
+        try:
+            for batch in self.__read_batches():
+                if not self.__put(batches, stopped, batch):
+                    return
+            self.__put(batches, stopped, None)
+        except Exception as error:
+            logger.exception('Reading %s failed', self.filename)
+            self.__put(batches, stopped, error)
+
+    def __read_batches(self):
+        """Split the chunks of the catalog in batches of lines.
+
+        """
+        catalog = open_catalog(self.filename)
+        try:
+            batch = []
+            partial_line = ''
+            while True:
+                chunk = catalog.read(self.chunk_bytes)
+                if len(chunk) == 0:
+                    break
+                lines = (partial_line + chunk).split('\n')
+                partial_line = lines.pop()
+                batch.extend(lines)
+                start = 0
+                while len(batch) - start >= self.batch_lines:
+                    yield batch[start:start + self.batch_lines]
+                    start += self.batch_lines
+                batch = batch[start:]
+            if len(partial_line) > 0:
+                batch.append(partial_line)
+            if len(batch) > 0:
+                yield batch
+        finally:
+            catalog.close()
+
+    def __put(self, batches, stopped, item):
+        """Put an item in the queue unless the consumer stopped.
+
+        Returns:
+          bool: False if the consumer stopped before the item was queued.
+
+        """
+        while not stopped.is_set():
+            try:
+                batches.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except Full:
+                pass
+        return False
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from collections import defaultdict
+
+
+class DuplicateGroups(object):
+    """Side table of the objects collapsed into an indexed document.
+
+    Objects whose stored fields are identical are indexed once: the first
+    one is the canonical document of the group, and the identifiers of the
+    following ones are kept here as members of the group, by global index of
+    the canonical document. The canonical object itself is not a member.
+
+    Attributes:
+      count (int): Number of members of all groups.
+
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._members = {}
+        self._docs = defaultdict(set)
+
+    def __len__(self):
+        return len(self._members)
+
+    def add(self, doc_index, iid):
+        """Add a member to the group of a document.
+
+        Args:
+          doc_index (int): Global index of the canonical document.
+          iid (object): Identifier of the collapsed object.
+
+        """
+        self._members.setdefault(doc_index, []).append(iid)
+        self._docs[iid].add(doc_index)
+        self.count += 1
+
+    def members(self, doc_index):
+        """Return the members of the group of a document.
+
+        Args:
+          doc_index (int): Global index of the canonical document.
+
+        Returns:
+          list: Identifiers of the members, in the order they were added,
+            empty if the document has no duplicates.
+
+        """
+        return self._members.get(doc_index, [])
+
+    def docs_of(self, iid):
+        """Return the documents whose group contains an identifier.
+
+        Args:
+          iid (object): Identifier of a member.
+
+        Returns:
+          list of int: Sorted global indices of the canonical documents.
+
+        """
+        return sorted(self._docs.get(iid, ()))
+
+    def remove(self, doc_index, iid):
+        """Remove every member with an identifier from a group.
+
+        Args:
+          doc_index (int): Global index of the canonical document.
+          iid (object): Identifier of the members.
+
+        Returns:
+          int: Number of removed members.
+
+        """
+        members = self._members.get(doc_index, [])
+        kept = [member for member in members if member != iid]
+        removed = len(members) - len(kept)
+        if removed > 0:
+            self.__discard(doc_index)
+            for member in kept:
+                self.add(doc_index, member)
+        return removed
+
+    def pop(self, doc_index):
+        """Remove the group of a document.
+
+        Args:
+          doc_index (int): Global index of the canonical document.
+
+        Returns:
+          list: Identifiers of the members of the group, empty if the
+            document has no duplicates.
+
+        """
+        members = self._members.get(doc_index, [])
+        self.__discard(doc_index)
+        return members
+
+    def __discard(self, doc_index):
+        """Drop a group and its reverse entries.
+
+        """
+        members = self._members.pop(doc_index, [])
+        for member in members:
+            docs = self._docs[member]
+            docs.discard(doc_index)
+            if len(docs) == 0:
+                del self._docs[member]
+        self.count -= len(members)
+
+    def counts(self, start, end):
+        """Count the members of the groups of a range of documents.
+
+        Args:
+          start (int): Global index of the first document.
+          end (int): Global index following the last document.
+
+        Returns:
+          tuple: Sorted global indices of the documents with duplicates, and
+            their numbers of members.
+
+        """
+        docs_indices = np.array(sorted(doc_index for doc_index in self._members
+                                       if start <= doc_index < end),
+                                dtype=np.int64)
+        counts = np.array([len(self._members[doc_index])
+                           for doc_index in docs_indices], dtype=np.int64)
+        return docs_indices, counts
+
+    def take(self, docs_indices):
+        """Return the groups of a selection of the documents, renumbered.
+
+        Args:
+          docs_indices (numpy.ndarray): Global indices of the selected
+            documents, in their new order.
+
+        Returns:
+          DuplicateGroups: Groups of the selected documents, by their
+            position in `docs_indices`.
+
+        """
+        groups = DuplicateGroups()
+        if len(self._members) == 0 or len(docs_indices) == 0:
+            return groups
+
+        docs_indices = np.asarray(docs_indices, dtype=np.int64)
+        positions = np.empty(max(max(self._members), docs_indices.max()) + 1,
+                             dtype=np.int64)
+        positions.fill(-1)
+        positions[docs_indices] = np.arange(len(docs_indices))
+        for doc_index, members in self._members.iteritems():
+            if positions[doc_index] >= 0:
+                for member in members:
+                    groups.add(int(positions[doc_index]), member)
+        return groups
+
+    def save(self, writer):
+        """Store the groups in a snapshot.
+
+        Args:
+          writer (SnapshotWriter): Snapshot being written.
+
+        """
+        writer.write_objects('duplicates_members', self._members)
+
+    def load(self, reader):
+        """Restore the groups from a snapshot.
+
+        Args:
+          reader (SnapshotReader): Snapshot being read.
+
+        """
+        self.count = 0
+        self._members = {}
+        self._docs = defaultdict(set)
+        for doc_index, members in reader.read_objects(
+                'duplicates_members').iteritems():
+            for member in members:
+                self.add(doc_index, member)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+
+class SegmentPlan(object):
+    """Evaluation of a query on a segment of the index.
+
+    Args:
+      doc_base (int): Global index of the first document of the segment.
+      n_docs (int): Number of documents of the segment.
+
+    Attributes:
+      doc_base (int): Global index of the first document of the segment.
+      n_docs (int): Number of documents of the segment.
+      terms (list of tuple): Unique query terms in evaluation order, from
+        the rarest in the segment, and the length of their posting list.
+      steps (list of tuple): Each term whose posting list was intersected
+        with the accumulated candidates, the strategy of the intersection,
+        and the number of remaining candidates.
+      filters (list of tuple): Each phrase or proximity constraint checked
+        on the candidates, and the number of remaining candidates.
+      candidates (int): Number of documents scored.
+      exit (str): Reason why the evaluation stopped early, None if it did
+        not.
+
+    """
+
+    def __init__(self, doc_base, n_docs):
+        self.doc_base = doc_base
+        self.n_docs = n_docs
+        self.terms = []
+        self.steps = []
+        self.filters = []
+        self.candidates = 0
+        self.exit = None
+
+    def lines(self):
+        """Describe the evaluation, one line per step.
+
+        Returns:
+          list of str: Lines of the description.
+
+        """
+        lines = ['segment of documents %d to %d:' % (
+            self.doc_base, self.doc_base + self.n_docs - 1)]
+        if len(self.terms) > 0:
+            lines.append('  terms by frequency: %s' % ', '.join(
+                '%s (%d)' % (term, length) for term, length in self.terms))
+        for term, strategy, remaining in self.steps:
+            lines.append('  intersect %s by %s: %d candidates' %
+                         (term, strategy, remaining))
+        for constraint, remaining in self.filters:
+            lines.append('  check %s: %d candidates' % (constraint, remaining))
+        if self.exit is not None:
+            lines.append('  stopped: %s' % self.exit)
+        else:
+            lines.append('  scored %d candidates' % self.candidates)
+        return lines
+
+
+class QueryPlan(object):
+    """Plan of the evaluation of a query, as described by `explain`.
+
+    Args:
+      query (str): Query string.
+      mode (str): Query mode.
+      parsed_query (Query): Normalized query.
+
+    Attributes:
+      query (str): Query string.
+      mode (str): Query mode.
+      terms (list of str): Normalized query terms.
+      dropped_words (list of str): Stop words dropped from the terms.
+      exit (str): Reason why the query was answered without evaluating the
+        segments, None if they were evaluated.
+      segments (list of SegmentPlan): Evaluation of each segment.
+
+    """
+
+    def __init__(self, query, mode, parsed_query):
+        self.query = query
+        self.mode = mode
+        self.terms = parsed_query.terms
+        self.dropped_words = parsed_query.dropped_words
+        self.exit = None
+        self.segments = []
+
+    def explain(self):
+        """Describe the plan.
+
+        Returns:
+          str: Description of the plan, one step per line.
+
+        """
+        lines = ['query: %s' % self.query,
+                 'mode: %s' % self.mode,
+                 'terms: %s' % ' '.join(self.terms)]
+        if len(self.dropped_words) > 0:
+            lines.append('dropped stop words: %s' %
+                         ' '.join(self.dropped_words))
+        if self.exit is not None:
+            lines.append('stopped: %s' % self.exit)
+        for segment in self.segments:
+            lines.extend(segment.lines())
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.explain()
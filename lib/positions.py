@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from postings import lookup
+
+
+class PositionalIndex(object):
+    """Class storing the positions of the terms in the indexed documents.
+
+    For each (term, document) posting, the positions of the term in the
+    document are stored delta-encoded: the first position followed by the
+    distance to the previous one. The deltas of all postings are concatenated
+    in the same order as the postings of the index (by term, then by
+    document), and delimited by an array of offsets. The documents of the
+    postings are not stored again: the entry of a document is found by its
+    position in the posting list of the term.
+
+    Positions are only decoded for the documents being checked, so phrase
+    and proximity constraints are evaluated on the intersected candidates,
+    not on whole posting lists.
+
+    Attributes:
+      vocabulary (dict): Dictionary containing the indexed terms as keys
+        and their global index.
+      index (Index): Posting lists of the documents.
+      term_offsets (numpy.ndarray): Start of the postings of each term.
+      entry_offsets (numpy.ndarray): Start of the deltas of each posting.
+      deltas (numpy.ndarray): Delta-encoded positions of all postings.
+
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.index = None
+        self.term_offsets = []
+        self.entry_offsets = []
+        self.deltas = []
+
+    def build_index_from(self, builder, index):
+        """Build the positional index from accumulated term positions.
+
+        Args:
+          builder (TermMatrixBuilder): Term positions of the indexed objects,
+            accumulated with `positional` enabled.
+          index (Index): Posting lists of the same objects.
+
+        """
+        self.vocabulary = builder.vocabulary
+        self.index = index
+        self.term_offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(builder.document_frequencies(), out=self.term_offsets[1:])
+        self.entry_offsets, deltas = builder.column_positions()
+
+        # positions are short distances in most documents
+        if len(deltas) == 0 or deltas.max() < np.iinfo(np.uint16).max:
+            deltas = deltas.astype(np.uint16)
+        self.deltas = deltas
+
+    def positions(self, term, docs_indices):
+        """Decode the positions of a term in the given documents.
+
+        Args:
+          term (str): Indexed term.
+          docs_indices (numpy.ndarray): Sorted indices of documents, those
+            not containing `term` having no occurrence.
+
+        Returns:
+          tuple: Arrays with the index in `docs_indices` of each occurrence
+            and the position of the occurrence, sorted by document and
+            position.
+
+        """
+        if len(docs_indices) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.int64)
+
+        found, entries = lookup(self.index.postings_list(term), docs_indices)
+        entries = self.term_offsets[self.vocabulary[term]] + entries
+
+        entries_starts = self.entry_offsets[entries]
+        lengths = self.entry_offsets[entries + 1] - entries_starts
+        total_length = lengths.sum()
+
+        # gather the deltas of the selected entries
+        segments_starts = np.cumsum(lengths) - lengths
+        gather = np.arange(total_length) + np.repeat(
+            entries_starts - segments_starts, lengths)
+        deltas = self.deltas[gather].astype(np.int64)
+
+        # restart the cumulative sum at the beginning of every entry
+        positions = np.cumsum(deltas)
+        offsets = positions[segments_starts] - deltas[segments_starts]
+        positions -= np.repeat(offsets, lengths)
+
+        rows = np.repeat(np.flatnonzero(found), lengths)
+        return rows, positions
+
+    def match_phrase(self, docs_indices, phrase):
+        """Select documents where the words of a phrase appear in order.
+
+        Args:
+          docs_indices (numpy.ndarray): Sorted indices of documents that
+            contain all words of the phrase.
+          phrase (list of tuple): Words and their offset in the phrase.
+
+        Returns:
+          numpy.ndarray: Documents of `docs_indices` containing the phrase.
+
+        """
+        matching_keys = None
+        for word, offset in phrase:
+            rows, positions = self.positions(word, docs_indices)
+            # where the phrase would start in the document
+            starts = positions - offset
+            keys = self.__keys(rows[starts >= 0], starts[starts >= 0])
+            if matching_keys is None:
+                matching_keys = np.unique(keys)
+            else:
+                matching_keys = np.intersect1d(matching_keys, keys)
+
+        matching_rows = np.unique(matching_keys >> 32)
+        return docs_indices[matching_rows]
+
+    def match_near(self, docs_indices, first_word, second_word, distance):
+        """Select documents where two words appear close to each other.
+
+        Args:
+          docs_indices (numpy.ndarray): Sorted indices of documents that
+            contain both words.
+          first_word (str): Indexed word.
+          second_word (str): Indexed word.
+          distance (int): Maximum number of positions between the words.
+
+        Returns:
+          numpy.ndarray: Documents of `docs_indices` where the words are at
+            most `distance` positions apart, in any order.
+
+        """
+        first_rows, first_positions = self.positions(first_word, docs_indices)
+        second_rows, second_positions = self.positions(second_word,
+                                                       docs_indices)
+        first_keys = self.__keys(first_rows, first_positions)
+        second_keys = self.__keys(second_rows, second_positions)
+
+        # closest occurrence of the first word after second - distance
+        closest = np.searchsorted(first_keys, second_keys - distance)
+        closest_keys = first_keys.take(closest, mode='clip')
+        is_near = (closest < len(first_keys)) & \
+                  (closest_keys <= second_keys + distance)
+
+        return docs_indices[np.unique(second_rows[is_near])]
+
+    def __keys(self, rows, positions):
+        """Combine rows and positions in sortable 64 bits keys.
+
+        """
+        return (rows.astype(np.int64) << 32) + positions
+
+    def nbytes(self):
+        """Return the memory used by the positions.
+
+        Returns:
+          int: Size in bytes of the offsets and deltas.
+
+        """
+        return (self.term_offsets.nbytes + self.entry_offsets.nbytes +
+                self.deltas.nbytes)
+
+    def save(self, writer):
+        """Store term positions in a snapshot.
+
+        Args:
+          writer (SnapshotWriter): Snapshot being written.
+
+        """
+        terms = [None] * len(self.vocabulary)
+        for term, term_index in self.vocabulary.iteritems():
+            terms[term_index] = term
+
+        writer.write_terms('positions_vocabulary', terms)
+        writer.write_array('positions_term_offsets', self.term_offsets)
+        writer.write_array('positions_entry_offsets', self.entry_offsets)
+        writer.write_array('positions_deltas', self.deltas)
+
+    def load(self, reader, index):
+        """Restore term positions from a snapshot.
+
+        Args:
+          reader (SnapshotReader): Snapshot being read.
+          index (Index): Posting lists of the documents, restored from the
+            same snapshot.
+
+        """
+        terms = reader.read_terms('positions_vocabulary')
+        self.vocabulary = dict((term, index) for index, term
+                               in enumerate(terms))
+        self.term_offsets = reader.read_array('positions_term_offsets')
+        self.index = index
+        self.entry_offsets = reader.read_array('positions_entry_offsets')
+        self.deltas = reader.read_array('positions_deltas')
@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+POSTINGS_DTYPE = np.int32
+EMPTY_POSTINGS = np.zeros(0, dtype=POSTINGS_DTYPE)
+EMPTY_POSTINGS.flags.writeable = False
+
+# documents of a compressed block, at most 255 to count them in a byte
+BLOCK_SIZE = 128
+# zeros after the compressed data, gaps are decoded by reading 8 bytes
+_PADDING_BYTES = 8
+
+# strategies of pair intersections: binary searches of the smaller list in
+# the larger one, a bitmap of the larger list, or the blocks of a compressed
+# larger list that may contain the documents of the smaller one
+GALLOP = 'gallop'
+BITMAP = 'bitmap'
+BLOCKS = 'blocks'
+# a bitmap is used when the larger list is at most `BITMAP_RATIO` times
+# larger than the smaller one, and the documents between the first and the
+# last one of the smaller list, which the bitmap covers, are at most
+# `BITMAP_SPAN` times as many as those of the larger list, so that the
+# bitmap stays linear in the size of both lists
+BITMAP_RATIO = 8
+BITMAP_SPAN = 32
+
+
+def as_postings(doc_indices):
+    """Convert document indices to the posting list representation.
+
+    Args:
+      doc_indices (iterable of int): Sorted indices of documents, such as a
+        compressed posting list.
+
+    Returns:
+      numpy.ndarray: Sorted `int32` array with the document indices.
+
+    """
+    if isinstance(doc_indices, BlockPostingList):
+        return doc_indices.decode()
+    return np.asarray(doc_indices, dtype=POSTINGS_DTYPE)
+
+
+def intersect(postings_lists, steps=None):
+    """Intersect sorted posting lists.
+
+    Lists are processed from the rarest to the most common, so that the
+    accumulated result, which can only shrink, is always the smaller operand
+    of the next intersection, and the intersection stops as soon as it is
+    empty. Only the rarest list is fully decoded when lists are compressed.
+
+    Args:
+      postings_lists (list of numpy.ndarray or BlockPostingList): Sorted
+        posting lists.
+      steps (list, optional): List receiving the position of each list
+        intersected with the accumulated result, in `postings_lists`, the
+        strategy used and the size of the result.
+
+    Returns:
+      numpy.ndarray: Sorted document indices present in all lists.
+
+    """
+    if len(postings_lists) == 0:
+        return EMPTY_POSTINGS
+
+    order = sorted(range(len(postings_lists)),
+                   key=lambda position: len(postings_lists[position]))
+    docs_indices = as_postings(postings_lists[order[0]])
+    for position in order[1:]:
+        if len(docs_indices) == 0:
+            break
+        postings = postings_lists[position]
+        strategy = pair_strategy(docs_indices, postings)
+        docs_indices = intersect_pair(docs_indices, postings, strategy)
+        if steps is not None:
+            steps.append((position, strategy, len(docs_indices)))
+    return docs_indices
+
+
+def pair_strategy(small, large):
+    """Choose how two sorted posting lists are intersected.
+
+    Args:
+      small (numpy.ndarray or BlockPostingList): Sorted posting list.
+      large (numpy.ndarray or BlockPostingList): Sorted posting list, not
+        shorter than `small`.
+
+    Returns:
+      str: `BLOCKS` if the larger list is compressed, `BITMAP` if both
+        lists have similar lengths and the smaller list is dense enough,
+        `GALLOP` otherwise.
+
+    """
+    if isinstance(large, BlockPostingList):
+        return BLOCKS
+    if len(small) > 0 and len(large) <= BITMAP_RATIO * len(small):
+        small = as_postings(small)
+        if int(small[-1]) - int(small[0]) < BITMAP_SPAN * len(large):
+            return BITMAP
+    return GALLOP
+
+
+def intersect_pair(small, large, strategy=None):
+    """Intersect two sorted posting lists.
+
+    With `GALLOP`, each document of the smaller list is looked up in the
+    larger list with a binary search, which is the vectorized form of a
+    galloping search: the cost is proportional to the size of the smaller
+    list (times the logarithm of the larger one) instead of the size of both
+    lists. With `BLOCKS`, only the blocks of the compressed larger list that
+    may contain the documents of the smaller list are decoded. With
+    `BITMAP`, the documents of the larger list between the first and the
+    last document of the smaller list are marked in a bitmap covering only
+    that range, and the documents of the smaller list are looked up without
+    searching, which is cheaper once the lists have similar lengths and the
+    range is not much larger than the lists.
+
+    Args:
+      small (numpy.ndarray or BlockPostingList): Sorted posting list,
+        ideally the shortest one.
+      large (numpy.ndarray or BlockPostingList): Sorted posting list.
+      strategy (str, optional): Strategy of the intersection, chosen by
+        `pair_strategy` by default.
+
+    Returns:
+      numpy.ndarray: Sorted document indices present in both lists.
+
+    """
+    if len(small) > len(large):
+        small, large = large, small
+    if len(small) == 0:
+        return EMPTY_POSTINGS
+
+    small = as_postings(small)
+    if strategy is None:
+        strategy = pair_strategy(small, large)
+    if isinstance(large, BlockPostingList):
+        if strategy == BLOCKS:
+            return large.intersect(small)
+        large = large.decode()
+
+    if strategy == BITMAP:
+        first, last = int(small[0]), int(small[-1])
+        start, end = np.searchsorted(large, [first, last + 1])
+        bitmap = np.zeros(last - first + 1, dtype=bool)
+        bitmap[large[start:end] - first] = True
+        return small[bitmap[small - first]]
+    positions = np.searchsorted(large, small)
+    found = large.take(positions, mode='clip') == small
+    return small[found]
+
+
+def seek(postings, start, target):
+    """Find the first document of a posting list not smaller than a target.
+
+    Args:
+      postings (numpy.ndarray or BlockPostingList): Sorted posting list.
+      start (int): Position from which the list is searched.
+      target (int): Document index.
+
+    Returns:
+      int: Position of the first document >= `target` at or after `start`,
+        the length of the list if there is none.
+
+    """
+    if isinstance(postings, BlockPostingList):
+        return postings.seek(start, target)
+    return start + int(np.searchsorted(postings[start:], target))
+
+
+def lookup(postings, docs_indices):
+    """Find documents in a posting list.
+
+    Args:
+      postings (numpy.ndarray or BlockPostingList): Sorted posting list.
+      docs_indices (numpy.ndarray): Sorted document indices.
+
+    Returns:
+      tuple: Boolean mask of the documents of `docs_indices` present in the
+        list, and the position in the list of each of them.
+
+    """
+    if isinstance(postings, BlockPostingList):
+        return postings.lookup(docs_indices)
+    if len(postings) == 0:
+        return (np.zeros(len(docs_indices), dtype=bool),
+                np.zeros(0, dtype=np.int64))
+    positions = np.searchsorted(postings, docs_indices)
+    found = postings.take(positions, mode='clip') == docs_indices
+    return found, positions[found]
+
+
+class CompressedPostings(object):
+    """Posting lists of all terms compressed in blocks.
+
+    The posting list of each term is split in blocks of `BLOCK_SIZE`
+    documents. The first document of a block is stored as is, and the gaps
+    between the following ones are bit-packed with the number of bits of the
+    largest gap of the block. The first and last documents of every block
+    are kept uncompressed as skip data, so that a search only decodes the
+    blocks that may contain the documents it looks for.
+
+    Offsets are stored as `int32` unless they need 64 bits.
+
+    Attributes:
+      term_offsets (numpy.ndarray): First block of each term, and the end of
+        the blocks of the last term.
+      block_first (numpy.ndarray): First document of each block.
+      block_last (numpy.ndarray): Last document of each block.
+      block_counts (numpy.ndarray): Number of documents of each block.
+      block_widths (numpy.ndarray): Number of bits of each packed gap.
+      block_offsets (numpy.ndarray): Start of the packed gaps of each block
+        in `data`, and the end of the last block.
+      data (numpy.ndarray): Bit-packed gaps of all blocks.
+
+    """
+
+    _ARRAYS = ['term_offsets', 'block_first', 'block_last', 'block_counts',
+               'block_widths', 'block_offsets', 'data']
+
+    def __init__(self):
+        self.term_offsets = np.zeros(1, dtype=np.int32)
+        self.block_first = EMPTY_POSTINGS
+        self.block_last = EMPTY_POSTINGS
+        self.block_counts = np.zeros(0, dtype=np.uint8)
+        self.block_widths = np.zeros(0, dtype=np.uint8)
+        self.block_offsets = np.zeros(1, dtype=np.int32)
+        self.data = np.zeros(_PADDING_BYTES, dtype=np.uint8)
+
+    def build(self, offsets, postings):
+        """Compress posting lists stored as a CSC matrix.
+
+        Args:
+          offsets (numpy.ndarray): Start of the posting list of each term in
+            `postings`, and the end of the last one.
+          postings (numpy.ndarray): Sorted posting lists of all terms,
+            concatenated.
+
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        postings = np.asarray(postings, dtype=np.int64)
+        lengths = np.diff(offsets)
+        blocks_per_term = (lengths + BLOCK_SIZE - 1) // BLOCK_SIZE
+        term_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(blocks_per_term, out=term_offsets[1:])
+        n_blocks = int(term_offsets[-1])
+
+        # block of every posting, and position of the posting in its block
+        terms = np.repeat(np.arange(len(lengths)), lengths)
+        ranks = np.arange(len(postings)) - offsets[terms]
+        blocks = term_offsets[terms] + ranks // BLOCK_SIZE
+        is_first = ranks % BLOCK_SIZE == 0
+
+        self.block_counts = np.bincount(
+            blocks, minlength=n_blocks).astype(np.uint8)
+        self.block_first = postings[is_first].astype(POSTINGS_DTYPE)
+        block_ends = np.append(np.flatnonzero(is_first)[1:],
+                               len(postings)) - 1
+        self.block_last = postings[block_ends[:n_blocks]].astype(
+            POSTINGS_DTYPE)
+
+        # gaps minus one between consecutive documents of a block
+        gaps = postings[~is_first] - postings[np.flatnonzero(~is_first) - 1]
+        gaps -= 1
+        gaps_blocks = blocks[~is_first]
+        widths = np.frexp(gaps.astype(float))[1]
+        self.block_widths = np.zeros(n_blocks, dtype=np.uint8)
+        if len(gaps) > 0:
+            starts = np.flatnonzero(np.diff(np.append(-1, gaps_blocks)))
+            self.block_widths[gaps_blocks[starts]] = \
+                np.maximum.reduceat(widths, starts)
+
+        block_bytes = ((self.block_counts.astype(np.int64) - 1) *
+                       self.block_widths + 7) // 8
+        block_offsets = np.zeros(n_blocks + 1, dtype=np.int64)
+        np.cumsum(block_bytes, out=block_offsets[1:])
+
+        gaps_ranks = (ranks[~is_first] % BLOCK_SIZE) - 1
+        gaps_widths = self.block_widths[gaps_blocks].astype(np.int64)
+        bit_starts = block_offsets[gaps_blocks] * 8 + gaps_ranks * gaps_widths
+        self.data = self.__pack(gaps, gaps_widths, bit_starts,
+                                int(block_offsets[-1]))
+        self.term_offsets = self.__compact(term_offsets)
+        self.block_offsets = self.__compact(block_offsets)
+
+    def __compact(self, offsets):
+        """Store offsets as `int32` if they fit.
+
+        """
+        if len(offsets) == 0 or offsets[-1] < np.iinfo(np.int32).max:
+            return offsets.astype(np.int32)
+        return offsets
+
+    def __pack(self, values, widths, bit_starts, n_bytes):
+        """Write the bits of values at the given bit positions.
+
+        Bits are packed from the least significant bit of each byte, and the
+        data is padded so that 8 bytes can be read from any position.
+
+        """
+        bits = np.zeros((n_bytes + _PADDING_BYTES) * 8, dtype=np.uint8)
+        for bit in range(int(widths.max()) if len(widths) > 0 else 0):
+            selected = widths > bit
+            bits[bit_starts[selected] + bit] = \
+                (values[selected] >> bit) & 1
+        return np.packbits(bits.reshape(-1, 8)[:, ::-1])
+
+    def __len__(self):
+        return len(self.term_offsets) - 1
+
+    def postings_list(self, term_index):
+        """Return the compressed posting list of a term.
+
+        Args:
+          term_index (int): Index of the term.
+
+        Returns:
+          BlockPostingList: Posting list decoding its blocks on demand.
+
+        """
+        return BlockPostingList(self, term_index)
+
+    def decode_blocks(self, blocks):
+        """Decode the documents of some blocks.
+
+        Args:
+          blocks (numpy.ndarray): Sorted indices of blocks.
+
+        Returns:
+          numpy.ndarray: Documents of the blocks, concatenated.
+
+        """
+        blocks = np.asarray(blocks, dtype=np.int64)
+        if len(blocks) == 0:
+            return EMPTY_POSTINGS
+        counts = self.block_counts[blocks].astype(np.int64)
+        widths = self.block_widths[blocks].astype(np.int64)
+
+        # bit position of every gap: the k-th gap of all blocks starts at
+        # k * width, shifted to the packed data of its block
+        gaps_counts = counts - 1
+        gaps_starts = np.cumsum(gaps_counts) - gaps_counts
+        gaps_widths = np.repeat(widths, gaps_counts)
+        bit_starts = np.repeat(
+            self.block_offsets[blocks].astype(np.int64) * 8 -
+            gaps_starts * widths, gaps_counts) + \
+            np.arange(len(gaps_widths)) * gaps_widths
+
+        # a gap spans at most 5 bytes: read the 8 bytes starting with it,
+        # through a view of the data as overlapping 64 bits words
+        words = np.ndarray(shape=(len(self.data) - _PADDING_BYTES + 1,),
+                           dtype='<u8', buffer=self.data, strides=(1,))
+        gaps = (words[bit_starts >> 3] >> (bit_starts & 7).astype(np.uint64)) \
+            & ((np.uint64(1) << gaps_widths.astype(np.uint64)) - np.uint64(1))
+
+        # the first document of a block is a step from the last document of
+        # the previous block, so one cumulative sum decodes all blocks
+        docs_starts = np.cumsum(counts) - counts
+        steps = np.empty(counts.sum(), dtype=np.int64)
+        is_gap = np.ones(len(steps), dtype=bool)
+        is_gap[docs_starts] = False
+        steps[is_gap] = gaps.astype(np.int64) + 1
+        steps[docs_starts] = self.block_first[blocks]
+        steps[docs_starts[1:]] -= self.block_last[blocks[:-1]]
+        return np.cumsum(steps).astype(POSTINGS_DTYPE)
+
+    def nbytes(self):
+        """Return the memory used by the compressed posting lists.
+
+        Returns:
+          int: Size in bytes of all arrays.
+
+        """
+        return sum(getattr(self, name).nbytes for name in self._ARRAYS)
+
+    def save(self, writer):
+        """Store the compressed posting lists in a snapshot.
+
+        Args:
+          writer (SnapshotWriter): Snapshot being written.
+
+        """
+        for name in self._ARRAYS:
+            writer.write_array('postings_' + name, getattr(self, name))
+
+    def load(self, reader):
+        """Restore compressed posting lists from a snapshot.
+
+        Args:
+          reader (SnapshotReader): Snapshot being read.
+
+        """
+        for name in self._ARRAYS:
+            setattr(self, name, reader.read_array('postings_' + name))
+
+
+class BlockPostingList(object):
+    """Posting list of a term stored in a `CompressedPostings`.
+
+    Blocks are only decoded when one of their documents is needed. The last
+    decoded block is kept, since cursors usually read several documents of
+    the same block.
+
+    Args:
+      postings (CompressedPostings): Compressed posting lists.
+      term_index (int): Index of the term.
+
+    """
+
+    __slots__ = ('postings', 'first_block', 'end_block', 'length',
+                 '_block', '_block_docs')
+
+    def __init__(self, postings, term_index):
+        self.postings = postings
+        self.first_block = int(postings.term_offsets[term_index])
+        self.end_block = int(postings.term_offsets[term_index + 1])
+        self.length = int(postings.block_counts[
+            self.first_block:self.end_block].sum(dtype=np.int64))
+        self._block = None
+        self._block_docs = None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError('Posting position out of range')
+        block = position // BLOCK_SIZE
+        return self.__block_docs(block)[position - block * BLOCK_SIZE]
+
+    def __block_docs(self, block):
+        """Decode a block of the list, keeping the last decoded one.
+
+        """
+        if self._block != block:
+            self._block_docs = self.postings.decode_blocks(
+                [self.first_block + block])
+            self._block = block
+        return self._block_docs
+
+    def decode(self):
+        """Decode the whole posting list.
+
+        Returns:
+          numpy.ndarray: Sorted document indices.
+
+        """
+        return self.postings.decode_blocks(
+            np.arange(self.first_block, self.end_block))
+
+    def seek(self, start, target):
+        """Find the first document not smaller than a target.
+
+        Only the block that may contain the document is decoded, it is found
+        with the last document of each block.
+
+        Args:
+          start (int): Position from which the list is searched.
+          target (int): Document index.
+
+        Returns:
+          int: Position of the first document >= `target` at or after
+            `start`, the length of the list if there is none.
+
+        """
+        if start >= self.length:
+            return self.length
+        start_block = start // BLOCK_SIZE
+        block_last = self.postings.block_last[
+            self.first_block + start_block:self.end_block]
+        block = start_block + int(np.searchsorted(block_last, target))
+        if block * BLOCK_SIZE >= self.length:
+            return self.length
+        position = block * BLOCK_SIZE + int(np.searchsorted(
+            self.__block_docs(block), target))
+        return max(position, start)
+
+    def lookup(self, docs_indices):
+        """Find the documents of a sorted array in the list.
+
+        Only the blocks that may contain one of the documents are decoded.
+
+        Args:
+          docs_indices (numpy.ndarray): Sorted document indices.
+
+        Returns:
+          tuple: Boolean mask of the documents of `docs_indices` present in
+            the list, and the position in the list of each of them.
+
+        """
+        block_first = self.postings.block_first[self.first_block:
+                                                self.end_block]
+        block_last = self.postings.block_last[self.first_block:
+                                              self.end_block]
+        blocks = np.searchsorted(block_last, docs_indices)
+        candidates = blocks < len(block_last)
+        candidates[candidates] &= (block_first[blocks[candidates]] <=
+                                   docs_indices[candidates])
+        blocks = np.unique(blocks[candidates])
+        if len(blocks) == 0:
+            return (np.zeros(len(docs_indices), dtype=bool),
+                    np.zeros(0, dtype=np.int64))
+
+        docs = self.postings.decode_blocks(self.first_block + blocks)
+        # position in the list of each decoded document
+        counts = self.postings.block_counts[
+            self.first_block + blocks].astype(np.int64)
+        docs_starts = np.cumsum(counts) - counts
+        ranks = np.arange(len(docs)) + np.repeat(
+            blocks * BLOCK_SIZE - docs_starts, counts)
+        positions = np.searchsorted(docs, docs_indices)
+        found = docs.take(positions, mode='clip') == docs_indices
+        return found, ranks[positions[found]]
+
+    def intersect(self, docs_indices):
+        """Select the documents of a sorted array present in the list.
+
+        Only the blocks that may contain one of the documents are decoded.
+
+        Args:
+          docs_indices (numpy.ndarray): Sorted document indices.
+
+        Returns:
+          numpy.ndarray: Documents of `docs_indices` present in the list.
+
+        """
+        found, positions = self.lookup(docs_indices)
+        return docs_indices[found]
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from postings import as_postings
+
+
+# slack added to each sum of upper bounds so that rounding errors, caused
+# by summing impacts in a different order, never prune a competitive document
+_BOUND_TOLERANCE = 1e-12
+
+
+class MaxScoreEvaluator(object):
+    """Term-at-a-time top-k evaluator using the MaxScore algorithm.
+
+    Each term has an upper bound for the score it can add to a document.
+    Terms are accumulated from the highest bound to the lowest into the
+    scores of the candidate documents, which are lower bounds of the final
+    scores, and the lowest score of the `k` best candidates is the threshold
+    to beat. Once the bounds of the remaining terms sum to less than the
+    threshold, these terms are non-essential: a document containing none of
+    the accumulated terms can not enter the top k, so only the candidates
+    found so far are looked up in the remaining posting lists, with binary
+    searches, and candidates whose score plus the remaining bounds can not
+    reach the threshold are dropped before each lookup.
+
+    Every step works on numpy arrays as long as the candidates, never on
+    arrays covering all the documents, so a query costs about as much as
+    merging the posting lists of its terms even when nothing can be pruned,
+    much less when a rare term with high scores is combined with common
+    ones, and nothing more when the index grows with documents containing
+    none of the terms.
+
+    Documents are scored as the sum of the impacts of the query terms they
+    contain, which means any document containing at least one term is a
+    candidate.
+
+    Args:
+      postings_lists (list of numpy.ndarray or BlockPostingList): Sorted
+        posting list of each query term.
+      impacts_lists (list of numpy.ndarray): Score of each posting, aligned
+        with `postings_lists`.
+      upper_bounds (list of float): Maximum impact of each query term.
+      deleted (numpy.ndarray, optional): Boolean mask of the deleted
+        documents, which are never selected.
+
+    Attributes:
+      scored_docs_count (int): Number of candidate documents scored by the
+        last call to `top_k`, useful to measure the pruning effectiveness.
+
+    """
+
+    def __init__(self, postings_lists, impacts_lists, upper_bounds,
+                 deleted=None):
+        self.postings_lists = [as_postings(postings)
+                               for postings in postings_lists]
+        self.impacts_lists = impacts_lists
+        self.upper_bounds = upper_bounds
+        self.deleted = deleted
+        self.scored_docs_count = 0
+
+    def top_k(self, k):
+        """Select the `k` documents with the highest scores.
+
+        Ties are broken by document index, keeping the smaller indices, which
+        matches a stable sort of all scored documents.
+
+        Args:
+          k (int): Number of documents to be selected.
+
+        Returns:
+          tuple: Arrays with the selected documents and their scores, sorted
+            by decreasing score.
+
+        """
+        self.scored_docs_count = 0
+        n_terms = len(self.postings_lists)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+
+        order = sorted(range(n_terms), key=lambda term:
+                       -self.upper_bounds[term])
+        # bound of the terms from each position of `order` to the end
+        remaining_bounds = np.cumsum(
+            [self.upper_bounds[term] for term in order][::-1])[::-1]
+        slack = n_terms * _BOUND_TOLERANCE
+
+        # essential terms: every live document they contain is a candidate,
+        # accumulated by merging the sorted candidates with each posting list
+        docs = np.zeros(0, dtype=np.int64)
+        docs_scores = np.zeros(0)
+        threshold = None
+        n_essential = n_terms
+        for rank, term in enumerate(order):
+            if (threshold is not None and
+                    remaining_bounds[rank] + slack < threshold):
+                n_essential = rank
+                break
+            postings = self.postings_lists[term]
+            impacts = np.asarray(self.impacts_lists[term], dtype=np.float64)
+            if self.deleted is not None and len(postings) > 0:
+                live = ~self.deleted[postings]
+                postings = postings[live]
+                impacts = impacts[live]
+            docs, inverse = np.unique(np.concatenate((docs, postings)),
+                                      return_inverse=True)
+            docs_scores = np.bincount(
+                inverse, np.concatenate((docs_scores, impacts)), len(docs))
+            threshold = self.__threshold(docs_scores, k)
+        self.scored_docs_count = len(docs)
+
+        # non-essential terms: only the candidates are looked up
+        for rank in range(n_essential, n_terms):
+            keep = docs_scores + remaining_bounds[rank] + slack >= threshold
+            docs = docs[keep]
+            docs_scores = docs_scores[keep] + self.__lookup(order[rank], docs)
+            threshold = self.__threshold(docs_scores, k)
+
+        if threshold is not None:
+            docs = docs[docs_scores + slack >= threshold]
+
+        # sum the impacts of the remaining candidates in query order, so
+        # that scores do not depend on the order of the terms bounds
+        docs_scores = np.zeros(len(docs))
+        for term in range(n_terms):
+            docs_scores += self.__lookup(term, docs)
+        best = np.lexsort((docs, -docs_scores))[:k]
+        return docs[best].astype(np.int32), docs_scores[best]
+
+    def __threshold(self, scores, k):
+        """Return the `k`-th highest score, None if there are fewer scores.
+
+        """
+        if len(scores) < k:
+            return None
+        return scores[np.argpartition(-scores, k - 1)[k - 1]]
+
+    def __lookup(self, term, docs):
+        """Return the impacts of a term in sorted documents, zero if absent.
+
+        """
+        postings = self.postings_lists[term]
+        impacts = np.zeros(len(docs))
+        if len(postings) == 0:
+            return impacts
+        positions = np.searchsorted(postings, docs)
+        found = postings.take(positions, mode='clip') == docs
+        impacts[found] = self.impacts_lists[term][positions[found]]
+        return impacts
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import re
+
+
+def is_indexed_word(word, stop_words):
+    """Check whether a word is kept by the indexing.
+
+    Stop words are filtered out, unless they are longer than five characters.
+
+    Args:
+      word (str): Word to be checked.
+      stop_words (list of str): Stop words that will be filtered.
+
+    Returns:
+      bool: True if the word is indexed.
+
+    """
+    return word not in stop_words or len(word) > 5
+
+
+def split_words(text):
+    """Split text in lowercase words, the default query normalization.
+
+    Args:
+      text (str): Text of the query.
+
+    Returns:
+      list of str: Words of the text.
+
+    """
+    return text.lower().split()
+
+
+class Query(object):
+    """Class representing a parsed query string.
+
+    Besides plain terms, a query can contain phrases between double quotes,
+    which must appear in that exact order in the documents, and proximity
+    operators `NEAR/k` between two terms, which must appear at most `k`
+    words apart, in any order::
+
+      "the importance of being earnest" wilde
+      oscar NEAR/2 wilde
+
+    Words are normalized the way the indexed text was, by `normalize`, so a
+    query such as `Wilde, Oscar` finds the words `wilde` and `oscar`. Stop
+    words are not indexed: they are dropped from the terms, and inside
+    phrases they only hold the place of a word: any word matches them.
+
+    Args:
+      query (str): Query string.
+      stop_words (list of str): Stop words that will be filtered during docs
+        processing.
+      normalize (callable, optional): Function splitting text in normalized
+        words, `split_words` by default.
+
+    Attributes:
+      terms (list of str): Terms that documents must contain, including the
+        indexed words of phrases and proximity operators.
+      dropped_words (list of str): Stop words dropped from the terms.
+      phrases (list of list of tuple): Indexed words of each phrase and
+        their offset from the start of the phrase.
+      proximities (list of tuple): Pairs of words and the maximum distance
+        between them.
+
+    """
+
+    _TOKEN_REGEX = re.compile(r'"[^"]*"?|\S+')
+    _NEAR_REGEX = re.compile(r'^NEAR/(\d+)$')
+
+    def __init__(self, query, stop_words, normalize=split_words):
+        self.terms = []
+        self.phrases = []
+        self.proximities = []
+        self.dropped_words = []
+        self._stop_words = stop_words
+
+        tokens = self._TOKEN_REGEX.findall(query)
+        position = 0
+        while position < len(tokens):
+            token = tokens[position]
+            near = self._NEAR_REGEX.match(token)
+            next_token = tokens[position + 1] \
+                if position + 1 < len(tokens) else None
+
+            if token.startswith('"'):
+                self.__add_phrase(normalize(token.strip('"')))
+            elif near and self.terms and next_token and \
+                    not next_token.startswith('"'):
+                # the left operand is the last term already added, the right
+                # one the first word of the next token
+                near_words = self.__add_terms(normalize(next_token))
+                if len(near_words) > 0:
+                    self.proximities.append((self.terms[-len(near_words) - 1],
+                                             near_words[0],
+                                             int(near.group(1))))
+                position += 1
+            else:
+                self.__add_terms(normalize(token))
+            position += 1
+
+    def __add_terms(self, words):
+        """Add the indexed words to the terms, dropping stop words.
+
+        """
+        indexed_words = []
+        for word in words:
+            if is_indexed_word(word, self._stop_words):
+                indexed_words.append(word)
+            else:
+                self.dropped_words.append(word)
+        self.terms.extend(indexed_words)
+        return indexed_words
+
+    def __add_phrase(self, words):
+        phrase = [(word, offset) for offset, word in enumerate(words)
+                  if is_indexed_word(word, self._stop_words)]
+        if len(phrase) > 1:
+            self.phrases.append(phrase)
+        self.terms.extend(word for word, offset in phrase)
+
+    def has_positional_constraints(self):
+        """Check whether the query needs term positions to be evaluated.
+
+        Returns:
+          bool: True if the query has phrases or proximity operators.
+
+        """
+        return len(self.phrases) > 0 or len(self.proximities) > 0
+
+    def __getstate__(self):
+        # stop words are only needed to parse the query, not to evaluate it
+        state = dict(self.__dict__)
+        state['_stop_words'] = None
+        return state
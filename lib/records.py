@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+import mmap
+import struct
+import tempfile
+import threading
+import numpy as np
+from array import array
+from cache import LRUCache
+
+
+RECORD_CACHE_ENTRIES = 1024
+
+
+class RecordFile(object):
+    """Append-only file of records read through a memory map.
+
+    A record holds the text fields of an object: the length of each field,
+    as little-endian 32 bits integers, followed by the concatenated fields.
+    Records are addressed by their byte offset in the file, which never
+    changes, so that offsets can be copied and reordered freely.
+
+    The file may start with the records of a snapshot, read from a
+    memory-mapped array, followed by the records appended since, which are
+    written to a temporary file and mapped again when a read reaches past
+    the mapped bytes. Decoded records are kept in a small LRU cache, since
+    the same top results are usually read again.
+
+    Args:
+      base (numpy.ndarray, optional): Bytes of the records of a snapshot.
+      cache_entries (int, optional): Maximum number of cached records, zero
+        disables caching.
+
+    Attributes:
+      base (numpy.ndarray): Bytes of the records of a snapshot, empty if
+        the records were not loaded from a snapshot.
+      cache (LRUCache): Cache of the decoded records by offset, None if
+        disabled.
+
+    """
+
+    def __init__(self, base=None, cache_entries=RECORD_CACHE_ENTRIES):
+        self.base = base if base is not None else np.zeros(0, dtype=np.uint8)
+        self.cache = LRUCache(cache_entries) if cache_entries > 0 else None
+        self._file = None
+        self._size = 0
+        # map of the appended records and its size, replaced together
+        self._mapping = (None, 0)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.base) + self._size
+
+    def append(self, fields):
+        """Append a record.
+
+        Args:
+          fields (list of str): Text of the fields of the record.
+
+        Returns:
+          int: Offset of the record.
+
+        """
+        record = struct.pack('<%dI' % len(fields),
+                             *[len(field) for field in fields]) + \
+            ''.join(fields)
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix='records')
+            offset = len(self.base) + self._size
+            self._file.write(record)
+            self._size += len(record)
+        return offset
+
+    def read(self, offset, fields_count):
+        """Read the fields of a record.
+
+        Args:
+          offset (int): Offset of the record.
+          fields_count (int): Number of fields of the record.
+
+        Returns:
+          tuple of str: Text of the fields of the record.
+
+        """
+        if self.cache is not None:
+            fields = self.cache.get(offset)
+            if fields is not None:
+                return fields
+
+        lengths = self.__lengths(offset, fields_count)
+        content = self.__read_bytes(offset + 4 * fields_count, sum(lengths))
+        fields = []
+        start = 0
+        for length in lengths:
+            fields.append(content[start:start + length])
+            start += length
+        fields = tuple(fields)
+
+        if self.cache is not None:
+            self.cache.put(offset, fields)
+        return fields
+
+    def read_raw(self, offset, fields_count):
+        """Read the encoded bytes of a record.
+
+        Args:
+          offset (int): Offset of the record.
+          fields_count (int): Number of fields of the record.
+
+        Returns:
+          str: Bytes of the record, header included.
+
+        """
+        size = 4 * fields_count + sum(self.__lengths(offset, fields_count))
+        return self.__read_bytes(offset, size)
+
+    def __lengths(self, offset, fields_count):
+        """Decode the lengths of the fields of a record.
+
+        """
+        return struct.unpack('<%dI' % fields_count,
+                             self.__read_bytes(offset, 4 * fields_count))
+
+    def __read_bytes(self, offset, size):
+        """Read bytes of the snapshot records or of the appended records.
+
+        """
+        if size == 0:
+            return ''
+        base_size = len(self.base)
+        if offset < base_size:
+            return self.base[offset:offset + size].tostring()
+
+        offset -= base_size
+        mapping, mapped_size = self._mapping
+        if offset + size > mapped_size:
+            mapping = self.__remap()
+        return mapping[offset:offset + size]
+
+    def __remap(self):
+        """Map the appended records again, including the latest ones.
+
+        Previous maps are not closed, since other threads may still be
+        reading them.
+
+        """
+        with self._lock:
+            mapping, mapped_size = self._mapping
+            if mapped_size < self._size:
+                self._file.flush()
+                mapping = mmap.mmap(self._file.fileno(), self._size,
+                                    access=mmap.ACCESS_READ)
+                self._mapping = (mapping, self._size)
+            return mapping
+
+
+class RecordStore(object):
+    """Storage of indexed objects in a record file.
+
+    Only the offset of the record of each object is kept in memory, with
+    its identifier: the text fields listed in `STORED_FIELDS` by the class
+    of the objects are written to a `RecordFile` and read back when objects
+    are materialized, usually only for the top results of a query.
+    Identifiers that are not integers are concatenated in a byte buffer,
+    delimited by an array of offsets, so that they are listed without
+    reading any record.
+
+    The store has the interface of `DocumentStore`, and the stores derived
+    from one store by `take` share its record file. Once saved, the records
+    of the stored objects are part of the snapshot, and a loaded store reads
+    them from the memory-mapped snapshot file. Its identifiers and offsets
+    are kept as snapshot arrays too, until objects are appended to it.
+
+    Args:
+      records (RecordFile, optional): File of the records, a new one by
+        default.
+
+    Attributes:
+      records (RecordFile): File of the records.
+      indexable_class (type): Class of the stored objects, None until an
+        object is appended.
+      integer_iids (bool): Whether identifiers are stored as integers.
+
+    """
+
+    def __init__(self, records=None):
+        self.records = records if records is not None else RecordFile()
+        self.indexable_class = None
+        self.integer_iids = True
+        self._names = ()
+        self._iids = array('l')
+        self._positional = array('b')
+        self._offsets = array('l')
+        self._iid_offsets = array('l', [0])
+        self._iid_buffer = array('c')
+        # whether the arrays are still the ones read from a snapshot
+        self._mapped = False
+
+    def __len__(self):
+        return len(self._positional)
+
+    def __iter__(self):
+        for doc_index in xrange(len(self)):
+            yield self[doc_index]
+
+    def __getitem__(self, doc_index):
+        """Materialize a stored object.
+
+        Args:
+          doc_index (int): Position of the object in the store.
+
+        Returns:
+          Indexable: New instance of the stored object.
+
+        """
+        if doc_index < 0:
+            doc_index += len(self)
+        return self.indexable_class(self.iid(doc_index),
+                                    *self.__record(doc_index),
+                                    positional=bool(
+                                        self._positional[doc_index]))
+
+    def iid(self, doc_index):
+        """Return the identifier of a stored object.
+
+        Args:
+          doc_index (int): Position of the object in the store.
+
+        Returns:
+          object: Identifier of the object.
+
+        """
+        if self.integer_iids:
+            return int(self._iids[doc_index])
+        offsets = self._iid_offsets
+        return self._iid_buffer[offsets[doc_index]:
+                                offsets[doc_index + 1]].tostring()
+
+    def fields(self, doc_index, names=None):
+        """Return stored fields of an object, without materializing it.
+
+        Args:
+          doc_index (int): Position of the object in the store.
+          names (list of str, optional): Names of the fields, all the
+            `STORED_FIELDS` by default.
+
+        Returns:
+          tuple of str: Value of each field, in the order of `names`.
+
+        """
+        if names is None:
+            names = self.indexable_class.STORED_FIELDS
+        record = self.__record(doc_index)
+        return tuple(record[self._names.index(name)] for name in names)
+
+    def iids(self):
+        """Return the identifiers of all stored objects.
+
+        Returns:
+          list: Identifier of each object, in store order.
+
+        """
+        if self.integer_iids:
+            return self._iids.tolist()
+        offsets = self.__values(self._iid_offsets).tolist()
+        content = self.__values(self._iid_buffer).tostring()
+        return [content[start:end]
+                for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def append(self, indexable):
+        """Store an object, writing its stored fields to the record file.
+
+        Args:
+          indexable (Indexable): Object to be stored.
+
+        Raises:
+          TypeError: If the object is not of the class of the stored objects,
+            or its identifier is not of the type of the stored identifiers.
+
+        """
+        if self.indexable_class is None:
+            self.__set_class(indexable.__class__,
+                             isinstance(indexable.iid, (int, long)))
+        elif indexable.__class__ is not self.indexable_class:
+            raise TypeError('Can not store %s objects with %s objects' %
+                            (indexable.__class__.__name__,
+                             self.indexable_class.__name__))
+        if self._mapped:
+            self.__copy_mapped()
+
+        if self.integer_iids:
+            if not isinstance(indexable.iid, (int, long)):
+                raise TypeError('Identifier %r is not an integer' %
+                                (indexable.iid,))
+            self._iids.append(indexable.iid)
+        else:
+            self._iid_buffer.fromstring(indexable.iid)
+            self._iid_offsets.append(len(self._iid_buffer))
+        self._offsets.append(self.records.append(
+            [getattr(indexable, name) for name in self._names]))
+        self._positional.append(indexable.positional)
+
+    def extend(self, other):
+        """Append the objects of another store.
+
+        The offsets of a store sharing the record file are copied, the
+        objects of any other store are written to the record file.
+
+        Args:
+          other (RecordStore or DocumentStore): Store whose objects are
+            appended, not modified.
+
+        Raises:
+          TypeError: If the stores do not hold objects of the same class.
+
+        """
+        if len(other) == 0:
+            return
+        if not isinstance(other, RecordStore) or \
+                other.records is not self.records:
+            for indexable in other:
+                self.append(indexable)
+            return
+
+        if self.indexable_class is None:
+            self.__set_class(other.indexable_class, other.integer_iids)
+        elif (other.indexable_class is not self.indexable_class or
+              other.integer_iids != self.integer_iids):
+            raise TypeError('Can not store %s objects with %s objects' %
+                            (other.indexable_class.__name__,
+                             self.indexable_class.__name__))
+        if self._mapped:
+            self.__copy_mapped()
+        for name in ['iids', 'positional', 'offsets']:
+            self.__extend_array(getattr(self, '_' + name),
+                                self.__values(getattr(other, '_' + name)))
+        other_offsets = self.__values(other._iid_offsets)
+        self.__extend_array(self._iid_offsets,
+                            other_offsets[1:] + len(self._iid_buffer))
+        self._iid_buffer.fromstring(
+            self.__values(other._iid_buffer).tostring())
+
+    def take(self, docs_indices):
+        """Return a store with a selection of the stored objects.
+
+        The records are not copied: the new store shares the record file.
+
+        Args:
+          docs_indices (numpy.ndarray): Positions of the selected objects.
+
+        Returns:
+          RecordStore: New store with the selected objects, in the order of
+            `docs_indices`.
+
+        """
+        docs_indices = np.asarray(docs_indices, dtype=np.int64)
+        store = RecordStore(self.records)
+        store.indexable_class = self.indexable_class
+        store.integer_iids = self.integer_iids
+        store._names = self._names
+        names = ['iids', 'positional', 'offsets'] if self.integer_iids \
+            else ['positional', 'offsets']
+        for name in names:
+            self.__extend_array(
+                getattr(store, '_' + name),
+                self.__values(getattr(self, '_' + name))[docs_indices])
+
+        if not self.integer_iids:
+            offsets = self.__values(self._iid_offsets)
+            buffer = self.__values(self._iid_buffer)
+            starts = offsets[docs_indices]
+            lengths = offsets[docs_indices + 1] - starts
+            new_offsets = np.zeros(len(docs_indices) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=new_offsets[1:])
+
+            # gather the bytes of the selected identifiers
+            gather = np.arange(new_offsets[-1]) + np.repeat(
+                starts - new_offsets[:-1], lengths)
+            store._iid_offsets = array('l')
+            self.__extend_array(store._iid_offsets, new_offsets)
+            store._iid_buffer = array('c', buffer[gather].tostring())
+        return store
+
+    def nbytes(self):
+        """Return the memory used by the stored objects.
+
+        The records are not counted, since they are read from their file.
+
+        Returns:
+          int: Size in bytes of the arrays of the store.
+
+        """
+        arrays = [self._iids, self._positional, self._offsets]
+        if not self.integer_iids:
+            arrays += [self._iid_offsets, self._iid_buffer]
+        return sum(len(values) * values.itemsize for values in arrays)
+
+    def save(self, writer, count=None):
+        """Store the objects in a snapshot.
+
+        The records of the stored objects are copied to the snapshot in
+        store order, so records of dropped objects are not kept.
+
+        Args:
+          writer (SnapshotWriter): Snapshot being written.
+          count (int, optional): Number of objects to be stored, from the
+            first one. All objects by default.
+
+        """
+        if count is None:
+            count = len(self)
+        fields_count = len(self._names)
+        records = [self.records.read_raw(offset, fields_count)
+                   for offset in self._offsets[:count]]
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum([len(record) for record in records], out=offsets[1:])
+
+        writer.write_objects('store_class', (self.indexable_class,
+                                             self.integer_iids))
+        writer.write_array('store_iids', self.__values(
+            self._iids)[:count if self.integer_iids else 0])
+        writer.write_array('store_positional',
+                           self.__values(self._positional)[:count])
+        iid_offsets = self.__values(self._iid_offsets)[:count + 1]
+        writer.write_array('store_iid_offsets', iid_offsets)
+        writer.write_array('store_iid_buffer', self.__values(
+            self._iid_buffer)[:iid_offsets[-1]])
+        writer.write_array('store_record_offsets', offsets)
+        writer.write_array('store_records',
+                           np.frombuffer(''.join(records), dtype=np.uint8))
+
+    def load(self, reader):
+        """Restore stored objects from a snapshot.
+
+        The records are read from the snapshot array, which is memory-mapped
+        if the snapshot is, and the other snapshot arrays are kept as they
+        are read until objects are appended to the store.
+
+        Args:
+          reader (SnapshotReader): Snapshot being read.
+
+        """
+        indexable_class, integer_iids = reader.read_objects('store_class')
+        self.records = RecordFile(reader.read_array('store_records'))
+        self.indexable_class = None
+        self._names = ()
+        if indexable_class is not None:
+            self.__set_class(indexable_class, integer_iids)
+
+        self._iids = reader.read_array('store_iids')
+        self._positional = reader.read_array('store_positional')
+        self._offsets = reader.read_array('store_record_offsets')[:-1]
+        self._iid_offsets = reader.read_array('store_iid_offsets')
+        self._iid_buffer = reader.read_array('store_iid_buffer')
+        self._mapped = True
+
+    def __set_class(self, indexable_class, integer_iids):
+        """Set the fields of the records of the stored class.
+
+        """
+        self.indexable_class = indexable_class
+        self.integer_iids = integer_iids
+        self._names = tuple(indexable_class.STORED_FIELDS)
+
+    def __record(self, doc_index):
+        """Read the fields of the record of a stored object.
+
+        """
+        return self.records.read(self._offsets[doc_index], len(self._names))
+
+    def __values(self, values):
+        """Return a typed array or a snapshot array as a numpy array.
+
+        """
+        if not isinstance(values, array):
+            return values
+        # identifiers are read as bytes
+        dtype = np.uint8 if values.typecode == 'c' else values.typecode
+        return np.frombuffer(values, dtype=dtype)
+
+    def __copy_mapped(self):
+        """Copy the arrays read from a snapshot to growable typed arrays.
+
+        """
+        for name, typecode in [('iids', 'l'), ('positional', 'b'),
+                               ('offsets', 'l'), ('iid_offsets', 'l')]:
+            values = array(typecode)
+            self.__extend_array(values, getattr(self, '_' + name))
+            setattr(self, '_' + name, values)
+        self._iid_buffer = array('c', self._iid_buffer.tostring())
+        self._mapped = False
+
+    def __extend_array(self, target, values):
+        """Append numpy values to a typed array, casting them to its type.
+
+        """
+        target.fromstring(np.asarray(values).astype(target.typecode)
+                          .tostring())
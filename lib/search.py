@@ -1,9 +1,35 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import scipy.sparse as sp
-import scipy.sparse.sparsetools as sptools
+import copy
 import logging
+import threading
+from array import array
 from collections import defaultdict
+from itertools import islice
+from cache import LRUCache
+from duplicates import DuplicateGroups
+from postings import CompressedPostings
+from postings import EMPTY_POSTINGS
+from postings import POSTINGS_DTYPE
+from postings import as_postings
+from postings import intersect
+from postings import intersect_pair
+from postings import lookup
+from postings import pair_strategy
+from positions import PositionalIndex
+from planner import QueryPlan
+from planner import SegmentPlan
+from pruning import MaxScoreEvaluator
+from query import Query
+from query import is_indexed_word
+from query import split_words
+from records import RecordStore
+from snapshot import SnapshotReader
+from snapshot import SnapshotWriter
+from store import DocumentStore
+from tracing import traced
+from tracing import tracer
 
 
 logger = logging.getLogger(__name__)
@@ -11,6 +37,125 @@ logger = logging.getLogger(__name__)
 
 STOP_WORDS_FILENAME = 'data/stop_words.txt'
 
+# query modes: documents must contain all the query terms or any of them
+ALL_TERMS = 'all'
+ANY_TERMS = 'any'
+
+# segments are compacted once this ratio of their documents is deleted
+DEFAULT_COMPACTION_RATIO = 0.2
+
+# segments are rescored once the idf of one of their terms changed by more
+# than this since they were scored, zero keeping scores exact
+DEFAULT_RESCORE_TOLERANCE = 0.0
+
+# adjacent segments are merged when the older one is at most this many times
+# larger than the newer one, which keeps a logarithmic number of segments
+MERGE_FACTOR = 4
+
+# precisions of the tf-idf scores, quantized scores are stored as 8-bit
+# integers with a scale per term
+FLOAT64 = 'float64'
+FLOAT32 = 'float32'
+QUANTIZED = 'uint8'
+SCORE_PRECISIONS = [FLOAT64, FLOAT32, QUANTIZED]
+QUANTIZATION_LEVELS = 255
+
+DEFAULT_CACHE_ENTRIES = 1024
+# objects indexed by the warm-up thread before each publication
+WARM_UP_CHUNK_DOCS = 50000
+# queries scored together by `search_many`, which bounds the size of the
+# matrices of candidates
+BATCH_CHUNK_QUERIES = 128
+# rough memory of a cached search result, the indexed object is not copied
+RESULT_SIZE_ESTIMATE = 128
+
+
+def load_stop_words(filename=STOP_WORDS_FILENAME):
+    """Load stop words that will be filtered during docs processing.
+
+    Stop words are words which are filtered out prior to
+    processing of natural language data. There is not one definite
+    list of stop words but we are using the list in `stop_words.txt` file.
+
+    Args:
+      filename (str, optional): File with one stop word per line.
+
+    Returns:
+      dict: English stop words as keys.
+
+    """
+    stop_words = {}
+    with open(filename) as stop_words_file:
+        for word in stop_words_file:
+            stop_words[word.strip()] = True
+    return stop_words
+
+
+def parse_query(query, mode, stop_words, positional, indexable_class=None):
+    """Parse a query, normalizing it like the indexed objects.
+
+    Args:
+      query (str): String containing one or more terms.
+      mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+      stop_words (list of str): Stop words dropped from the terms.
+      positional (bool): Whether term positions are indexed.
+      indexable_class (type, optional): Class of the indexed objects, whose
+        `normalize_query` splits the query in words.
+
+    Returns:
+      Query: Parsed query.
+
+    Raises:
+      ValueError: If `mode` is not a known query mode, or if the query
+        has positional constraints that can not be evaluated.
+
+    """
+    if mode not in [ALL_TERMS, ANY_TERMS]:
+        raise ValueError('Unknown query mode: %s' % mode)
+
+    normalize = indexable_class.normalize_query \
+        if indexable_class is not None else split_words
+    parsed_query = Query(query, stop_words, normalize)
+    if parsed_query.has_positional_constraints():
+        if not positional:
+            raise ValueError('Phrase and proximity queries require a '
+                             'positional search engine')
+        if mode != ALL_TERMS:
+            raise ValueError('Phrase and proximity queries are only '
+                             'supported in all terms mode')
+    return parsed_query
+
+
+def top_k_positions(scores, k):
+    """Select the positions of the `k` highest scores.
+
+    Only the candidates that can be part of the top `k` are sorted: the
+    `k`-th highest score is found with `numpy.argpartition` and used as a
+    threshold. Ties are broken by position, keeping the order of a stable
+    sort of all the scores.
+
+    Args:
+      scores (numpy.ndarray): Scores of the candidates.
+      k (int): Number of positions to be selected.
+
+    Returns:
+      numpy.ndarray: Positions of the highest scores, sorted by decreasing
+        score.
+
+    """
+    if k <= 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    if k < len(scores):
+        partition = np.argpartition(-scores, k - 1)
+        threshold = scores[partition[k - 1]]
+        positions = np.flatnonzero(scores >= threshold)
+    else:
+        positions = np.arange(len(scores))
+
+    order = np.lexsort((positions, -scores[positions]))
+    return positions[order[:k]]
+
 
 class Indexable(object):
     """Class representing an object that can be indexed.
@@ -18,34 +163,123 @@ class Indexable(object):
     It is a general abstraction for indexable objects and can be used in
     different contexts.
 
+    Words are counted the first time they are needed, so objects can be
+    created cheaply, for instance from data parsed by other processes.
+    Attributes are declared in `__slots__`, and search engines keep indexed
+    objects in a `DocumentStore`: only the fields listed in `STORED_FIELDS`
+    are stored, and the words are not kept once the object is indexed.
+
+    Subclasses list in `STORED_FIELDS` the text attributes passed to their
+    constructor after `iid`, in order, and in `DUPLICATE_FIELDS` the stored
+    fields whose values identify duplicate objects.
+
     Args:
       iid (int): Identifier of indexable objects.
       metadata (str): Plain text with data to be indexed.
+      positional (bool, optional): Whether the positions of the words in
+        `metadata` are kept, as needed by positional indexes.
 
     Attributes:
       iid (int): Identifier of indexable objects.
-      words_count (dict): Dictionary containing the unique words from
-        `metadata` and their frequency.
+      metadata (str): Plain text with data to be indexed.
+      positional (bool): Whether the positions of the words are kept.
 
     """
 
-    def __init__(self, iid, metadata):
+    __slots__ = ('iid', 'metadata', 'positional', '_words_count',
+                 '_words_positions')
+
+    STORED_FIELDS = ('metadata',)
+    DUPLICATE_FIELDS = ('metadata',)
+
+    def __init__(self, iid, metadata, positional=False):
         self.iid = iid
-        self.words_count = defaultdict(int)
+        self.metadata = metadata
+        self.positional = positional
+        self._words_count = None
+        self._words_positions = None
+
+    @property
+    def words_count(self):
+        """dict: Unique words from `metadata` and their frequency."""
+        if self._words_count is None:
+            self.__count_words()
+        return self._words_count
+
+    @property
+    def words_positions(self):
+        """dict: Unique words from `metadata` and their positions, empty
+        unless `positional` is set."""
+        if self._words_count is None:
+            self.__count_words()
+        return self._words_positions
+
+    def __count_words(self):
+        """Count the words of the metadata, and keep their positions.
+
+        """
+        words_count = defaultdict(int)
+        words_positions = {}
+        if self.positional:
+            words_positions = defaultdict(list)
+            for position, word in enumerate(self.metadata.split()):
+                words_count[word] += 1
+                words_positions[word].append(position)
+        else:
+            for word in self.metadata.split():
+                words_count[word] += 1
+        self._words_count = words_count
+        self._words_positions = words_positions
+
+    @staticmethod
+    def normalize_query(text):
+        """Split the text of a query in words normalized like `metadata`.
+
+        Subclasses whose metadata is preprocessed override it, so that
+        queries are preprocessed the same way.
+
+        Args:
+          text (str): Text of the query, or of one of its phrases.
+
+        Returns:
+          list of str: Normalized words.
 
-        for word in metadata.split():
-            self.words_count[word] += 1
+        """
+        return split_words(text)
 
     def __repr__(self):
         return ' '.join(self.words_count.keys()[:10])
 
     def __eq__(self, other):
         return (isinstance(other, self.__class__)
-                and self.__dict__ == other.__dict__)
+                and self.__fields() == other.__fields())
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __fields(self):
+        """Return the attributes of the object, without the words counts.
+
+        """
+        return dict((name, value) for name, value
+                    in self.__getstate__().iteritems()
+                    if not name.startswith('_'))
+
+    def __getstate__(self):
+        # words are counted again if needed, keeping pickles small
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in self.__class__.__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        state['_words_count'] = None
+        state['_words_positions'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
     def words_generator(self, stop_words):
         """Yield unique words extracted from indexed metadata.
 
@@ -57,7 +291,7 @@ class Indexable(object):
 
         """
         for word in self.words_count.keys():
-            if word not in stop_words or len(word) > 5:
+            if is_indexed_word(word, stop_words):
                 yield word
 
     def count_for_word(self, word):
@@ -72,6 +306,20 @@ class Indexable(object):
         """
         return self.words_count[word] if word in self.words_count else 0
 
+    def positions_for_word(self, word):
+        """Positions of a given word in indexed metadata.
+
+        Args:
+          word (str): Word whose the positions will be retrieved.
+
+        Returns:
+          list of int: Sorted positions of the word, empty if the positions
+            were not kept.
+
+        """
+        positions = self.words_positions
+        return positions[word] if word in positions else []
+
 
 class IndexableResult(object):
     """Class representing a search result with a tf-idf score.
@@ -79,29 +327,406 @@ class IndexableResult(object):
     Args:
       score (float): tf-idf score for the result.
       indexable (Indexable): Indexed object.
+      duplicates (list, optional): Identifiers of the objects identical to
+        `indexable` collapsed into the result.
 
     Attributes:
       score (float): tf-idf score for the result.
       indexable (Indexable): Indexed object.
+      duplicates (list): Identifiers of the objects identical to
+        `indexable` collapsed into the result, empty unless duplicates are
+        collapsed.
 
     """
 
-    def __init__(self, score, indexable):
+    __slots__ = ('score', 'indexable', 'duplicates')
+
+    def __init__(self, score, indexable, duplicates=None):
         self.score = score
         self.indexable = indexable
+        self.duplicates = duplicates if duplicates is not None else []
 
     def __repr__(self):
+        if len(self.duplicates) > 0:
+            return 'score: %f, indexable: %s, duplicates: %s' % \
+                   (self.score, self.indexable,
+                    ', '.join(str(iid) for iid in self.duplicates))
         return 'score: %f, indexable: %s' % (self.score, self.indexable)
 
     def __eq__(self, other):
         return (isinstance(other, self.__class__)
                 and abs(self.score - other.score) < 0.0001
-                and self.indexable == other.indexable)
+                and self.indexable == other.indexable
+                and self.duplicates == other.duplicates)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
 
+class SearchResults(list):
+    """List of search results, with the part of the corpus they cover.
+
+    While the engine warms up, queries are evaluated on the objects indexed
+    so far, and the results tell how many objects were searched.
+
+    Args:
+      results (iterable of IndexableResult, optional): Search results.
+      covered_count (int, optional): Number of objects searched.
+      complete (bool, optional): Whether all objects were indexed.
+      coverage (float, optional): Fraction of the corpus searched.
+
+    Attributes:
+      covered_count (int): Number of objects searched, duplicates included
+        and deleted ones excluded.
+      complete (bool): Whether all objects were indexed when the query was
+        evaluated, False while the engine warms up.
+      coverage (float): Fraction of the corpus searched, 1.0 once complete,
+        None if the size of the corpus is unknown.
+
+    """
+
+    def __init__(self, results=(), covered_count=0, complete=True,
+                 coverage=1.0):
+        list.__init__(self, results)
+        self.covered_count = covered_count
+        self.complete = complete
+        self.coverage = coverage
+
+    def copy(self):
+        """Return a copy of the results and of their coverage.
+
+        Returns:
+          SearchResults: New list with the same results.
+
+        """
+        return SearchResults(self, self.covered_count, self.complete,
+                             self.coverage)
+
+
+class TermMatrixBuilder(object):
+    """Class accumulating the term frequencies of indexable objects.
+
+    Term frequencies are appended to growable typed arrays while the objects
+    are streamed, so that the sparse term frequency matrix can be created in
+    a single vectorized call instead of one sparse write per term. Since
+    objects are added one at a time, the arrays are already in CSR order: a
+    row pointer array delimits the column indices and counts of each object.
+
+    A builder restored from a snapshot keeps the snapshot arrays, which are
+    memory-mapped if the snapshot is, and only copies them to typed arrays
+    when objects are added to it.
+
+    Args:
+      stop_words (list of str): Stop words that will be filtered during docs
+        processing.
+      positional (bool, optional): Whether the positions of the terms are
+        accumulated as well. Added objects must keep their positions.
+
+    Attributes:
+      stop_words (list of str): Stop words that will be filtered during docs
+        processing.
+      positional (bool): Whether the positions of the terms are accumulated.
+      vocabulary (dict): Dictionary containing unique words of the corpus as
+        keys and their respective global index, assigned in the order the
+        words are first seen.
+      n_docs (int): Number of objects added so far.
+
+    """
+
+    _ARRAYS = [('indptr', 'l'), ('indices', 'i'), ('counts', 'i'),
+               ('positions_indptr', 'l'), ('positions', 'i')]
+
+    def __init__(self, stop_words, positional=False):
+        self.stop_words = stop_words
+        self.positional = positional
+        self.vocabulary = {}
+        self.n_docs = 0
+        self._indptr = array('l', [0])
+        self._indices = array('i')
+        self._counts = array('i')
+        self._positions_indptr = array('l', [0])
+        self._positions = array('i')
+        # whether the arrays are still the ones read from a snapshot
+        self._mapped = False
+
+    def add(self, indexable):
+        """Add the term frequencies of an object as a new row.
+
+        Args:
+          indexable (Indexable): Object to be added.
+
+        """
+        if self._mapped:
+            self.__copy_mapped()
+        vocabulary = self.vocabulary
+        for word in indexable.words_generator(self.stop_words):
+            word_index_in_vocabulary = vocabulary.get(word)
+            if word_index_in_vocabulary is None:
+                word_index_in_vocabulary = len(vocabulary)
+                vocabulary[word] = word_index_in_vocabulary
+            self._indices.append(word_index_in_vocabulary)
+            self._counts.append(indexable.count_for_word(word))
+            if self.positional:
+                self.__add_positions(indexable.positions_for_word(word))
+        self._indptr.append(len(self._indices))
+        self.n_docs += 1
+
+    def __add_positions(self, positions):
+        """Append delta-encoded positions of a term in the current object.
+
+        """
+        previous_position = 0
+        for position in positions:
+            self._positions.append(position - previous_position)
+            previous_position = position
+        self._positions_indptr.append(len(self._positions))
+
+    def extend(self, other):
+        """Append the objects accumulated by another builder.
+
+        The terms of `other` are mapped to the vocabulary of this builder,
+        unknown terms being appended to it in the order of `other`, and the
+        rows of `other` are appended with a few vectorized operations.
+
+        Args:
+          other (TermMatrixBuilder): Builder whose objects are appended, not
+            modified.
+
+        """
+        terms_mapping = np.zeros(len(other.vocabulary), dtype=np.int64)
+        for term, other_index in sorted(other.vocabulary.iteritems(),
+                                        key=lambda item: item[1]):
+            term_index = self.vocabulary.get(term)
+            if term_index is None:
+                term_index = len(self.vocabulary)
+                self.vocabulary[term] = term_index
+            terms_mapping[other_index] = term_index
+
+        if self._mapped:
+            self.__copy_mapped()
+        other_indptr = other.__values('indptr')
+        other_indices = other.__values('indices')
+        self.__extend_array(self._indptr, other_indptr[1:] + self._indptr[-1])
+        self.__extend_array(self._indices, terms_mapping[other_indices])
+        self.__extend_array(self._counts, other.__values('counts'))
+
+        if self.positional:
+            other_offsets = other.__values('positions_indptr')
+            self.__extend_array(self._positions_indptr,
+                                other_offsets[1:] + len(self._positions))
+            self.__extend_array(self._positions, other.__values('positions'))
+
+        self.n_docs += other.n_docs
+
+    def __getstate__(self):
+        # typed arrays are pickled as lists of numbers, send their bytes
+        state = self.__dict__.copy()
+        for name, typecode in self._ARRAYS:
+            state['_' + name] = (typecode, self.__values(name).tostring())
+        state['_mapped'] = False
+        return state
+
+    def __setstate__(self, state):
+        for name, typecode in self._ARRAYS:
+            values = array(typecode)
+            values.fromstring(state['_' + name][1])
+            state['_' + name] = values
+        self.__dict__.update(state)
+
+    def __values(self, name):
+        """Return an accumulated array as a numpy array, without copy.
+
+        """
+        values = getattr(self, '_' + name)
+        if self._mapped:
+            return values
+        return np.frombuffer(values, dtype=values.typecode)
+
+    def __copy_mapped(self):
+        """Copy the arrays read from a snapshot to growable typed arrays.
+
+        """
+        for name, typecode in self._ARRAYS:
+            values = array(typecode)
+            self.__extend_array(values, getattr(self, '_' + name))
+            setattr(self, '_' + name, values)
+        self._mapped = False
+
+    def __extend_array(self, target, values):
+        """Append numpy values to a typed array, casting them to its type.
+
+        """
+        target.fromstring(values.astype(target.typecode).tostring())
+
+    def subset(self, keep):
+        """Return a builder with a selection of the accumulated objects.
+
+        Args:
+          keep (numpy.ndarray): Boolean mask of the objects to be kept.
+
+        Returns:
+          TermMatrixBuilder: Builder with the selected objects, in the same
+            order, and the same vocabulary.
+
+        """
+        builder = TermMatrixBuilder(self.stop_words, self.positional)
+        builder.vocabulary = dict(self.vocabulary)
+        builder.n_docs = int(np.count_nonzero(keep))
+
+        lengths = np.diff(self.__values('indptr'))
+        kept_entries = np.repeat(keep, lengths)
+        self.__extend_array(builder._indptr, np.cumsum(lengths[keep]))
+        for name in ['indices', 'counts']:
+            self.__extend_array(getattr(builder, '_' + name),
+                                self.__values(name)[kept_entries])
+
+        if self.positional:
+            offsets = self.__values('positions_indptr')
+            positions = self.__values('positions')
+            entries_lengths = np.diff(offsets)
+            self.__extend_array(builder._positions_indptr,
+                                np.cumsum(entries_lengths[kept_entries]))
+            self.__extend_array(
+                builder._positions,
+                positions[np.repeat(kept_entries, entries_lengths)])
+        return builder
+
+    def row_terms(self, rows):
+        """Return the terms of some of the accumulated objects.
+
+        Args:
+          rows (numpy.ndarray): Indices of the objects.
+
+        Returns:
+          numpy.ndarray: Vocabulary indices of the terms of each object,
+            concatenated.
+
+        """
+        indptr = self.__values('indptr')
+        indices = self.__values('indices')
+        return np.concatenate([np.zeros(0, dtype=indices.dtype)] +
+                              [indices[indptr[row]:indptr[row + 1]]
+                               for row in rows])
+
+    def save(self, writer):
+        """Store the accumulated term frequencies in a snapshot.
+
+        Args:
+          writer (SnapshotWriter): Snapshot being written.
+
+        """
+        terms = [None] * len(self.vocabulary)
+        for term, term_index in self.vocabulary.iteritems():
+            terms[term_index] = term
+
+        writer.write_terms('builder_vocabulary', terms)
+        for name, typecode in self._ARRAYS:
+            writer.write_array('builder_' + name, self.__values(name))
+
+    def load(self, reader):
+        """Restore accumulated term frequencies from a snapshot.
+
+        The snapshot arrays are kept as they are read, memory-mapped if the
+        snapshot is, until objects are added to the builder.
+
+        Args:
+          reader (SnapshotReader): Snapshot being read.
+
+        """
+        terms = reader.read_terms('builder_vocabulary')
+        self.vocabulary = dict((term, index) for index, term
+                               in enumerate(terms))
+        for name, typecode in self._ARRAYS:
+            values = reader.read_array('builder_' + name)
+            if values.dtype != np.dtype(typecode):
+                values = values.astype(typecode)
+            setattr(self, '_' + name, values)
+        self._mapped = True
+        self.n_docs = len(self._indptr) - 1
+
+    def arrays(self):
+        """Return the accumulated term frequencies as CSR arrays.
+
+        Returns:
+          tuple: Row pointers, column indices and term frequencies (as 32-bit
+            integers) of the accumulated objects.
+
+        """
+        indptr = self.__values('indptr')
+        indices = self.__values('indices')
+        counts = self.__values('counts')
+
+        # keep row pointers and column indices with the same integer type,
+        # as expected by the sparse matrix routines
+        indptr = indptr.astype(sp.sputils.get_index_dtype(maxval=indptr[-1]))
+        return indptr, indices.copy(), counts.copy()
+
+    def columns(self):
+        """Return the accumulated term frequencies in CSC format.
+
+        The column indices of the CSC matrix are the sorted positions of the
+        objects containing each term, so the same matrix provides both the
+        term frequencies used for ranking and the posting lists used for
+        indexing. The matrix is created on each call and not kept by the
+        builder: posting lists and scores keep only the arrays they need.
+
+        Returns:
+          scipy.sparse.csc_matrix: Matrix of shape (`n_docs`, number of
+            terms) with the frequency of each term in each object.
+
+        """
+        indptr, indices, counts = self.arrays()
+        shape = (self.n_docs, len(self.vocabulary))
+        return sp.csr_matrix((counts, indices, indptr), shape=shape).tocsc()
+
+    def document_frequencies(self):
+        """Count the accumulated objects containing each term.
+
+        Returns:
+          numpy.ndarray: Number of objects containing each term of the
+            vocabulary.
+
+        """
+        indices = self.__values('indices')
+        return np.bincount(indices, minlength=len(self.vocabulary))
+
+    def nbytes(self):
+        """Return the memory used by the accumulated term frequencies.
+
+        Returns:
+          int: Size in bytes of the typed arrays, positions included.
+
+        """
+        return sum(self.__values(name).nbytes
+                   for name, typecode in self._ARRAYS)
+
+    def column_positions(self):
+        """Return the accumulated term positions in CSC order.
+
+        The positions of each (object, term) entry are reordered to follow
+        the entries of the matrix returned by `columns`: by term, then by
+        object.
+
+        Returns:
+          tuple: Offsets of the positions of each entry, and the
+            delta-encoded positions of all entries.
+
+        """
+        indices = self.__values('indices')
+        offsets = self.__values('positions_indptr')
+        deltas = self.__values('positions')
+
+        # a stable sort by term keeps the objects sorted within each term
+        order = np.argsort(indices, kind='mergesort')
+        lengths = np.diff(offsets)[order]
+        column_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=column_offsets[1:])
+
+        gather = np.arange(column_offsets[-1]) + np.repeat(
+            offsets[:-1][order] - column_offsets[:-1], lengths)
+        return column_offsets, deltas[gather]
+
+
 class TfidfRank(object):
     """Class encapsulating tf-idf ranking logic.
 
@@ -114,6 +739,15 @@ class TfidfRank(object):
     informative than features that occur in a small fraction of the training
     corpus.
 
+    Scores are computed in double precision, then stored with the configured
+    `precision`: as doubles, as single precision floats, or quantized to
+    8-bit integers with a scale per term, the highest score of each term
+    being mapped to `QUANTIZATION_LEVELS`. Scores are stored once, by term
+    in the order of the posting lists, and looked up by document with
+    binary searches in the posting lists of the query terms. The rank keeps
+    no raw term frequency: rescoring a segment reads those of its
+    `TermMatrixBuilder`, see `Segment`.
+
     Args:
       smoothing (int, optional): Smoothing parameter for tf-idf computation
         preventing by-zero divisions when a term does not occur in corpus.
@@ -121,6 +755,9 @@ class TfidfRank(object):
       stop_words (list of str): Stop words that will be filtered during docs
         processing.
 
+      precision (str, optional): Storage of the scores, one of
+        `SCORE_PRECISIONS`.
+
     Attributes:
       smoothing (int, optional): Smoothing parameter for tf-idf computation
         preventing by-zero divisions when a term does not occur in corpus.
@@ -128,100 +765,251 @@ class TfidfRank(object):
       stop_words (list of str): Stop words that will be filtered during docs
         processing.
 
+      precision (str): Storage of the scores, one of `SCORE_PRECISIONS`.
+
       vocabulary (dict): Dictionary containing unique words of the corpus as
         keys and their respective global index used in tf-idf data structures.
 
-      ft_matrix (matrix): Matrix containing the frequency term for each term
-        in the corpus respecting the index stored in `vocabulary`.
-
-      ifd_diag_matrix (list): Vector containing the inverse document
-        frequency for each term in the corpus. It respects the index stored in
+      idf (numpy.ndarray): Vector containing the inverse document frequency
+        for each term in the corpus. It respects the index stored in
         `vocabulary`.
 
-      tf_idf_matrix (matrix): Matrix containing the ft-idf score for each term
-        in the corpus respecting the index stored in `vocabulary`.
+      index (Index): Posting lists of the ranked documents, usually shared
+        with a segment.
+
+      impacts (numpy.ndarray): The tf-idf score of each (document, term)
+        pair, stored by term in the order of the posting list of each term
+        in `index`, with the dtype of `precision`, so that the scores of a
+        term are aligned with its posting list without keeping another copy
+        of the document indices.
+
+      term_offsets (numpy.ndarray): Start of the scores of each term in
+        `impacts`, and the end of the scores of the last term.
+
+      n_docs (int): Number of ranked documents.
+
+      scales (numpy.ndarray): Score of one quantization level for each term,
+        None unless scores are quantized.
+
+      max_scores (numpy.ndarray): Highest score of each term in the corpus,
+        used as upper bound by dynamic pruning.
+
+    Raises:
+      ValueError: If `precision` is not a known score precision.
 
     """
 
-    def __init__(self, stop_words, smoothing=1):
+    def __init__(self, stop_words, smoothing=1, precision=FLOAT64):
+        if precision not in SCORE_PRECISIONS:
+            raise ValueError('Unknown score precision: %s' % precision)
         self.smoothing = smoothing
         self.stop_words = stop_words
+        self.precision = precision
         self.vocabulary = {}
-        self.ft_matrix = []
-        self.ifd_diag_matrix = []
-        self.tf_idf_matrix = []
+        self.idf = []
+        self.index = None
+        self.impacts = []
+        self.term_offsets = []
+        self.n_docs = 0
+        self.scales = None
+        self.max_scores = []
 
     def build_rank(self, objects):
         """Build tf-idf ranking score for terms in the corpus.
 
-        Note:
-          The code in this method could have been extracted to other smaller
-          methods, improving legibility. This extraction has not been done so
-          that its runtime complexity can be computed easily (the runtime
-          complexity can be improved).
-
         Args:
           objects (list of Indexable): List of indexed objects that will be
             considered during tf-idf score computation.
 
         """
-        self.__build_vocabulary(objects)
+        builder = TermMatrixBuilder(self.stop_words)
+        logger.info('Starting tf computation...')
+        for indexable in objects:
+            builder.add(indexable)
+        self.build_rank_from(builder)
+
+    @traced('rank')
+    def build_rank_from(self, builder, idf=None, max_scores=None,
+                        index=None):
+        """Build tf-idf ranking score from accumulated term frequencies.
+
+        All steps work directly on the CSR arrays collected by the builder:
+        the document frequency is a count of the column indices, the tf-idf
+        scores are the term frequencies multiplied by the idf of their column,
+        and the norm of each row is summed from the squared scores. The
+        scores are then computed by term, from a CSC matrix of the builder
+        which is released afterwards.
+
+        Args:
+          builder (TermMatrixBuilder): Term frequencies of the indexed
+            objects.
+          idf (numpy.ndarray, optional): Inverse document frequency of each
+            term of the builder vocabulary, computed from the builder objects
+            if not given. Segments of an index share the idf of the whole
+            corpus.
+          max_scores (numpy.ndarray, optional): Highest double precision
+            score of each term, mapped to the highest quantization level,
+            computed from the builder objects if not given. Shards of an
+            index share the highest scores of the whole corpus.
+          index (Index, optional): Posting lists of the builder objects,
+            built from the builder if not given. Segments share their own.
 
+        """
+        self.vocabulary = builder.vocabulary
         n_terms = len(self.vocabulary)
-        n_docs = len(objects)
-        ft_matrix = sp.lil_matrix((n_docs, n_terms), dtype=np.dtype(float))
+        n_docs = builder.n_docs
 
         logger.info('Vocabulary assembled with terms count %s', n_terms)
 
-        # compute idf
-        logger.info('Starting tf computation...')
-        for index, indexable in enumerate(objects):
-            for word in indexable.words_generator(self.stop_words):
-                word_index_in_vocabulary = self.vocabulary[word]
-                doc_word_count = indexable.count_for_word(word)
-                ft_matrix[index, word_index_in_vocabulary] = doc_word_count
-        self.ft_matrix = ft_matrix.tocsc()
+        indptr, indices, counts = builder.arrays()
 
         logger.info('Starting tf-idf computation...')
-        # compute idf with smoothing
-        df = np.diff(self.ft_matrix.indptr) + self.smoothing
-        n_docs_smooth = n_docs + self.smoothing
-
-        # create diagonal matrix to be multiplied with ft
-        idf = np.log(float(n_docs_smooth) / df) + 1.0
-        self.ifd_diag_matrix = sp.spdiags(idf, diags=0, m=n_terms, n=n_terms)
+        if idf is None:
+            idf = self.compute_idf(np.bincount(indices, minlength=n_terms),
+                                   n_docs)
+        self.idf = idf
 
         # compute tf-idf
-        self.tf_idf_matrix = self.ft_matrix * self.ifd_diag_matrix
-        self.tf_idf_matrix = self.tf_idf_matrix.tocsr()
+        data = counts * idf[indices]
 
         # compute td-idf normalization
-        norm = self.tf_idf_matrix.tocsr(copy=True)
-        norm.data **= 2
-        norm = norm.sum(axis=1)
+        logger.info('Starting tf-idf norm computation...')
+        rows = np.repeat(np.arange(n_docs), np.diff(indptr))
+        norm = np.bincount(rows, weights=data ** 2, minlength=n_docs)
         n_nzeros = np.where(norm > 0)
         norm[n_nzeros] = 1.0 / np.sqrt(norm[n_nzeros])
-        norm = np.array(norm).T[0]
-        sptools.csr_scale_rows(self.tf_idf_matrix.shape[0],
-                                      self.tf_idf_matrix.shape[1],
-                                      self.tf_idf_matrix.indptr,
-                                      self.tf_idf_matrix.indices,
-                                      self.tf_idf_matrix.data, norm)
+        del data, rows
+
+        # compute the normalized scores by term, in the order of the posting
+        # lists
+        columns = builder.columns()
+        columns_terms = np.repeat(np.arange(n_terms), np.diff(columns.indptr))
+        impacts = columns.data * idf[columns_terms] * norm[columns.indices]
+
+        self.scales = None
+        if self.precision == QUANTIZED:
+            if max_scores is None:
+                max_scores = self.__max_scores(columns.indptr, impacts)
+            self.scales = np.where(max_scores > 0,
+                                   max_scores / QUANTIZATION_LEVELS, 1.0)
+
+        self.impacts = self.__stored_scores(impacts, columns_terms)
+        self.term_offsets = columns.indptr
+        self.n_docs = n_docs
+        if index is None:
+            index = Index(self.stop_words)
+            index.build_index_from(builder)
+        self.index = index
+
+        # bound the stored scores, as they are the ones summed by searches
+        self.max_scores = self.__max_scores(self.term_offsets, self.impacts)
+        if self.scales is not None:
+            self.max_scores *= self.scales
+
+    def __stored_scores(self, scores, terms):
+        """Convert double precision scores to the configured precision.
+
+        Args:
+          scores (numpy.ndarray): Scores in double precision.
+          terms (numpy.ndarray): Vocabulary index of the term of each score.
+
+        Returns:
+          numpy.ndarray: Scores with the dtype of `precision`, quantized
+            scores being rounded to the nearest level of their term.
+
+        """
+        if self.precision == QUANTIZED:
+            return np.rint(scores / self.scales[terms]).astype(np.uint8)
+        return scores.astype(self.precision, copy=False)
+
+    def __term_weights(self, terms_indices):
+        """Return the factors converting stored scores of terms to scores.
 
-    def __build_vocabulary(self, objects):
-        """Build vocabulary with indexable objects.
+        """
+        if self.scales is None:
+            return np.ones(len(terms_indices))
+        return self.scales[terms_indices]
+
+    def compute_idf(self, df, n_docs):
+        """Compute the smoothed inverse document frequency of terms.
 
         Args:
-          objects (list of Indexable): Indexed objects that will be
-            considered during ranking.
+          df (numpy.ndarray): Number of documents containing each term.
+          n_docs (int): Number of documents in the corpus.
+
+        Returns:
+          numpy.ndarray: Inverse document frequency of each term.
 
         """
-        vocabulary_index = 0
-        for indexable in objects:
-            for word in indexable.words_generator(self.stop_words):
-                if word not in self.vocabulary:
-                    self.vocabulary[word] = vocabulary_index
-                    vocabulary_index += 1
+        n_docs_smooth = n_docs + self.smoothing
+        return np.log(float(n_docs_smooth) / (df + self.smoothing)) + 1.0
+
+    def __max_scores(self, indptr, scores):
+        """Compute the highest score of each term.
+
+        Args:
+          indptr (numpy.ndarray): Offsets of the scores of each term.
+          scores (numpy.ndarray): Scores stored by term.
+
+        Returns:
+          numpy.ndarray: Highest score of each term, zero for terms that do
+            not occur in any document.
+
+        """
+        n_terms = len(indptr) - 1
+        max_scores = np.zeros(n_terms)
+        not_empty = np.diff(indptr) > 0
+        if np.any(not_empty):
+            starts = indptr[:-1][not_empty]
+            max_scores[not_empty] = np.maximum.reduceat(scores, starts)
+        return max_scores
+
+    def term_impacts(self, term):
+        """Return the documents containing a term and their scores.
+
+        Args:
+          term (str): Term in the vocabulary.
+
+        Returns:
+          tuple: Posting list of `term` in `index`, decoded on demand if
+            compressed, and the score of the term in each of its documents.
+
+        """
+        term_index = self.vocabulary[term]
+        start = self.term_offsets[term_index]
+        end = self.term_offsets[term_index + 1]
+        impacts = self.impacts[start:end]
+        if self.scales is not None:
+            impacts = impacts * self.scales[term_index]
+        return self.index.postings_list(term), impacts
+
+    def __stored_lookup(self, term, docs_indices):
+        """Return the stored scores of a term in documents, zero if absent.
+
+        """
+        found, positions = lookup(self.index.postings_list(term),
+                                  docs_indices)
+        scores = np.zeros(len(docs_indices))
+        scores[found] = self.impacts[self.term_offsets[self.vocabulary[term]]
+                                     + positions]
+        return scores
+
+    def __stored_columns(self, terms):
+        """Return the stored scores of some terms, one column per term.
+
+        """
+        postings_lists = [EMPTY_POSTINGS]
+        scores = [self.impacts[:0]]
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        for column, term in enumerate(terms):
+            term_index = self.vocabulary[term]
+            postings_lists.append(as_postings(self.index.postings_list(term)))
+            scores.append(self.impacts[self.term_offsets[term_index]:
+                                       self.term_offsets[term_index + 1]])
+            indptr[column + 1] = indptr[column] + len(postings_lists[-1])
+        return sp.csc_matrix((np.concatenate(scores),
+                              np.concatenate(postings_lists), indptr),
+                             shape=(self.n_docs, len(terms)))
 
     def compute_rank(self, doc_index, terms):
         """Compute tf-idf score of an indexed document.
@@ -234,11 +1022,181 @@ class TfidfRank(object):
           float: tf-idf of document identified by its index.
 
         """
-        score = 0
-        for term in terms:
-            term_index = self.vocabulary[term]
-            score += self.tf_idf_matrix[doc_index, term_index]
-        return score
+        return float(self.compute_ranks(np.array([doc_index]), terms)[0])
+
+    @traced('score')
+    def compute_ranks(self, docs_indices, terms):
+        """Compute tf-idf scores of several indexed documents at once.
+
+        All the candidate documents are looked up at once in the posting
+        list of each query term, and the scores found summed, instead of
+        looking up each (document, term) score separately.
+
+        Args:
+          docs_indices (numpy.ndarray): Indices of the documents to be ranked.
+          terms (list of str): List of query terms.
+
+        Returns:
+          numpy.ndarray: tf-idf of each document, in the order of
+            `docs_indices`.
+
+        """
+        terms_indices = [self.vocabulary[term] for term in terms]
+        scores = np.zeros(len(docs_indices))
+        # weighting the scores also sums them in double precision
+        for term, weight in zip(terms, self.__term_weights(terms_indices)):
+            scores += self.__stored_lookup(term, docs_indices) * weight
+        return scores
+
+    @traced('score')
+    def compute_batch_ranks(self, terms_lists, candidates=None):
+        """Compute the tf-idf scores of documents for several queries at once.
+
+        The queries are a sparse matrix of term weights, one row per query,
+        and the scores of all the documents for all the queries are a single
+        product with the columns of the query terms, built from their
+        posting lists and `impacts`; a product of the same structures without the
+        weights finds the documents containing any of the terms of each
+        query. When the candidates of each query are known, as they contain
+        all of its terms, their scores are looked up in the columns of the
+        query terms instead, so only the candidates are scored.
+
+        Args:
+          terms_lists (list of list of str): Terms of each query, repeated
+            terms counting as many times as they occur.
+          candidates (tuple of numpy.ndarray, optional): Query and document
+            of the only pairs to be scored, sorted by query then document.
+
+        Returns:
+          tuple of numpy.ndarray: Query and document of each pair of a query
+            and a candidate, or of a document containing any of its terms,
+            sorted by query then document, and the score of the pair.
+
+        """
+        terms = sorted(set(term for query_terms in terms_lists
+                           for term in query_terms
+                           if term in self.vocabulary),
+                       key=self.vocabulary.get)
+        terms_indices = np.array([self.vocabulary[term] for term in terms],
+                                 dtype=np.int64)
+        columns = dict((term, column) for column, term in enumerate(terms))
+        queries = []
+        terms_columns = []
+        for query, query_terms in enumerate(terms_lists):
+            for term in query_terms:
+                if term in self.vocabulary:
+                    queries.append(query)
+                    terms_columns.append(columns[term])
+
+        shape = (len(terms_lists), len(terms))
+        # occurrences of each term in each query, duplicates being summed
+        query_matrix = sp.csr_matrix(
+            (np.ones(len(queries)), (queries, terms_columns)), shape=shape)
+        query_matrix.sum_duplicates()
+        weights_matrix = query_matrix.copy()
+        weights_matrix.data *= self.__term_weights(
+            terms_indices)[query_matrix.indices]
+
+        if candidates is not None:
+            queries, docs_indices = candidates
+            # the candidates of a query are looked up in the posting list
+            # of each of its terms, so only their scores are read
+            bounds = np.searchsorted(queries, np.arange(shape[0] + 1))
+            scores = np.zeros(len(docs_indices))
+            for query in range(shape[0]):
+                start, end = bounds[query], bounds[query + 1]
+                if start == end:
+                    continue
+                docs = docs_indices[start:end]
+                for entry in range(weights_matrix.indptr[query],
+                                   weights_matrix.indptr[query + 1]):
+                    term = terms[weights_matrix.indices[entry]]
+                    scores[start:end] += self.__stored_lookup(term, docs) * \
+                        weights_matrix.data[entry]
+            return queries, docs_indices, scores
+
+        terms_matrix = self.__stored_columns(terms)
+        terms_presence = terms_matrix.copy()
+        terms_presence.data = np.ones(terms_matrix.nnz)
+        query_matrix.data[:] = 1.0
+        matches = query_matrix.dot(terms_presence.T)
+        scores = weights_matrix.dot(terms_matrix.T)
+        matches.sort_indices()
+        scores.sort_indices()
+
+        # the products have the same rows but scores may omit zeros, the
+        # scores of the pairs are found by a binary search
+        n_docs = self.n_docs
+        queries = np.repeat(np.arange(shape[0]), np.diff(matches.indptr))
+        keys = queries * n_docs + matches.indices
+        scored_keys = np.repeat(np.arange(shape[0]) * n_docs,
+                                np.diff(scores.indptr)) + scores.indices
+        positions = np.minimum(np.searchsorted(scored_keys, keys),
+                               max(len(scored_keys) - 1, 0))
+        docs_scores = np.zeros(len(keys))
+        if len(scored_keys) > 0:
+            found = scored_keys[positions] == keys
+            docs_scores[found] = scores.data[positions[found]]
+        return queries, matches.indices, docs_scores
+
+    def nbytes(self):
+        """Return the memory used by the scores.
+
+        Returns:
+          int: Size in bytes of `impacts` and of their offsets, whose
+            documents are the posting lists of `index`.
+
+        """
+        return self.impacts.nbytes + self.term_offsets.nbytes
+
+    def save(self, writer):
+        """Store vocabulary, idf and tf-idf scores in a snapshot.
+
+        Scores are stored with their precision, which is read back from the
+        snapshot manifest.
+
+        Args:
+          writer (SnapshotWriter): Snapshot being written.
+
+        """
+        terms = [None] * len(self.vocabulary)
+        for term, term_index in self.vocabulary.iteritems():
+            terms[term_index] = term
+
+        writer.write_terms('rank_vocabulary', terms)
+        writer.write_array('rank_idf', self.idf)
+        writer.write_array('rank_docs_count', np.array([self.n_docs]))
+        writer.write_array('rank_impacts', self.impacts)
+        writer.write_array('rank_term_offsets', self.term_offsets)
+        writer.write_array('rank_max_scores', self.max_scores)
+        if self.scales is not None:
+            writer.write_array('rank_scales', self.scales)
+
+    def load(self, reader, index):
+        """Restore vocabulary, idf and tf-idf scores from a snapshot.
+
+        Args:
+          reader (SnapshotReader): Snapshot being read.
+          index (Index): Posting lists of the documents, restored from the
+            same snapshot, which the scores by term are aligned with.
+
+        """
+        terms = reader.read_terms('rank_vocabulary')
+        self.vocabulary = dict((term, term_index) for term_index, term
+                               in enumerate(terms))
+
+        self.precision = reader.manifest.get('precision', FLOAT64)
+        self.idf = reader.read_array('rank_idf')
+
+        # the arrays are used as they are, keeping them memory-mapped
+        self.n_docs = int(reader.read_array('rank_docs_count')[0])
+        self.impacts = reader.read_array('rank_impacts')
+        self.term_offsets = reader.read_array('rank_term_offsets')
+        self.index = index
+        self.max_scores = reader.read_array('rank_max_scores')
+        self.scales = None
+        if self.precision == QUANTIZED:
+            self.scales = reader.read_array('rank_scales')
 
 
 class Index(object):
@@ -251,23 +1209,37 @@ class Index(object):
       search then saving some space. This logic may have to be revisited if the
       index become too large.
 
+    Posting lists can be compressed in blocks, see `CompressedPostings`,
+    which takes several times less memory at the cost of decoding the blocks
+    touched by each search.
+
     Args:
-      term_index (dict): Dictionary containing a term as key and a list of all
-        the documents that contain that key/term as values
       stop_words (list of str): Stop words that will be filtered during docs
         processing.
+      pair_cache (LRUCache, optional): Cache of posting lists intersections.
+      compressed (bool, optional): Whether posting lists are compressed.
 
     Attributes:
-      term_index (dict): Dictionary containing a term as key and a list of all
-        the documents that contain that key/term as values
+      term_index (dict): Dictionary containing a term as key and a sorted
+        `int32` array of all the documents that contain that key/term as
+        values, or the index of the term in `postings` if compressed.
+        Posting lists are frozen once the index is built.
       stop_words (list of str): Stop words that will be filtered during docs
         processing.
+      pair_cache (LRUCache): Cache of the intersection of the two rarest
+        terms of queries, None if disabled.
+      compressed (bool): Whether posting lists are compressed.
+      postings (CompressedPostings): Compressed posting lists of all terms,
+        None unless `compressed` is set.
 
     """
 
-    def __init__(self, stop_words):
+    def __init__(self, stop_words, pair_cache=None, compressed=False):
         self.stop_words = stop_words
-        self.term_index = defaultdict(list)
+        self.term_index = {}
+        self.pair_cache = pair_cache
+        self.compressed = compressed
+        self.postings = None
 
     def build_index(self, objects):
         """Build index the given indexable objects.
@@ -277,137 +1249,1919 @@ class Index(object):
             considered during search.
 
         """
-        for position, indexable in enumerate(objects):
-            for word in indexable.words_generator(self.stop_words):
-                # build dictionary where term is the key and an array
-                # of the IDs of indexable object containing the term
-                self.term_index[word].append(position)
+        builder = TermMatrixBuilder(self.stop_words)
+        for indexable in objects:
+            builder.add(indexable)
+        self.build_index_from(builder)
 
-    def search_terms(self, terms):
-        """Search for terms in indexed documents.
+    @traced('postings')
+    def build_index_from(self, builder):
+        """Build index from accumulated term frequencies.
 
-        Args:
-          terms (list of str): List of terms considered during the search.
+        The posting list of each term is the slice of the column indices of
+        the builder CSC matrix, so no per-posting work is needed.
 
-        Returns:
-          list of int: List containing the index of indexed objects that
-            contains the query terms.
+        Args:
+          builder (TermMatrixBuilder): Term frequencies of the indexed
+            objects.
 
         """
-        docs_indices = []
-        for term_index, term in enumerate(terms):
+        columns = builder.columns()
+        if self.compressed:
+            self.postings = CompressedPostings()
+            self.postings.build(columns.indptr, columns.indices)
+            # the builder vocabulary is not modified once it is indexed
+            self.term_index = builder.vocabulary
+            return
+
+        postings = columns.indices.astype(POSTINGS_DTYPE, copy=False)
+        offsets = columns.indptr
+        # build dictionary where term is the key and an array
+        # of the IDs of indexable object containing the term
+        self.term_index = {}
+        for term, term_index in builder.vocabulary.iteritems():
+            start, end = offsets[term_index], offsets[term_index + 1]
+            self.term_index[term] = postings[start:end]
+
+    def postings_list(self, term):
+        """Return the posting list of an indexed term.
 
+        Args:
+          term (str): Indexed term.
+
+        Returns:
+          numpy.ndarray or BlockPostingList: Sorted indices of the documents
+            containing `term`, decoded on demand if compressed.
+
+        """
+        if self.compressed:
+            return self.postings.postings_list(self.term_index[term])
+        return self.term_index[term]
+
+    @traced('intersect')
+    def search_terms(self, terms, plan=None):
+        """Search for terms in indexed documents.
+
+        Posting lists are intersected from the rarest to the most common term,
+        so each step costs roughly the size of the smaller list, and the
+        strategy of each step depends on the ratio of the lengths of the
+        lists, see `pair_strategy`. The search stops as soon as a term is
+        missing or no document is left. When the pair cache is enabled, the
+        intersection of the two rarest terms is cached, as the same pairs
+        (such as author names) are queried over and over.
+
+        Args:
+          terms (list of str): List of terms considered during the search.
+          plan (SegmentPlan, optional): Plan receiving the order of the
+            terms and the steps of the intersection.
+
+        Returns:
+          numpy.ndarray: Sorted array containing the index of indexed objects
+            that contains the query terms.
+
+        """
+        for term in terms:
             # keep only docs that contains all terms
             if term not in self.term_index:
-                docs_indices = []
-                break
-
-            # compute intersection between results
-            # there is room for improvements in this part of the code
-            docs_with_term = self.term_index[term]
-            if term_index == 0:
-                docs_indices = docs_with_term
+                if plan is not None:
+                    plan.exit = 'missing term %s' % term
+                return EMPTY_POSTINGS
+
+        terms_postings = dict((term, self.postings_list(term))
+                              for term in set(terms))
+        unique_terms = sorted(terms_postings,
+                              key=lambda term: len(terms_postings[term]))
+        postings_lists = [terms_postings[term] for term in unique_terms]
+        if tracer.enabled:
+            for postings in postings_lists:
+                tracer.observe('postings_length', len(postings))
+                tracer.count('postings_touched_total', len(postings))
+        steps = []
+        if self.pair_cache is not None and len(unique_terms) > 1:
+            # the indexes of different segments share the cache
+            pair = (id(self),) + tuple(sorted(unique_terms[:2]))
+            generation = self.pair_cache.generation
+            pair_postings = self.pair_cache.get(pair)
+            strategy = 'cache'
+            if pair_postings is None:
+                tracer.count('pair_cache_misses_total')
+                strategy = pair_strategy(postings_lists[0], postings_lists[1])
+                pair_postings = intersect_pair(postings_lists[0],
+                                               postings_lists[1], strategy)
+                self.pair_cache.put(pair, pair_postings, generation)
             else:
-                docs_indices = set(docs_indices) & set(docs_with_term)
-        return list(docs_indices)
+                tracer.count('pair_cache_hits_total')
+            steps.append((1, strategy, len(pair_postings)))
+            postings_lists = [pair_postings] + postings_lists[2:]
+            docs_indices = intersect(postings_lists, steps)
+            # positions of the lists after the pair are shifted by one
+            steps[1:] = [(position + 1, step_strategy, remaining)
+                         for position, step_strategy, remaining in steps[1:]]
+        else:
+            docs_indices = intersect(postings_lists, steps)
+
+        if plan is not None:
+            plan.terms = [(term, len(terms_postings[term]))
+                          for term in unique_terms]
+            plan.steps = [(unique_terms[position], strategy, remaining)
+                          for position, strategy, remaining in steps]
+            if len(docs_indices) == 0 and len(unique_terms) > 0:
+                plan.exit = 'no document contains all terms'
+        return docs_indices
+
+    def nbytes(self):
+        """Return the memory used by the posting lists.
 
+        Returns:
+          int: Size in bytes of the posting lists, compressed or not.
 
-class SearchEngine(object):
-    """Search engine for objects that can be indexed.
+        """
+        if self.compressed:
+            return self.postings.nbytes()
+        return sum(postings.nbytes for postings in self.term_index.values())
+
+    def save(self, writer):
+        """Store posting lists in a snapshot.
+
+        All posting lists are concatenated in a single array and delimited by
+        an array of offsets, the same layout used by CSR matrices. Compressed
+        posting lists are stored as they are, by term index.
+
+        Args:
+          writer (SnapshotWriter): Snapshot being written.
+
+        """
+        if self.compressed:
+            terms = [None] * len(self.term_index)
+            for term, term_index in self.term_index.iteritems():
+                terms[term_index] = term
+            writer.write_terms('index_terms', terms)
+            self.postings.save(writer.section('index_'))
+            return
+
+        terms = self.term_index.keys()
+        lengths = [len(self.term_index[term]) for term in terms]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        postings = np.zeros(offsets[-1], dtype=POSTINGS_DTYPE)
+        for term, start, end in zip(terms, offsets[:-1], offsets[1:]):
+            postings[start:end] = self.term_index[term]
+
+        writer.write_terms('index_terms', terms)
+        writer.write_array('index_postings', postings)
+        writer.write_array('index_offsets', offsets)
+
+    def load(self, reader):
+        """Restore posting lists from a snapshot.
+
+        Args:
+          reader (SnapshotReader): Snapshot being read.
+
+        """
+        terms = reader.read_terms('index_terms')
+        self.compressed = reader.manifest.get('compressed', False)
+        if self.compressed:
+            self.term_index = dict((term, index) for index, term
+                                   in enumerate(terms))
+            self.postings = CompressedPostings()
+            self.postings.load(reader.section('index_'))
+            return
+
+        # slices of a plain view of the mapped array are much cheaper to
+        # create than memmap slices, and still read the mapped file
+        postings = reader.read_array('index_postings').view(np.ndarray)
+        offsets = reader.read_array('index_offsets')
+
+        self.term_index = {}
+        for term, start, end in zip(terms, offsets[:-1], offsets[1:]):
+            self.term_index[term] = postings[start:end]
+
+
+class Segment(object):
+    """Class representing an immutable part of the index.
+
+    A segment covers consecutive documents and holds everything needed to
+    search them: their raw term frequencies, posting lists, positions and
+    tf-idf scores. Scores depend on the document frequencies of the whole
+    corpus, so once they changed enough, see `is_stale`, a segment is
+    rescored from its raw term frequencies into a new segment instead of
+    being modified in place. Queries running meanwhile keep using the
+    segments they started with.
+
+    Searches only read the posting lists, positions and scores. The raw
+    term frequencies, the only copy of the (document, term) pairs in row
+    order, are kept for rescoring, counting the terms of deleted documents
+    and merging segments; rebuilding them from the scores is not possible
+    once scores are quantized.
+
+    Deleted documents are marked in a bitmap, checked by the search paths,
+    and only dropped when the segment is rewritten.
+
+    Args:
+      stop_words (list of str): Stop words that will be filtered during docs
+        processing.
+      pair_cache (LRUCache, optional): Cache of posting lists intersections
+        shared by the segments of an index.
+      compressed (bool, optional): Whether posting lists are compressed.
+      precision (str, optional): Storage of the tf-idf scores, one of
+        `SCORE_PRECISIONS`.
 
     Attributes:
-      objects (list of Indexable): List of objects that can be considered
-        during search.
       stop_words (list of str): Stop words that will be filtered during docs
         processing.
-      rank (TfidfRank): Object responsible for tf-idf ranking computation.
-      index (Index): Object responsible for data indexing.
+      precision (str): Storage of the tf-idf scores.
+      doc_base (int): Global index of the first document of the segment.
+      n_docs (int): Number of documents in the segment.
+      builder (TermMatrixBuilder): Raw term frequencies of the documents.
+      global_terms (numpy.ndarray): Global index of each term of the
+        segment vocabulary.
+      index (Index): Posting lists of the segment, by local document index.
+      positions (PositionalIndex): Positions of the terms, None unless the
+        segment is positional.
+      rank (TfidfRank): Scores of the segment documents.
+      idf (numpy.ndarray): Inverse document frequency the segment was scored
+        with, None until it is scored.
+      iids (numpy.ndarray): Identifier of the object of each document.
+      deleted (numpy.ndarray): Boolean mask of the deleted documents.
+      deleted_count (int): Number of deleted documents.
 
     """
 
-    def __init__(self):
-        self.objects = []
-        self.stop_words = self.__load_stop_words()
-        self.rank = TfidfRank(self.stop_words)
-        self.index = Index(self.stop_words)
+    def __init__(self, stop_words, pair_cache=None, compressed=False,
+                 precision=FLOAT64):
+        self.stop_words = stop_words
+        self.precision = precision
+        self.doc_base = 0
+        self.n_docs = 0
+        self.builder = TermMatrixBuilder(stop_words)
+        self.global_terms = np.zeros(0, dtype=np.int64)
+        self.index = Index(stop_words, pair_cache, compressed)
+        self.positions = None
+        self.rank = TfidfRank(stop_words, precision=precision)
+        self.idf = None
+        self.iids = np.zeros(0, dtype=np.int64)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.deleted_count = 0
+        # documents sorted by identifier, searched by `docs_of`
+        self._iids_order = np.zeros(0, dtype=np.int64)
+
+    def build_segment_from(self, builder, doc_base):
+        """Build posting lists and positions of accumulated objects.
+
+        The segment is not searchable until it is scored with `rescored`.
+
+        Args:
+          builder (TermMatrixBuilder): Term frequencies of the objects, not
+            modified afterwards.
+          doc_base (int): Global index of the first object of `builder`.
+
+        """
+        self.builder = builder
+        self.doc_base = doc_base
+        self.n_docs = builder.n_docs
+        self.deleted = np.zeros(builder.n_docs, dtype=bool)
+        self.deleted_count = 0
+        self.index.build_index_from(builder)
+        if builder.positional:
+            self.positions = PositionalIndex()
+            self.positions.build_index_from(builder, self.index)
+
+    def index_iids(self, iids):
+        """Sort the identifiers of the segment objects, see `docs_of`.
+
+        Args:
+          iids (list): Identifier of the object of each document.
+
+        """
+        self.iids = np.asarray(iids)
+        self._iids_order = np.argsort(self.iids, kind='mergesort')
+
+    def docs_of(self, iid):
+        """Find the documents of an object identifier not deleted yet.
+
+        Args:
+          iid (int): Identifier of the objects.
+
+        Returns:
+          list of int: Indices in the segment of the documents, sorted.
+
+        """
+        start, end = [np.searchsorted(self.iids, iid, side, self._iids_order)
+                      for side in ['left', 'right']]
+        docs_indices = np.sort(self._iids_order[start:end])
+        # identifiers of another type may be found among the sorted ones
+        if len(docs_indices) == 0 or self.iids[docs_indices[0]] != iid:
+            return []
+        return docs_indices[~self.deleted[docs_indices]].tolist()
+
+    def document_frequencies(self):
+        """Count the documents of the segment containing each of its terms.
+
+        Returns:
+          numpy.ndarray: Document frequency of each term of the segment
+            vocabulary.
+
+        """
+        return self.builder.document_frequencies()
+
+    def with_deleted(self, docs_indices):
+        """Return a copy of the segment where documents are deleted.
+
+        Args:
+          docs_indices (list of int): Indices in the segment of documents
+            not deleted yet.
+
+        Returns:
+          Segment: Segment sharing the data of this one, with a new bitmap
+            of deleted documents.
+
+        """
+        segment = copy.copy(self)
+        segment.deleted = self.deleted.copy()
+        segment.deleted[docs_indices] = True
+        segment.deleted_count = self.deleted_count + len(docs_indices)
+        return segment
+
+    def rescored(self, idf, max_scores=None):
+        """Return a copy of the segment scored with the given idf.
+
+        Args:
+          idf (numpy.ndarray): Inverse document frequency of each term of the
+            segment vocabulary.
+          max_scores (numpy.ndarray, optional): Highest score of each term,
+            setting the scales of quantized scores, the highest scores of
+            the segment if not given.
+
+        Returns:
+          Segment: Segment sharing the posting lists and positions of this
+            one, with new tf-idf scores.
+
+        """
+        segment = copy.copy(self)
+        segment.rank = TfidfRank(self.stop_words, precision=self.precision)
+        segment.rank.build_rank_from(self.builder, idf, max_scores,
+                                     self.index)
+        segment.idf = idf
+        return segment
+
+    def is_stale(self, idf, tolerance):
+        """Check whether the segment should be rescored with a new idf.
+
+        The largest change of the idf of a term is compared with the
+        tolerance, so that the idf of rare terms, which changes a lot
+        whenever one of their few documents is deleted and moves their
+        documents in the rankings, is never left behind.
+
+        Args:
+          idf (numpy.ndarray): Current inverse document frequency of each term
+            of the segment vocabulary.
+          tolerance (float): Largest change of the idf of a term since the
+            segment was scored that does not require rescoring it.
+
+        Returns:
+          bool: True if the segment was never scored, or if the idf of one
+            of its terms changed by more than `tolerance`.
+
+        """
+        if self.idf is None:
+            return True
+        if len(idf) == 0:
+            return False
+        return np.max(np.abs(idf - self.idf)) > tolerance
+
+    @traced('segment')
+    def search_all_terms(self, query, n_results, plan=None):
+        """Rank the documents containing all the query terms.
+
+        Phrases and proximity operators are checked only on the documents
+        containing all the terms.
+
+        Args:
+          query (Query): Parsed query.
+          n_results (int): Desired number of results.
+          plan (SegmentPlan, optional): Plan receiving the steps of the
+            evaluation.
+
+        Returns:
+          tuple: Arrays with the best documents, by index in the segment, and
+            their scores, sorted by decreasing score.
+
+        """
+        terms = query.terms
+        docs_indices = self.index.search_terms(terms, plan)
+        if self.deleted_count > 0:
+            docs_indices = docs_indices[~self.deleted[docs_indices]]
+        for phrase in query.phrases:
+            docs_indices = self.positions.match_phrase(docs_indices, phrase)
+            if plan is not None:
+                plan.filters.append(('phrase "%s"' % ' '.join(
+                    word for word, offset in phrase), len(docs_indices)))
+        for first_word, second_word, distance in query.proximities:
+            docs_indices = self.positions.match_near(docs_indices, first_word,
+                                                     second_word, distance)
+            if plan is not None:
+                plan.filters.append(('%s NEAR/%d %s' % (
+                    first_word, distance, second_word), len(docs_indices)))
+        tracer.observe('query_candidates', len(docs_indices))
+        if len(docs_indices) == 0:
+            return docs_indices, np.zeros(0)
+        if plan is not None:
+            plan.candidates = len(docs_indices)
+
+        # score every candidate at once and keep only the best
+        docs_scores = self.rank.compute_ranks(docs_indices, terms)
+        with tracer.span('top_k'):
+            best_positions = top_k_positions(docs_scores, n_results)
+        return docs_indices[best_positions], docs_scores[best_positions]
+
+    @traced('segment')
+    def search_batch(self, queries, mode, n_results):
+        """Rank the documents of the segment for several queries at once.
+
+        In `ALL_TERMS` mode, the candidates of each query are found as by
+        `search_all_terms`, intersecting posting lists and checking phrases
+        and proximity operators, then the candidates of all queries are
+        scored at once; in `ANY_TERMS` mode, every document containing any
+        of the terms of a query is scored. Scores are computed by
+        `TfidfRank.compute_batch_ranks`, and the best documents of every
+        query selected from the slice of its scores.
+
+        The candidates of `ALL_TERMS` queries are not found with the product
+        of `ANY_TERMS` queries, keeping the documents containing as many
+        query terms as the query: the product touches every posting of every
+        query term, while an intersection starting from the rarest term
+        skips most postings of the common ones, so it is faster even though
+        it is run one query at a time.
+
+        Args:
+          queries (list of Query): Parsed queries.
+          mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+          n_results (int): Desired number of results of each query.
+
+        Returns:
+          tuple of numpy.ndarray: Offsets of the results of each query in
+            the following arrays, followed by one extra offset, the best
+            documents of each query, by index in the segment and sorted by
+            decreasing score, and their scores.
+
+        """
+        candidates = None
+        if mode == ALL_TERMS:
+            queries_parts = [np.zeros(0, dtype=np.int64)]
+            docs_parts = [np.zeros(0, dtype=np.int64)]
+            for position, query in enumerate(queries):
+                docs_indices = self.index.search_terms(query.terms)
+                if self.deleted_count > 0:
+                    docs_indices = docs_indices[~self.deleted[docs_indices]]
+                for phrase in query.phrases:
+                    docs_indices = self.positions.match_phrase(docs_indices,
+                                                               phrase)
+                for first_word, second_word, distance in query.proximities:
+                    docs_indices = self.positions.match_near(
+                        docs_indices, first_word, second_word, distance)
+                queries_parts.append(np.repeat(position, len(docs_indices)))
+                docs_parts.append(docs_indices.astype(np.int64))
+            candidates = (np.concatenate(queries_parts),
+                          np.concatenate(docs_parts))
+        columns, docs_indices, docs_scores = self.rank.compute_batch_ranks(
+            [query.terms for query in queries], candidates)
+        if mode == ANY_TERMS and self.deleted_count > 0:
+            keep = ~self.deleted[docs_indices]
+            columns = columns[keep]
+            docs_indices = docs_indices[keep]
+            docs_scores = docs_scores[keep]
+
+        # pairs are sorted by query then document, so the best documents of
+        # each query are selected from its slice, ties ordered by document
+        queries_bounds = np.arange(len(queries) + 1)
+        bounds = np.searchsorted(columns, queries_bounds)
+        best_positions = [np.zeros(0, dtype=np.int64)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            best_positions.append(
+                start + top_k_positions(docs_scores[start:end], n_results))
+        best_positions = np.concatenate(best_positions)
+        offsets = np.searchsorted(columns[best_positions], queries_bounds)
+        return (offsets, docs_indices[best_positions],
+                docs_scores[best_positions])
+
+    @traced('segment')
+    def search_any_terms(self, terms, n_results, plan=None):
+        """Rank the documents containing any of the query terms.
+
+        Candidates are evaluated with MaxScore dynamic pruning over the
+        columns of the terms in `impact_matrix`, so the documents of the
+        terms whose scores can not lift a document into the top results are
+        only looked up for the candidates of the other terms.
+
+        Args:
+          terms (list of str): Query terms.
+          n_results (int): Desired number of results.
+          plan (SegmentPlan, optional): Plan receiving the terms and the
+            number of scored documents.
 
-    def __load_stop_words(self):
-        """Load stop words that will be filtered during docs processing.
+        Returns:
+          tuple: Arrays with the best documents, by index in the segment, and
+            their scores, sorted by decreasing score.
 
-        Stop words are words which are filtered out prior to
-        processing of natural language data. There is not one definite
-        list of stop words but we are using the list in `stop_words.txt` file.
+        """
+        rank = self.rank
+        terms = [term for term in terms if term in rank.vocabulary]
+        postings_lists = []
+        impacts_lists = []
+        upper_bounds = []
+        for term in terms:
+            postings, impacts = rank.term_impacts(term)
+            postings_lists.append(postings)
+            impacts_lists.append(impacts)
+            upper_bounds.append(rank.max_scores[rank.vocabulary[term]])
+
+        deleted = self.deleted if self.deleted_count > 0 else None
+        evaluator = MaxScoreEvaluator(postings_lists, impacts_lists,
+                                      upper_bounds, deleted)
+        with tracer.span('maxscore'):
+            results = evaluator.top_k(n_results)
+        tracer.observe('query_candidates', evaluator.scored_docs_count)
+        if plan is not None:
+            plan.terms = sorted(zip(terms, [len(postings) for postings
+                                            in postings_lists]),
+                                key=lambda term_length: term_length[1])
+            plan.candidates = evaluator.scored_docs_count
+        return results
+
+    def nbytes(self):
+        """Return the memory used by the segment.
 
         Returns:
-          list str: List of English stop words.
+          int: Size in bytes of the term frequencies, posting lists,
+            positions and scores of the segment, and of its identifiers and
+            bitmap of deleted documents.
+
+        """
+        nbytes = (self.builder.nbytes() + self.index.nbytes() +
+                  self.rank.nbytes() + self.global_terms.nbytes +
+                  self.iids.nbytes + self._iids_order.nbytes +
+                  self.deleted.nbytes)
+        if self.positions is not None:
+            nbytes += self.positions.nbytes()
+        return nbytes
+
+    def save(self, writer):
+        """Store the segment in a snapshot.
+
+        Args:
+          writer (SnapshotWriter): Snapshot being written, usually a section
+            dedicated to the segment.
 
         """
-        stop_words = {}
-        with open(STOP_WORDS_FILENAME) as stop_words_file:
-            for word in stop_words_file:
-                stop_words[word.strip()] = True
-        return stop_words
+        writer.write_array('segment_range',
+                           np.array([self.doc_base, self.n_docs]))
+        writer.write_array('segment_global_terms', self.global_terms)
+        writer.write_array('segment_deleted', self.deleted)
+        writer.write_array('segment_iids', self.iids)
+        writer.write_array('segment_iids_order', self._iids_order)
+        self.builder.save(writer)
+        self.index.save(writer)
+        self.rank.save(writer)
+        if self.positions is not None:
+            self.positions.save(writer)
+
+    def load(self, reader):
+        """Restore the segment from a snapshot.
+
+        Args:
+          reader (SnapshotReader): Snapshot being read, usually a section
+            dedicated to the segment.
+
+        """
+        self.doc_base, self.n_docs = [
+            int(value) for value in reader.read_array('segment_range')]
+        self.global_terms = reader.read_array('segment_global_terms')
+        self.deleted = reader.read_array('segment_deleted')
+        self.deleted_count = int(np.count_nonzero(self.deleted))
+        self.iids = reader.read_array('segment_iids')
+        self._iids_order = reader.read_array('segment_iids_order')
+        self.builder = TermMatrixBuilder(self.stop_words,
+                                         reader.manifest['positional'])
+        self.builder.load(reader)
+        self.index.load(reader)
+        self.rank.load(reader, self.index)
+        self.idf = self.rank.idf
+        self.precision = self.rank.precision
+        self.positions = None
+        if self.builder.positional:
+            self.positions = PositionalIndex()
+            self.positions.load(reader, self.index)
+
+
+class SearchEngine(object):
+    """Search engine for objects that can be indexed.
+
+    The index is split in segments, in the spirit of a log-structured merge
+    tree: objects added after the engine is started are indexed in a new
+    small segment, without touching the existing ones, and adjacent segments
+    of similar sizes are merged in the background. Queries are evaluated on
+    every segment and their best results are merged. The document
+    frequencies of all segments are aggregated, and segments are rescored
+    whenever the idf of one of their terms changed, so that scores are the
+    same as with a single index built from scratch. Since every added or
+    deleted document changes the idf of all terms a little, a positive
+    `rescore_tolerance` trades this exactness for fewer rescorings: a
+    segment is then only rescored once the idf of one of its terms moved by
+    more than the tolerance since it was scored, and scores may differ from
+    those of a rebuilt index by as much. Segments rewritten by a merge are
+    always scored with the current idf.
+
+    Deleted objects are marked in the bitmaps of their segments and their
+    terms no longer count in the document frequencies. They are physically
+    dropped, and the following documents renumbered, when their segment is
+    merged or once the ratio of deleted documents in the segment exceeds
+    `compaction_ratio`.
+
+    Indexed objects are kept in a columnar `DocumentStore` and only
+    materialized for the returned results. With `lazy_objects`, only the
+    offsets of their records are kept in memory, in a `RecordStore`, and the
+    records are read from a memory-mapped file for the returned results.
+
+    The engine can also be warmed up: `warm_up` starts an empty index and
+    indexes the objects in chunks in a background thread, publishing new
+    segments after every chunk, so queries are answered from the start on
+    the objects indexed so far. Publications replace the segments at once,
+    and a query evaluates the segments it found when it started, so its
+    results are those of an index of a prefix of the objects.
+
+    With `deduplicate`, objects whose `DUPLICATE_FIELDS` are identical to an
+    indexed object are not indexed again: they are kept as members of the
+    group of that object in `duplicates`, and counted in the document
+    frequencies as many times as they occur, so the scores are the same as
+    without deduplication. Search results expand the groups into one result
+    per object, or collapse them into a single result.
+
+    Attributes:
+      objects (DocumentStore or RecordStore): Objects that can be considered
+        during search, followed by the objects waiting to be indexed.
+      stop_words (list of str): Stop words that will be filtered during docs
+        processing.
+      positional (bool): Whether term positions are indexed.
+      compressed (bool): Whether posting lists are compressed.
+      precision (str): Storage of the tf-idf scores, one of
+        `SCORE_PRECISIONS`.
+      deduplicate (bool): Whether identical objects are indexed once.
+      lazy_objects (bool): Whether objects are kept in a record file instead
+        of in memory.
+      duplicates (DuplicateGroups): Identifiers of the objects collapsed
+        into each indexed document.
+      merge_in_background (bool): Whether segments are merged by a
+        background thread instead of the thread adding objects.
+      compaction_ratio (float): Ratio of deleted documents above which a
+        segment is compacted.
+      rescore_tolerance (float): Largest change of the idf of a term of a
+        segment tolerated before it is rescored.
+      segments (tuple of Segment): Searchable segments, ordered by their
+        first document. The tuple is replaced, never modified.
+      vocabulary (dict): Dictionary containing the terms of all segments as
+        keys and their global index.
+      document_frequencies (numpy.ndarray): Number of indexed documents
+        containing each term of `vocabulary`.
+      indexed_count (int): Number of objects indexed in the segments, the
+        following ones will be indexed by the next `refresh`.
+      deleted_count (int): Number of indexed documents deleted but not
+        dropped from the segments yet.
+      generation (int): Counter bumped by every change to the index.
+      warming_up (bool): Whether objects are being indexed by `warm_up`.
+      coverage (float): Fraction of the corpus indexed, 1.0 unless the
+        engine warms up, None if the size of the corpus is unknown.
+      results_cache (LRUCache): Cache of search results, None if disabled.
+      pair_cache (LRUCache): Cache of posting lists intersections, None if
+        disabled.
+
+    Args:
+      positional (bool, optional): Whether term positions are indexed, as
+        needed by phrase and proximity queries. Indexed objects must keep
+        their words positions.
+      cache_entries (int, optional): Maximum number of entries of the
+        results and intersections caches, zero disables caching.
+      cache_bytes (int, optional): Maximum estimated memory of each cache.
+      merge_in_background (bool, optional): Whether segments are merged by a
+        background thread.
+      compaction_ratio (float, optional): Ratio of deleted documents above
+        which a segment is compacted.
+      rescore_tolerance (float, optional): Largest change of the idf of a
+        term of a segment tolerated before it is rescored, zero keeping the
+        scores exact.
+      compressed (bool, optional): Whether posting lists are compressed.
+      precision (str, optional): Storage of the tf-idf scores, one of
+        `SCORE_PRECISIONS`. Single precision and quantized scores take less
+        memory, and may reorder results whose scores are nearly tied.
+      deduplicate (bool, optional): Whether objects with identical
+        `DUPLICATE_FIELDS` are indexed once.
+      lazy_objects (bool, optional): Whether objects are kept in a record
+        file read on demand instead of in memory.
+
+    Raises:
+      ValueError: If `precision` is not a known score precision.
+
+    """
+
+    def __init__(self, positional=False, cache_entries=DEFAULT_CACHE_ENTRIES,
+                 cache_bytes=None, merge_in_background=True,
+                 compaction_ratio=DEFAULT_COMPACTION_RATIO, compressed=False,
+                 precision=FLOAT64, deduplicate=False, lazy_objects=False,
+                 rescore_tolerance=DEFAULT_RESCORE_TOLERANCE):
+        if precision not in SCORE_PRECISIONS:
+            raise ValueError('Unknown score precision: %s' % precision)
+        self.stop_words = load_stop_words()
+        self.positional = positional
+        self.compressed = compressed
+        self.precision = precision
+        self.deduplicate = deduplicate
+        self.lazy_objects = lazy_objects
+        self.objects = RecordStore() if lazy_objects else DocumentStore()
+        self.duplicates = DuplicateGroups()
+        self.merge_in_background = merge_in_background
+        self.compaction_ratio = compaction_ratio
+        self.rescore_tolerance = rescore_tolerance
+        self.segments = ()
+        self.vocabulary = {}
+        self.document_frequencies = np.zeros(0, dtype=np.int64)
+        self.indexed_count = 0
+        self.deleted_count = 0
+        self.generation = 0
+        self.warming_up = False
+        self.coverage = 1.0
+        self.results_cache = None
+        self.pair_cache = None
+        if cache_entries > 0:
+            self.results_cache = LRUCache(
+                cache_entries, cache_bytes,
+                lambda results: len(results) * RESULT_SIZE_ESTIMATE)
+            self.pair_cache = LRUCache(cache_entries, cache_bytes,
+                                       lambda postings: postings.nbytes)
+        self._lock = threading.Lock()
+        self._merge_thread = None
+        self._warm_up_thread = None
+        self._warm_up_error = None
+        # canonical document of each hash of duplicate fields, built on the
+        # first deduplication of added objects
+        self._fields_docs = None
 
     def add_object(self, indexable):
         """Add object to index.
 
+        Objects added before `start` are indexed by it. Objects added
+        afterwards are indexed in a new segment by the next `refresh`, which
+        is done before any search.
+
         Args:
           indexable (Indexable): Object to be added to index.
 
         """
-        self.objects.append(indexable)
+        with self._lock:
+            self.objects.append(indexable)
+
+    def add_objects(self, objects):
+        """Add objects to a started index and make them searchable.
+
+        Adding objects in batches is cheaper than one at a time, since every
+        refresh indexes a new segment, and rescores the existing segments
+        once their idf changed by more than `rescore_tolerance`.
+
+        Args:
+          objects (iterable of Indexable): Objects to be added to index.
+
+        """
+        store = self.new_store()
+        for indexable in objects:
+            store.append(indexable)
+        with self._lock:
+            self.objects.extend(store)
+        self.refresh()
+
+    def delete(self, iid):
+        """Delete the indexed objects with a given identifier.
+
+        Args:
+          iid (int): Identifier of the objects.
+
+        Returns:
+          int: Number of deleted objects.
+
+        """
+        with self._lock:
+            segments = self.__index_pending(self.segments)
+            segments, deleted_count = self.__delete_docs(segments, iid)
+            if segments is self.segments:
+                return 0
+            # duplicates of deleted documents are indexed again
+            self.__publish(self.__index_pending(segments))
+        self.__schedule_merges()
+        return deleted_count
+
+    def update(self, iid, indexable):
+        """Replace the indexed objects with a given identifier.
+
+        The previous objects are deleted and the new one is indexed in a new
+        segment, and both changes become visible at once.
+
+        Args:
+          iid (int): Identifier of the objects to be replaced.
+          indexable (Indexable): New version of the objects.
+
+        Returns:
+          int: Number of replaced objects.
 
-    def start(self):
+        """
+        with self._lock:
+            segments = self.__index_pending(self.segments)
+            segments, deleted_count = self.__delete_docs(segments, iid)
+            self.objects.append(indexable)
+            self.__publish(self.__index_pending(segments))
+        self.__schedule_merges()
+        return deleted_count
+
+    def start(self, objects=None):
         """Perform search engine initialization.
 
         The current implementation initialize the ranking and indexing of
-        added objects. The code below is not very efficient as it iterates over
-        all indexed objects twice, but can be improved easily with generators.
+        added objects in a single pass: each object is read once, and its
+        term frequencies are shared by the index and the ranking. Objects can
+        be streamed from any iterable, such as a generator reading them from a
+        file, so that no list of objects has to be assembled beforehand.
+
+        All objects are indexed in a single segment, replacing any existing
+        segments.
+
+        Args:
+          objects (iterable of Indexable, optional): Objects indexed after
+            the ones added with `add_object`.
 
         """
         logger.info('Start search engine (Indexing | Ranking)...')
-        self.index.build_index(self.objects)
-        self.rank.build_rank(self.objects)
+        builder = TermMatrixBuilder(self.stop_words, self.positional)
+        store = self.new_store()
+        for indexable in self.objects:
+            store.append(indexable)
+            builder.add(indexable)
+
+        if objects is not None:
+            for indexable in objects:
+                store.append(indexable)
+                builder.add(indexable)
+
+        self.start_from(builder, store)
+
+    def warm_up(self, objects, chunk_size=WARM_UP_CHUNK_DOCS, progress=None):
+        """Start an empty index and index objects in a background thread.
+
+        The objects are indexed in chunks, each one in a new segment merged
+        in the background like the ones of `add_objects`, and published
+        together with the coverage of the corpus, so searches can be run
+        while the objects are indexed. Their results are partial until the
+        warm-up is done, see `SearchResults`. Only the new segment is scored
+        at each publication, so the segments published before keep the idf
+        of a smaller part of the corpus until they are merged, or rescored
+        once the warm-up is done; otherwise every chunk would rescore all
+        the previous ones.
+
+        Args:
+          objects (iterable of Indexable): Objects to be indexed, after the
+            ones added with `add_object`.
+          chunk_size (int, optional): Number of objects indexed before each
+            publication.
+          progress (callable, optional): Function returning the fraction of
+            the corpus read so far, called before each publication.
+
+        """
+        self.wait_for_warm_up()
+        self.start()
+        with self._lock:
+            self.warming_up = True
+            self.coverage = 0.0 if progress is not None else None
+            self._warm_up_error = None
+            self.__bump_generation()
+        thread = threading.Thread(target=self.__warm_up,
+                                  args=(iter(objects), chunk_size, progress),
+                                  name='search-warm-up')
+        thread.daemon = True
+        self._warm_up_thread = thread
+        thread.start()
+
+    def wait_for_warm_up(self):
+        """Block until the objects given to `warm_up` are indexed.
+
+        Raises:
+          Exception: The error which stopped the warm-up, if any.
+
+        """
+        thread = self._warm_up_thread
+        if thread is not None:
+            thread.join()
+        if self._warm_up_error is not None:
+            raise self._warm_up_error
+
+    def __warm_up(self, objects, chunk_size, progress):
+        """Index the objects of the warm-up by chunks.
 
-    def search(self, query, n_results=10):
+        """
+        try:
+            while True:
+                store = self.new_store()
+                for indexable in islice(objects, chunk_size):
+                    store.append(indexable)
+                if len(store) == 0:
+                    break
+                coverage = progress() if progress is not None else None
+                with self._lock:
+                    self.objects.extend(store)
+                    segments = self.__index_pending(self.segments)
+                    self.coverage = coverage
+                    # the idf of the published segments is updated at the end
+                    self.__publish(segments, float('inf'))
+                self.__schedule_merges()
+            logger.info('Warm-up done, %d objects indexed', self.count())
+        except Exception as error:
+            logger.exception('Warm-up failed')
+            self._warm_up_error = error
+        finally:
+            with self._lock:
+                self.warming_up = False
+                if self._warm_up_error is None:
+                    self.coverage = 1.0
+                # rescores the stale segments, and cached results are no
+                # longer partial
+                self.__publish(self.segments)
+
+    @traced()
+    def start_from(self, builder, objects):
+        """Initialize the search engine from accumulated term frequencies.
+
+        Objects can be parsed and their term frequencies accumulated by
+        other processes, then merged in a single builder, which produces the
+        same index as `start` as long as the objects are merged in order.
+
+        Args:
+          builder (TermMatrixBuilder): Term frequencies of `objects`.
+          objects (DocumentStore, RecordStore or list of Indexable): Objects
+            to be indexed, replacing the ones added with `add_object`.
+
+        """
+        if not isinstance(objects, (DocumentStore, RecordStore)) or \
+                (self.lazy_objects and not isinstance(objects, RecordStore)):
+            store = self.new_store()
+            for indexable in objects:
+                store.append(indexable)
+            objects = store
+        duplicates = DuplicateGroups()
+        fields_docs = None
+        if self.deduplicate:
+            fields_docs = {}
+            kept, members = self.__find_duplicates(objects, 0, fields_docs)
+            if len(members) > 0:
+                keep = np.zeros(len(objects), dtype=bool)
+                keep[kept] = True
+                builder = builder.subset(keep)
+                objects = objects.take(kept)
+            for doc_index, iid in members:
+                duplicates.add(doc_index, iid)
+            logger.info('Collapsed %d duplicates into %d objects',
+                        duplicates.count, len(duplicates))
+
+        self.wait_for_merges()
+        logger.info('Building index...')
+        segment = Segment(self.stop_words, self.pair_cache,
+                          self.compressed, self.precision)
+        segment.build_segment_from(builder, 0)
+        segment.index_iids(objects.iids())
+        with self._lock:
+            self.objects = objects
+            self.duplicates = duplicates
+            self.vocabulary = {}
+            self.document_frequencies = np.zeros(0, dtype=np.int64)
+            self.indexed_count = builder.n_docs
+            self.deleted_count = 0
+            self._fields_docs = fields_docs
+            self.__register_segment(segment)
+            self.__publish((segment,))
+
+    def new_store(self):
+        """Return an empty store of the kind used for the indexed objects.
+
+        Objects can be accumulated in the store, then passed to `start_from`
+        or appended to `objects` without being copied again.
+
+        Returns:
+          DocumentStore or RecordStore: A record store sharing the record
+            file of `objects` with `lazy_objects`, a columnar store
+            otherwise.
+
+        """
+        if not self.lazy_objects:
+            return DocumentStore()
+        if isinstance(self.objects, RecordStore):
+            return RecordStore(self.objects.records)
+        return RecordStore()
+
+    @traced()
+    def refresh(self):
+        """Index the objects added since the last refresh in a new segment.
+
+        The existing segments are rescored if the updated document
+        frequencies changed their idf by more than `rescore_tolerance`, and
+        merged afterwards if needed.
+
+        """
+        with self._lock:
+            segments = self.__index_pending(self.segments)
+            if segments is self.segments:
+                return
+            self.__publish(segments)
+        self.__schedule_merges()
+
+    def __index_pending(self, segments):
+        """Index the objects added since the last refresh.
+
+        Args:
+          segments (tuple of Segment): Current segments.
+
+        With `deduplicate`, pending objects identical to an indexed or
+        pending object are dropped from `objects` and added to the group of
+        that object instead.
+
+        Returns:
+          tuple of Segment: `segments` followed by a new segment with the
+            pending objects, or `segments` if there are none.
+
+        """
+        members = []
+        if self.deduplicate and len(self.objects) > self.indexed_count:
+            kept, members = self.__find_duplicates(
+                self.objects, self.indexed_count, self.__fields_docs(segments))
+            if len(members) > 0:
+                docs_indices = np.concatenate(
+                    [np.arange(self.indexed_count), kept])
+                self.objects = self.objects.take(docs_indices)
+                self.duplicates = self.duplicates.take(docs_indices)
+                self.__add_duplicates(segments, members)
+
+        objects = [self.objects[doc_index] for doc_index
+                   in range(self.indexed_count, len(self.objects))]
+        if len(objects) == 0:
+            # a new tuple, so that segments are rescored with the frequencies
+            # of the added duplicates
+            return tuple(list(segments)) if len(members) > 0 else segments
+
+        logger.info('Indexing %d objects in a new segment...', len(objects))
+        builder = TermMatrixBuilder(self.stop_words, self.positional)
+        for indexable in objects:
+            builder.add(indexable)
+        segment = Segment(self.stop_words, self.pair_cache,
+                          self.compressed, self.precision)
+        segment.build_segment_from(builder, self.indexed_count)
+        segment.index_iids([indexable.iid for indexable in objects])
+        self.indexed_count += builder.n_docs
+        self.__register_segment(segment)
+        return segments + (segment,)
+
+    def __delete_docs(self, segments, iid):
+        """Mark the documents of an object identifier as deleted.
+
+        The terms of the deleted documents are removed from the document
+        frequencies.
+
+        Duplicates with the identifier are removed from their groups. When
+        the canonical document of a group is deleted, the first remaining
+        member is appended to `objects`, with the other members as its
+        group, to be indexed by the next `__index_pending`.
+
+        Args:
+          segments (tuple of Segment): Current segments.
+          iid (int): Identifier of the objects to be deleted.
+
+        Returns:
+          tuple: Segments with the documents marked as deleted, the same
+            tuple if nothing was deleted, and the number of deleted
+            objects.
+
+        """
+        removed_duplicates = []
+        for doc_index in self.duplicates.docs_of(iid):
+            removed_duplicates.extend(
+                [doc_index] * self.duplicates.remove(doc_index, iid))
+        if len(removed_duplicates) > 0:
+            self.document_frequencies -= self.__count_terms(
+                segments, removed_duplicates)
+
+        deleted_count = 0
+        updated_segments = list(segments)
+        for position, segment in enumerate(segments):
+            segment_docs = segment.docs_of(iid)
+            if len(segment_docs) == 0:
+                continue
+
+            # each document counts once for itself and once per duplicate
+            groups = [self.duplicates.pop(segment.doc_base + doc_index)
+                      for doc_index in segment_docs]
+            terms = segment.builder.row_terms(np.repeat(
+                segment_docs, [1 + len(members) for members in groups]))
+            self.document_frequencies -= np.bincount(
+                segment.global_terms[terms],
+                minlength=len(self.document_frequencies))
+            updated_segments[position] = segment.with_deleted(segment_docs)
+            deleted_count += len(segment_docs)
+
+            for doc_index, members in zip(segment_docs, groups):
+                self.__forget_fields(segment.doc_base + doc_index)
+                if len(members) > 0:
+                    self.__promote_duplicate(segment.doc_base + doc_index,
+                                             members)
+
+        if deleted_count == 0 and len(removed_duplicates) == 0:
+            return segments, 0
+        self.deleted_count += deleted_count
+        return (tuple(updated_segments),
+                deleted_count + len(removed_duplicates))
+
+    def __promote_duplicate(self, doc_index, members):
+        """Append the first duplicate of a deleted document to `objects`.
+
+        Args:
+          doc_index (int): Global index of the deleted document.
+          members (list): Identifiers of the duplicates of the document.
+
+        """
+        promoted = self.objects[doc_index]
+        promoted.iid = members[0]
+        promoted_index = len(self.objects)
+        self.objects.append(promoted)
+        for member in members[1:]:
+            self.duplicates.add(promoted_index, member)
+
+    def __find_duplicates(self, objects, start, fields_docs):
+        """Match stored objects with identical objects stored before them.
+
+        Objects are identical when their `DUPLICATE_FIELDS` are equal.
+        Fields are looked up by their hash, and compared to the fields of
+        the object found, so a hash collision never collapses distinct
+        objects.
+
+        Args:
+          objects (DocumentStore): Stored objects.
+          start (int): Position of the first object to be matched, the
+            previous ones being canonical documents already.
+          fields_docs (dict): Canonical document of each hash of stored
+            fields, where the new canonical documents are added.
+
+        Returns:
+          tuple: Positions of the objects from `start` that are not
+            duplicates, and a list of (global index of the canonical
+            document, identifier) pairs for the duplicates. Global indices
+            are counted once the duplicates are dropped.
+
+        """
+        names = objects.indexable_class.DUPLICATE_FIELDS
+        kept = []
+        members = []
+        for doc_index in xrange(start, len(objects)):
+            fields = objects.fields(doc_index, names)
+            key = hash(fields)
+            canonical = fields_docs.get(key)
+            if canonical is not None:
+                position = canonical if canonical < start \
+                    else kept[canonical - start]
+                if objects.fields(position, names) == fields:
+                    members.append((canonical, objects.iid(doc_index)))
+                    continue
+            else:
+                fields_docs[key] = start + len(kept)
+            kept.append(doc_index)
+        return np.array(kept, dtype=np.int64), members
+
+    def __fields_docs(self, segments):
+        """Return the canonical document of each hash of duplicate fields.
+
+        """
+        if self._fields_docs is None:
+            names = self.objects.indexable_class.DUPLICATE_FIELDS
+            deleted = np.concatenate([np.zeros(0, dtype=bool)] +
+                                     [segment.deleted for segment in segments])
+            self._fields_docs = {}
+            for doc_index in xrange(self.indexed_count):
+                if not deleted[doc_index]:
+                    self._fields_docs.setdefault(
+                        hash(self.objects.fields(doc_index, names)), doc_index)
+        return self._fields_docs
+
+    def __forget_fields(self, doc_index):
+        """Stop matching new objects with a deleted document.
+
+        """
+        if self._fields_docs is not None:
+            key = hash(self.objects.fields(
+                doc_index, self.objects.indexable_class.DUPLICATE_FIELDS))
+            if self._fields_docs.get(key) == doc_index:
+                del self._fields_docs[key]
+
+    def __add_duplicates(self, segments, members):
+        """Add objects to the groups of their canonical documents.
+
+        The terms of the indexed canonical documents are counted once more
+        in the document frequencies, the others are counted when they are
+        indexed.
+
+        Args:
+          segments (tuple of Segment): Current segments.
+          members (list of tuple): Global index of the canonical document
+            and identifier of each duplicate.
+
+        """
+        indexed_docs = []
+        for doc_index, iid in members:
+            self.duplicates.add(doc_index, iid)
+            if doc_index < self.indexed_count:
+                indexed_docs.append(doc_index)
+        if len(indexed_docs) > 0:
+            self.document_frequencies += self.__count_terms(segments,
+                                                            indexed_docs)
+
+    def __count_terms(self, segments, docs_indices):
+        """Count the documents containing each term among indexed ones.
+
+        Args:
+          segments (tuple of Segment): Current segments.
+          docs_indices (list of int): Global indices of the documents, a
+            document being counted as many times as it is listed.
+
+        Returns:
+          numpy.ndarray: Number of listed documents containing each term of
+            `vocabulary`.
+
+        """
+        frequencies = np.zeros(len(self.document_frequencies), dtype=np.int64)
+        for segment in segments:
+            segment_docs = [doc_index - segment.doc_base
+                            for doc_index in docs_indices
+                            if segment.doc_base <= doc_index <
+                            segment.doc_base + segment.n_docs]
+            if len(segment_docs) > 0:
+                terms = segment.builder.row_terms(segment_docs)
+                frequencies += np.bincount(segment.global_terms[terms],
+                                           minlength=len(frequencies))
+        return frequencies
+
+    def __register_segment(self, segment):
+        """Add the document frequencies of a new segment to the global ones.
+
+        """
+        segment.global_terms = self.__global_terms(segment.builder.vocabulary)
+        missing_terms = len(self.vocabulary) - len(self.document_frequencies)
+        if missing_terms > 0:
+            self.document_frequencies = np.concatenate(
+                [self.document_frequencies,
+                 np.zeros(missing_terms, dtype=np.int64)])
+        self.document_frequencies[segment.global_terms] += \
+            segment.document_frequencies()
+        docs_indices, counts = self.duplicates.counts(
+            segment.doc_base, segment.doc_base + segment.n_docs)
+        if len(docs_indices) > 0:
+            self.document_frequencies += self.__count_terms(
+                (segment,), np.repeat(docs_indices, counts))
+
+    def __global_terms(self, vocabulary):
+        """Map the terms of a segment vocabulary to their global index.
+
+        """
+        global_terms = np.zeros(len(vocabulary), dtype=np.int64)
+        for term, term_index in vocabulary.iteritems():
+            global_index = self.vocabulary.get(term)
+            if global_index is None:
+                global_index = len(self.vocabulary)
+                self.vocabulary[term] = global_index
+            global_terms[term_index] = global_index
+        return global_terms
+
+    def __global_idf(self):
+        """Compute the idf of the terms of all segments.
+
+        """
+        rank = TfidfRank(self.stop_words)
+        return rank.compute_idf(self.document_frequencies,
+                                self.indexed_count - self.deleted_count +
+                                self.duplicates.count)
+
+    def __publish(self, segments, tolerance=None):
+        """Score segments with the global idf and make them searchable.
+
+        New segments are scored, and the others rescored only if they are
+        stale, see `Segment.is_stale`, so that a single change to the index
+        does not rescore the whole corpus.
+
+        Args:
+          segments (tuple of Segment): Segments to be published.
+          tolerance (float, optional): Tolerance of `Segment.is_stale`,
+            `rescore_tolerance` by default.
+
+        """
+        if tolerance is None:
+            tolerance = self.rescore_tolerance
+        idf = self.__global_idf()
+        published = []
+        for segment in segments:
+            segment_idf = idf[segment.global_terms]
+            if segment.is_stale(segment_idf, tolerance):
+                segment = segment.rescored(segment_idf)
+            published.append(segment)
+        self.segments = tuple(published)
+        self.__bump_generation()
+
+    def __bump_generation(self):
+        """Invalidate cached results after a change to the index.
+
+        """
+        self.generation += 1
+        for cache in [self.results_cache, self.pair_cache]:
+            if cache is not None:
+                cache.invalidate()
+
+    def __rewrite_candidate(self):
+        """Find segments that should be rewritten.
+
+        Adjacent segments are checked from the newest, and merged when the
+        older one is at most `MERGE_FACTOR` times larger, so that small
+        segments are merged together long before they are merged into large
+        ones. Otherwise, a segment with too many deleted documents is
+        compacted.
+
+        Returns:
+          tuple: Position of the first segment to be rewritten and number of
+            segments, None if no rewrite is needed.
+
+        """
+        segments = self.segments
+        for position in reversed(range(len(segments) - 1)):
+            if segments[position].n_docs <= \
+                    MERGE_FACTOR * segments[position + 1].n_docs:
+                return position, 2
+        for position, segment in enumerate(segments):
+            if segment.deleted_count > self.compaction_ratio * segment.n_docs:
+                return position, 1
+        return None
+
+    def __schedule_merges(self):
+        """Merge and compact segments, in a background thread if enabled.
+
+        """
+        if not self.merge_in_background:
+            self.__merge_segments()
+            return
+
+        with self._lock:
+            if self._merge_thread is None and \
+                    self.__rewrite_candidate() is not None:
+                self._merge_thread = threading.Thread(
+                    target=self.__merge_segments, name='segments-merge')
+                self._merge_thread.daemon = True
+                self._merge_thread.start()
+
+    def __merge_segments(self):
+        """Rewrite segments until no merge or compaction is needed.
+
+        """
+        try:
+            while self.__rewrite_next_segments():
+                pass
+        except Exception:
+            logger.exception('Merging segments failed')
+            with self._lock:
+                self._merge_thread = None
+
+    def __rewrite_next_segments(self):
+        """Rewrite the next candidate segments into a single one.
+
+        The new segment contains the documents of the rewritten segments that
+        are not deleted. It is built without holding the lock, so objects can
+        be added, deleted and searched meanwhile, and only published if the
+        rewritten segments have not changed.
+
+        Returns:
+          bool: False if no rewrite was needed.
+
+        """
+        with self._lock:
+            candidate = self.__rewrite_candidate()
+            if candidate is None:
+                self._merge_thread = None
+                return False
+            position, count = candidate
+            rewritten = self.segments[position:position + count]
+
+        logger.info('Rewriting segments of %s objects...',
+                    ', '.join(str(segment.n_docs) for segment in rewritten))
+        builder = TermMatrixBuilder(self.stop_words, self.positional)
+        for segment in rewritten:
+            if segment.deleted_count > 0:
+                builder.extend(segment.builder.subset(~segment.deleted))
+            else:
+                builder.extend(segment.builder)
+
+        replacement = None
+        if builder.n_docs > 0:
+            replacement = Segment(self.stop_words, self.pair_cache,
+                                  self.compressed, self.precision)
+            replacement.build_segment_from(builder, rewritten[0].doc_base)
+            replacement.index_iids(np.concatenate(
+                [segment.iids[~segment.deleted] for segment in rewritten]))
+
+        with self._lock:
+            current = self.segments[position:position + count]
+            # deletions replace the bitmap of the segments
+            unchanged = len(current) == count and all(
+                segment.doc_base == previous.doc_base and
+                segment.deleted is previous.deleted
+                for segment, previous in zip(current, rewritten))
+            if unchanged:
+                self.__replace_segments(position, rewritten, replacement)
+        return True
+
+    def __replace_segments(self, position, rewritten, replacement):
+        """Publish a segment replacing consecutive segments.
+
+        The deleted objects of the rewritten segments are dropped and the
+        following documents are renumbered.
+
+        """
+        removed = sum(segment.deleted_count for segment in rewritten)
+        segments = list(self.segments[:position])
+        if replacement is not None:
+            replacement.global_terms = self.__global_terms(
+                replacement.builder.vocabulary)
+            segments.append(replacement.rescored(
+                self.__global_idf()[replacement.global_terms]))
+        for segment in self.segments[position + len(rewritten):]:
+            segment = copy.copy(segment)
+            segment.doc_base -= removed
+            segments.append(segment)
+
+        if removed > 0:
+            start = rewritten[0].doc_base
+            end = rewritten[-1].doc_base + rewritten[-1].n_docs
+            kept = np.flatnonzero(np.concatenate(
+                [~segment.deleted for segment in rewritten]))
+            # a new store, searches in progress keep using the previous one
+            docs_indices = np.concatenate(
+                [np.arange(start), start + kept,
+                 np.arange(end, len(self.objects))])
+            self.objects = self.objects.take(docs_indices)
+            self.duplicates = self.duplicates.take(docs_indices)
+            self.indexed_count -= removed
+            self.deleted_count -= removed
+            self._fields_docs = None
+
+        self.segments = tuple(segments)
+        self.__bump_generation()
+
+    def wait_for_merges(self):
+        """Block until the background merges and compactions are done.
+
+        """
+        thread = self._merge_thread
+        while thread is not None:
+            thread.join()
+            thread = self._merge_thread
+
+    @traced()
+    def search(self, query, n_results=10, mode=ALL_TERMS, collapse=False):
         """Return indexed documents given a query of terms.
 
         Assumptions:
-          1) We assume all terms in the provided query have to be found.
-          Otherwise, an empty list will be returned. It is a simple
-          assumption that can be easily changed to consider any term.
+          1) In `ALL_TERMS` mode, we assume all terms in the provided query
+          have to be found. Otherwise, an empty list will be returned. In
+          `ANY_TERMS` mode, documents containing at least one of the terms
+          are ranked, and terms absent from the index are ignored.
+
+          2) Positional information is only used by phrases ("...") and
+          proximity operators (NEAR/k), which need a positional engine and
+          the `ALL_TERMS` mode. Their words are also ranked as plain terms.
 
-          2) We do not use positional information of the query term. It is
-          not difficult whatsoever to take it into account, but it was just a
-          design choice since this requirement was not specified.
+          3) Duplicates collapsed at index time are returned after their
+          canonical object, with the same score, unless `collapse` is set.
+
+          4) The query is normalized like the indexed text, see
+          `Indexable.normalize_query`, and stop words are dropped. In
+          `ALL_TERMS` mode, no segment is searched if a term is absent from
+          the whole index. `explain` describes the evaluation of a query.
 
         Args:
           query (str): String containing one or more terms.
           n_results (int): Desired number of results.
+          mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+          collapse (bool): Whether duplicates are returned as a single
+            result listing their identifiers.
+
+        Returns:
+          SearchResults: List of search results including the indexed
+            object and its respective tf-idf score, and the part of the
+            corpus searched.
+
+        Raises:
+          ValueError: If `mode` is not a known query mode, or if the query
+            has positional constraints that can not be evaluated.
+
+        """
+        tracer.count('queries_total')
+        with tracer.span('parse'):
+            parsed_query = parse_query(query, mode, self.stop_words,
+                                       self.positional,
+                                       self.objects.indexable_class)
+        if len(self.objects) > self.indexed_count:
+            self.refresh()
+
+        cache_key = self.__cache_key(parsed_query, n_results, mode, collapse)
+        if self.results_cache is not None:
+            generation = self.results_cache.generation
+            search_results = self.results_cache.get(cache_key)
+            if search_results is not None:
+                tracer.count('results_cache_hits_total')
+                return search_results.copy()
+            tracer.count('results_cache_misses_total')
+
+        with self._lock:
+            segments, objects = self.segments, self.objects
+            duplicates = self.duplicates
+            search_results = SearchResults(
+                covered_count=self.indexed_count - self.deleted_count +
+                self.duplicates.count,
+                complete=not self.warming_up, coverage=self.coverage)
+
+        docs_lists = []
+        scores_lists = []
+        if self.__early_exit(parsed_query, mode) is None:
+            docs_lists, scores_lists = self.__evaluate(parsed_query, mode,
+                                                       n_results, segments)
+
+        with tracer.span('collect'):
+            self.__collect_results(search_results, docs_lists, scores_lists,
+                                   n_results, collapse, objects, duplicates)
+        if self.results_cache is not None:
+            self.results_cache.put(cache_key, search_results.copy(),
+                                   generation)
+        return search_results
+
+    @traced()
+    def search_many(self, queries, n_results=10, mode=ALL_TERMS,
+                    collapse=False, chunk_size=BATCH_CHUNK_QUERIES):
+        """Search for several queries at once.
+
+        Instead of evaluating each query on its own, the queries are scored
+        in chunks of `chunk_size`: every segment scores the candidates of
+        all the queries of a chunk at once, with a sparse matrix product in
+        `ANY_TERMS` mode, see `Segment.search_batch`, so the memory used
+        depends on the size of the chunks rather than on the number of
+        queries. The results are those of `search`, and share its results
+        cache: cached queries are not evaluated, and the results of the
+        others are cached.
+
+        Args:
+          queries (iterable of str): Query strings.
+          n_results (int): Desired number of results of each query.
+          mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+          collapse (bool): Whether duplicates are returned in the result of
+            their canonical object instead of as results of their own.
+          chunk_size (int): Number of queries scored together.
 
         Returns:
-          list of IndexableResult: List of search results including the indexed
-            object and its respective tf-idf score.
+          list of SearchResults: Results of each query, in order.
+
+        Raises:
+          ValueError: If `mode` is not a known query mode, or if a query has
+            positional constraints that can not be evaluated.
 
         """
-        terms = query.lower().split()
-        docs_indices = self.index.search_terms(terms)
-        search_results = []
+        parsed_queries = [parse_query(query, mode, self.stop_words,
+                                      self.positional,
+                                      self.objects.indexable_class)
+                          for query in queries]
+        tracer.count('queries_total', len(parsed_queries))
+        if len(self.objects) > self.indexed_count:
+            self.refresh()
+
+        with self._lock:
+            segments, objects = self.segments, self.objects
+            duplicates = self.duplicates
+            covered_count = self.indexed_count - self.deleted_count + \
+                self.duplicates.count
+            complete, coverage = not self.warming_up, self.coverage
+
+        batch_results = [SearchResults(covered_count=covered_count,
+                                       complete=complete, coverage=coverage)
+                         for parsed_query in parsed_queries]
+        cache_keys = [self.__cache_key(parsed_query, n_results, mode,
+                                       collapse)
+                      for parsed_query in parsed_queries]
+        cached = set()
+        if self.results_cache is not None:
+            generation = self.results_cache.generation
+            for position, cache_key in enumerate(cache_keys):
+                search_results = self.results_cache.get(cache_key)
+                if search_results is not None:
+                    tracer.count('results_cache_hits_total')
+                    batch_results[position] = search_results.copy()
+                    cached.add(position)
+                else:
+                    tracer.count('results_cache_misses_total')
+
+        # cached queries and queries without any possible match are not
+        # evaluated
+        evaluated = [position for position, parsed_query
+                     in enumerate(parsed_queries)
+                     if position not in cached and
+                     self.__early_exit(parsed_query, mode) is None]
+        for start in range(0, len(evaluated), chunk_size):
+            chunk = evaluated[start:start + chunk_size]
+            segments_results = [
+                segment.search_batch([parsed_queries[position]
+                                      for position in chunk],
+                                     mode, n_results)
+                for segment in segments]
+            for column, position in enumerate(chunk):
+                docs_lists = []
+                scores_lists = []
+                for segment, results in zip(segments, segments_results):
+                    offsets, docs_indices, docs_scores = results
+                    begin, end = offsets[column], offsets[column + 1]
+                    docs_lists.append(segment.doc_base +
+                                      docs_indices[begin:end])
+                    scores_lists.append(docs_scores[begin:end])
+                self.__collect_results(batch_results[position], docs_lists,
+                                       scores_lists, n_results, collapse,
+                                       objects, duplicates)
+        if self.results_cache is not None:
+            for position, cache_key in enumerate(cache_keys):
+                if position not in cached:
+                    self.results_cache.put(
+                        cache_key, batch_results[position].copy(), generation)
+        return batch_results
+
+    @staticmethod
+    def __cache_key(parsed_query, n_results, mode, collapse):
+        """Return the key of the cached results of a parsed query.
 
-        for doc_index in docs_indices:
-            indexable = self.objects[doc_index]
-            doc_score = self.rank.compute_rank(doc_index, terms)
-            result = IndexableResult(doc_score, indexable)
-            search_results.append(result)
+        """
+        return (mode, n_results, collapse, tuple(parsed_query.terms),
+                tuple(tuple(phrase) for phrase in parsed_query.phrases),
+                tuple(parsed_query.proximities))
+
+    def __collect_results(self, search_results, docs_lists, scores_lists,
+                          n_results, collapse, objects, duplicates):
+        """Append the best documents of all segments to search results.
+
+        """
+        if len(docs_lists) == 0:
+            return
+
+        if len(docs_lists) == 1:
+            # the best documents of a segment are already sorted
+            docs_indices, docs_scores = docs_lists[0], scores_lists[0]
+            best_positions = range(min(len(docs_indices), n_results))
+        else:
+            docs_indices = np.concatenate(docs_lists)
+            docs_scores = np.concatenate(scores_lists)
+            best_positions = top_k_positions(docs_scores, n_results)
+        for position in best_positions:
+            doc_index = docs_indices[position]
+            score = float(docs_scores[position])
+            members = list(duplicates.members(doc_index))
+            if collapse:
+                search_results.append(IndexableResult(
+                    score, objects[doc_index], members))
+                continue
+            search_results.append(IndexableResult(score, objects[doc_index]))
+            for member in members:
+                duplicate = objects[doc_index]
+                duplicate.iid = member
+                search_results.append(IndexableResult(score, duplicate))
+        del search_results[n_results:]
+
+    def explain(self, query, n_results=10, mode=ALL_TERMS):
+        """Evaluate a query and describe the plan of its evaluation.
+
+        The plan lists the normalized terms and the dropped stop words, and
+        for every segment the terms ordered by document frequency, the
+        strategy of each intersection and the number of candidates left,
+        and where the evaluation stopped early. Results are not cached.
+
+        Args:
+          query (str): String containing one or more terms.
+          n_results (int): Desired number of results.
+          mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+
+        Returns:
+          QueryPlan: Plan of the evaluation, described by its `explain`.
 
-        search_results.sort(key=lambda x: x.score, reverse=True)
-        return search_results[:n_results]
+        Raises:
+          ValueError: If `mode` is not a known query mode, or if the query
+            has positional constraints that can not be evaluated.
+
+        """
+        parsed_query = parse_query(query, mode, self.stop_words,
+                                   self.positional, self.objects.indexable_class)
+        if len(self.objects) > self.indexed_count:
+            self.refresh()
+
+        plan = QueryPlan(query, mode, parsed_query)
+        plan.exit = self.__early_exit(parsed_query, mode)
+        if plan.exit is None:
+            self.__evaluate(parsed_query, mode, n_results, self.segments, plan)
+        return plan
+
+    def __early_exit(self, parsed_query, mode):
+        """Tell whether a query can be answered without searching segments.
+
+        Returns:
+          str: Reason why no document can match, None if segments must be
+            searched.
+
+        """
+        if len(parsed_query.terms) == 0:
+            return 'no indexed term'
+        if mode == ALL_TERMS:
+            for term in parsed_query.terms:
+                if term not in self.vocabulary:
+                    return 'missing term %s' % term
+        return None
+
+    def __evaluate(self, parsed_query, mode, n_results, segments, plan=None):
+        """Select the best documents of every segment.
+
+        Args:
+          parsed_query (Query): Parsed query.
+          mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+          n_results (int): Desired number of results.
+          segments (tuple of Segment): Segments to be searched.
+          plan (QueryPlan, optional): Plan receiving the evaluation of each
+            segment.
+
+        Returns:
+          tuple: Lists of the global indices of the best documents of each
+            segment, and of their scores.
+
+        """
+        # every segment selects its best documents, the best of all
+        # segments are kept; ties stay ordered by document index since
+        # segments are ordered by their first document
+        docs_lists = []
+        scores_lists = []
+        for segment in segments:
+            segment_plan = None
+            if plan is not None:
+                segment_plan = SegmentPlan(segment.doc_base, segment.n_docs)
+                plan.segments.append(segment_plan)
+            if mode == ALL_TERMS:
+                docs_indices, docs_scores = segment.search_all_terms(
+                    parsed_query, n_results, segment_plan)
+            else:
+                docs_indices, docs_scores = segment.search_any_terms(
+                    parsed_query.terms, n_results, segment_plan)
+            docs_lists.append(segment.doc_base +
+                              np.asarray(docs_indices, dtype=np.int64))
+            scores_lists.append(np.asarray(docs_scores, dtype=float))
+        return docs_lists, scores_lists
+
+    @traced()
+    def save(self, path):
+        """Write the initialized search engine to a snapshot directory.
+
+        The snapshot contains the indexed objects and every segment, with
+        its raw term frequencies, posting lists and tf-idf scores, so that
+        `load` can restore the engine without rebuilding the index, and new
+        objects can still be added afterwards. A warm-up in progress is
+        waited for, so that the snapshot holds all its objects.
+
+        Args:
+          path (str): Directory where the snapshot will be written.
+
+        """
+        logger.info('Saving search engine snapshot to %s...', path)
+        self.wait_for_warm_up()
+        self.refresh()
+        writer = SnapshotWriter(path)
+        with self._lock:
+            segments = self.segments
+            terms = [None] * len(self.vocabulary)
+            for term, term_index in self.vocabulary.iteritems():
+                terms[term_index] = term
+            document_frequencies = self.document_frequencies
+            # objects may be appended meanwhile, which moves the buffers
+            self.objects.save(writer.section('objects_'), self.indexed_count)
+            writer.manifest['objects_count'] = self.indexed_count
+            self.duplicates.save(writer.section('objects_'))
+
+        writer.manifest['positional'] = self.positional
+        writer.manifest['compressed'] = self.compressed
+        writer.manifest['precision'] = self.precision
+        writer.manifest['deduplicate'] = self.deduplicate
+        writer.manifest['lazy_objects'] = self.lazy_objects
+        writer.manifest['segments_count'] = len(segments)
+        writer.write_terms('vocabulary', terms)
+        writer.write_array('document_frequencies', document_frequencies)
+        for position, segment in enumerate(segments):
+            segment.save(writer.section('segment%d_' % position))
+        writer.close()
+
+    @traced()
+    def load(self, path, mmap=True):
+        """Restore the search engine from a snapshot directory.
+
+        The engine is ready to answer queries once this method returns, there
+        is no need to call `start`. Nothing is rebuilt from the indexed
+        objects: with `mmap`, the arrays of the segments and of the stored
+        objects stay mapped until they are modified, and only the
+        vocabularies are read.
+
+        Args:
+          path (str): Directory containing the snapshot.
+          mmap (bool): Whether the snapshot arrays should be memory-mapped
+            instead of read into memory.
+
+        Raises:
+          ValueError: If the directory does not hold a snapshot of a supported
+            version.
+
+        """
+        logger.info('Loading search engine snapshot from %s...', path)
+        self.wait_for_warm_up()
+        self.wait_for_merges()
+        reader = SnapshotReader(path, mmap)
+        lazy_objects = reader.manifest.get('lazy_objects', False)
+        objects = RecordStore() if lazy_objects else DocumentStore()
+        objects.load(reader.section('objects_'))
+        duplicates = DuplicateGroups()
+        deduplicate = reader.manifest.get('deduplicate', False)
+        if deduplicate:
+            duplicates.load(reader.section('objects_'))
+        terms = reader.read_terms('vocabulary')
+
+        segments = []
+        for position in range(reader.manifest['segments_count']):
+            segment = Segment(self.stop_words, self.pair_cache,
+                              self.compressed, self.precision)
+            segment.load(reader.section('segment%d_' % position))
+            segments.append(segment)
+
+        with self._lock:
+            self.objects = objects
+            self.duplicates = duplicates
+            self.deduplicate = deduplicate
+            self.lazy_objects = lazy_objects
+            self.positional = reader.manifest['positional']
+            self.compressed = reader.manifest.get('compressed', False)
+            self.precision = reader.manifest.get('precision', FLOAT64)
+            self.vocabulary = dict((term, index) for index, term
+                                   in enumerate(terms))
+            # frequencies are updated in place when segments are added
+            self.document_frequencies = np.array(
+                reader.read_array('document_frequencies'))
+            self.indexed_count = len(objects)
+            self.deleted_count = sum(segment.deleted_count
+                                     for segment in segments)
+            self._fields_docs = None
+            self.segments = tuple(segments)
+            self.__bump_generation()
+
+    @staticmethod
+    def snapshot_exists(path):
+        """Check whether a search engine snapshot is stored in a directory.
+
+        Args:
+          path (str): Directory that may contain a snapshot.
+
+        Returns:
+          bool: True if a complete snapshot of the supported version is
+            found.
+
+        """
+        return SnapshotReader.exists(path)
+
+    def cache_stats(self):
+        """Return the counters of the search engine caches.
+
+        Returns:
+          dict: Counters of the results cache (`results`) and of the
+            intersections cache (`pairs`), empty if caching is disabled.
+
+        """
+        stats = {}
+        if self.results_cache is not None:
+            stats['results'] = self.results_cache.stats()
+        if self.pair_cache is not None:
+            stats['pairs'] = self.pair_cache.stats()
+        return stats
 
     def count(self):
         """Return number of objects already in the index.
 
         Returns:
-          int: Number of documents indexed.
+          int: Number of objects indexed, duplicates included and deleted
+            ones excluded.
 
         """
-        return len(self.objects)
\ No newline at end of file
+        return len(self.objects) - self.deleted_count + self.duplicates.count
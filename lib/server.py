@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+import json
+import socket
+import logging
+import threading
+import time
+import Queue
+import SocketServer
+from search import ALL_TERMS
+from search import ANY_TERMS
+
+
+logger = logging.getLogger(__name__)
+
+
+# queries evaluated at once, others are rejected as the server is busy
+DEFAULT_MAX_REQUESTS = 32
+
+# queries scored together, and how long the first query of a batch waits for
+# others to arrive, in seconds
+DEFAULT_BATCH_QUERIES = 64
+DEFAULT_BATCH_WAIT = 0.002
+
+
+def result_fields(result):
+    """Convert a search result to the fields of its JSON reply.
+
+    Args:
+      result (IndexableResult): Search result.
+
+    Returns:
+      dict: Score, identifier and fields identifying the indexed object,
+        and the identifiers of its collapsed duplicates if any.
+
+    """
+    indexable = result.indexable
+    fields = {'score': result.score, 'id': indexable.iid}
+    for field in indexable.DUPLICATE_FIELDS:
+        fields[field] = getattr(indexable, field)
+    if len(result.duplicates) > 0:
+        fields['duplicates'] = list(result.duplicates)
+    return fields
+
+
+class PendingQuery(object):
+    """Query waiting to be scored by a `QueryBatcher`.
+
+    Args:
+      query (str): Query string.
+      n_results (int): Desired number of results.
+      mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+      collapse (bool): Whether duplicates are collapsed in the results.
+
+    Attributes:
+      results (SearchResults): Results of the query, once scored.
+      error (Exception): Error raised by the query, None if it succeeded.
+      done (threading.Event): Set once the query is scored.
+
+    """
+
+    __slots__ = ('query', 'n_results', 'mode', 'collapse', 'results',
+                 'error', 'done')
+
+    def __init__(self, query, n_results, mode, collapse):
+        self.query = query
+        self.n_results = n_results
+        self.mode = mode
+        self.collapse = collapse
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+    def key(self):
+        """Return the parameters shared by the queries scored together.
+
+        """
+        return self.n_results, self.mode, self.collapse
+
+
+class QueryBatcher(object):
+    """Thread scoring the queries of all connections in batches.
+
+    Connections only read requests and write replies: their queries are
+    queued, and a single thread scores them with `SearchEngine.search_many`,
+    taking every query that arrived while the first one waited at most
+    `wait` seconds. Queries arriving together are thus scored in one batch,
+    and the scoring never competes with itself for the interpreter.
+
+    Args:
+      engine (SearchEngine): Engine answering the queries.
+      max_queries (int, optional): Maximum number of queries of a batch.
+      wait (float, optional): Time the first query of a batch waits for
+        other queries, in seconds.
+
+    Attributes:
+      engine (SearchEngine): Engine answering the queries.
+      max_queries (int): Maximum number of queries of a batch.
+      wait (float): Time the first query of a batch waits for other
+        queries, in seconds.
+      batches (int): Number of batches scored.
+      queries (int): Number of queries scored.
+
+    """
+
+    def __init__(self, engine, max_queries=DEFAULT_BATCH_QUERIES,
+                 wait=DEFAULT_BATCH_WAIT):
+        self.engine = engine
+        self.max_queries = max_queries
+        self.wait = wait
+        self.batches = 0
+        self.queries = 0
+        self._pending = Queue.Queue()
+        self._thread = threading.Thread(target=self.__run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def search(self, query, n_results=10, mode=ALL_TERMS, collapse=False):
+        """Score a query with the next batch, and wait for its results.
+
+        Args:
+          query (str): Query string.
+          n_results (int): Desired number of results.
+          mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+          collapse (bool): Whether duplicates are collapsed in the results.
+
+        Returns:
+          SearchResults: Results of the query.
+
+        Raises:
+          ValueError: If the query can not be evaluated.
+          Exception: Any other error of the engine scoring the query.
+
+        """
+        pending = PendingQuery(query, n_results, mode, collapse)
+        self._pending.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.results
+
+    def close(self):
+        """Stop the thread once the queued queries are scored.
+
+        """
+        self._pending.put(None)
+        self._thread.join()
+
+    def __run(self):
+        while True:
+            batch = [self._pending.get()]
+            if batch[0] is None:
+                return
+            deadline = time.time() + self.wait
+            while len(batch) < self.max_queries:
+                try:
+                    pending = self._pending.get(
+                        timeout=max(deadline - time.time(), 0))
+                except Queue.Empty:
+                    break
+                if pending is None:
+                    self._pending.put(None)
+                    break
+                batch.append(pending)
+            self.__score(batch)
+
+    def __score(self, batch):
+        groups = {}
+        for pending in batch:
+            groups.setdefault(pending.key(), []).append(pending)
+        for (n_results, mode, collapse), group in groups.iteritems():
+            try:
+                batch_results = self.engine.search_many(
+                    [pending.query for pending in group], n_results, mode,
+                    collapse)
+            except ValueError:
+                # an invalid query fails the batch, the others are scored
+                # on their own
+                batch_results = None
+            except Exception as error:
+                logger.exception('Failed to score a batch of queries')
+                batch_results = [error] * len(group)
+            self.batches += 1
+            self.queries += len(group)
+
+            for position, pending in enumerate(group):
+                if batch_results is None:
+                    try:
+                        pending.results = self.engine.search_many(
+                            [pending.query], n_results, mode, collapse)[0]
+                    except Exception as error:
+                        pending.error = error
+                elif isinstance(batch_results[position], Exception):
+                    pending.error = batch_results[position]
+                else:
+                    pending.results = batch_results[position]
+                pending.done.set()
+
+
+class QueryRequestHandler(SocketServer.StreamRequestHandler):
+    """Handler answering the queries of a connection, one per line.
+
+    Each request is a JSON object on a line, with the query string in
+    `query`, and optionally `n_results`, `mode` and `collapse`; the reply
+    is a JSON object on a line, with the `results`, each with its `score`,
+    `id` and identifying fields, and whether the whole index was searched
+    in `complete`, or the `error` of an invalid request or of a query the
+    engine failed to evaluate.
+
+    """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.strip():
+                continue
+            try:
+                reply = self.__answer(json.loads(line))
+            except ValueError as error:
+                reply = {'error': str(error)}
+            except Exception as error:
+                # the batcher logged the failure, the connection is kept
+                reply = {'error': 'Failed to evaluate the query: %s' % error}
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+
+    def __answer(self, request):
+        server = self.server
+        if not isinstance(request, dict) or \
+                not isinstance(request.get('query'), basestring):
+            raise ValueError('Request without query string')
+        query = request['query']
+        if isinstance(query, unicode):
+            query = query.encode('utf-8')
+        n_results = request.get('n_results', 10)
+        if not isinstance(n_results, int) or n_results < 0:
+            raise ValueError('Invalid number of results: %s' % n_results)
+        mode = str(request.get('mode', server.mode))
+        if mode not in [ALL_TERMS, ANY_TERMS]:
+            raise ValueError('Unknown query mode: %s' % mode)
+        collapse = bool(request.get('collapse', server.collapse))
+
+        results = server.search(query, n_results, mode, collapse)
+        return {'results': [result_fields(result) for result in results],
+                'complete': results.complete,
+                'coverage': results.coverage}
+
+
+class QueryServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """TCP server answering queries against a shared search engine.
+
+    The index is loaded once, and every connection is served by a thread
+    reading JSON requests, one per line, see `QueryRequestHandler`. The
+    queries of all connections are scored in batches by a `QueryBatcher`.
+    At most `max_requests` queries are evaluated at once, whatever the
+    number of open connections: past the limit, queries are answered with
+    an error instead of waiting, so that an overloaded server replies
+    quickly and idle connections never hold a slot.
+
+    Args:
+      address (tuple): Host and port the server listens on, port 0 picking
+        a free port.
+      engine (SearchEngine): Engine answering the queries.
+      mode (str, optional): Query mode of the requests without `mode`.
+      collapse (bool, optional): Whether duplicates are collapsed for the
+        requests without `collapse`.
+      max_requests (int, optional): Maximum number of queries evaluated at
+        once.
+      batch_queries (int, optional): Maximum number of queries scored
+        together.
+      batch_wait (float, optional): Time the first query of a batch waits
+        for other queries, in seconds.
+
+    Attributes:
+      engine (SearchEngine): Engine answering the queries.
+      mode (str): Query mode of the requests without `mode`.
+      collapse (bool): Whether duplicates are collapsed for the requests
+        without `collapse`.
+      batcher (QueryBatcher): Thread scoring the queries.
+
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, engine, mode=ALL_TERMS, collapse=False,
+                 max_requests=DEFAULT_MAX_REQUESTS,
+                 batch_queries=DEFAULT_BATCH_QUERIES,
+                 batch_wait=DEFAULT_BATCH_WAIT):
+        if mode not in [ALL_TERMS, ANY_TERMS]:
+            raise ValueError('Unknown query mode: %s' % mode)
+        SocketServer.TCPServer.__init__(self, address, QueryRequestHandler)
+        self.engine = engine
+        self.mode = mode
+        self.collapse = collapse
+        self.batcher = QueryBatcher(engine, batch_queries, batch_wait)
+        self._slots = threading.BoundedSemaphore(max_requests)
+
+    def search(self, query, n_results=10, mode=ALL_TERMS, collapse=False):
+        """Score a query with the batcher, if the server is not busy.
+
+        Args:
+          query (str): Query string.
+          n_results (int): Desired number of results.
+          mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+          collapse (bool): Whether duplicates are collapsed in the results.
+
+        Returns:
+          SearchResults: Results of the query.
+
+        Raises:
+          ValueError: If the query can not be evaluated, or if
+            `max_requests` queries are already being evaluated.
+
+        """
+        if not self._slots.acquire(False):
+            raise ValueError('Server busy, retry later')
+        try:
+            return self.batcher.search(query, n_results, mode, collapse)
+        finally:
+            self._slots.release()
+
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        self.batcher.close()
+
+
+class QueryClient(object):
+    """Client of a `QueryServer`, sending one query at a time.
+
+    Args:
+      address (tuple): Host and port of the server.
+      timeout (float, optional): Timeout of the socket operations, in
+        seconds.
+
+    """
+
+    def __init__(self, address, timeout=None):
+        self._socket = socket.create_connection(address, timeout)
+        self._file = self._socket.makefile('rwb')
+
+    def search(self, query, n_results=10, mode=None, collapse=None):
+        """Send a query and wait for its results.
+
+        Args:
+          query (str): Query string.
+          n_results (int): Desired number of results.
+          mode (str, optional): Query mode, the one of the server if None.
+          collapse (bool, optional): Whether duplicates are collapsed, as
+            decided by the server if None.
+
+        Returns:
+          dict: Reply of the server, with the `results` and whether the
+            whole index was searched.
+
+        Raises:
+          ValueError: If the server rejected the query.
+          IOError: If the server closed the connection.
+
+        """
+        request = {'query': query, 'n_results': n_results}
+        if mode is not None:
+            request['mode'] = mode
+        if collapse is not None:
+            request['collapse'] = collapse
+        self._file.write(json.dumps(request) + '\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise IOError('Connection closed by the server')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        return reply
+
+    def close(self):
+        """Close the connection.
+
+        """
+        self._file.close()
+        self._socket.close()
@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import logging
+import multiprocessing
+import threading
+import traceback
+import zlib
+from itertools import islice
+from cache import LRUCache
+from search import ALL_TERMS
+from search import DEFAULT_CACHE_ENTRIES
+from search import FLOAT64
+from search import QUANTIZED
+from search import SCORE_PRECISIONS
+from search import IndexableResult
+from search import SearchResults
+from search import Segment
+from search import TermMatrixBuilder
+from search import TfidfRank
+from search import load_stop_words
+from search import parse_query
+from search import top_k_positions
+from store import DocumentStore
+
+
+logger = logging.getLogger(__name__)
+
+
+# documents are assigned to shards by ranges of consecutive documents, or by
+# a hash of their identifier
+RANGE_PARTITION = 'range'
+HASH_PARTITION = 'hash'
+PARTITIONS = [RANGE_PARTITION, HASH_PARTITION]
+
+# objects sent to the workers at once while the engine is started
+SHARD_BATCH_OBJECTS = 1024
+
+
+def partition_docs(iids, shards_count, partition=RANGE_PARTITION):
+    """Assign documents to shards.
+
+    Args:
+      iids (list): Identifier of each document, in index order.
+      shards_count (int): Number of shards.
+      partition (str, optional): Either `RANGE_PARTITION`, which splits the
+        documents in ranges of similar sizes, or `HASH_PARTITION`, which
+        assigns each document by the CRC32 of its identifier, so that it
+        does not depend on the other documents.
+
+    Returns:
+      list of numpy.ndarray: Sorted indices of the documents of each shard.
+
+    Raises:
+      ValueError: If `partition` is not a known partition.
+
+    """
+    n_docs = len(iids)
+    if partition == RANGE_PARTITION:
+        bounds = [n_docs * shard // shards_count
+                  for shard in range(shards_count + 1)]
+        return [np.arange(start, end, dtype=np.int64)
+                for start, end in zip(bounds[:-1], bounds[1:])]
+    if partition == HASH_PARTITION:
+        shards = np.array([zlib.crc32(str(iid)) & 0xffffffff
+                           for iid in iids], dtype=np.int64) % shards_count
+        return [np.flatnonzero(shards == shard).astype(np.int64)
+                for shard in range(shards_count)]
+    raise ValueError('Unknown partition: %s' % partition)
+
+
+def serve_shard(connection, stop_words, positional):
+    """Answer the requests of the sharded engine, in a worker process.
+
+    The worker tokenizes the objects of its shard in its own builder, with
+    its own vocabulary, keeps them in its own document store, and holds the
+    segment of the shard. Requests adding objects are not answered, so that
+    the parent can stream them without waiting; an error raised meanwhile is
+    the reply of the next request. The other requests are answered with a
+    tuple of a success flag and a value, or the formatted traceback of the
+    error:
+      - `('add', doc_ids, objects)` adds objects, with their global document
+        indices;
+      - `('extend', builder, store, doc_ids)` adds objects whose term
+        frequencies are already accumulated;
+      - `('build', compressed, precision)` builds the segment and returns
+        the terms of its vocabulary, by local index, and their document
+        frequencies;
+      - `('max_scores', idf)` returns the highest double precision score of
+        each term in the segment, given the global idf of its terms;
+      - `('score', idf, max_scores)` scores the segment with the global idf
+        of its terms, and quantizes scores with the global highest scores,
+        if any;
+      - `('search', query, mode, n_results)` returns the global indices, the
+        scores and the objects of the best documents of the shard;
+      - `('close',)` stops the worker.
+
+    Args:
+      connection (multiprocessing.Connection): End of the pipe of the
+        worker.
+      stop_words (list of str): Stop words that will be filtered during docs
+        processing.
+      positional (bool): Whether term positions are indexed.
+
+    """
+    builder = TermMatrixBuilder(stop_words, positional)
+    store = DocumentStore()
+    docs_parts = []
+    segment = None
+    doc_ids = None
+    error = None
+    while True:
+        request = connection.recv()
+        command = request[0]
+        if command == 'close':
+            connection.close()
+            return
+        try:
+            if command in ['add', 'extend']:
+                if error is not None:
+                    continue
+                if command == 'add':
+                    docs, objects = request[1:]
+                    for indexable in objects:
+                        builder.add(indexable)
+                        store.append(indexable)
+                else:
+                    shard_builder, shard_store, docs = request[1:]
+                    builder.extend(shard_builder)
+                    store.extend(shard_store)
+                docs_parts.append(np.asarray(docs, dtype=np.int64))
+                continue
+            if error is not None:
+                raise RuntimeError(error)
+            if command == 'build':
+                compressed, precision = request[1:]
+                pair_cache = LRUCache(DEFAULT_CACHE_ENTRIES, None,
+                                      lambda postings: postings.nbytes)
+                segment = Segment(stop_words, pair_cache, compressed,
+                                  precision)
+                segment.build_segment_from(builder, 0)
+                doc_ids = np.concatenate(
+                    [np.zeros(0, dtype=np.int64)] + docs_parts)
+                terms = sorted(builder.vocabulary,
+                               key=builder.vocabulary.get)
+                reply = (terms, segment.document_frequencies())
+            elif command == 'max_scores':
+                rank = TfidfRank(stop_words)
+                rank.build_rank_from(segment.builder, request[1],
+                                     index=segment.index)
+                reply = rank.max_scores
+            elif command == 'score':
+                segment = segment.rescored(*request[1:])
+                reply = None
+            elif command == 'search':
+                query, mode, n_results = request[1:]
+                if mode == ALL_TERMS:
+                    docs_indices, docs_scores = segment.search_all_terms(
+                        query, n_results)
+                else:
+                    docs_indices, docs_scores = segment.search_any_terms(
+                        query.terms, n_results)
+                docs_indices = np.asarray(docs_indices, dtype=np.int64)
+                reply = (doc_ids[docs_indices],
+                         np.asarray(docs_scores, dtype=float),
+                         [store[doc_index] for doc_index in docs_indices])
+            else:
+                raise ValueError('Unknown shard request: %s' % command)
+            connection.send((True, reply))
+        except Exception:
+            if command in ['add', 'extend']:
+                error = traceback.format_exc()
+            else:
+                connection.send((False, traceback.format_exc()))
+
+
+class ShardedSearchEngine(object):
+    """Search engine splitting its documents among worker processes.
+
+    Each shard is a segment, with its posting lists and tf-idf scores, held
+    by a worker process, so that a corpus too large for a single process
+    can be indexed, and queries are scored on several cores. The objects
+    are streamed to the workers in batches, and each worker tokenizes its
+    own objects, so the parent process never holds the term frequencies of
+    the corpus. The documents frequencies of all shards are summed by term
+    and the shards scored with the global idf, and quantized scores are
+    scaled by the highest score of each term among all shards, so that
+    scores are exactly those of a single `SearchEngine` indexing the same
+    objects in a single segment. Every query is sent to all the shards at
+    once, and the best documents of each shard are merged; ties are ordered
+    by document index, as with a single engine.
+
+    The indexed objects are kept by the workers, in columnar
+    `DocumentStore`s, and only materialized for the returned results. The
+    index can not be modified once started: deletions, updates and
+    deduplication are only supported by `SearchEngine`.
+
+    Attributes:
+      shards_count (int): Number of shards.
+      partition (str): Assignment of the documents to the shards.
+      stop_words (list of str): Stop words that will be filtered during docs
+        processing.
+      positional (bool): Whether term positions are indexed.
+      compressed (bool): Whether posting lists are compressed.
+      precision (str): Storage of the tf-idf scores, one of
+        `SCORE_PRECISIONS`.
+      docs_count (int): Number of indexed objects.
+      indexable_class (type): Class of the indexed objects, None until the
+        engine is started.
+      vocabulary (dict): Dictionary containing the terms of all shards as
+        keys and their global index.
+      document_frequencies (numpy.ndarray): Number of indexed documents
+        containing each term of `vocabulary`.
+
+    Args:
+      shards_count (int, optional): Number of shards, and of worker
+        processes.
+      partition (str, optional): Either `RANGE_PARTITION` or
+        `HASH_PARTITION`, see `partition_docs`.
+      positional (bool, optional): Whether term positions are indexed.
+      compressed (bool, optional): Whether posting lists are compressed.
+      precision (str, optional): Storage of the tf-idf scores, one of
+        `SCORE_PRECISIONS`.
+
+    Raises:
+      ValueError: If `partition` or `precision` is not known, or if
+        `shards_count` is not positive.
+
+    """
+
+    def __init__(self, shards_count=2, partition=RANGE_PARTITION,
+                 positional=False, compressed=False, precision=FLOAT64):
+        if shards_count < 1:
+            raise ValueError('Invalid number of shards: %d' % shards_count)
+        if partition not in PARTITIONS:
+            raise ValueError('Unknown partition: %s' % partition)
+        if precision not in SCORE_PRECISIONS:
+            raise ValueError('Unknown score precision: %s' % precision)
+        self.shards_count = shards_count
+        self.partition = partition
+        self.stop_words = load_stop_words()
+        self.positional = positional
+        self.compressed = compressed
+        self.precision = precision
+        self.docs_count = 0
+        self.indexable_class = None
+        self.vocabulary = {}
+        self.document_frequencies = np.zeros(0, dtype=np.int64)
+        self._lock = threading.Lock()
+        self._workers = []
+        self._connections = []
+
+    def start(self, objects):
+        """Index objects in the shards.
+
+        Objects are sent to the workers of their shards in batches of
+        `SHARD_BATCH_OBJECTS`, which tokenize and store them. Documents are
+        assigned to shards as by `partition_docs`: by a hash of their
+        identifier, or by ranges, which need the number of objects, so
+        objects without a length are read into a list first.
+
+        Args:
+          objects (iterable of Indexable): Objects to be indexed.
+
+        """
+        bounds = None
+        if self.partition == RANGE_PARTITION:
+            if not hasattr(objects, '__len__'):
+                objects = list(objects)
+            bounds = [len(objects) * shard // self.shards_count
+                      for shard in range(self.shards_count + 1)]
+
+        self.__start_workers()
+        self.indexable_class = None
+        objects = iter(objects)
+        first_doc = 0
+        while True:
+            batch = list(islice(objects, SHARD_BATCH_OBJECTS))
+            if len(batch) == 0:
+                break
+            if self.indexable_class is None:
+                self.indexable_class = batch[0].__class__
+            if bounds is None:
+                shards_positions = partition_docs(
+                    [indexable.iid for indexable in batch],
+                    self.shards_count, HASH_PARTITION)
+            else:
+                shards = np.searchsorted(
+                    bounds, first_doc + np.arange(len(batch)), 'right') - 1
+                shards_positions = [np.flatnonzero(shards == shard)
+                                    for shard in range(self.shards_count)]
+            for connection, positions in zip(self._connections,
+                                             shards_positions):
+                if len(positions) > 0:
+                    connection.send(('add', first_doc + positions,
+                                     [batch[position]
+                                      for position in positions]))
+            first_doc += len(batch)
+        self.__build(first_doc)
+
+    def start_from(self, builder, objects):
+        """Index objects in the shards from accumulated term frequencies.
+
+        The builder is split in one builder per shard, sharing its
+        vocabulary, which is sent to the worker of the shard with its
+        objects. Since the parent process holds the term frequencies of the
+        whole corpus, `start` should be preferred when they are not already
+        accumulated.
+
+        Args:
+          builder (TermMatrixBuilder): Term frequencies of `objects`.
+          objects (DocumentStore or list of Indexable): Objects to be
+            indexed.
+
+        """
+        if not isinstance(objects, DocumentStore):
+            store = DocumentStore()
+            for indexable in objects:
+                store.append(indexable)
+            objects = store
+
+        self.__start_workers()
+        self.indexable_class = objects.indexable_class
+        shards_docs = partition_docs(objects.iids(), self.shards_count,
+                                     self.partition)
+        for connection, shard_docs in zip(self._connections, shards_docs):
+            keep = np.zeros(builder.n_docs, dtype=bool)
+            keep[shard_docs] = True
+            connection.send(('extend', builder.subset(keep),
+                             objects.take(shard_docs), shard_docs))
+        self.__build(builder.n_docs)
+
+    def __start_workers(self):
+        """Start one worker process per shard, stopping the previous ones.
+
+        """
+        self.close()
+        logger.info('Starting %d shards...', self.shards_count)
+        for shard in range(self.shards_count):
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=serve_shard,
+                args=(worker_connection, self.stop_words, self.positional))
+            worker.daemon = True
+            worker.start()
+            worker_connection.close()
+            self._workers.append(worker)
+            self._connections.append(connection)
+
+    def __build(self, docs_count):
+        """Build and score the segments of the shards.
+
+        The workers build their segments in parallel and send back the
+        document frequencies of their terms, which are summed by term. The
+        shards are then scored with the global idf of their terms, after a
+        round trip collecting the highest score of each term when scores
+        are quantized.
+
+        Args:
+          docs_count (int): Number of objects sent to the shards.
+
+        """
+        logger.info('Building %d shards...', self.shards_count)
+        self.__scatter(('build', self.compressed, self.precision))
+        vocabulary = {}
+        shards_terms = []
+        shards_frequencies = []
+        for terms, frequencies in self.__gather():
+            shards_terms.append(np.array(
+                [vocabulary.setdefault(term, len(vocabulary))
+                 for term in terms], dtype=np.int64))
+            shards_frequencies.append(frequencies)
+        document_frequencies = np.zeros(len(vocabulary), dtype=np.int64)
+        for terms, frequencies in zip(shards_terms, shards_frequencies):
+            document_frequencies[terms] += frequencies
+
+        rank = TfidfRank(self.stop_words)
+        idf = rank.compute_idf(document_frequencies, docs_count)
+        shards_max_scores = [None] * self.shards_count
+        if self.precision == QUANTIZED:
+            for connection, terms in zip(self._connections, shards_terms):
+                connection.send(('max_scores', idf[terms]))
+            max_scores = np.zeros(len(vocabulary))
+            for terms, terms_max_scores in zip(shards_terms,
+                                               self.__gather()):
+                max_scores[terms] = np.maximum(max_scores[terms],
+                                               terms_max_scores)
+            shards_max_scores = [max_scores[terms] for terms in shards_terms]
+        for connection, terms, terms_max_scores in zip(
+                self._connections, shards_terms, shards_max_scores):
+            connection.send(('score', idf[terms], terms_max_scores))
+        self.__gather()
+
+        self.docs_count = docs_count
+        self.vocabulary = vocabulary
+        self.document_frequencies = document_frequencies
+
+    def search(self, query, n_results=10, mode=ALL_TERMS):
+        """Search for the best objects of all shards.
+
+        The query is parsed and normalized as by `SearchEngine.search`, then
+        sent to every shard.
+
+        Args:
+          query (str): String containing one or more terms.
+          n_results (int): Desired number of results.
+          mode (str): Either `ALL_TERMS` or `ANY_TERMS`.
+
+        Returns:
+          SearchResults: List of IndexableResult with the best objects and
+            their tf-idf scores.
+
+        Raises:
+          ValueError: If `mode` is not a known query mode, or if the query
+            has positional constraints that can not be evaluated.
+          RuntimeError: If a shard failed to evaluate the query.
+
+        """
+        parsed_query = parse_query(query, mode, self.stop_words,
+                                   self.positional, self.indexable_class)
+        search_results = SearchResults(covered_count=self.docs_count)
+        terms_frequencies = [self.document_frequencies[self.vocabulary[term]]
+                             if term in self.vocabulary else 0
+                             for term in parsed_query.terms]
+        if len(terms_frequencies) == 0 or \
+                (mode == ALL_TERMS and min(terms_frequencies) == 0) or \
+                max(terms_frequencies) == 0:
+            return search_results
+
+        with self._lock:
+            self.__scatter(('search', parsed_query, mode, n_results))
+            replies = self.__gather()
+
+        docs_indices = np.concatenate([docs for docs, scores, objects
+                                       in replies])
+        docs_scores = np.concatenate([scores for docs, scores, objects
+                                      in replies])
+        docs_objects = [indexable for docs, scores, objects in replies
+                        for indexable in objects]
+        # ties are broken by position, so candidates are ordered by document
+        order = np.argsort(docs_indices, kind='mergesort')
+        docs_scores = docs_scores[order]
+        for position in top_k_positions(docs_scores, n_results):
+            search_results.append(IndexableResult(
+                float(docs_scores[position]),
+                docs_objects[order[position]]))
+        return search_results
+
+    def __scatter(self, request):
+        """Send a request to every shard.
+
+        """
+        for connection in self._connections:
+            connection.send(request)
+
+    def __gather(self):
+        """Receive the reply of every shard to the last request.
+
+        Raises:
+          RuntimeError: If a shard failed to answer the request.
+
+        """
+        replies = []
+        errors = []
+        for shard, connection in enumerate(self._connections):
+            success, reply = connection.recv()
+            if success:
+                replies.append(reply)
+            else:
+                errors.append('shard %d: %s' % (shard, reply))
+        if len(errors) > 0:
+            raise RuntimeError('Shards failed:\n' + '\n'.join(errors))
+        return replies
+
+    def close(self):
+        """Stop the worker processes.
+
+        """
+        with self._lock:
+            for connection in self._connections:
+                connection.send(('close',))
+                connection.close()
+            for worker in self._workers:
+                worker.join()
+            self._connections = []
+            self._workers = []
+
+    def count(self):
+        """Return number of objects already in the index.
+
+        Returns:
+          int: Number of objects indexed.
+
+        """
+        return self.docs_count
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import shutil
+import cPickle
+import numpy as np
+from contextlib import contextmanager
+
+
+SNAPSHOT_FORMAT = 'simple-search-engine-snapshot'
+SNAPSHOT_VERSION = 10
+MANIFEST_FILENAME = 'manifest.json'
+# directory of the entries written by each save, numbered in the manifest
+GENERATION_DIRECTORY = 'generation%d'
+_GENERATION_PATTERN = re.compile(r'^generation(\d+)$')
+
+
+def _generations(path):
+    """List the generation directories of a snapshot directory.
+
+    Args:
+      path (str): Snapshot directory.
+
+    Returns:
+      dict: Generation number of each directory name.
+
+    """
+    generations = {}
+    for name in os.listdir(path):
+        match = _GENERATION_PATTERN.match(name)
+        if match is not None and os.path.isdir(os.path.join(path, name)):
+            generations[name] = int(match.group(1))
+    return generations
+
+
+class SnapshotWriter(object):
+    """Write search engine data structures to a snapshot directory.
+
+    A snapshot is a directory containing a JSON manifest and a generation
+    directory with one file per stored entry. Numeric arrays are stored in
+    the numpy `.npy` format so that they can be memory-mapped when the
+    snapshot is loaded.
+
+    Saving again to the same directory never modifies the previous
+    snapshot: entries are written to a new generation directory, and the
+    manifest naming it replaces the previous one by a rename, so that an
+    interrupted save leaves the previous snapshot complete. Older
+    generations are only removed afterwards.
+
+    Args:
+      path (str): Directory where the snapshot will be written.
+
+    Attributes:
+      path (str): Directory where the snapshot will be written.
+      generation (int): Number of the generation directory of the entries.
+      manifest (dict): Snapshot properties that will be written to the
+        manifest file when `close` is called.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.generation = max(_generations(path).values() + [0]) + 1
+        self.manifest = {'format': SNAPSHOT_FORMAT,
+                         'version': SNAPSHOT_VERSION,
+                         'generation': self.generation}
+        os.mkdir(os.path.join(path, GENERATION_DIRECTORY % self.generation))
+
+    def write_array(self, name, array):
+        """Write a numeric array to the snapshot.
+
+        Args:
+          name (str): Name of the entry.
+          array (numpy.ndarray): Array to be stored.
+
+        """
+        with self.__open(name, '.npy') as array_file:
+            np.save(array_file, np.ascontiguousarray(array))
+
+    def write_terms(self, name, terms):
+        """Write a list of terms to the snapshot, one per line.
+
+        Args:
+          name (str): Name of the entry.
+          terms (list of str): Terms without whitespaces.
+
+        """
+        with self.__open(name, '.txt') as terms_file:
+            terms_file.write('\n'.join(terms))
+
+    def write_objects(self, name, objects):
+        """Write arbitrary python objects to the snapshot.
+
+        Args:
+          name (str): Name of the entry.
+          objects (object): Picklable object.
+
+        """
+        with self.__open(name, '.pickle') as objects_file:
+            cPickle.dump(objects, objects_file, cPickle.HIGHEST_PROTOCOL)
+
+    def section(self, prefix):
+        """Return a view of the snapshot writing entries under a prefix.
+
+        Args:
+          prefix (str): Prefix added to the names of the entries.
+
+        Returns:
+          SnapshotSection: View of the snapshot.
+
+        """
+        return SnapshotSection(self, prefix)
+
+    def close(self):
+        """Write the manifest, marking the snapshot as complete.
+
+        The manifest is written to a temporary file renamed last, so that an
+        interrupted save never replaces the previous snapshot. The other
+        generations are then removed: the entries of the previous snapshot
+        may still be memory-mapped by a loaded engine, and their mappings
+        stay valid once the files are unlinked.
+
+        """
+        filename = os.path.join(self.path, MANIFEST_FILENAME)
+        with open(filename + '.tmp', 'wb') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2, sort_keys=True)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.rename(filename + '.tmp', filename)
+
+        for name, generation in _generations(self.path).iteritems():
+            if generation != self.generation:
+                shutil.rmtree(os.path.join(self.path, name))
+
+    @contextmanager
+    def __open(self, name, extension):
+        """Open a new file for an entry, synced to disk on close.
+
+        Entries are on disk before the manifest naming their generation.
+
+        """
+        with open(self.__filename(name, extension), 'wb') as entry_file:
+            yield entry_file
+            entry_file.flush()
+            os.fsync(entry_file.fileno())
+
+    def __filename(self, name, extension=''):
+        return os.path.join(self.path, GENERATION_DIRECTORY % self.generation,
+                            name + extension)
+
+
+class SnapshotReader(object):
+    """Read search engine data structures from a snapshot directory.
+
+    Args:
+      path (str): Directory containing the snapshot.
+      mmap (bool): Whether arrays should be memory-mapped instead of read
+        into memory.
+
+    Attributes:
+      path (str): Directory containing the snapshot.
+      mmap (bool): Whether arrays should be memory-mapped instead of read
+        into memory.
+      manifest (dict): Snapshot properties read from the manifest file.
+
+    Raises:
+      ValueError: If the directory does not hold a snapshot of a supported
+        version.
+
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        with open(os.path.join(path, MANIFEST_FILENAME)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        if self.manifest.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError('%s is not a search engine snapshot' % path)
+        if self.manifest.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported snapshot version %s (expected %s)'
+                             % (self.manifest.get('version'),
+                                SNAPSHOT_VERSION))
+
+    @staticmethod
+    def exists(path):
+        """Check whether a complete snapshot is stored in a directory.
+
+        Snapshots of another format version can not be loaded, and are
+        considered missing so that the index is rebuilt and saved again.
+
+        Args:
+          path (str): Directory that may contain a snapshot.
+
+        Returns:
+          bool: True if the snapshot manifest exists and has the supported
+            format and version.
+
+        """
+        filename = os.path.join(path, MANIFEST_FILENAME)
+        if not os.path.isfile(filename):
+            return False
+        try:
+            with open(filename) as manifest_file:
+                manifest = json.load(manifest_file)
+        except ValueError:
+            return False
+        return isinstance(manifest, dict) and \
+            manifest.get('format') == SNAPSHOT_FORMAT and \
+            manifest.get('version') == SNAPSHOT_VERSION
+
+    def read_array(self, name):
+        """Read a numeric array from the snapshot.
+
+        Args:
+          name (str): Name of the entry.
+
+        Returns:
+          numpy.ndarray: Stored array, read-only when memory-mapped.
+
+        """
+        mmap_mode = 'r' if self.mmap else None
+        return np.load(self.__filename(name, '.npy'), mmap_mode=mmap_mode)
+
+    def read_terms(self, name):
+        """Read a list of terms from the snapshot.
+
+        Args:
+          name (str): Name of the entry.
+
+        Returns:
+          list of str: Stored terms.
+
+        """
+        with open(self.__filename(name, '.txt'), 'rb') as terms_file:
+            content = terms_file.read()
+        return content.split('\n') if content else []
+
+    def read_objects(self, name):
+        """Read arbitrary python objects from the snapshot.
+
+        Args:
+          name (str): Name of the entry.
+
+        Returns:
+          object: Stored object.
+
+        """
+        with open(self.__filename(name, '.pickle'), 'rb') as objects_file:
+            return cPickle.load(objects_file)
+
+    def section(self, prefix):
+        """Return a view of the snapshot reading entries under a prefix.
+
+        Args:
+          prefix (str): Prefix added to the names of the entries.
+
+        Returns:
+          SnapshotSection: View of the snapshot.
+
+        """
+        return SnapshotSection(self, prefix)
+
+    def __filename(self, name, extension=''):
+        return os.path.join(self.path, GENERATION_DIRECTORY %
+                            self.manifest['generation'], name + extension)
+
+
+class SnapshotSection(object):
+    """View of a snapshot whose entries share a name prefix.
+
+    Sections let several instances of the same data structure, such as the
+    segments of an index, be stored in one snapshot with the entry names
+    they use on their own. The manifest is shared by all sections.
+
+    Args:
+      snapshot (SnapshotWriter or SnapshotReader): Snapshot being written or
+        read.
+      prefix (str): Prefix added to the names of the entries.
+
+    Attributes:
+      snapshot (SnapshotWriter or SnapshotReader): Snapshot being written or
+        read.
+      prefix (str): Prefix added to the names of the entries.
+      manifest (dict): Manifest of the snapshot.
+
+    """
+
+    def __init__(self, snapshot, prefix):
+        self.snapshot = snapshot
+        self.prefix = prefix
+        self.manifest = snapshot.manifest
+
+    def write_array(self, name, array):
+        self.snapshot.write_array(self.prefix + name, array)
+
+    def write_terms(self, name, terms):
+        self.snapshot.write_terms(self.prefix + name, terms)
+
+    def write_objects(self, name, objects):
+        self.snapshot.write_objects(self.prefix + name, objects)
+
+    def read_array(self, name):
+        return self.snapshot.read_array(self.prefix + name)
+
+    def read_terms(self, name):
+        return self.snapshot.read_terms(self.prefix + name)
+
+    def read_objects(self, name):
+        return self.snapshot.read_objects(self.prefix + name)
+
+    def section(self, prefix):
+        return SnapshotSection(self.snapshot, self.prefix + prefix)
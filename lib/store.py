@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from array import array
+
+
+class DocumentStore(object):
+    """Columnar storage of indexed objects.
+
+    Objects are not kept as Python objects once they are indexed: integer
+    identifiers are stored in a typed array, and every text field is
+    concatenated with the same field of the other objects in a byte buffer,
+    delimited by an array of offsets. The stored fields are the ones listed
+    in `STORED_FIELDS` by the class of the objects, identifiers that are not
+    integers being stored as a text field too.
+
+    Objects are materialized again when they are accessed, usually only for
+    search results, and their words are counted again only if needed.
+
+    All objects of a store must have the same class, which is set by the
+    first appended object.
+
+    A store restored from a snapshot keeps the snapshot arrays, which are
+    memory-mapped if the snapshot is, and only copies them to typed arrays
+    when objects are appended to it.
+
+    Attributes:
+      indexable_class (type): Class of the stored objects, None until an
+        object is appended.
+      integer_iids (bool): Whether identifiers are stored as integers.
+
+    """
+
+    def __init__(self):
+        self.indexable_class = None
+        self.integer_iids = True
+        self._iids = array('l')
+        self._positional = array('b')
+        self._buffers = {}
+        self._offsets = {}
+        # whether the arrays are still the ones read from a snapshot
+        self._mapped = False
+
+    def __len__(self):
+        return len(self._positional)
+
+    def __iter__(self):
+        for doc_index in xrange(len(self)):
+            yield self[doc_index]
+
+    def __getitem__(self, doc_index):
+        """Materialize a stored object.
+
+        Args:
+          doc_index (int): Position of the object in the store.
+
+        Returns:
+          Indexable: New instance of the stored object.
+
+        """
+        if doc_index < 0:
+            doc_index += len(self)
+        values = [self.__field(name, doc_index)
+                  for name in self.indexable_class.STORED_FIELDS]
+        return self.indexable_class(self.iid(doc_index), *values,
+                                    positional=bool(
+                                        self._positional[doc_index]))
+
+    def iid(self, doc_index):
+        """Return the identifier of a stored object.
+
+        Args:
+          doc_index (int): Position of the object in the store.
+
+        Returns:
+          object: Identifier of the object.
+
+        """
+        if self.integer_iids:
+            return int(self._iids[doc_index])
+        return self.__field('iid', doc_index)
+
+    def fields(self, doc_index, names=None):
+        """Return stored fields of an object, without materializing it.
+
+        Args:
+          doc_index (int): Position of the object in the store.
+          names (list of str, optional): Names of the fields, all the
+            `STORED_FIELDS` by default.
+
+        Returns:
+          tuple of str: Value of each field, in the order of `names`.
+
+        """
+        if names is None:
+            names = self.indexable_class.STORED_FIELDS
+        return tuple(self.__field(name, doc_index) for name in names)
+
+    def iids(self):
+        """Return the identifiers of all stored objects.
+
+        Returns:
+          list: Identifier of each object, in store order.
+
+        """
+        if self.integer_iids:
+            return self._iids.tolist()
+        return [self.__field('iid', doc_index)
+                for doc_index in xrange(len(self))]
+
+    def append(self, indexable):
+        """Store an object, dropping everything but its stored fields.
+
+        Args:
+          indexable (Indexable): Object to be stored.
+
+        Raises:
+          TypeError: If the object is not of the class of the stored objects,
+            or its identifier is not of the type of the stored identifiers.
+
+        """
+        if self.indexable_class is None:
+            self.__set_class(indexable.__class__,
+                             isinstance(indexable.iid, (int, long)))
+        elif indexable.__class__ is not self.indexable_class:
+            raise TypeError('Can not store %s objects with %s objects' %
+                            (indexable.__class__.__name__,
+                             self.indexable_class.__name__))
+        if self._mapped:
+            self.__copy_mapped()
+
+        if self.integer_iids:
+            if not isinstance(indexable.iid, (int, long)):
+                raise TypeError('Identifier %r is not an integer' %
+                                (indexable.iid,))
+            self._iids.append(indexable.iid)
+        else:
+            self.__append_field('iid', indexable.iid)
+        for name in self.indexable_class.STORED_FIELDS:
+            self.__append_field(name, getattr(indexable, name))
+        self._positional.append(indexable.positional)
+
+    def extend(self, other):
+        """Append the objects of another store.
+
+        Args:
+          other (DocumentStore): Store whose objects are appended, not
+            modified.
+
+        Raises:
+          TypeError: If the stores do not hold objects of the same class.
+
+        """
+        if len(other) == 0:
+            return
+        if self.indexable_class is None:
+            self.__set_class(other.indexable_class, other.integer_iids)
+        elif (other.indexable_class is not self.indexable_class or
+              other.integer_iids != self.integer_iids):
+            raise TypeError('Can not store %s objects with %s objects' %
+                            (other.indexable_class.__name__,
+                             self.indexable_class.__name__))
+        if self._mapped:
+            self.__copy_mapped()
+
+        self.__extend_array(self._iids, self.__values(other._iids))
+        self.__extend_array(self._positional,
+                            self.__values(other._positional))
+        for name in self._buffers:
+            other_offsets = self.__values(other._offsets[name])
+            self.__extend_array(self._offsets[name],
+                                other_offsets[1:] + len(self._buffers[name]))
+            self._buffers[name].fromstring(
+                self.__values(other._buffers[name]).tostring())
+
+    def take(self, docs_indices):
+        """Return a store with a selection of the stored objects.
+
+        Args:
+          docs_indices (numpy.ndarray): Positions of the selected objects.
+
+        Returns:
+          DocumentStore: New store with the selected objects, in the order
+            of `docs_indices`.
+
+        """
+        docs_indices = np.asarray(docs_indices, dtype=np.int64)
+        store = DocumentStore()
+        store.indexable_class = self.indexable_class
+        store.integer_iids = self.integer_iids
+        names = ['iids', 'positional'] if self.integer_iids else ['positional']
+        for name in names:
+            self.__extend_array(
+                getattr(store, '_' + name),
+                self.__values(getattr(self, '_' + name))[docs_indices])
+
+        for name in self._buffers:
+            offsets = self.__values(self._offsets[name])
+            buffer = self.__values(self._buffers[name])
+            starts = offsets[docs_indices]
+            lengths = offsets[docs_indices + 1] - starts
+            new_offsets = np.zeros(len(docs_indices) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=new_offsets[1:])
+
+            # gather the bytes of the selected fields
+            gather = np.arange(new_offsets[-1]) + np.repeat(
+                starts - new_offsets[:-1], lengths)
+            store._offsets[name] = array('l')
+            self.__extend_array(store._offsets[name], new_offsets)
+            store._buffers[name] = array('c', buffer[gather].tostring())
+        return store
+
+    def nbytes(self):
+        """Return the memory used by the stored objects.
+
+        Returns:
+          int: Size in bytes of the arrays and buffers of the store.
+
+        """
+        arrays = [self._iids, self._positional] + \
+            self._buffers.values() + self._offsets.values()
+        return sum(len(values) * values.itemsize for values in arrays)
+
+    def save(self, writer, count=None):
+        """Store the objects in a snapshot.
+
+        Args:
+          writer (SnapshotWriter): Snapshot being written.
+          count (int, optional): Number of objects to be stored, from the
+            first one. All objects by default.
+
+        """
+        if count is None:
+            count = len(self)
+        writer.write_objects('store_class', (self.indexable_class,
+                                             self.integer_iids))
+        writer.write_array('store_iids', self.__values(
+            self._iids)[:count if self.integer_iids else 0])
+        writer.write_array('store_positional',
+                           self.__values(self._positional)[:count])
+        for name in self._buffers:
+            offsets = self.__values(self._offsets[name])
+            writer.write_array('store_%s_offsets' % name, offsets[:count + 1])
+            writer.write_array('store_%s_buffer' % name, self.__values(
+                self._buffers[name])[:offsets[count]])
+
+    def load(self, reader):
+        """Restore stored objects from a snapshot.
+
+        The snapshot arrays are kept as they are read, memory-mapped if the
+        snapshot is, until objects are appended to the store.
+
+        Args:
+          reader (SnapshotReader): Snapshot being read.
+
+        """
+        indexable_class, integer_iids = reader.read_objects('store_class')
+        self.indexable_class = None
+        self._buffers = {}
+        self._offsets = {}
+        if indexable_class is not None:
+            self.__set_class(indexable_class, integer_iids)
+
+        self._iids = reader.read_array('store_iids')
+        self._positional = reader.read_array('store_positional')
+        for name in self._buffers:
+            self._offsets[name] = reader.read_array('store_%s_offsets' % name)
+            self._buffers[name] = reader.read_array('store_%s_buffer' % name)
+        self._mapped = True
+
+    def __getstate__(self):
+        # typed arrays are pickled as lists of values, send their bytes
+        state = self.__dict__.copy()
+        state['_iids'] = self._iids.tostring()
+        state['_positional'] = self._positional.tostring()
+        state['_offsets'] = dict((name, offsets.tostring()) for name, offsets
+                                 in self._offsets.iteritems())
+        state['_buffers'] = dict((name, buffer.tostring()) for name, buffer
+                                 in self._buffers.iteritems())
+        state['_mapped'] = False
+        return state
+
+    def __setstate__(self, state):
+        state['_iids'] = array('l', state['_iids'])
+        state['_positional'] = array('b', state['_positional'])
+        state['_offsets'] = dict((name, array('l', offsets)) for name, offsets
+                                 in state['_offsets'].iteritems())
+        state['_buffers'] = dict((name, array('c', buffer)) for name, buffer
+                                 in state['_buffers'].iteritems())
+        self.__dict__.update(state)
+
+    def __set_class(self, indexable_class, integer_iids):
+        """Create the buffers of the fields of the stored class.
+
+        """
+        self.indexable_class = indexable_class
+        self.integer_iids = integer_iids
+        names = list(indexable_class.STORED_FIELDS)
+        if not integer_iids:
+            names.append('iid')
+        for name in names:
+            self._buffers[name] = array('c')
+            self._offsets[name] = array('l', [0])
+
+    def __append_field(self, name, value):
+        """Append the text of a field to its buffer.
+
+        """
+        buffer = self._buffers[name]
+        buffer.fromstring(value)
+        self._offsets[name].append(len(buffer))
+
+    def __field(self, name, doc_index):
+        """Read the text of a field of a stored object.
+
+        """
+        offsets = self._offsets[name]
+        return self._buffers[name][offsets[doc_index]:
+                                   offsets[doc_index + 1]].tostring()
+
+    def __values(self, values):
+        """Return a typed array or a snapshot array as a numpy array.
+
+        """
+        if not isinstance(values, array):
+            return values
+        # text buffers are read as bytes
+        dtype = np.uint8 if values.typecode == 'c' else values.typecode
+        return np.frombuffer(values, dtype=dtype)
+
+    def __copy_mapped(self):
+        """Copy the arrays read from a snapshot to growable typed arrays.
+
+        """
+        iids = array('l')
+        self.__extend_array(iids, self._iids)
+        positional = array('b')
+        self.__extend_array(positional, self._positional)
+        self._iids = iids
+        self._positional = positional
+        for name in self._buffers:
+            offsets = array('l')
+            self.__extend_array(offsets, self._offsets[name])
+            self._offsets[name] = offsets
+            self._buffers[name] = array('c', self._buffers[name].tostring())
+        self._mapped = False
+
+    def __extend_array(self, target, values):
+        """Append numpy values to a typed array, casting them to its type.
+
+        """
+        target.fromstring(np.asarray(values).astype(target.typecode)
+                          .tostring())
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+
+logger = logging.getLogger(__name__)
+
+
+# upper bounds of the histogram buckets, in seconds for durations
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+                    5.0, 10.0, 60.0)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# children kept by a span, the others are only counted
+MAX_SPAN_CHILDREN = 100
+
+
+class Histogram(object):
+    """Distribution of observed values in fixed buckets.
+
+    Args:
+      bounds (tuple of float): Sorted upper bounds of the buckets, values
+        above the last one being counted in an extra bucket.
+
+    Attributes:
+      bounds (tuple of float): Upper bounds of the buckets.
+      counts (list of int): Number of values in each bucket, the last one
+        counting the values above all the bounds.
+      count (int): Number of observed values.
+      total (float): Sum of the observed values.
+
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'total')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        """Count a value in its bucket.
+
+        Args:
+          value (float): Observed value.
+
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        """Return the distribution as plain data.
+
+        Returns:
+          dict: Number and sum of the values, and the cumulative count of
+            each bucket by upper bound, as in Prometheus histograms.
+
+        """
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {'count': self.count, 'sum': self.total, 'buckets': buckets}
+
+
+class Span(object):
+    """Timed operation, nested in the span of the same thread open when it
+    starts.
+
+    Spans are used as context managers, see `Tracer.span`. The duration of
+    each span is recorded in the histogram of its path, the names of its
+    ancestors and its own joined by slashes, and finished spans are kept by
+    their parent, so that a whole trace can be displayed, see
+    `format_trace`.
+
+    Args:
+      tracer (Tracer): Tracer recording the span.
+      name (str): Name of the operation.
+
+    Attributes:
+      name (str): Name of the operation.
+      path (str): Names of the enclosing spans and of the span, joined by
+        slashes.
+      start (float): Time the span started.
+      duration (float): Duration in seconds, None until the span ends.
+      children (list of Span): First finished spans nested in the span.
+      dropped (int): Number of nested spans not kept in `children`.
+
+    """
+
+    __slots__ = ('tracer', 'name', 'path', 'start', 'duration', 'children',
+                 'dropped', 'parent')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.path = name
+        self.start = None
+        self.duration = None
+        self.children = []
+        self.dropped = 0
+        self.parent = None
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        if len(stack) > 0:
+            self.parent = stack[-1]
+            self.path = self.parent.path + '/' + self.name
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, error_type, error, error_traceback):
+        self.duration = time.time() - self.start
+        self.tracer._stack().pop()
+        self.tracer._finish(self)
+        return False
+
+
+class NoSpan(object):
+    """Context manager doing nothing, returned while tracing is disabled.
+
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, error_traceback):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+class Tracer(object):
+    """Recorder of nested spans, counters and histograms.
+
+    While the tracer is disabled, `span` returns a shared context manager
+    doing nothing, and counters and histograms are not updated, so
+    instrumented code only pays for a call and an attribute check. Callers
+    computing the value of a metric should check `enabled` first.
+
+    Metrics are recorded under a lock, as they may be updated from several
+    threads, such as the warm-up, merge and query server threads.
+
+    Args:
+      enabled (bool, optional): Whether spans and metrics are recorded.
+
+    Attributes:
+      enabled (bool): Whether spans and metrics are recorded.
+      counters (dict): Value of each counter, by name.
+      histograms (dict): Histogram of each observed metric, by name.
+      spans (dict): Histogram of the durations of the spans, by path.
+
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self.spans = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self):
+        """Start recording spans and metrics.
+
+        """
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording spans and metrics, keeping the recorded ones.
+
+        """
+        self.enabled = False
+
+    def reset(self):
+        """Forget the recorded metrics.
+
+        """
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.spans = {}
+
+    def span(self, name):
+        """Return a context manager timing an operation.
+
+        Args:
+          name (str): Name of the operation.
+
+        Returns:
+          Span or NoSpan: A new span, or a span doing nothing while the
+            tracer is disabled.
+
+        """
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name)
+
+    def count(self, name, value=1):
+        """Increment a counter.
+
+        Args:
+          name (str): Name of the counter.
+          value (float, optional): Increment.
+
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, bounds=SIZE_BUCKETS):
+        """Record a value in a histogram.
+
+        Args:
+          name (str): Name of the histogram.
+          value (float): Observed value.
+          bounds (tuple of float, optional): Upper bounds of the buckets,
+            used when the histogram is created.
+
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(bounds)
+            histogram.observe(value)
+
+    def last_trace(self):
+        """Return the last span of the current thread not nested in another.
+
+        Returns:
+          Span: Last finished root span of the thread, None if there is
+            none.
+
+        """
+        return getattr(self._local, 'last_trace', None)
+
+    def snapshot(self):
+        """Return the recorded metrics as plain data.
+
+        Returns:
+          dict: Value of each counter in `counters`, distribution of each
+            histogram in `histograms` and of the durations of each span
+            path in `spans`, see `Histogram.snapshot`.
+
+        """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': dict((name, histogram.snapshot()) for
+                                   name, histogram in
+                                   self.histograms.iteritems()),
+                'spans': dict((path, histogram.snapshot()) for
+                              path, histogram in self.spans.iteritems()),
+            }
+
+    def dump(self):
+        """Format the recorded metrics in the Prometheus text format.
+
+        Span durations are the `span_duration_seconds` histogram, labeled by
+        span path.
+
+        Returns:
+          str: Metrics, one sample per line.
+
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name in sorted(snapshot['counters']):
+            lines.append('# TYPE %s counter' % name)
+            lines.append('%s %s' % (name, format_value(
+                snapshot['counters'][name])))
+        for name in sorted(snapshot['histograms']):
+            lines.append('# TYPE %s histogram' % name)
+            lines.extend(histogram_lines(name, '',
+                                         snapshot['histograms'][name]))
+        if len(snapshot['spans']) > 0:
+            lines.append('# TYPE span_duration_seconds histogram')
+        for path in sorted(snapshot['spans']):
+            lines.extend(histogram_lines('span_duration_seconds',
+                                         'span="%s",' % path,
+                                         snapshot['spans'][path]))
+        return '\n'.join(lines)
+
+    def _stack(self):
+        """Return the spans open in the current thread, innermost last.
+
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _finish(self, span):
+        """Record the duration of a finished span and attach it to its
+        parent.
+
+        """
+        with self._lock:
+            histogram = self.spans.get(span.path)
+            if histogram is None:
+                histogram = self.spans[span.path] = Histogram(
+                    DURATION_BUCKETS)
+            histogram.observe(span.duration)
+        parent = span.parent
+        span.parent = None
+        if parent is None:
+            self._local.last_trace = span
+            logger.info('Span = %s, Time = %2.2f sec', span.name,
+                        span.duration)
+        elif len(parent.children) < MAX_SPAN_CHILDREN:
+            parent.children.append(span)
+        else:
+            parent.dropped += 1
+
+
+def format_value(value):
+    """Format a metric value, integers without a decimal point.
+
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return '%d' % value
+    return repr(float(value))
+
+
+def histogram_lines(name, labels, histogram):
+    """Format the samples of a histogram in the Prometheus text format.
+
+    Args:
+      name (str): Name of the histogram.
+      labels (str): Labels of every sample, each followed by a comma.
+      histogram (dict): Distribution, see `Histogram.snapshot`.
+
+    Returns:
+      list of str: Lines of the cumulative buckets, sum and count.
+
+    """
+    lines = ['%s_bucket{%sle="%s"} %d' % (name, labels, format_value(bound),
+                                          count)
+             for bound, count in histogram['buckets']]
+    labels = '{%s}' % labels.rstrip(',') if labels else ''
+    lines.append('%s_sum%s %s' % (name, labels,
+                                  format_value(histogram['sum'])))
+    lines.append('%s_count%s %d' % (name, labels, histogram['count']))
+    return lines
+
+
+def format_trace(span, indent=0):
+    """Describe a span and the spans nested in it, one per line.
+
+    Args:
+      span (Span): Finished span.
+      indent (int, optional): Depth of the span in the trace.
+
+    Returns:
+      str: Name and duration of each span, indented by depth.
+
+    """
+    lines = ['%s%s: %.3f ms' % ('  ' * indent, span.name,
+                                span.duration * 1000)]
+    for child in span.children:
+        lines.append(format_trace(child, indent + 1))
+    if span.dropped > 0:
+        lines.append('%s... %d more' % ('  ' * (indent + 1), span.dropped))
+    return '\n'.join(lines)
+
+
+# tracer of the library, disabled unless enabled by the application
+tracer = Tracer()
+
+
+def traced(name=None):
+    """Decorator recording each call of a function in a span.
+
+    Args:
+      name (str, optional): Name of the span, the name of the function by
+        default.
+
+    Returns:
+      callable: Decorator.
+
+    """
+
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with Span(tracer, span_name):
+                return fn(*args, **kwargs)
+
+        return wrapped
+
+    return decorator
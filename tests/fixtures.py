@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""Objects shared by the test cases."""
+import numpy as np
+import sys
+
+sys.path.append('lib')
+from search import Indexable
+
+
+def random_objects(seed, count, first_iid=0, n_words=40, length=4,
+                   positional=False):
+    random = np.random.RandomState(seed)
+    words = ['w%d' % word for word in range(n_words)]
+    return [Indexable(iid, ' '.join(random.choice(words, length)), positional)
+            for iid in range(first_iid, first_iid + count)]
+
+
+def sample_stop_words():
+    return ['a', 'the', 'this', 'is']
@@ -1,8 +1,15 @@
 import unittest
+import gzip
+import re
+import shutil
 import sys
+import tempfile
 
 sys.path.append('lib')
 from book import BookInventory
+from book import BookDataPreprocessor
+from book import catalog_chunks
+from snapshot import SNAPSHOT_FORMAT
 
 
 class BookInventoryTests(unittest.TestCase):
@@ -29,6 +36,296 @@ class BookInventoryTests(unittest.TestCase):
         self.inventory.load_books()
         self.assertEqual(self.inventory.books_count(), 10)
 
+    def test_index_snapshot(self):
+        """
+        Test if books are loaded from the index snapshot once it is written.
+        """
+        index_dir = tempfile.mkdtemp()
+        try:
+            inventory = BookInventory('./tests/test_title_author.tab.txt',
+                                      index_dir)
+            inventory.load_books()
+            expected_results = inventory.search_books('united states')
+
+            inventory = BookInventory('./not_existent_catalog.txt', index_dir)
+            inventory.load_books()
+            self.assertEqual(inventory.books_count(), 10)
+            self.assertEqual(inventory.search_books('united states'),
+                             expected_results)
+        finally:
+            shutil.rmtree(index_dir)
+
+    def test_outdated_index_snapshot(self):
+        """
+        Test if an index snapshot of another version is rebuilt.
+        """
+        index_dir = tempfile.mkdtemp()
+        try:
+            with open(index_dir + '/manifest.json', 'w') as manifest_file:
+                manifest_file.write('{"format": "%s", "version": 0}' %
+                                    SNAPSHOT_FORMAT)
+
+            inventory = BookInventory('./tests/test_title_author.tab.txt',
+                                      index_dir)
+            inventory.load_books()
+            self.assertEqual(inventory.books_count(), 10)
+
+            inventory = BookInventory('./not_existent_catalog.txt', index_dir)
+            inventory.load_books()
+            self.assertEqual(inventory.books_count(), 10)
+        finally:
+            shutil.rmtree(index_dir)
+
+    def test_add_books(self):
+        """
+        Test if books of another catalog are added to the loaded books.
+        """
+        catalog_dir = tempfile.mkdtemp()
+        try:
+            catalog_filename = catalog_dir + '/new_title_author.tab.txt'
+            with open(catalog_filename, 'w') as catalog:
+                catalog.write('11\tThe plays\tOscar Wilde\n')
+
+            self.inventory.load_books()
+            self.inventory.add_books(catalog_filename)
+            self.assertEqual(self.inventory.books_count(), 11)
+            self.assertIn('id: 11', self.inventory.search_books('wilde'))
+        finally:
+            shutil.rmtree(catalog_dir)
+
+    def test_query_normalization(self):
+        """
+        Test if queries are preprocessed like the catalog entries.
+        """
+        catalog_dir = tempfile.mkdtemp()
+        try:
+            catalog_filename = catalog_dir + '/title_author.tab.txt'
+            with open(catalog_filename, 'w') as catalog:
+                catalog.write('11\tThe plays\tWilde, Oscar\n'
+                              '12\tL\xc3\xa9gendes\tOscar Wilde\n')
+
+            inventory = BookInventory(catalog_filename)
+            inventory.load_books()
+            for query, expected_iids in [('Wilde, Oscar', ['11', '12']),
+                                         ('the plays', ['11']),
+                                         ('(Wilde)', ['11', '12']),
+                                         ('l\xc3\xa9gendes', ['12'])]:
+                self.assertListEqual(re.findall(
+                    r'id: (\w+),', inventory.search_books(query)),
+                    expected_iids)
+            self.assertIn('dropped stop words: the',
+                          inventory.explain_query('the plays'))
+        finally:
+            shutil.rmtree(catalog_dir)
+
+    def test_compressed_catalog(self):
+        """
+        Test if books of a gzip catalog are indexed as the plain catalog.
+        """
+        catalog_dir = tempfile.mkdtemp()
+        try:
+            catalog_filename = catalog_dir + '/title_author.tab.txt.gz'
+            with open('./tests/test_title_author.tab.txt', 'rb') as catalog:
+                with gzip.GzipFile(catalog_filename, 'wb') as compressed:
+                    compressed.write(catalog.read())
+
+            self.inventory.load_books()
+            for processes in [1, 2]:
+                inventory = BookInventory(catalog_filename,
+                                          processes=processes)
+                inventory.load_books()
+                self.assertEqual(inventory.books_count(), 10)
+                self.assertEqual(list(inventory.engine.objects),
+                                 list(self.inventory.engine.objects))
+                self.assertEqual(inventory.search_books('united states'),
+                                 self.inventory.search_books('united states'))
+        finally:
+            shutil.rmtree(catalog_dir)
+
+    def test_duplicate_books(self):
+        """
+        Test if books with the same title and author are indexed once.
+        """
+        catalog_dir = tempfile.mkdtemp()
+        try:
+            catalog_filename = catalog_dir + '/title_author.tab.txt'
+            with open(catalog_filename, 'w') as catalog:
+                catalog.write('1277695\tGreuze\tAlys Eyre Macklin\n'
+                              '570698\tGreuze\tAlys Eyre Macklin\n'
+                              '417681\tGreuze and his models\tJohn Rivers\n'
+                              '39325\tGreuze.\tAlys Eyre Macklin\n')
+
+            inventory = BookInventory(catalog_filename, deduplicate=True)
+            inventory.load_books()
+            self.assertEqual(inventory.books_count(), 4)
+            self.assertEqual(inventory.engine.indexed_count, 2)
+
+            results = inventory.search_books('greuze').split('\n')
+            self.assertEqual(len(results), 4)
+            self.assertIn('id: 570698,', results[1])
+            results = inventory.search_books('greuze', collapse=True)
+            self.assertEqual(len(results.split('\n')), 2)
+            self.assertIn('duplicates: 570698, 39325', results)
+        finally:
+            shutil.rmtree(catalog_dir)
+
+    def test_lazy_books(self):
+        """
+        Test if books kept in a record file are displayed as loaded ones.
+        """
+        index_dir = tempfile.mkdtemp()
+        try:
+            self.inventory.load_books()
+            expected_results = self.inventory.search_books('united states')
+            for processes in [1, 2]:
+                inventory = BookInventory('./tests/test_title_author.tab.txt',
+                                          processes=processes,
+                                          lazy_objects=True)
+                inventory.load_books()
+                self.assertEqual(inventory.search_books('united states'),
+                                 expected_results)
+
+            inventory = BookInventory('./tests/test_title_author.tab.txt',
+                                      index_dir, lazy_objects=True)
+            inventory.load_books()
+            inventory = BookInventory('./not_existent_catalog.txt', index_dir)
+            inventory.load_books()
+            self.assertTrue(inventory.engine.lazy_objects)
+            self.assertEqual(inventory.search_books('united states'),
+                             expected_results)
+        finally:
+            shutil.rmtree(index_dir)
+
+    def test_warm_up(self):
+        """
+        Test if books indexed in the background are saved and searched.
+        """
+        index_dir = tempfile.mkdtemp()
+        try:
+            self.inventory.load_books()
+            expected_results = self.inventory.search_books('united states')
+            inventory = BookInventory('./tests/test_title_author.tab.txt',
+                                      index_dir, warm_up=True)
+            inventory.load_books()
+            inventory.wait_for_books()
+            self.assertEqual(inventory.books_count(), 10)
+            self.assertEqual(inventory.search_books('united states'),
+                             expected_results)
+
+            inventory = BookInventory('./not_existent_catalog.txt', index_dir,
+                                      warm_up=True)
+            inventory.load_books()
+            self.assertEqual(inventory.search_books('united states'),
+                             expected_results)
+        finally:
+            shutil.rmtree(index_dir)
+
+    def test_delete_and_update_books(self):
+        """
+        Test if deleted and updated books are reflected by searches.
+        """
+        self.inventory.load_books()
+        self.assertIn('id: 2,', self.inventory.search_books('bering'))
+
+        self.assertTrue(self.inventory.delete_book('2'))
+        self.assertFalse(self.inventory.delete_book('2'))
+        self.assertEqual(self.inventory.books_count(), 9)
+        self.assertNotIn('id: 2,', self.inventory.search_books('bering'))
+
+        self.assertTrue(self.inventory.update_book('3', 'The plays',
+                                                   'Oscar Wilde'))
+        self.assertIn('id: 3,', self.inventory.search_books('wilde'))
+        self.assertNotIn('id: 3,', self.inventory.search_books('timber'))
+        self.assertEqual(self.inventory.books_count(), 9)
+
+    def test_parallel_loading(self):
+        """
+        Test if books parsed by several processes are indexed identically.
+        """
+        for positional in [False, True]:
+            serial_inventory = BookInventory(
+                './tests/test_title_author.tab.txt', positional=positional)
+            serial_inventory.load_books()
+            inventory = BookInventory('./tests/test_title_author.tab.txt',
+                                      positional=positional, processes=3)
+            inventory.load_books()
+
+            self.assertEqual(inventory.books_count(), 10)
+            self.assertEqual(inventory.engine.vocabulary,
+                             serial_inventory.engine.vocabulary)
+            self.assertEqual(list(inventory.engine.objects),
+                             list(serial_inventory.engine.objects))
+            for query in ['united states', 'account', 'ice sea']:
+                self.assertEqual(inventory.search_books(query),
+                                 serial_inventory.search_books(query))
+
+    def test_catalog_chunks(self):
+        """
+        Test if catalog chunks cover the file and end with whole lines.
+        """
+        filename = './tests/test_title_author.tab.txt'
+        with open(filename, 'rb') as catalog:
+            content = catalog.read()
+
+        for chunks_count in [1, 3, 7, 100]:
+            chunks = catalog_chunks(filename, chunks_count)
+            self.assertLessEqual(len(chunks), chunks_count)
+            self.assertEqual(''.join(content[start:end]
+                                     for start, end in chunks), content)
+            for start, end in chunks[:-1]:
+                self.assertEqual(content[end - 1], '\n')
+
+
+class BookDataPreprocessorTests(unittest.TestCase):
+    """
+    Test case for BookDataPreprocessor class.
+    """
+
+    def setUp(self):
+        """
+        Setup preprocessor that will be subjected to the tests.
+        """
+        self.processor = BookDataPreprocessor()
+
+    def test_batch_matches_catalog(self):
+        """
+        Test if batch preprocessing of the test catalog matches each line.
+        """
+        with open('./tests/test_title_author.tab.txt') as catalog:
+            entries = catalog.readlines()
+        self.assertEqual(self.processor.preprocess_batch(entries),
+                         [self.processor.preprocess(entry)
+                          for entry in entries])
+
+    def test_batch_matches_tricky_entries(self):
+        """
+        Test if batch preprocessing handles punctuation, accents and spaces.
+        """
+        entries = ['1\tReport, 1,000 copies [vol. 2]\tSmith, John\n',
+                   '2\tA,,=5 (test); {x}\tDoe-Ray\r\n',
+                   '3\t\xc3\x89COLE fran\xc3\xa7aise\tM\xc3\xbcller\t\n',
+                   '4\t  Spaced\xc2\xa0out \x0b title \tO\'Brien\n',
+                   '5\t$100: ?!\t\n']
+        self.assertEqual(self.processor.preprocess_batch(entries),
+                         [self.processor.preprocess(entry)
+                          for entry in entries])
+        self.assertEqual(self.processor.preprocess_batch([]), [])
+
+    def test_book_fields(self):
+        """
+        Test if the words of a book are those of its title and author.
+        """
+        book = self.processor.to_book('1\tThe Plays\tOscar Wilde\n')
+        self.assertEqual((book.iid, book.title, book.author),
+                         ('1', 'the plays', 'oscar wilde'))
+        self.assertEqual(sorted(book.words_count),
+                         ['oscar', 'plays', 'the', 'wilde'])
+
+        # fields following the author are kept with it
+        book = self.processor.to_book('2\tPoems\tWilde\t1881\n')
+        self.assertEqual(book.author, 'wilde 1881')
+        self.assertEqual(book.metadata.split(), ['poems', 'wilde', '1881'])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
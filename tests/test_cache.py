@@ -0,0 +1,94 @@
+import unittest
+import sys
+
+sys.path.append('lib')
+from cache import LRUCache
+
+
+class LRUCacheTests(unittest.TestCase):
+    """
+    Test case for LRUCache class.
+    """
+
+    def test_least_recently_used_eviction(self):
+        """
+        Test if the least recently used entry is evicted when full.
+        """
+        cache = LRUCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_memory_budget(self):
+        """
+        Test if entries are evicted to respect the memory budget.
+        """
+        cache = LRUCache(max_bytes=10, sizeof=len)
+        cache.put('a', 'xxxx')
+        cache.put('b', 'yyyy')
+        cache.put('c', 'zzzz')
+        cache.put('d', 'x' * 11)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.get('c'), 'zzzz')
+        self.assertEqual(cache.stats()['bytes'], 8)
+
+    def test_memory_budget_requires_sizeof(self):
+        """
+        Test if a memory budget without size estimation is rejected.
+        """
+        self.assertRaises(ValueError, LRUCache, None, 100)
+
+    def test_invalidation(self):
+        """
+        Test if entries cached before an invalidation are not returned.
+        """
+        cache = LRUCache()
+        cache.put('a', 1)
+        cache.invalidate()
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+        stats = cache.stats()
+        self.assertEqual(stats['stale'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_outdated_generation_put(self):
+        """
+        Test if values computed before an invalidation are not cached.
+        """
+        cache = LRUCache()
+        generation = cache.generation
+        cache.invalidate()
+        cache.put('a', 1, generation)
+        self.assertIsNone(cache.get('a'))
+
+        cache.put('a', 2, cache.generation)
+        self.assertEqual(cache.get('a'), 2)
+
+    def test_stats(self):
+        """
+        Test if hits and misses are counted.
+        """
+        cache = LRUCache()
+        cache.get('a')
+        cache.put('a', 1)
+        cache.get('a')
+        cache.get('a')
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
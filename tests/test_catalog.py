@@ -0,0 +1,112 @@
+import unittest
+import gzip
+import shutil
+import sys
+import tempfile
+import threading
+import zipfile
+
+sys.path.append('lib')
+from catalog import CatalogReader
+from catalog import is_compressed
+from catalog import open_catalog
+
+
+CATALOG_FILENAME = './tests/test_title_author.tab.txt'
+
+
+class CatalogReaderTests(unittest.TestCase):
+    """
+    Test case for CatalogReader class.
+    """
+
+    def setUp(self):
+        """
+        Write the test catalog compressed with gzip and zip.
+        """
+        with open(CATALOG_FILENAME, 'rb') as catalog:
+            self.content = catalog.read()
+        self.lines = self.content.split('\n')
+        if self.content.endswith('\n'):
+            self.lines.pop()
+
+        self.catalog_dir = tempfile.mkdtemp()
+        self.gzip_filename = self.catalog_dir + '/title_author.tab.txt.gz'
+        with gzip.GzipFile(self.gzip_filename, 'wb') as catalog:
+            catalog.write(self.content)
+        self.zip_filename = self.catalog_dir + '/title_author.tab.txt.zip'
+        with zipfile.ZipFile(self.zip_filename, 'w',
+                             zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('title_author.tab.txt', self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.catalog_dir)
+
+    def test_compressed_catalogs(self):
+        """
+        Test if compressed catalogs are detected and decompressed.
+        """
+        self.assertFalse(is_compressed(CATALOG_FILENAME))
+        for filename in [self.gzip_filename, self.zip_filename]:
+            self.assertTrue(is_compressed(filename))
+            catalog = open_catalog(filename)
+            try:
+                self.assertEqual(catalog.read(), self.content)
+            finally:
+                catalog.close()
+
+    def test_line_batches(self):
+        """
+        Test if batches contain every line, whatever the chunk size.
+        """
+        for filename in [CATALOG_FILENAME, self.gzip_filename,
+                         self.zip_filename]:
+            for batch_lines, chunk_bytes in [(1, 7), (3, 50), (4, 1 << 20)]:
+                reader = CatalogReader(filename, batch_lines,
+                                       queue_batches=1,
+                                       chunk_bytes=chunk_bytes)
+                batches = list(reader)
+                self.assertEqual(sum(batches, []), self.lines)
+                for batch in batches[:-1]:
+                    self.assertEqual(len(batch), batch_lines)
+
+    def test_last_line_without_line_break(self):
+        """
+        Test if a last line without line break is read.
+        """
+        filename = self.catalog_dir + '/unterminated.tab.txt'
+        with open(filename, 'wb') as catalog:
+            catalog.write('1\tThe plays\tOscar Wilde\n2\tGreuze\tAlys Macklin')
+        self.assertEqual(list(CatalogReader(filename, 10, chunk_bytes=5)),
+                         [['1\tThe plays\tOscar Wilde',
+                           '2\tGreuze\tAlys Macklin']])
+
+    def test_interrupted_iteration(self):
+        """
+        Test if the reading thread stops when the iteration is interrupted.
+        """
+        threads_count = threading.active_count()
+        batches = iter(CatalogReader(self.gzip_filename, 1, queue_batches=1,
+                                     chunk_bytes=10))
+        self.assertEqual(next(batches), self.lines[:1])
+        batches.close()
+        self.assertEqual(threading.active_count(), threads_count)
+
+    def test_reading_errors(self):
+        """
+        Test if errors of the reading thread are raised by the iteration.
+        """
+        filename = self.catalog_dir + '/corrupted.tab.txt.gz'
+        with open(self.gzip_filename, 'rb') as catalog:
+            content = catalog.read()
+        with open(filename, 'wb') as catalog:
+            catalog.write(content[:len(content) // 2])
+
+        reader = CatalogReader(filename, 1)
+        self.assertRaises(IOError, list, reader)
+        self.assertRaises(IOError, list,
+                          CatalogReader(self.catalog_dir + '/missing.txt', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
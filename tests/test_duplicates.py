@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+import sys
+
+sys.path.append('lib')
+from duplicates import DuplicateGroups
+
+
+class DuplicateGroupsTests(unittest.TestCase):
+    """
+    Test case for DuplicateGroups class.
+    """
+
+    def setUp(self):
+        """
+        Setup groups that will be subjected to the tests.
+        """
+        self.groups = DuplicateGroups()
+        for doc_index, iid in [(0, 'a'), (0, 'b'), (3, 'c'), (5, 'a'),
+                               (0, 'a')]:
+            self.groups.add(doc_index, iid)
+
+    def test_members(self):
+        """
+        Test if members are found by document and by identifier.
+        """
+        self.assertEqual(len(self.groups), 3)
+        self.assertEqual(self.groups.count, 5)
+        self.assertEqual(self.groups.members(0), ['a', 'b', 'a'])
+        self.assertEqual(self.groups.members(1), [])
+        self.assertEqual(self.groups.docs_of('a'), [0, 5])
+        self.assertEqual(self.groups.docs_of('unknown'), [])
+
+        docs_indices, counts = self.groups.counts(0, 4)
+        np.testing.assert_array_equal(docs_indices, [0, 3])
+        np.testing.assert_array_equal(counts, [3, 1])
+
+    def test_remove_and_pop(self):
+        """
+        Test if removed members are no longer found.
+        """
+        self.assertEqual(self.groups.remove(0, 'a'), 2)
+        self.assertEqual(self.groups.remove(0, 'a'), 0)
+        self.assertEqual(self.groups.members(0), ['b'])
+        self.assertEqual(self.groups.docs_of('a'), [5])
+
+        self.assertEqual(self.groups.pop(5), ['a'])
+        self.assertEqual(self.groups.pop(5), [])
+        self.assertEqual(self.groups.docs_of('a'), [])
+        self.assertEqual(self.groups.count, 2)
+
+    def test_take(self):
+        """
+        Test if groups follow their documents once renumbered.
+        """
+        groups = self.groups.take(np.array([1, 3, 4, 5]))
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(groups.members(1), ['c'])
+        self.assertEqual(groups.members(3), ['a'])
+        self.assertEqual(groups.docs_of('a'), [3])
+        self.assertEqual(groups.count, 2)
+        self.assertEqual(len(DuplicateGroups().take(np.arange(3))), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
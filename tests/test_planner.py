@@ -0,0 +1,53 @@
+import unittest
+import sys
+
+sys.path.append('lib')
+from planner import QueryPlan
+from planner import SegmentPlan
+from query import Query
+
+
+class QueryPlanTests(unittest.TestCase):
+    """
+    Test case for QueryPlan and SegmentPlan classes.
+    """
+
+    def test_explain(self):
+        """
+        Test if plans describe the terms and the steps of each segment.
+        """
+        plan = QueryPlan('the Oscar wilde', 'all',
+                         Query('the Oscar wilde', ['the']))
+        segment_plan = SegmentPlan(100, 50)
+        segment_plan.terms = [('oscar', 3), ('wilde', 40)]
+        segment_plan.steps = [('wilde', 'gallop', 2)]
+        segment_plan.candidates = 2
+        plan.segments.append(segment_plan)
+
+        self.assertEqual(str(plan), '\n'.join([
+            'query: the Oscar wilde',
+            'mode: all',
+            'terms: oscar wilde',
+            'dropped stop words: the',
+            'segment of documents 100 to 149:',
+            '  terms by frequency: oscar (3), wilde (40)',
+            '  intersect wilde by gallop: 2 candidates',
+            '  scored 2 candidates']))
+
+    def test_early_exit(self):
+        """
+        Test if plans describe where the evaluation stopped.
+        """
+        plan = QueryPlan('unknown', 'all', Query('unknown', []))
+        plan.exit = 'missing term unknown'
+        self.assertEqual(plan.explain().split('\n')[-1],
+                         'stopped: missing term unknown')
+
+        segment_plan = SegmentPlan(0, 10)
+        segment_plan.exit = 'no document contains all terms'
+        self.assertEqual(segment_plan.lines()[-1],
+                         '  stopped: no document contains all terms')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import numpy as np
+import sys
+
+sys.path.append('lib')
+from positions import PositionalIndex
+from search import Index
+from search import Indexable
+from search import TermMatrixBuilder
+from fixtures import sample_stop_words
+
+
+class PositionalIndexTests(unittest.TestCase):
+    """
+    Test case for PositionalIndex class.
+    """
+
+    def setUp(self):
+        """
+        Setup positional index that will be subjected to the tests.
+        """
+        self.samples = [
+            Indexable(1, 'oscar wilde the plays', True),
+            Indexable(2, 'plays by oscar wilde', True),
+            Indexable(3, 'wilde plays oscar plays wilde', True),
+            Indexable(4, 'the wilde oscar', True),
+        ]
+        builder = TermMatrixBuilder(sample_stop_words(), positional=True)
+        for indexable in self.samples:
+            builder.add(indexable)
+        index = Index(sample_stop_words())
+        index.build_index_from(builder)
+        self.positions = PositionalIndex()
+        self.positions.build_index_from(builder, index)
+
+    def test_decoded_positions(self):
+        """
+        Test if positions are decoded for the requested documents.
+        """
+        rows, positions = self.positions.positions('wilde',
+                                                   np.array([0, 2, 3]))
+        np.testing.assert_array_equal(rows, [0, 1, 1, 2])
+        np.testing.assert_array_equal(positions, [1, 0, 4, 1])
+
+        rows, positions = self.positions.positions('plays', np.array([2]))
+        np.testing.assert_array_equal(rows, [0, 0])
+        np.testing.assert_array_equal(positions, [1, 3])
+
+    def test_phrase_match(self):
+        """
+        Test if documents with words in the phrase order are matched.
+        """
+        docs_indices = np.array([0, 1, 2, 3])
+        matches = self.positions.match_phrase(
+            docs_indices, [('oscar', 0), ('wilde', 1)])
+        np.testing.assert_array_equal(matches, [0, 1])
+
+        # the stop word between the words holds a position
+        matches = self.positions.match_phrase(
+            docs_indices, [('wilde', 0), ('plays', 2)])
+        np.testing.assert_array_equal(matches, [0])
+
+    def test_phrase_starting_before_document(self):
+        """
+        Test if phrases can not start before the first word of a document.
+        """
+        matches = self.positions.match_phrase(
+            np.array([0, 1, 2]), [('plays', 1), ('oscar', 2)])
+        np.testing.assert_array_equal(matches, [2])
+
+    def test_near_match(self):
+        """
+        Test if words close to each other, in any order, are matched.
+        """
+        docs_indices = np.array([0, 1, 2])
+        matches = self.positions.match_near(docs_indices, 'oscar', 'plays', 1)
+        np.testing.assert_array_equal(matches, [2])
+
+        matches = self.positions.match_near(docs_indices, 'plays', 'oscar', 2)
+        np.testing.assert_array_equal(matches, [1, 2])
+
+        matches = self.positions.match_near(docs_indices, 'oscar', 'plays', 3)
+        np.testing.assert_array_equal(matches, [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
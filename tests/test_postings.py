@@ -0,0 +1,199 @@
+import unittest
+import numpy as np
+import sys
+
+sys.path.append('lib')
+from postings import BITMAP
+from postings import BLOCK_SIZE
+from postings import BLOCKS
+from postings import CompressedPostings
+from postings import GALLOP
+from postings import as_postings
+from postings import intersect
+from postings import intersect_pair
+from postings import lookup
+from postings import pair_strategy
+from postings import seek
+
+
+class IntersectionTests(unittest.TestCase):
+    """
+    Test case for posting lists intersection.
+    """
+
+    def test_pair_intersection(self):
+        """
+        Test if two posting lists are correctly intersected.
+        """
+        small = as_postings([2, 5, 9, 40])
+        large = as_postings([1, 2, 3, 5, 8, 13, 21, 40, 41])
+
+        np.testing.assert_array_equal(intersect_pair(small, large), [2, 5, 40])
+        np.testing.assert_array_equal(intersect_pair(large, small), [2, 5, 40])
+
+    def test_pair_intersection_beyond_last_doc(self):
+        """
+        Test if documents past the end of the larger list are not matched.
+        """
+        small = as_postings([50, 60])
+        large = as_postings([1, 2, 3, 50])
+
+        np.testing.assert_array_equal(intersect_pair(small, large), [50])
+
+    def test_empty_intersection(self):
+        """
+        Test if intersections with empty lists are empty.
+        """
+        postings = as_postings([1, 2, 3])
+
+        self.assertEqual(len(intersect([])), 0)
+        self.assertEqual(len(intersect([postings, as_postings([])])), 0)
+
+    def test_intersection_matches_sets(self):
+        """
+        Test if intersections agree with set intersections on random lists.
+        """
+        random = np.random.RandomState(7)
+        postings_lists = [np.unique(random.randint(0, 1000, size))
+                          for size in [500, 40, 900, 200]]
+
+        expected_indices = set(postings_lists[0])
+        for postings in postings_lists[1:]:
+            expected_indices &= set(postings)
+
+        search_results = intersect([as_postings(postings)
+                                    for postings in postings_lists])
+        self.assertEqual(search_results.dtype, np.int32)
+        np.testing.assert_array_equal(search_results,
+                                      sorted(expected_indices))
+
+    def test_pair_strategies(self):
+        """
+        Test if all pair strategies agree, and are chosen by length ratio.
+        """
+        random = np.random.RandomState(11)
+        large = as_postings(np.unique(random.randint(0, 5000, 2000)))
+        compressed_postings = CompressedPostings()
+        compressed_postings.build([0, len(large)], large)
+        compressed = compressed_postings.postings_list(0)
+        for size in [1, 50, 1000]:
+            small = as_postings(np.unique(random.randint(0, 6000, size)))
+            expected_indices = sorted(set(small) & set(large))
+            for strategy in [GALLOP, BITMAP, BLOCKS]:
+                np.testing.assert_array_equal(
+                    intersect_pair(small, compressed, strategy),
+                    expected_indices)
+            for strategy in [GALLOP, BITMAP]:
+                np.testing.assert_array_equal(
+                    intersect_pair(small, large, strategy), expected_indices)
+
+        self.assertEqual(pair_strategy(large[:10], large), GALLOP)
+        self.assertEqual(pair_strategy(large[:1000], large), BITMAP)
+        # the bitmap would cover far more documents than both lists hold
+        sparse = as_postings([0, 10 ** 6])
+        self.assertEqual(pair_strategy(sparse, large[:3]), GALLOP)
+        np.testing.assert_array_equal(
+            intersect_pair(sparse, as_postings([0, 5, 10 ** 6]), BITMAP),
+            [0, 10 ** 6])
+        self.assertEqual(pair_strategy(large[:10], compressed), BLOCKS)
+
+    def test_intersection_steps(self):
+        """
+        Test if intersection steps follow the lists from the rarest.
+        """
+        steps = []
+        intersect([as_postings(range(100)), as_postings([3, 7, 200]),
+                   as_postings([7, 8])], steps)
+        self.assertListEqual(steps, [(1, BITMAP, 1), (0, GALLOP, 1)])
+
+
+class CompressedPostingsTests(unittest.TestCase):
+    """
+    Test case for CompressedPostings class.
+    """
+
+    def setUp(self):
+        """
+        Setup posting lists of various lengths and gaps.
+        """
+        random = np.random.RandomState(11)
+        self.postings_lists = [
+            np.unique(random.randint(0, 3 * size + 1, size))
+            for size in [0, 1, 2, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1,
+                         1000, 5000]]
+        self.postings_lists.append(np.array([0, 2 ** 30, 2 ** 31 - 1]))
+        lengths = [len(postings) for postings in self.postings_lists]
+        self.compressed = CompressedPostings()
+        self.compressed.build(np.cumsum([0] + lengths),
+                              np.concatenate(self.postings_lists))
+
+    def test_decode(self):
+        """
+        Test if posting lists are decoded, as a whole or by position.
+        """
+        self.assertEqual(len(self.compressed), len(self.postings_lists))
+        for term, postings in enumerate(self.postings_lists):
+            postings_list = self.compressed.postings_list(term)
+            self.assertEqual(len(postings_list), len(postings))
+            np.testing.assert_array_equal(postings_list.decode(), postings)
+            np.testing.assert_array_equal(as_postings(postings_list),
+                                          postings)
+            for position in range(0, len(postings), 37):
+                self.assertEqual(postings_list[position], postings[position])
+
+    def test_seek(self):
+        """
+        Test if seeking in a compressed list matches a plain list.
+        """
+        random = np.random.RandomState(12)
+        for term, postings in enumerate(self.postings_lists):
+            postings_list = self.compressed.postings_list(term)
+            for target in random.randint(-1, 3 * len(postings) + 2, 50):
+                for start in [0, len(postings) // 2, len(postings)]:
+                    self.assertEqual(seek(postings_list, start, target),
+                                     seek(postings, start, target))
+
+    def test_intersection(self):
+        """
+        Test if intersections with compressed lists match plain lists.
+        """
+        random = np.random.RandomState(13)
+        docs_indices = as_postings(np.unique(random.randint(0, 5000, 300)))
+        for term, postings in enumerate(self.postings_lists):
+            postings_list = self.compressed.postings_list(term)
+            np.testing.assert_array_equal(
+                intersect_pair(docs_indices, postings_list),
+                intersect_pair(docs_indices, as_postings(postings)))
+            np.testing.assert_array_equal(
+                intersect([postings_list, self.compressed.postings_list(6)]),
+                intersect([as_postings(postings),
+                           as_postings(self.postings_lists[6])]))
+
+    def test_lookup(self):
+        """
+        Test if documents are found at their position in compressed lists.
+        """
+        random = np.random.RandomState(14)
+        docs_indices = as_postings(np.unique(random.randint(0, 5000, 300)))
+        for term, postings in enumerate(self.postings_lists):
+            postings_list = self.compressed.postings_list(term)
+            found, positions = lookup(postings_list, docs_indices)
+            expected_found = np.in1d(docs_indices, postings)
+            np.testing.assert_array_equal(found, expected_found)
+            np.testing.assert_array_equal(postings[positions],
+                                          docs_indices[expected_found])
+            np.testing.assert_array_equal(
+                positions, lookup(as_postings(postings), docs_indices)[1])
+
+    def test_compression(self):
+        """
+        Test if dense posting lists take less memory once compressed.
+        """
+        postings = as_postings(np.arange(0, 100000, 3))
+        compressed = CompressedPostings()
+        compressed.build([0, len(postings)], postings)
+        self.assertLess(compressed.nbytes() * 4, postings.nbytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import numpy as np
+import sys
+
+sys.path.append('lib')
+from pruning import MaxScoreEvaluator
+
+
+def exhaustive_top_k(postings_lists, impacts_lists, k):
+    scores = {}
+    for postings, impacts in zip(postings_lists, impacts_lists):
+        for doc, impact in zip(postings, impacts):
+            scores[doc] = scores.get(doc, 0.0) + impact
+    ranking = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return ranking[:k]
+
+
+class MaxScoreEvaluatorTests(unittest.TestCase):
+    """
+    Test case for MaxScoreEvaluator class.
+    """
+
+    def build_evaluator(self, postings_lists, impacts_lists):
+        upper_bounds = [max(impacts) if len(impacts) > 0 else 0.0
+                        for impacts in impacts_lists]
+        return MaxScoreEvaluator(postings_lists, impacts_lists, upper_bounds)
+
+    def test_simple_top_k(self):
+        """
+        Test if documents with any term are ranked by summed impacts.
+        """
+        postings_lists = [np.array([0, 2, 4]), np.array([2, 3])]
+        impacts_lists = [np.array([0.5, 0.2, 0.1]), np.array([0.6, 0.9])]
+        evaluator = self.build_evaluator(postings_lists, impacts_lists)
+
+        docs, scores = evaluator.top_k(3)
+        np.testing.assert_array_equal(docs, [3, 2, 0])
+        np.testing.assert_almost_equal(scores, [0.9, 0.8, 0.5])
+
+    def test_deleted_documents_are_skipped(self):
+        """
+        Test if deleted documents are never selected.
+        """
+        postings_lists = [np.array([0, 2, 4]), np.array([2, 3])]
+        impacts_lists = [np.array([0.5, 0.2, 0.1]), np.array([0.6, 0.9])]
+        upper_bounds = [0.5, 0.9]
+        deleted = np.array([False, False, False, True, False])
+        evaluator = MaxScoreEvaluator(postings_lists, impacts_lists, upper_bounds,
+                                  deleted)
+
+        docs, scores = evaluator.top_k(3)
+        np.testing.assert_array_equal(docs, [2, 0, 4])
+        np.testing.assert_almost_equal(scores, [0.8, 0.5, 0.1])
+
+    def test_empty_inputs(self):
+        """
+        Test if queries without postings or results return nothing.
+        """
+        evaluator = self.build_evaluator([np.array([], dtype=np.int32)],
+                                         [np.array([])])
+        self.assertEqual(len(evaluator.top_k(10)[0]), 0)
+        self.assertEqual(len(self.build_evaluator([], []).top_k(10)[0]), 0)
+
+    def test_matches_exhaustive_evaluation(self):
+        """
+        Test if pruning returns the same documents as scoring all of them.
+        """
+        random = np.random.RandomState(11)
+        for n_terms in [1, 2, 3, 5]:
+            postings_lists = []
+            impacts_lists = []
+            for term in range(n_terms):
+                size = random.randint(1, 400)
+                postings_lists.append(
+                    np.unique(random.randint(0, 2000, size)).astype(np.int32))
+                # coarse impacts produce many ties
+                impacts_lists.append(
+                    random.randint(1, 6, len(postings_lists[-1])) / 4.0)
+
+            evaluator = self.build_evaluator(postings_lists, impacts_lists)
+            for k in [1, 10, 50]:
+                docs, scores = evaluator.top_k(k)
+                expected = exhaustive_top_k(postings_lists, impacts_lists, k)
+                np.testing.assert_array_equal(docs, [d for d, s in expected])
+                np.testing.assert_almost_equal(scores,
+                                               [s for d, s in expected])
+
+    def test_documents_are_pruned(self):
+        """
+        Test if documents that can not enter the top k are not scored.
+        """
+        rare_postings = np.array([10, 500, 900], dtype=np.int32)
+        common_postings = np.arange(1000, dtype=np.int32)
+        evaluator = self.build_evaluator(
+            [rare_postings, common_postings],
+            [np.ones(3), np.ones(1000) * 0.01])
+
+        docs, scores = evaluator.top_k(3)
+        np.testing.assert_array_equal(docs, [10, 500, 900])
+        self.assertLess(evaluator.scored_docs_count, 100)
+
+    def test_cost_independent_of_unmatched_documents(self):
+        """
+        Test if documents containing no query term are never visited.
+        """
+        # arrays covering every index up to these postings would not fit
+        # in memory, so the query only completes if the evaluator works on
+        # the postings alone
+        last_doc = np.iinfo(np.int32).max
+        postings_lists = [np.array([3, last_doc - 1], dtype=np.int32),
+                          np.array([last_doc - 1, last_doc], dtype=np.int32)]
+        impacts_lists = [np.array([0.5, 0.2]), np.array([0.4, 0.1])]
+        evaluator = self.build_evaluator(postings_lists, impacts_lists)
+
+        docs, scores = evaluator.top_k(2)
+        np.testing.assert_array_equal(docs, [last_doc - 1, 3])
+        np.testing.assert_almost_equal(scores, [0.6, 0.5])
+        self.assertEqual(evaluator.scored_docs_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import sys
+
+sys.path.append('lib')
+from query import Query
+from fixtures import sample_stop_words
+
+
+class QueryTests(unittest.TestCase):
+    """
+    Test case for Query class.
+    """
+
+    def setUp(self):
+        self.stop_words = sample_stop_words() + ['of']
+
+    def test_plain_terms(self):
+        """
+        Test if plain queries are split in lower case terms.
+        """
+        query = Query('Indexable  METADATA', self.stop_words)
+        self.assertListEqual(query.terms, ['indexable', 'metadata'])
+        self.assertFalse(query.has_positional_constraints())
+
+    def test_phrase(self):
+        """
+        Test if phrases keep the offsets of their indexed words.
+        """
+        query = Query('"The Importance of being Earnest" wilde',
+                      self.stop_words)
+        self.assertListEqual(query.terms,
+                             ['importance', 'being', 'earnest', 'wilde'])
+        self.assertListEqual(query.phrases,
+                             [[('importance', 1), ('being', 3),
+                               ('earnest', 4)]])
+
+    def test_single_word_phrase(self):
+        """
+        Test if phrases with one indexed word are plain terms.
+        """
+        query = Query('"the plays"', self.stop_words)
+        self.assertListEqual(query.terms, ['plays'])
+        self.assertFalse(query.has_positional_constraints())
+
+    def test_proximity(self):
+        """
+        Test if proximity operators are parsed.
+        """
+        query = Query('oscar NEAR/2 wilde plays', self.stop_words)
+        self.assertListEqual(query.terms, ['oscar', 'wilde', 'plays'])
+        self.assertListEqual(query.proximities, [('oscar', 'wilde', 2)])
+
+    def test_invalid_proximity(self):
+        """
+        Test if proximity operators without operands are plain terms.
+        """
+        query = Query('NEAR/2 wilde', self.stop_words)
+        self.assertListEqual(query.terms, ['near/2', 'wilde'])
+        self.assertFalse(query.has_positional_constraints())
+
+    def test_dropped_stop_words(self):
+        """
+        Test if stop words are dropped from the terms.
+        """
+        query = Query('the plays of Wilde', self.stop_words)
+        self.assertListEqual(query.terms, ['plays', 'wilde'])
+        self.assertListEqual(query.dropped_words, ['the', 'of'])
+
+    def test_normalization(self):
+        """
+        Test if terms, phrases and proximity operands are normalized.
+        """
+        def normalize(text):
+            return text.lower().replace(',', ' ').split()
+
+        query = Query('Wilde,Oscar "the Importance,of" oscar NEAR/2 wilde,x',
+                      self.stop_words, normalize)
+        self.assertListEqual(query.terms, ['wilde', 'oscar', 'importance',
+                                           'oscar', 'wilde', 'x'])
+        self.assertListEqual(query.phrases, [])
+        self.assertListEqual(query.proximities, [('oscar', 'wilde', 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
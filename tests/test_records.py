@@ -0,0 +1,159 @@
+import unittest
+import numpy as np
+import shutil
+import sys
+import tempfile
+
+sys.path.append('lib')
+from book import Book
+from records import RecordFile
+from records import RecordStore
+from search import Indexable
+from snapshot import SnapshotReader
+from snapshot import SnapshotWriter
+from store import DocumentStore
+
+
+class RecordFileTests(unittest.TestCase):
+    """
+    Test case for RecordFile class.
+    """
+
+    def test_append_and_read(self):
+        """
+        Test if records are read back by offset, before and after appends.
+        """
+        records = RecordFile()
+        first = records.append(['oscar wilde', '', 'plays'])
+        self.assertEqual(records.read(first, 3), ('oscar wilde', '', 'plays'))
+        second = records.append(['poems', 'x' * 5000, ''])
+        self.assertEqual(records.read(second, 3), ('poems', 'x' * 5000, ''))
+        self.assertEqual(records.read(first, 3), ('oscar wilde', '', 'plays'))
+        self.assertEqual(len(records), second + 12 + 5005)
+
+    def test_snapshot_base(self):
+        """
+        Test if appended records follow the records of a snapshot.
+        """
+        records = RecordFile()
+        offset = records.append(['title', 'author'])
+        raw = records.read_raw(offset, 2)
+
+        loaded_records = RecordFile(np.frombuffer(raw, dtype=np.uint8),
+                                    cache_entries=0)
+        self.assertIsNone(loaded_records.cache)
+        new_offset = loaded_records.append(['new title', 'new author'])
+        self.assertEqual(new_offset, len(raw))
+        self.assertEqual(loaded_records.read(0, 2), ('title', 'author'))
+        self.assertEqual(loaded_records.read(new_offset, 2),
+                         ('new title', 'new author'))
+
+
+class RecordStoreTests(unittest.TestCase):
+    """
+    Test case for RecordStore class.
+    """
+
+    def setUp(self):
+        """
+        Setup stores of indexables and books.
+        """
+        self.indexables = [Indexable(1, 'oscar wilde the plays'),
+                           Indexable(2, '', True),
+                           Indexable(3, 'the wilde oscar')]
+        self.books = [Book('10', 'the plays', 'oscar wilde'),
+                      Book('11', 'poems', '')]
+        self.indexables_store = RecordStore()
+        for indexable in self.indexables:
+            self.indexables_store.append(indexable)
+        self.books_store = RecordStore()
+        for book in self.books:
+            self.books_store.append(book)
+
+    def test_materialized_objects(self):
+        """
+        Test if stored objects are materialized with the same fields.
+        """
+        self.assertEqual(list(self.indexables_store), self.indexables)
+        self.assertEqual(list(self.books_store), self.books)
+        self.assertEqual(self.books_store[-1], self.books[-1])
+        self.assertEqual(self.indexables_store.iids(), [1, 2, 3])
+        self.assertEqual(self.books_store.iids(), ['10', '11'])
+        self.assertEqual(self.books_store.iid(1), '11')
+        self.assertEqual(self.books_store.fields(0, ['author', 'title']),
+                         ('oscar wilde', 'the plays'))
+        self.assertEqual(self.books_store.fields(0),
+                         ('the plays', 'oscar wilde'))
+        self.assertRaises(TypeError, self.indexables_store.append,
+                          self.books[0])
+
+    def test_extend_and_take(self):
+        """
+        Test if stores are concatenated and subsets selected in order.
+        """
+        store = RecordStore(self.books_store.records)
+        store.extend(self.books_store)
+        self.assertIs(store.records, self.books_store.records)
+        documents = DocumentStore()
+        for book in self.books:
+            documents.append(book)
+        store.extend(documents)
+        self.assertEqual(list(store), self.books + self.books)
+
+        subset = store.take([3, 0])
+        self.assertIs(subset.records, store.records)
+        self.assertEqual(list(subset), [self.books[1], self.books[0]])
+        self.assertEqual(list(store.take([])), [])
+        self.assertEqual(list(self.indexables_store.take([2, 1])),
+                         [self.indexables[2], self.indexables[1]])
+
+    def test_snapshot(self):
+        """
+        Test if the first objects of a store are restored from a snapshot.
+        """
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            for store in [self.indexables_store, self.books_store]:
+                subset = store.take([1, 0])
+                writer = SnapshotWriter(snapshot_dir)
+                subset.save(writer, 1)
+                writer.close()
+
+                loaded_store = RecordStore()
+                loaded_store.load(SnapshotReader(snapshot_dir))
+                self.assertEqual(list(loaded_store), [store[1]])
+                loaded_store.append(store[0])
+                self.assertEqual(list(loaded_store), [store[1], store[0]])
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_snapshot_iids(self):
+        """
+        Test if identifiers are listed without reading the records.
+        """
+        def unexpected_read(offset, fields_count):
+            raise AssertionError('Record read for its identifier')
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            writer = SnapshotWriter(snapshot_dir)
+            self.books_store.save(writer)
+            writer.close()
+
+            loaded_store = RecordStore()
+            loaded_store.load(SnapshotReader(snapshot_dir))
+            loaded_store.records.read = unexpected_read
+            self.assertEqual(loaded_store.iids(), ['10', '11'])
+            self.assertEqual(loaded_store.iid(1), '11')
+            self.assertEqual(loaded_store.take([1]).iids(), ['11'])
+            del loaded_store.records.read
+
+            loaded_store.append(Book('12', 'poems', 'oscar wilde'))
+            self.assertEqual(loaded_store.iids(), ['10', '11', '12'])
+            self.assertEqual(loaded_store[2].title, 'poems')
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,28 @@
 import unittest
 import numpy as np
+import os
+import shutil
 import sys
+import tempfile
+import threading
 
 sys.path.append('lib')
 from search import Index
 from search import Indexable
 from search import IndexableResult
+from search import TermMatrixBuilder
 from search import TfidfRank
 from search import SearchEngine
-
-
-def sample_stop_words():
-    return ['a', 'the', 'this', 'is']
+from search import ALL_TERMS
+from search import ANY_TERMS
+from search import FLOAT32
+from search import QUANTIZED
+from search import top_k_positions
+from snapshot import SNAPSHOT_VERSION
+from store import DocumentStore
+from records import RecordStore
+from fixtures import random_objects
+from fixtures import sample_stop_words
 
 
 class SearchEngineTests(unittest.TestCase):
@@ -83,12 +94,892 @@ class SearchEngineTests(unittest.TestCase):
         results = self.engine.search('indexable metadata', 1)
         self.assertListEqual(results, expected_results)
 
+    def test_search_ranking(self):
+        """
+        Test if the best candidates are selected, ties kept in index order.
+        """
+        objects = [Indexable(1, 'oscar wilde plays'),
+                   Indexable(2, 'oscar wilde'),
+                   Indexable(3, 'wilde poems'),
+                   Indexable(4, 'oscar wilde letters'),
+                   Indexable(5, 'oscar wilde complete plays poems'),
+                   Indexable(6, 'oscar winners'),
+                   Indexable(7, 'oscar wilde')]
+        self.build_sample_index(objects)
+
+        # shorter documents first, then documents whose other terms are
+        # more common ('plays' is in two documents, 'letters' in one)
+        for query, n_results, expected_iids in [
+                ('oscar wilde', 10, [2, 7, 1, 4, 5]),
+                ('oscar wilde', 3, [2, 7, 1]),
+                ('oscar wilde', 1, [2]),
+                ('wilde plays', 10, [1, 5]),
+                ('poems', 10, [3, 5]),
+                ('oscar unknown', 10, [])]:
+            results = self.engine.search(query, n_results)
+            self.assertListEqual([result.indexable.iid for result in results],
+                                 expected_iids)
+        results = self.engine.search('oscar wilde')
+        self.assertAlmostEqual(results[0].score, 2 ** 0.5)
+        self.assertEqual(results[0].score, results[1].score)
+
+    def test_any_terms_search(self):
+        """
+        Test if documents with any query term are ranked in any terms mode.
+        """
+        objects = [Indexable(1, 'oscar wilde plays'),
+                   Indexable(2, 'oscar wilde'),
+                   Indexable(3, 'wilde poems'),
+                   Indexable(4, 'oscar poems'),
+                   Indexable(5, 'poems'),
+                   Indexable(6, 'wilde letters'),
+                   Indexable(7, 'collected plays'),
+                   Indexable(8, 'oscar winners')]
+        self.build_sample_index(objects)
+
+        # documents with both terms first, then documents by the weight of
+        # the matched term in them: 'poems' (3 documents) weighs more than
+        # 'oscar' (4 documents), and less in longer documents
+        for query, n_results, expected_iids in [
+                ('oscar poems', 10, [4, 5, 3, 2, 8, 1]),
+                ('oscar poems unknown', 3, [4, 5, 3]),
+                ('wilde', 10, [2, 3, 6, 1]),
+                ('unknown', 10, [])]:
+            results = self.engine.search(query, n_results, ANY_TERMS)
+            self.assertListEqual([result.indexable.iid for result in results],
+                                 expected_iids)
+        results = self.engine.search('poems', 10, ANY_TERMS)
+        self.assertAlmostEqual(results[0].score, 1.0)
+
+    def test_phrase_search(self):
+        """
+        Test if phrase and proximity queries filter bag-of-words matches.
+        """
+        sample1 = Indexable(1, 'oscar wilde the plays', True)
+        sample2 = Indexable(2, 'plays by wilde and oscar', True)
+        sample3 = Indexable(3, 'the plays of oscar wilde', True)
+        for compressed in [False, True]:
+            self.engine = SearchEngine(positional=True, compressed=compressed)
+            self.build_sample_index([sample1, sample2, sample3])
+
+            results = self.engine.search('"oscar wilde" plays')
+            self.assertListEqual([result.indexable for result in results],
+                                 [sample1, sample3])
+            self.assertListEqual(results, [
+                result for result in self.engine.search('oscar wilde plays')
+                if result.indexable in [sample1, sample3]])
+
+            results = self.engine.search('plays NEAR/2 oscar')
+            self.assertListEqual([result.indexable for result in results],
+                                 [sample3])
+
+    def test_phrase_search_without_positions(self):
+        """
+        Test if phrase queries are rejected when positions are not indexed.
+        """
+        self.build_sample_index([Indexable(1, 'oscar wilde')])
+        self.assertRaises(ValueError, self.engine.search, '"oscar wilde"')
+
+    def test_unknown_query_mode(self):
+        """
+        Test if unknown query modes are rejected.
+        """
+        self.build_sample_index([Indexable(1, 'indexable metadata')])
+        self.assertRaises(ValueError, self.engine.search, 'metadata', 10,
+                          'some')
+
+    def test_explain(self):
+        """
+        Test if query plans follow the terms by frequency and exit early.
+        """
+        objects = [Indexable(iid, 'common' if iid % 10 else 'common rare')
+                   for iid in range(100)]
+        self.build_sample_index(objects)
+
+        plan = self.engine.explain('the Common rare')
+        self.assertListEqual(plan.terms, ['common', 'rare'])
+        self.assertListEqual(plan.dropped_words, ['the'])
+        self.assertIsNone(plan.exit)
+        segment_plan = plan.segments[0]
+        self.assertListEqual(segment_plan.terms, [('rare', 10),
+                                                  ('common', 100)])
+        self.assertListEqual(segment_plan.steps, [('common', 'gallop', 10)])
+        self.assertEqual(segment_plan.candidates, 10)
+        self.assertIn('intersect common by gallop: 10 candidates',
+                      plan.explain())
+
+        plan = self.engine.explain('rare unknown')
+        self.assertEqual(plan.exit, 'missing term unknown')
+        self.assertListEqual(plan.segments, [])
+        self.assertListEqual(self.engine.search('rare unknown'), [])
+        self.assertListEqual(self.engine.search('the this'), [])
+        self.assertEqual(len(self.engine.search('rare unknown', 10,
+                                                ANY_TERMS)), 10)
+
+    def test_search_many(self):
+        """
+        Test if batches of queries are ranked like single searches.
+        """
+        self.engine = SearchEngine(positional=True, cache_entries=0)
+        self.build_sample_index([
+            Indexable(1, 'oscar wilde plays', True),
+            Indexable(2, 'wilde oscar plays and poems', True),
+            Indexable(3, 'the plays of oscar wilde', True),
+            Indexable(4, 'oscar wilde', True),
+            Indexable(5, 'poems', True)])
+        self.engine.add_objects([Indexable(6, 'oscar wilde letters', True),
+                                 Indexable(7, 'plays', True),
+                                 Indexable(8, 'letters of wilde', True)])
+        self.engine.delete(4)
+        self.engine.delete(7)
+        # merges rescore the segments they rewrite
+        self.engine.wait_for_merges()
+
+        # 1 and 3 have the same terms and tie, longer documents come last
+        expected_iids = {
+            ALL_TERMS: [('oscar wilde', [1, 3, 6, 2]),
+                        ('plays', [1, 3, 2]),
+                        ('poems unknown', []),
+                        ('', []),
+                        ('the plays', [1, 3, 2]),
+                        ('wilde letters', [8, 6]),
+                        ('"oscar wilde"', [1, 3, 6]),
+                        ('oscar NEAR/1 plays', [2])],
+            ANY_TERMS: [('oscar wilde', [1, 3, 6, 2, 8]),
+                        ('plays', [1, 3, 2]),
+                        ('poems unknown', [5, 2]),
+                        ('', []),
+                        ('the plays', [1, 3, 2]),
+                        ('wilde letters', [8, 6, 1, 3, 2])]}
+        for mode, queries_iids in expected_iids.iteritems():
+            queries = [query for query, iids in queries_iids]
+            for chunk_size in [1, 4, 100]:
+                batch_results = self.engine.search_many(queries, 10, mode,
+                                                        chunk_size=chunk_size)
+                self.assertListEqual(
+                    [[result.indexable.iid for result in results]
+                     for results in batch_results],
+                    [iids for query, iids in queries_iids])
+                for query, results in zip(queries, batch_results):
+                    self.assertListEqual(results,
+                                         self.engine.search(query, 10, mode))
+        self.assertRaises(ValueError, self.engine.search_many,
+                          ['plays', '"oscar wilde"'], 10, ANY_TERMS)
+
+    def test_streamed_objects_search(self):
+        """
+        Test if objects streamed to start are indexed like added objects.
+        """
+        sample1 = Indexable(1, 'this is an indexable metadata')
+        sample2 = Indexable(2, 'this is an indexable super metadata')
+        sample3 = Indexable(3, 'this is another indexable metadata')
+        self.engine.add_object(sample1)
+        self.engine.start(iter([sample2, sample3]))
+
+        expected_results = [
+            IndexableResult(1.414214, sample1),
+            IndexableResult(0.906589, sample2),
+            IndexableResult(0.906589, sample3),
+        ]
+
+        self.assertEqual(self.engine.count(), 3)
+        results = self.engine.search('indexable metadata')
+        self.assertListEqual(results, expected_results)
+
+    def test_results_cache(self):
+        """
+        Test if repeated queries are answered from the results cache.
+        """
+        self.build_sample_index([Indexable(1, 'indexable metadata'),
+                                 Indexable(2, 'indexable super metadata'),
+                                 Indexable(3, 'another indexable')])
+
+        results = self.engine.search('indexable metadata')
+        self.assertListEqual(self.engine.search('metadata  INDEXABLE'),
+                             results)
+
+        stats = self.engine.cache_stats()
+        self.assertEqual(stats['results']['hits'], 0)
+        self.assertEqual(stats['results']['misses'], 2)
+        self.assertListEqual(self.engine.search('indexable metadata'),
+                             results)
+        self.assertEqual(self.engine.cache_stats()['results']['hits'], 1)
+
+    def test_results_cache_invalidation(self):
+        """
+        Test if cached results are discarded when the index is rebuilt.
+        """
+        self.build_sample_index([Indexable(1, 'indexable metadata')])
+        self.assertEqual(len(self.engine.search('indexable')), 1)
+
+        self.build_sample_index([Indexable(2, 'another indexable')])
+        self.assertEqual(len(self.engine.search('indexable')), 2)
+        self.assertEqual(self.engine.cache_stats()['results']['stale'], 1)
+
+    def test_disabled_cache(self):
+        """
+        Test if caching can be disabled.
+        """
+        self.engine = SearchEngine(cache_entries=0)
+        self.build_sample_index([Indexable(1, 'indexable metadata')])
+
+        self.assertEqual(len(self.engine.search('indexable metadata')), 1)
+        self.assertEqual(self.engine.cache_stats(), {})
+
+    def test_snapshot_round_trip(self):
+        """
+        Test if a loaded snapshot answers queries like the saved engine.
+        """
+        sample1 = Indexable(1, 'this is an indexable metadata')
+        sample2 = Indexable(2, 'this is an indexable super metadata')
+        sample3 = Indexable(3, 'this is another indexable metadata')
+        self.build_sample_index([sample1, sample2, sample3])
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            self.engine.save(snapshot_dir)
+            self.assertTrue(SearchEngine.snapshot_exists(snapshot_dir))
+
+            loaded_engine = SearchEngine()
+            loaded_engine.load(snapshot_dir)
+
+            self.assertEqual(loaded_engine.count(), 3)
+            for query in ['indexable metadata', 'super', 'asdasdasdas']:
+                self.assertListEqual(loaded_engine.search(query),
+                                     self.engine.search(query))
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_positional_snapshot_round_trip(self):
+        """
+        Test if positions are restored from a snapshot.
+        """
+        self.engine = SearchEngine(positional=True)
+        self.build_sample_index([Indexable(1, 'oscar wilde plays', True),
+                                 Indexable(2, 'wilde oscar plays', True)])
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            self.engine.save(snapshot_dir)
+            loaded_engine = SearchEngine()
+            loaded_engine.load(snapshot_dir)
+            self.assertListEqual(loaded_engine.search('"oscar wilde"'),
+                                 self.engine.search('"oscar wilde"'))
+            self.assertEqual(len(loaded_engine.search('"oscar wilde"')), 1)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_interrupted_snapshot_save(self):
+        """
+        Test if an interrupted save keeps the previous snapshot loadable.
+        """
+        self.build_sample_index([Indexable(1, 'indexable metadata'),
+                                 Indexable(2, 'another indexable metadata')])
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            self.engine.save(snapshot_dir)
+            expected_results = self.engine.search('indexable')
+            self.engine.delete(2)
+            self.engine.wait_for_merges()
+
+            def interrupted_save(writer):
+                raise IOError('Disk full')
+            segment = self.engine.segments[0]
+            segment.save = interrupted_save
+            self.assertRaises(IOError, self.engine.save, snapshot_dir)
+            del segment.save
+
+            loaded_engine = SearchEngine()
+            loaded_engine.load(snapshot_dir)
+            self.assertListEqual(loaded_engine.search('indexable'),
+                                 expected_results)
+
+            self.engine.save(snapshot_dir)
+            loaded_engine.load(snapshot_dir)
+            self.assertListEqual(loaded_engine.search('indexable'),
+                                 self.engine.search('indexable'))
+            self.assertEqual(len(loaded_engine.search('indexable')), 1)
+            # entries of older and interrupted saves are removed
+            self.assertEqual(len(os.listdir(snapshot_dir)), 2)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_snapshot_version_check(self):
+        """
+        Test if snapshots written with another format version are rejected.
+        """
+        self.build_sample_index([Indexable(1, 'indexable metadata')])
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            self.engine.save(snapshot_dir)
+            manifest_filename = snapshot_dir + '/manifest.json'
+            with open(manifest_filename) as manifest_file:
+                manifest = manifest_file.read()
+            with open(manifest_filename, 'w') as manifest_file:
+                manifest_file.write(manifest.replace(
+                    '"version": %d' % SNAPSHOT_VERSION, '"version": 0'))
+
+            self.assertFalse(SearchEngine.snapshot_exists(snapshot_dir))
+            self.assertRaises(ValueError, SearchEngine().load, snapshot_dir)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_incremental_segments_match_rebuild(self):
+        """
+        Test if objects added in segments are ranked as after a rebuild.
+        """
+        self.engine = SearchEngine(merge_in_background=False)
+        self.build_sample_index(random_objects(11, 200))
+        for batch in range(6):
+            self.engine.add_objects(random_objects(12 + batch, 20,
+                                                   200 + batch * 20))
+        self.assertTrue(1 < len(self.engine.segments) < 7)
+
+        rebuilt_engine = SearchEngine()
+        rebuilt_engine.start(iter(self.engine.objects))
+        self.assert_same_results(self.engine, rebuilt_engine)
+
+    def test_background_merges(self):
+        """
+        Test if segments merged in the background keep the same results.
+        """
+        self.build_sample_index(random_objects(21, 100))
+        for batch in range(8):
+            self.engine.add_objects(random_objects(22 + batch, 25,
+                                                   100 + batch * 25))
+        self.engine.wait_for_merges()
+        self.assertLess(len(self.engine.segments), 8)
+        self.assertEqual(sum(segment.n_docs
+                             for segment in self.engine.segments), 300)
+
+        rebuilt_engine = SearchEngine()
+        rebuilt_engine.start(iter(self.engine.objects))
+        self.assert_same_results(self.engine, rebuilt_engine)
+
+    def test_added_object_is_searchable(self):
+        """
+        Test if an object added to a started engine is found right away.
+        """
+        self.build_sample_index([Indexable(1, 'indexable metadata')])
+        self.assertEqual(len(self.engine.search('another')), 0)
+
+        self.engine.add_object(Indexable(2, 'another indexable metadata'))
+        results = self.engine.search('another')
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].indexable.iid, 2)
+        self.assertEqual(self.engine.indexed_count, 2)
+
+    def test_segmented_snapshot_round_trip(self):
+        """
+        Test if segments are restored from a snapshot and can grow.
+        """
+        self.engine = SearchEngine(merge_in_background=False)
+        self.build_sample_index(random_objects(31, 100))
+        self.engine.add_objects(random_objects(32, 10, 100))
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            self.engine.save(snapshot_dir)
+            loaded_engine = SearchEngine(merge_in_background=False)
+            loaded_engine.load(snapshot_dir)
+            self.assertEqual(len(loaded_engine.segments), 2)
+            self.assert_same_results(loaded_engine, self.engine)
+
+            new_objects = random_objects(33, 30, 110)
+            loaded_engine.add_objects(new_objects)
+            self.engine.add_objects(new_objects)
+            self.assert_same_results(loaded_engine, self.engine)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_delete(self):
+        """
+        Test if deleted objects are not found and no longer affect scores.
+        """
+        self.engine = SearchEngine(merge_in_background=False,
+                                   compaction_ratio=1.0)
+        objects = random_objects(41, 150)
+        self.build_sample_index(objects)
+        for iid in [3, 50, 149]:
+            self.assertEqual(self.engine.delete(iid), 1)
+        self.assertEqual(self.engine.delete(3), 0)
+        self.assertEqual(self.engine.delete('unknown'), 0)
+        self.assertEqual(self.engine.segments[0].deleted_count, 3)
+
+        rebuilt_engine = SearchEngine()
+        rebuilt_engine.start(iter([indexable for indexable in objects
+                                   if indexable.iid not in [3, 50, 149]]))
+        self.assert_same_results(self.engine, rebuilt_engine)
+
+    def test_rescore_tolerance(self):
+        """
+        Test if segments are only rescored once their idf changed enough.
+        """
+        self.engine = SearchEngine(merge_in_background=False,
+                                   compaction_ratio=1.0,
+                                   rescore_tolerance=0.02)
+        self.build_sample_index(random_objects(44, 2000))
+        self.engine.add_objects(random_objects(45, 100, 2000))
+        self.assertEqual(len(self.engine.segments), 2)
+
+        ranks = [segment.rank for segment in self.engine.segments]
+        self.assertEqual(self.engine.delete(5), 1)
+        self.assertEqual(self.engine.delete(2050), 1)
+        for segment, rank in zip(self.engine.segments, ranks):
+            self.assertIs(segment.rank, rank)
+        self.assertNotIn(5, [result.indexable.iid for result in
+                             self.engine.search('w1', 2100, ANY_TERMS)])
+
+        # the idf drifts as more documents are deleted
+        for iid in range(100, 300):
+            self.engine.delete(iid)
+        for segment, rank in zip(self.engine.segments, ranks):
+            self.assertIsNot(segment.rank, rank)
+
+        self.engine.rescore_tolerance = 0
+        ranks = [segment.rank for segment in self.engine.segments]
+        self.engine.delete(6)
+        for segment, rank in zip(self.engine.segments, ranks):
+            self.assertIsNot(segment.rank, rank)
+
+    def test_update(self):
+        """
+        Test if updated objects are found by their new metadata only.
+        """
+        self.build_sample_index([Indexable(1, 'indexable metadata'),
+                                 Indexable(2, 'another indexable')])
+        self.assertEqual(self.engine.search('another')[0].indexable.iid, 2)
+
+        self.assertEqual(self.engine.update(2, Indexable(2, 'updated')), 1)
+        self.assertEqual(len(self.engine.search('another')), 0)
+        self.assertEqual(self.engine.search('updated')[0].indexable.iid, 2)
+        self.assertEqual(self.engine.count(), 2)
+
+    def test_compaction(self):
+        """
+        Test if deleted objects are dropped once the ratio is exceeded.
+        """
+        self.engine = SearchEngine(merge_in_background=False,
+                                   compaction_ratio=0.1)
+        objects = random_objects(51, 100) + random_objects(52, 10, 100)
+        self.build_sample_index(objects[:100])
+        self.engine.add_objects(objects[100:])
+        deleted_iids = range(0, 99, 9)
+        for iid in deleted_iids:
+            self.engine.delete(iid)
+
+        self.assertEqual(self.engine.deleted_count, 0)
+        self.assertEqual(len(self.engine.objects), 110 - len(deleted_iids))
+        self.assertEqual(self.engine.segments[-1].doc_base,
+                         100 - len(deleted_iids))
+
+        rebuilt_engine = SearchEngine()
+        rebuilt_engine.start(iter([indexable for indexable in objects
+                                   if indexable.iid not in deleted_iids]))
+        self.assert_same_results(self.engine, rebuilt_engine)
+
+        # the identifiers are found after documents are renumbered
+        self.assertEqual(self.engine.delete(105), 1)
+        self.assertEqual(self.engine.count(), 109 - len(deleted_iids))
+
+    def test_deletions_snapshot_round_trip(self):
+        """
+        Test if deleted objects stay deleted in a snapshot.
+        """
+        self.engine = SearchEngine(compaction_ratio=1.0)
+        self.build_sample_index(random_objects(61, 50))
+        self.engine.delete(7)
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            self.engine.save(snapshot_dir)
+            loaded_engine = SearchEngine()
+            loaded_engine.load(snapshot_dir)
+            self.assertEqual(loaded_engine.count(), 49)
+            self.assert_same_results(loaded_engine, self.engine)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_snapshot_load_keeps_arrays_mapped(self):
+        """
+        Test if a snapshot is loaded without reading the stored objects.
+        """
+        def unexpected_iids(store):
+            raise AssertionError('Identifiers listed at load')
+
+        for store_class, lazy_objects in [(DocumentStore, False),
+                                          (RecordStore, True)]:
+            self.engine = SearchEngine(merge_in_background=False,
+                                       lazy_objects=lazy_objects)
+            self.build_sample_index([Indexable('a', 'oscar wilde plays'),
+                                     Indexable('b', 'wilde poems'),
+                                     Indexable('c', 'oscar winners')])
+            snapshot_dir = tempfile.mkdtemp()
+            try:
+                self.engine.save(snapshot_dir)
+                loaded_engine = SearchEngine(merge_in_background=False)
+                iids = store_class.iids
+                store_class.iids = unexpected_iids
+                try:
+                    loaded_engine.load(snapshot_dir)
+                finally:
+                    store_class.iids = iids
+                segment = loaded_engine.segments[0]
+                self.assertIsInstance(segment.iids, np.memmap)
+                self.assertIsInstance(segment.builder._indptr, np.memmap)
+                self.assertIsInstance(loaded_engine.objects._positional,
+                                      np.memmap)
+
+                self.assertEqual(loaded_engine.delete('b'), 1)
+                loaded_engine.add_object(Indexable('d', 'wilde letters'))
+                # shorter documents first, the term weighs more in them
+                self.assertListEqual(
+                    [result.indexable.iid
+                     for result in loaded_engine.search('wilde')], ['d', 'a'])
+                self.assertListEqual(
+                    [result.indexable.iid
+                     for result in loaded_engine.search('oscar')], ['c', 'a'])
+            finally:
+                shutil.rmtree(snapshot_dir)
+
+    def test_compressed_postings(self):
+        """
+        Test if compressed posting lists give the same results.
+        """
+        engines = [SearchEngine(merge_in_background=False, compressed=True),
+                   SearchEngine(merge_in_background=False)]
+        for engine in engines:
+            engine.start(iter(random_objects(71, 2000)))
+            engine.add_objects(random_objects(72, 300, 2000))
+            engine.delete(5)
+        self.assertIsNotNone(engines[0].segments[0].index.postings)
+        self.assert_same_results(engines[0], engines[1])
+        for mode in [ALL_TERMS, ANY_TERMS]:
+            queries = ['w1', 'w2 w3', 'w4 w5 w6']
+            self.assertListEqual(engines[0].search_many(queries, 10, mode),
+                                 engines[1].search_many(queries, 10, mode))
+        # no uncompressed copy of the posting lists is kept
+        self.assertLess(engines[0].segments[0].nbytes(),
+                        engines[1].segments[0].nbytes() -
+                        engines[1].segments[0].index.nbytes() / 2)
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            engines[0].save(snapshot_dir)
+            loaded_engine = SearchEngine()
+            loaded_engine.load(snapshot_dir)
+            self.assertTrue(loaded_engine.compressed)
+            self.assert_same_results(loaded_engine, engines[1])
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_score_precisions(self):
+        """
+        Test if reduced precision scores keep the top results of doubles.
+        """
+        objects = random_objects(81, 3000)
+        expected_engine = SearchEngine(merge_in_background=False)
+        expected_engine.start(iter(objects))
+        queries = ['w1', 'w2 w3', 'w4 w5', 'w6 w7', 'w8 w9', 'w10 w11 w12']
+
+        # a score error of each term moves the k-th best score as much,
+        # quantized scores break nearly tied results in another order
+        for precision, tolerance, agreement in [(FLOAT32, 1e-6, 1.0),
+                                                (QUANTIZED, 3 / 510.0, 0.8)]:
+            engine = SearchEngine(merge_in_background=False,
+                                  precision=precision)
+            engine.start(iter(objects))
+            matches = expected_count = 0
+            for query in queries:
+                for mode in [ALL_TERMS, ANY_TERMS]:
+                    results = engine.search(query, 10, mode)
+                    expected_results = expected_engine.search(query, 10, mode)
+                    self.assertEqual(len(results), len(expected_results))
+                    expected_count += len(expected_results)
+                    np.testing.assert_allclose(
+                        [result.score for result in results],
+                        [result.score for result in expected_results],
+                        atol=tolerance)
+                    matches += len(
+                        set(result.indexable.iid for result in results) &
+                        set(result.indexable.iid for result in
+                            expected_results))
+            self.assertGreaterEqual(matches, agreement * expected_count)
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            engine.save(snapshot_dir)
+            loaded_engine = SearchEngine()
+            loaded_engine.load(snapshot_dir)
+            self.assertEqual(loaded_engine.precision, QUANTIZED)
+            self.assert_same_results(loaded_engine, engine)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_duplicates_collapsed(self):
+        """
+        Test if identical objects are indexed once and scored as before.
+        """
+        distinct_objects = random_objects(91, 200)
+        objects = distinct_objects + [
+            Indexable(200 + copy, distinct_objects[copy % 20].metadata)
+            for copy in range(60)]
+        expected_engine = SearchEngine(merge_in_background=False)
+        expected_engine.start(iter(objects))
+        self.engine = SearchEngine(merge_in_background=False,
+                                   deduplicate=True)
+        self.engine.start(iter(objects))
+
+        self.assertEqual(self.engine.indexed_count, 200)
+        self.assertEqual(self.engine.duplicates.count, 60)
+        self.assertEqual(self.engine.count(), 260)
+        self.assert_same_matches(self.engine, expected_engine)
+
+        results = self.engine.search('w1', 1000, collapse=True)
+        expected_iids = [result.indexable.iid for result
+                         in expected_engine.search('w1', 1000)]
+        self.assertEqual(sorted(iid for result in results
+                                for iid in [result.indexable.iid] +
+                                result.duplicates),
+                         sorted(expected_iids))
+        self.assertLess(len(results), len(expected_iids))
+        for result in results:
+            for iid in result.duplicates:
+                self.assertEqual(objects[iid].metadata,
+                                 result.indexable.metadata)
+
+    def test_duplicates_added_and_deleted(self):
+        """
+        Test if added and deleted duplicates keep the scores of all objects.
+        """
+        expected_engine = SearchEngine(merge_in_background=False,
+                                       compaction_ratio=0.01,
+                                       rescore_tolerance=0)
+        self.engine = SearchEngine(merge_in_background=False,
+                                   compaction_ratio=0.01, deduplicate=True,
+                                   rescore_tolerance=0)
+        objects = random_objects(92, 100)
+        new_objects = [Indexable(100 + copy, objects[copy % 5].metadata)
+                       for copy in range(10)] + random_objects(93, 10, 110)
+        new_objects.append(Indexable(120, new_objects[-1].metadata))
+        for engine in [expected_engine, self.engine]:
+            engine.start(iter(objects))
+            engine.add_objects(new_objects)
+        self.assertEqual(self.engine.indexed_count, 110)
+        self.assert_same_matches(self.engine, expected_engine)
+
+        # deleting a canonical object keeps its duplicates, and deleting a
+        # duplicate keeps the canonical object, before and after compactions
+        for iid in [0, 101, 50, 100, 7, 119, 3, 108]:
+            self.assertEqual(self.engine.delete(iid),
+                             expected_engine.delete(iid))
+            self.assert_same_matches(self.engine, expected_engine)
+        self.assertEqual(self.engine.update(1, Indexable(1, 'w1 w2')),
+                         expected_engine.update(1, Indexable(1, 'w1 w2')))
+        self.assert_same_matches(self.engine, expected_engine)
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            self.engine.save(snapshot_dir)
+            loaded_engine = SearchEngine(merge_in_background=False,
+                                         rescore_tolerance=0)
+            loaded_engine.load(snapshot_dir)
+            self.assertTrue(loaded_engine.deduplicate)
+            self.assert_same_matches(loaded_engine, expected_engine)
+            loaded_engine.add_objects([Indexable(121, objects[2].metadata)])
+            expected_engine.add_objects([Indexable(121, objects[2].metadata)])
+            self.assert_same_matches(loaded_engine, expected_engine)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_lazy_objects(self):
+        """
+        Test if objects kept in a record file give the same results.
+        """
+        expected_engine = SearchEngine(merge_in_background=False,
+                                       compaction_ratio=0.01)
+        self.engine = SearchEngine(merge_in_background=False,
+                                   compaction_ratio=0.01, lazy_objects=True)
+        for engine in [expected_engine, self.engine]:
+            engine.start(iter(random_objects(94, 200)))
+            engine.add_objects(random_objects(95, 20, 200))
+            engine.delete(3)
+            engine.update(4, Indexable(4, 'w1 w2'))
+        self.assertEqual(self.engine.objects.nbytes(),
+                         len(self.engine.objects) * 17)
+        self.assert_same_results(self.engine, expected_engine)
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            self.engine.save(snapshot_dir)
+            loaded_engine = SearchEngine(merge_in_background=False)
+            loaded_engine.load(snapshot_dir)
+            self.assertTrue(loaded_engine.lazy_objects)
+            self.assert_same_results(loaded_engine, expected_engine)
+
+            # the loaded records are read from the snapshot being replaced
+            loaded_engine.add_objects(random_objects(96, 5, 220))
+            expected_engine.add_objects(random_objects(96, 5, 220))
+            loaded_engine.save(snapshot_dir)
+            self.assert_same_results(loaded_engine, expected_engine)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_warm_up_partial_results(self):
+        """
+        Test if results during a warm-up are those of the indexed prefix.
+        """
+        objects = random_objects(97, 100)
+        published = threading.Event()
+        resumed = threading.Event()
+
+        def gated_objects():
+            for position, indexable in enumerate(objects):
+                # the previous chunk is published once the next one starts
+                if position > 0 and position % 30 == 0:
+                    published.set()
+                    resumed.wait()
+                    resumed.clear()
+                yield indexable
+
+        self.engine = SearchEngine(merge_in_background=False,
+                                   rescore_tolerance=0)
+        self.engine.warm_up(gated_objects(), chunk_size=30,
+                            progress=lambda: 0.25)
+        for indexed_count in [30, 60, 90]:
+            published.wait()
+            published.clear()
+            expected_engine = SearchEngine()
+            expected_engine.start(iter(objects[:indexed_count]))
+            self.assertTrue(self.engine.warming_up)
+            # scores are only final once the warm-up is done
+            self.assert_same_documents(self.engine, expected_engine)
+            results = self.engine.search('w1', 10, ANY_TERMS)
+            self.assertFalse(results.complete)
+            self.assertEqual(results.covered_count, indexed_count)
+            self.assertEqual(results.coverage, 0.25)
+            resumed.set()
+
+        self.engine.wait_for_warm_up()
+        expected_engine = SearchEngine()
+        expected_engine.start(iter(objects))
+        self.assert_same_results(self.engine, expected_engine)
+        results = self.engine.search('w1', 10, ANY_TERMS)
+        self.assertTrue(results.complete)
+        self.assertEqual(results.covered_count, 100)
+        self.assertEqual(results.coverage, 1.0)
+
+    def test_warm_up_deferred_rescoring(self):
+        """
+        Test if published segments are only rescored once warmed up.
+        """
+        objects = random_objects(98, 200)
+        publications = []
+
+        def progress():
+            publications.append(dict(
+                ((segment.doc_base, segment.n_docs), segment.rank)
+                for segment in self.engine.segments))
+            return len(publications) * 0.02
+
+        self.engine = SearchEngine(merge_in_background=False,
+                                   rescore_tolerance=0)
+        self.engine.warm_up(iter(objects), chunk_size=4, progress=progress)
+        self.engine.wait_for_warm_up()
+
+        kept_count = 0
+        for previous, current in zip(publications, publications[1:]):
+            for doc_range, rank in current.iteritems():
+                if doc_range in previous:
+                    self.assertIs(rank, previous[doc_range])
+                    kept_count += 1
+        self.assertGreater(kept_count, 0)
+
+        expected_engine = SearchEngine()
+        expected_engine.start(iter(objects))
+        self.assert_same_results(self.engine, expected_engine)
+
+    def test_warm_up_error(self):
+        """
+        Test if an error of the warm-up is raised once it is waited for.
+        """
+        def failing_objects():
+            yield Indexable(1, 'w1 w2')
+            raise IOError('catalog truncated')
+
+        self.engine.warm_up(failing_objects())
+        self.assertRaises(IOError, self.engine.wait_for_warm_up)
+        self.assertFalse(self.engine.warming_up)
+        self.assertIsNone(self.engine.coverage)
+
+    def assert_same_matches(self, engine, expected_engine):
+        # duplicates are returned after their canonical object, so results
+        # with the same score are compared regardless of their order
+        self.assertEqual(engine.count(), expected_engine.count())
+        for query in ['w1', 'w2 w3', 'w4 w5 w6', 'w7 unknown']:
+            for mode in [ALL_TERMS, ANY_TERMS]:
+                results = engine.search(query, 1000, mode)
+                expected_results = expected_engine.search(query, 1000, mode)
+                self.assertEqual(
+                    sorted((round(result.score, 8), result.indexable.iid)
+                           for result in results),
+                    sorted((round(result.score, 8), result.indexable.iid)
+                           for result in expected_results))
+
+    def assert_same_documents(self, engine, expected_engine):
+        self.assertEqual(engine.count(), expected_engine.count())
+        for query in ['w1', 'w2 w3', 'w4 w5 w6', 'w7 unknown']:
+            for mode in [ALL_TERMS, ANY_TERMS]:
+                self.assertEqual(
+                    sorted(result.indexable.iid for result in
+                           engine.search(query, 1000, mode)),
+                    sorted(result.indexable.iid for result in
+                           expected_engine.search(query, 1000, mode)))
+
+    def assert_same_results(self, engine, expected_engine):
+        self.assertEqual(engine.count(), expected_engine.count())
+        for query in ['w1', 'w2 w3', 'w4 w5 w6', 'w7 unknown']:
+            for mode in [ALL_TERMS, ANY_TERMS]:
+                self.assertListEqual(engine.search(query, 10, mode),
+                                     expected_engine.search(query, 10, mode))
+
     def build_sample_index(self, objects):
         for indexable in objects:
             self.engine.add_object(indexable)
         self.engine.start()
 
 
+class TopKTests(unittest.TestCase):
+    """
+    Test case for top-k selection.
+    """
+
+    def test_top_k_order(self):
+        """
+        Test if the highest scores are selected in decreasing order.
+        """
+        scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3])
+        np.testing.assert_array_equal(top_k_positions(scores, 3), [1, 3, 2])
+
+    def test_top_k_ties(self):
+        """
+        Test if ties are broken by position like a stable sort.
+        """
+        scores = np.array([0.5, 0.9, 0.5, 0.5, 0.1, 0.5])
+        np.testing.assert_array_equal(top_k_positions(scores, 3), [1, 0, 2])
+
+    def test_top_k_limits(self):
+        """
+        Test if k larger than the candidates or empty inputs are handled.
+        """
+        scores = np.array([0.2, 0.4])
+        np.testing.assert_array_equal(top_k_positions(scores, 10), [1, 0])
+        self.assertEqual(len(top_k_positions(scores, 0)), 0)
+        self.assertEqual(len(top_k_positions(np.array([]), 10)), 0)
+
+
 class IndexTests(unittest.TestCase):
     """
     Test case for Index class.
@@ -204,7 +1095,7 @@ class TfidfRankTests(unittest.TestCase):
         sample1 = Indexable(1, 'this is an indexable metadata')
         sample2 = Indexable(2, 'this is an indexable super metadata')
         sample3 = Indexable(3, 'this is another indexable metadata')
-        self.rank.build_rank([sample1, sample2, sample3])
+        builder = self.build_rank_from_builder([sample1, sample2, sample3])
 
         expected_vocab_indices = {
             'an': 2, 'super': 3, 'indexable': 1, 'another': 4, 'metadata': 0
@@ -215,7 +1106,7 @@ class TfidfRankTests(unittest.TestCase):
                                 [1, 1, 0, 0, 1]])
 
         self.assertEqual(self.rank.vocabulary, expected_vocab_indices)
-        np.testing.assert_array_equal(self.rank.ft_matrix.todense(),
+        np.testing.assert_array_equal(builder.columns().todense(),
                                       expected_tf)
 
     def test_doc_frequency_matrix_with_sample2(self):
@@ -224,7 +1115,7 @@ class TfidfRankTests(unittest.TestCase):
         """
         sample1 = Indexable(1, 'the sky is blue')
         sample2 = Indexable(2, 'the sun is bright')
-        self.rank.build_rank([sample1, sample2])
+        builder = self.build_rank_from_builder([sample1, sample2])
 
         expected_vocab_indices = {'blue': 0, 'sun': 2, 'bright': 3, 'sky': 1}
 
@@ -232,7 +1123,7 @@ class TfidfRankTests(unittest.TestCase):
                                 [0, 0, 1, 1]])
 
         self.assertEqual(self.rank.vocabulary, expected_vocab_indices)
-        np.testing.assert_array_equal(self.rank.ft_matrix.todense(), expected_tf)
+        np.testing.assert_array_equal(builder.columns().todense(), expected_tf)
 
     def test_doc_inverse_term_frequency_vector1(self):
         """
@@ -249,10 +1140,10 @@ class TfidfRankTests(unittest.TestCase):
                            [0.45329466, 0.45329466, 0, 0, 0.76749457]]
 
         np.testing.assert_almost_equal(
-            self.rank.ifd_diag_matrix.diagonal(), expected_idf, 4)
+            self.rank.idf, expected_idf, 4)
 
         np.testing.assert_almost_equal(
-            self.rank.tf_idf_matrix.todense(), expected_tf_idf, 4)
+            self.score_matrix(self.rank), expected_tf_idf, 4)
 
     def test_doc_inverse_term_frequency_vector2(self):
         """
@@ -267,10 +1158,10 @@ class TfidfRankTests(unittest.TestCase):
                            [0, 0, 0.70710678, 0.70710678]]
 
         np.testing.assert_almost_equal(
-            self.rank.ifd_diag_matrix.diagonal(), expected_idf, 4)
+            self.rank.idf, expected_idf, 4)
 
         np.testing.assert_almost_equal(
-            self.rank.tf_idf_matrix.todense(), expected_tf_idf, 4)
+            self.score_matrix(self.rank), expected_tf_idf, 4)
 
     def test_score_computation(self):
         """
@@ -286,6 +1177,116 @@ class TfidfRankTests(unittest.TestCase):
         np.testing.assert_almost_equal(
             self.rank.compute_rank(0, ['blue', 'sky']), 1.414213, 5)
 
+    def test_term_max_scores(self):
+        """
+        Test if the maximum score of each term is computed.
+        """
+        sample1 = Indexable(1, 'the sky is blue')
+        sample2 = Indexable(2, 'the sun is bright')
+        sample3 = Indexable(3, 'the blue sun')
+        self.rank.build_rank([sample1, sample2, sample3])
+
+        expected_max_scores = self.score_matrix(self.rank).max(axis=0)
+        np.testing.assert_almost_equal(self.rank.max_scores,
+                                       expected_max_scores)
+
+        postings, impacts = self.rank.term_impacts('blue')
+        np.testing.assert_array_equal(postings, [0, 2])
+        np.testing.assert_almost_equal(
+            impacts, [self.rank.compute_rank(0, ['blue']),
+                      self.rank.compute_rank(2, ['blue'])])
+
+    def test_batch_score_computation(self):
+        """
+        Test if the scores of several documents are calculated at once.
+        """
+        sample1 = Indexable(1, 'the sky is blue')
+        sample2 = Indexable(2, 'the sun is bright')
+        sample3 = Indexable(3, 'the blue sun')
+        self.rank.build_rank([sample1, sample2, sample3])
+
+        np.testing.assert_almost_equal(
+            self.rank.compute_ranks(np.array([2, 0]), ['blue', 'sun']),
+            [self.rank.compute_rank(2, ['blue', 'sun']),
+             self.rank.compute_rank(0, ['blue', 'sun'])], 6)
+
+    def test_batch_ranks(self):
+        """
+        Test if several queries are scored at once, with or without
+        candidates.
+        """
+        sample1 = Indexable(1, 'the sky is blue')
+        sample2 = Indexable(2, 'the sun is bright')
+        sample3 = Indexable(3, 'the blue sun')
+        self.rank.build_rank([sample1, sample2, sample3])
+
+        terms_lists = [['blue', 'sun'], ['sky', 'unknown'], [], ['sun', 'sun']]
+        queries, docs_indices, scores = \
+            self.rank.compute_batch_ranks(terms_lists)
+        self.assertListEqual(list(queries), [0, 0, 0, 1, 3, 3])
+        self.assertListEqual(list(docs_indices), [0, 1, 2, 0, 1, 2])
+        np.testing.assert_almost_equal(
+            scores, [self.rank.compute_rank(doc_index, [
+                term for term in terms_lists[query] if term != 'unknown'])
+                for query, doc_index in zip(queries, docs_indices)], 6)
+
+        candidates = (np.array([0, 3]), np.array([2, 1]))
+        queries, docs_indices, scores = \
+            self.rank.compute_batch_ranks(terms_lists, candidates)
+        np.testing.assert_almost_equal(
+            scores, [self.rank.compute_rank(2, ['blue', 'sun']),
+                     self.rank.compute_rank(1, ['sun', 'sun'])], 6)
+
+    def test_reduced_precision_scores(self):
+        """
+        Test if scores are stored in single precision or quantized.
+        """
+        builder = TermMatrixBuilder(sample_stop_words())
+        for indexable in random_objects(91, 500):
+            builder.add(indexable)
+        self.rank.build_rank_from(builder)
+        expected_scores = self.score_matrix(self.rank)
+
+        for precision, tolerance in [(FLOAT32, 1e-7), (QUANTIZED, 1 / 510.0)]:
+            rank = TfidfRank(sample_stop_words(), precision=precision)
+            rank.build_rank_from(builder)
+            self.assertEqual(rank.impacts.dtype, np.dtype(precision))
+            self.assertLess(rank.nbytes(), self.rank.nbytes())
+
+            terms = sorted(rank.vocabulary)
+            scores = np.array([rank.compute_ranks(np.arange(500), [term])
+                               for term in terms]).T
+            columns = [self.rank.vocabulary[term] for term in terms]
+            np.testing.assert_allclose(scores, expected_scores[:, columns],
+                                       atol=tolerance)
+            for term in terms:
+                postings, impacts = rank.term_impacts(term)
+                np.testing.assert_allclose(
+                    impacts, scores[postings, terms.index(term)])
+                self.assertLessEqual(impacts.max(),
+                                     rank.max_scores[rank.vocabulary[term]])
+
+    def test_unknown_precision(self):
+        """
+        Test if an unknown score precision is rejected.
+        """
+        self.assertRaises(ValueError, TfidfRank, sample_stop_words(),
+                          precision='float16')
+        self.assertRaises(ValueError, SearchEngine, precision='float16')
+
+    def build_rank_from_builder(self, objects):
+        builder = TermMatrixBuilder(sample_stop_words())
+        for indexable in objects:
+            builder.add(indexable)
+        self.rank.build_rank_from(builder)
+        return builder
+
+    def score_matrix(self, rank):
+        terms = sorted(rank.vocabulary, key=rank.vocabulary.get)
+        docs_indices = np.arange(rank.n_docs)
+        return np.array([rank.compute_ranks(docs_indices, [term])
+                         for term in terms]).T
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,204 @@
+import unittest
+import threading
+import sys
+
+sys.path.append('lib')
+from search import Indexable
+from search import SearchEngine
+from search import ALL_TERMS
+from search import ANY_TERMS
+from server import QueryClient
+from server import QueryServer
+
+
+class FailingSearchEngine(SearchEngine):
+    """
+    Search engine failing to evaluate any batch of queries.
+    """
+
+    def search_many(self, queries, n_results=10, mode=ALL_TERMS,
+                    collapse=False, chunk_size=None):
+        raise RuntimeError('Engine failure')
+
+
+class QueryServerTests(unittest.TestCase):
+    """
+    Test case for QueryServer class.
+    """
+
+    def setUp(self):
+        """
+        Start a server answering queries on a small index of titles.
+        """
+        self.objects = [Indexable(1, 'oscar wilde plays'),
+                        Indexable(2, 'oscar wilde'),
+                        Indexable(3, 'wilde poems'),
+                        Indexable(4, 'oscar poems'),
+                        Indexable(5, 'poems'),
+                        Indexable(6, 'wilde letters'),
+                        Indexable(7, 'collected plays'),
+                        Indexable(8, 'oscar winners')]
+        self.engine = SearchEngine(cache_entries=0)
+        self.engine.start(self.objects)
+        self.servers = []
+        self.clients = []
+        self.server = self.serve(self.engine)
+
+    def tearDown(self):
+        """
+        Close the clients and stop the servers.
+        """
+        for client in self.clients:
+            client.close()
+        for server, thread in self.servers:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_results(self):
+        """
+        Test if the replies hold the results of the engine.
+        """
+        client = self.connect()
+        metadata = dict((indexable.iid, indexable.metadata)
+                        for indexable in self.objects)
+        for query, mode, expected_iids in [
+                ('oscar wilde', None, [2, 1]),
+                ('oscar poems', ANY_TERMS, [4, 5, 3, 2, 8]),
+                ('', None, []),
+                ('unknown', None, [])]:
+            reply = client.search(query, 5, mode)
+            self.assertTrue(reply['complete'])
+            self.assertEqual([result['id'] for result in reply['results']],
+                             expected_iids)
+            self.assertEqual([result['metadata']
+                              for result in reply['results']],
+                             [metadata[iid] for iid in expected_iids])
+            expected_results = self.engine.search(query, 5, mode or 'all')
+            for result, expected_result in zip(reply['results'],
+                                               expected_results):
+                self.assertAlmostEqual(result['score'],
+                                       expected_result.score)
+        # both words weigh the same in the title made of them only
+        reply = client.search('oscar wilde')
+        self.assertAlmostEqual(reply['results'][0]['score'], 2 ** 0.5)
+
+    def test_invalid_requests(self):
+        """
+        Test if invalid requests are answered with an error.
+        """
+        client = self.connect()
+        self.assertRaises(ValueError, client.search, 'oscar', 10, 'some')
+        self.assertRaises(ValueError, client.search, 'oscar', -1)
+        self.assertRaises(ValueError, client.search, '"oscar wilde"')
+        self.assertRaises(ValueError, client.search, None)
+        # the connection is still usable
+        self.assertGreater(len(client.search('oscar')['results']), 0)
+
+    def test_concurrent_queries(self):
+        """
+        Test if queries sent together are batched and answered correctly.
+        """
+        # shorter titles first, then titles whose other word is more common
+        expected_iids = {'oscar': [2, 4, 8, 1],
+                         'wilde': [2, 3, 6, 1],
+                         'plays': [1, 7],
+                         'poems': [5, 3, 4],
+                         'letters': [6],
+                         'winners': [8],
+                         'collected': [7],
+                         'oscar wilde': [2, 1],
+                         'oscar poems': [4],
+                         'wilde letters': [6],
+                         'plays collected': [7],
+                         'oscar letters': []}
+        queries = sorted(expected_iids)
+        replies = {}
+
+        def send(client, client_queries):
+            for query in client_queries:
+                try:
+                    replies[query] = client.search(query)
+                except ValueError as error:
+                    replies[query] = error
+
+        threads = []
+        for position in range(4):
+            thread = threading.Thread(target=send, args=(
+                self.connect(), queries[position::4] + ['"oscar wilde"']))
+            threads.append(thread)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for query in queries:
+            self.assertEqual([result['id'] for result in
+                              replies[query]['results']],
+                             expected_iids[query])
+        self.assertIsInstance(replies['"oscar wilde"'], ValueError)
+        batcher = self.server.batcher
+        self.assertEqual(batcher.queries, len(queries) + 4)
+        self.assertLess(batcher.batches, batcher.queries)
+
+    def test_engine_errors(self):
+        """
+        Test if queries failing in the engine are answered with an error.
+        """
+        server = self.serve(FailingSearchEngine())
+        client = self.connect(server)
+        self.assertRaises(ValueError, client.search, 'oscar')
+        # the connection is still usable
+        self.assertRaises(ValueError, client.search, 'wilde')
+
+    def test_idle_connections(self):
+        """
+        Test if open connections do not keep other clients waiting.
+        """
+        clients = [self.connect() for position in range(6)]
+        for client in clients:
+            self.assertGreater(len(client.search('oscar')['results']), 0)
+
+    def test_busy_server(self):
+        """
+        Test if queries past the maximum number of requests are rejected.
+        """
+        client = self.connect()
+        for position in range(4):
+            self.server._slots.acquire()
+        self.assertRaises(ValueError, client.search, 'oscar')
+        for position in range(4):
+            self.server._slots.release()
+        self.assertGreater(len(client.search('oscar')['results']), 0)
+
+    def test_cached_queries(self):
+        """
+        Test if repeated queries are answered from the results cache.
+        """
+        engine = SearchEngine()
+        engine.start(self.objects)
+        server = self.serve(engine)
+        client = self.connect(server)
+        reply = client.search('oscar wilde', 5)
+        self.assertEqual(engine.cache_stats()['results']['hits'], 0)
+        self.assertEqual(client.search('oscar wilde', 5), reply)
+        self.assertEqual(engine.cache_stats()['results']['hits'], 1)
+        self.assertEqual(server.batcher.queries, 2)
+
+    def serve(self, engine):
+        server = QueryServer(('localhost', 0), engine, max_requests=4,
+                             batch_wait=0.01)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.servers.append((server, thread))
+        return server
+
+    def connect(self, server=None):
+        server = server or self.server
+        client = QueryClient(server.server_address, timeout=30)
+        self.clients.append(client)
+        return client
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+import numpy as np
+import sys
+
+sys.path.append('lib')
+from search import SearchEngine
+from search import ALL_TERMS
+from search import ANY_TERMS
+from search import FLOAT32
+from search import QUANTIZED
+from search import TermMatrixBuilder
+from shards import HASH_PARTITION
+from shards import RANGE_PARTITION
+from shards import ShardedSearchEngine
+from shards import partition_docs
+from fixtures import random_objects
+
+
+class PartitionTests(unittest.TestCase):
+    """
+    Test case for the assignment of documents to shards.
+    """
+
+    def test_partitions(self):
+        """
+        Test if every document is assigned to exactly one shard.
+        """
+        iids = range(100, 200)
+        for partition in [RANGE_PARTITION, HASH_PARTITION]:
+            shards_docs = partition_docs(iids, 3, partition)
+            self.assertEqual(len(shards_docs), 3)
+            self.assertListEqual(sorted(np.concatenate(shards_docs)),
+                                 range(100))
+        self.assertListEqual([list(docs) for docs in
+                              partition_docs(iids[:5], 2)], [[0, 1], [2, 3, 4]])
+        self.assertRaises(ValueError, partition_docs, iids, 2, 'some')
+
+
+class ShardedSearchEngineTests(unittest.TestCase):
+    """
+    Test case for ShardedSearchEngine class.
+    """
+
+    def setUp(self):
+        """
+        Setup a single engine whose results are expected from the shards.
+        """
+        self.objects = random_objects(3, 1000, n_words=60, length=5,
+                                      positional=True)
+        self.engine = SearchEngine(positional=True)
+        self.engine.start(self.objects)
+        self.sharded_engines = []
+
+    def tearDown(self):
+        """
+        Stop the worker processes of the sharded engines.
+        """
+        for sharded_engine in self.sharded_engines:
+            sharded_engine.close()
+
+    def test_same_results_as_single_shard(self):
+        """
+        Test if sharded results and scores match a single shard exactly.
+        """
+        queries = [('w1', ALL_TERMS), ('w2 w3', ALL_TERMS),
+                   ('w4 w5 w6', ANY_TERMS), ('w7 unknown', ALL_TERMS),
+                   ('w7 unknown', ANY_TERMS), ('"w1 w2"', ALL_TERMS),
+                   ('w3 NEAR/2 w4', ALL_TERMS), ('the', ALL_TERMS)]
+        for partition in [RANGE_PARTITION, HASH_PARTITION]:
+            for shards_count in [1, 3]:
+                sharded_engine = self.start_sharded_engine(
+                    shards_count, partition)
+                self.assertEqual(sharded_engine.count(), 1000)
+                for query, mode in queries:
+                    expected_results = self.engine.search(query, 10, mode)
+                    results = sharded_engine.search(query, 10, mode)
+                    self.assertListEqual(results, expected_results)
+                    self.assertListEqual(
+                        [result.score for result in results],
+                        [result.score for result in expected_results])
+
+    def test_same_scores_with_precisions(self):
+        """
+        Test if sharded single precision and quantized scores match too.
+        """
+        for precision in [FLOAT32, QUANTIZED]:
+            engine = SearchEngine(precision=precision)
+            engine.start(self.objects)
+            sharded_engine = ShardedSearchEngine(3, HASH_PARTITION,
+                                                 precision=precision)
+            self.sharded_engines.append(sharded_engine)
+            sharded_engine.start(self.objects)
+            for query, mode in [('w1', ALL_TERMS), ('w2 w3', ALL_TERMS),
+                                ('w4 w5 w6', ANY_TERMS)]:
+                expected_results = engine.search(query, 10, mode)
+                results = sharded_engine.search(query, 10, mode)
+                self.assertListEqual(results, expected_results)
+                self.assertListEqual(
+                    [result.score for result in results],
+                    [result.score for result in expected_results])
+
+    def test_start_from_streams_and_builders(self):
+        """
+        Test if streamed objects and accumulated frequencies are indexed.
+        """
+        builder = TermMatrixBuilder(self.engine.stop_words, True)
+        for indexable in self.objects:
+            builder.add(indexable)
+        for partition in [RANGE_PARTITION, HASH_PARTITION]:
+            streamed_engine = ShardedSearchEngine(3, partition,
+                                                  positional=True)
+            self.sharded_engines.append(streamed_engine)
+            streamed_engine.start(iter(self.objects))
+            built_engine = ShardedSearchEngine(3, partition, positional=True)
+            self.sharded_engines.append(built_engine)
+            built_engine.start_from(builder, self.objects)
+            for sharded_engine in [streamed_engine, built_engine]:
+                self.assertEqual(sharded_engine.count(), 1000)
+                for query, mode in [('w1', ALL_TERMS), ('w4 w5', ANY_TERMS),
+                                    ('"w1 w2"', ALL_TERMS)]:
+                    self.assertListEqual(
+                        sharded_engine.search(query, 10, mode),
+                        self.engine.search(query, 10, mode))
+
+    def test_empty_shards(self):
+        """
+        Test if shards without any document do not prevent searches.
+        """
+        sharded_engine = ShardedSearchEngine(3)
+        self.sharded_engines.append(sharded_engine)
+        sharded_engine.start(self.objects[:1])
+        self.assertEqual(sharded_engine.count(), 1)
+        self.assertEqual(len(sharded_engine.search(
+            self.objects[0].metadata.split()[0], 10, ANY_TERMS)), 1)
+
+    def test_invalid_queries(self):
+        """
+        Test if invalid queries are rejected before reaching the shards.
+        """
+        sharded_engine = ShardedSearchEngine(2)
+        self.sharded_engines.append(sharded_engine)
+        sharded_engine.start(self.objects[:10])
+        self.assertRaises(ValueError, sharded_engine.search, '"w1 w2"')
+        self.assertRaises(ValueError, sharded_engine.search, 'w1', 10,
+                          'some')
+        self.assertRaises(ValueError, ShardedSearchEngine, 0)
+
+    def start_sharded_engine(self, shards_count, partition):
+        sharded_engine = ShardedSearchEngine(shards_count, partition,
+                                             positional=True)
+        self.sharded_engines.append(sharded_engine)
+        sharded_engine.start(self.objects)
+        return sharded_engine
+
+
+if __name__ == '__main__':
+    unittest.main()
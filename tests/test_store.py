@@ -0,0 +1,124 @@
+import unittest
+import cPickle
+import shutil
+import sys
+import tempfile
+
+sys.path.append('lib')
+from book import Book
+from search import Indexable
+from snapshot import SnapshotReader
+from snapshot import SnapshotWriter
+from store import DocumentStore
+
+
+class DocumentStoreTests(unittest.TestCase):
+    """
+    Test case for DocumentStore class.
+    """
+
+    def setUp(self):
+        """
+        Setup stores of indexables and books.
+        """
+        self.indexables = [Indexable(1, 'oscar wilde the plays'),
+                           Indexable(2, '', True),
+                           Indexable(3, 'the wilde oscar')]
+        self.books = [Book('10', 'the plays', 'oscar wilde'),
+                      Book('11', 'poems', '')]
+        self.indexables_store = DocumentStore()
+        for indexable in self.indexables:
+            self.indexables_store.append(indexable)
+        self.books_store = DocumentStore()
+        for book in self.books:
+            self.books_store.append(book)
+
+    def test_materialized_objects(self):
+        """
+        Test if stored objects are materialized with the same fields.
+        """
+        self.assertEqual(len(self.indexables_store), 3)
+        self.assertEqual(list(self.indexables_store), self.indexables)
+        self.assertEqual(list(self.books_store), self.books)
+        self.assertEqual(self.books_store[-1], self.books[-1])
+        self.assertTrue(self.indexables_store.integer_iids)
+        self.assertFalse(self.books_store.integer_iids)
+        self.assertEqual(self.indexables_store.iids(), [1, 2, 3])
+        self.assertEqual(self.books_store.iids(), ['10', '11'])
+
+    def test_book_metadata_is_not_stored(self):
+        """
+        Test if only the title and author of books are stored.
+        """
+        self.assertEqual(self.books_store.fields(0),
+                         ('the plays', 'oscar wilde'))
+        book = self.books_store[0]
+        self.assertEqual(book.metadata, 'the plays oscar wilde')
+        self.assertEqual(book.count_for_word('wilde'), 1)
+
+    def test_words_are_not_stored(self):
+        """
+        Test if materialized objects count their words again.
+        """
+        self.indexables[0].words_count
+        indexable = self.indexables_store[0]
+        self.assertIsNone(indexable._words_count)
+        self.assertEqual(indexable.count_for_word('oscar'), 1)
+
+    def test_mixed_classes(self):
+        """
+        Test if objects of another class are rejected.
+        """
+        self.assertRaises(TypeError, self.indexables_store.append,
+                          self.books[0])
+        self.assertRaises(TypeError, self.indexables_store.append,
+                          Indexable('4', 'plays'))
+        self.assertRaises(TypeError, self.indexables_store.extend,
+                          self.books_store)
+
+    def test_extend_and_take(self):
+        """
+        Test if stores are concatenated and subsets selected in order.
+        """
+        store = DocumentStore()
+        store.extend(self.books_store)
+        store.extend(self.books_store)
+        self.assertEqual(list(store), self.books + self.books)
+
+        subset = store.take([3, 0])
+        self.assertEqual(list(subset), [self.books[1], self.books[0]])
+        self.assertEqual(list(store.take([])), [])
+        self.assertEqual(list(self.indexables_store.take([2, 1])),
+                         [self.indexables[2], self.indexables[1]])
+
+    def test_pickle(self):
+        """
+        Test if stores are restored from their pickled state.
+        """
+        for store in [self.indexables_store, self.books_store]:
+            restored_store = cPickle.loads(
+                cPickle.dumps(store, cPickle.HIGHEST_PROTOCOL))
+            self.assertEqual(list(restored_store), list(store))
+
+    def test_snapshot(self):
+        """
+        Test if the first objects of a store are restored from a snapshot.
+        """
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            for store in [self.indexables_store, self.books_store]:
+                writer = SnapshotWriter(snapshot_dir)
+                store.save(writer, 2)
+                writer.close()
+
+                loaded_store = DocumentStore()
+                loaded_store.load(SnapshotReader(snapshot_dir))
+                self.assertEqual(list(loaded_store), list(store)[:2])
+                loaded_store.append(store[0])
+                self.assertEqual(len(loaded_store), 3)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
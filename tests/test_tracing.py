@@ -0,0 +1,183 @@
+import unittest
+import sys
+
+sys.path.append('lib')
+from search import Indexable
+from search import SearchEngine
+from tracing import MAX_SPAN_CHILDREN
+from tracing import NO_SPAN
+from tracing import Histogram
+from tracing import Tracer
+from tracing import format_trace
+from tracing import traced
+from tracing import tracer
+
+
+class TracerTests(unittest.TestCase):
+    """
+    Test case for Tracer class.
+    """
+
+    def setUp(self):
+        """
+        Setup an enabled tracer that will be subjected to the tests.
+        """
+        self.tracer = Tracer(enabled=True)
+
+    def test_disabled(self):
+        """
+        Test if nothing is recorded while the tracer is disabled.
+        """
+        self.tracer.disable()
+        with self.tracer.span('search') as span:
+            self.tracer.count('queries_total')
+            self.tracer.observe('query_candidates', 3)
+        self.assertIs(span, NO_SPAN)
+        self.assertEqual(self.tracer.snapshot(),
+                         {'counters': {}, 'histograms': {}, 'spans': {}})
+        self.assertIsNone(self.tracer.last_trace())
+
+    def test_nested_spans(self):
+        """
+        Test if spans are recorded by path and kept by their parent.
+        """
+        for _ in range(2):
+            with self.tracer.span('search'):
+                with self.tracer.span('segment'):
+                    with self.tracer.span('intersect'):
+                        pass
+                    with self.tracer.span('score'):
+                        pass
+                with self.tracer.span('collect'):
+                    pass
+
+        spans = self.tracer.snapshot()['spans']
+        self.assertEqual(sorted(spans), ['search', 'search/collect',
+                                         'search/segment',
+                                         'search/segment/intersect',
+                                         'search/segment/score'])
+        self.assertEqual(spans['search/segment/score']['count'], 2)
+
+        trace = self.tracer.last_trace()
+        self.assertEqual(trace.name, 'search')
+        self.assertEqual([child.name for child in trace.children],
+                         ['segment', 'collect'])
+        self.assertEqual([child.name for child in trace.children[0].children],
+                         ['intersect', 'score'])
+        lines = format_trace(trace).split('\n')
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[2].startswith('    intersect: '))
+
+    def test_dropped_children(self):
+        """
+        Test if the children of a span are bounded.
+        """
+        with self.tracer.span('search_many'):
+            for _ in range(MAX_SPAN_CHILDREN + 5):
+                with self.tracer.span('segment'):
+                    pass
+        trace = self.tracer.last_trace()
+        self.assertEqual(len(trace.children), MAX_SPAN_CHILDREN)
+        self.assertEqual(trace.dropped, 5)
+        self.assertIn('... 5 more', format_trace(trace))
+        self.assertEqual(self.tracer.snapshot()['spans'][
+            'search_many/segment']['count'], MAX_SPAN_CHILDREN + 5)
+
+    def test_histogram(self):
+        """
+        Test if values are counted in cumulative buckets.
+        """
+        histogram = Histogram((1, 10))
+        for value in [0, 1, 2, 10, 11, 50]:
+            histogram.observe(value)
+        self.assertEqual(histogram.snapshot(), {
+            'count': 6, 'sum': 74.0,
+            'buckets': [(1, 2), (10, 4), (float('inf'), 6)]})
+
+    def test_dump(self):
+        """
+        Test if metrics are formatted in the Prometheus text format.
+        """
+        self.tracer.count('queries_total', 2)
+        self.tracer.observe('query_candidates', 5, (1, 10))
+        with self.tracer.span('search'):
+            pass
+        lines = self.tracer.dump().split('\n')
+        self.assertEqual(lines[:9], [
+            '# TYPE queries_total counter',
+            'queries_total 2',
+            '# TYPE query_candidates histogram',
+            'query_candidates_bucket{le="1"} 0',
+            'query_candidates_bucket{le="10"} 1',
+            'query_candidates_bucket{le="+Inf"} 1',
+            'query_candidates_sum 5',
+            'query_candidates_count 1',
+            '# TYPE span_duration_seconds histogram'])
+        self.assertIn('span_duration_seconds_count{span="search"} 1', lines)
+
+        self.tracer.reset()
+        self.assertEqual(self.tracer.dump(), '')
+
+
+class InstrumentationTests(unittest.TestCase):
+    """
+    Test case for the spans and metrics of the search engine.
+    """
+
+    def setUp(self):
+        """
+        Enable the tracer of the library.
+        """
+        tracer.reset()
+        tracer.enable()
+
+    def tearDown(self):
+        """
+        Disable the tracer of the library.
+        """
+        tracer.disable()
+        tracer.reset()
+
+    def test_search_spans(self):
+        """
+        Test if a search records its phases and metrics.
+        """
+        engine = SearchEngine()
+        engine.start([Indexable(1, 'first indexable metadata'),
+                      Indexable(2, 'second indexable metadata'),
+                      Indexable(3, 'third document')])
+        engine.search('indexable metadata')
+        engine.search('indexable metadata')
+        engine.search('document', mode='any')
+
+        snapshot = tracer.snapshot()
+        for path in ['start_from', 'start_from/postings', 'search',
+                     'search/parse', 'search/segment',
+                     'search/segment/intersect', 'search/segment/score',
+                     'search/segment/top_k', 'search/segment/maxscore',
+                     'search/collect']:
+            self.assertIn(path, snapshot['spans'])
+        self.assertEqual(snapshot['counters']['queries_total'], 3)
+        self.assertEqual(snapshot['counters']['results_cache_hits_total'], 1)
+        self.assertEqual(snapshot['counters']['results_cache_misses_total'],
+                         2)
+        self.assertEqual(snapshot['counters']['postings_touched_total'], 4)
+        self.assertEqual(snapshot['histograms']['query_candidates']['sum'], 3)
+        self.assertEqual(tracer.last_trace().name, 'search')
+
+    def test_traced(self):
+        """
+        Test if decorated functions are recorded only while enabled.
+        """
+        @traced('answer')
+        def answer(value):
+            return value * 2
+
+        self.assertEqual(answer(21), 42)
+        tracer.disable()
+        self.assertEqual(answer(1), 2)
+        self.assertEqual(tracer.snapshot()['spans']['answer']['count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()